@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Benchmark: legacy vs meta-device / mmap checkpoint loading (cold start, peak host RAM).
+
+Writes a randomly initialised checkpoint (model.safetensors and pytorch_model.bin)
+and loads it in fresh subprocesses, so peak RSS covers only one load:
+    python benchmarks/checkpoint_loading.py --device cpu --model_dim 512 --num_layers 8
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="BLIP3-o checkpoint loading benchmark")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", type=str, default="float16", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--model_dim", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=8)
+    parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--checkpoint_dir", type=str, default=None, help="Existing checkpoint (skips writing one)")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    parser.add_argument("--_worker", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def legacy_load(model_path: Path, device: torch.device, dtype: torch.dtype):
+    """The previous BLIP3oInference._load_model: fp32 CPU init, full torch.load, filter, .to()."""
+    from src.modules.config.blip3o_config import BLIP3oDiTConfig
+    from src.modules.models.blip3o_dit import BLIP3oDiTModel
+
+    with open(model_path / "config.json") as f:
+        config = BLIP3oDiTConfig(**json.load(f))
+    model = BLIP3oDiTModel(config)
+    state_dict = torch.load(model_path / "pytorch_model.bin", map_location=device)
+    model_state_dict = model.state_dict()
+    filtered = {k: v for k, v in state_dict.items() if k in model_state_dict and model_state_dict[k].shape == v.shape}
+    model.load_state_dict(filtered, strict=False)
+    return model.to(device=device, dtype=dtype).eval()
+
+
+def fast_load(model_path: Path, device: torch.device, dtype: torch.dtype, weight_name: str):
+    from src.modules.models.checkpoint_loader import load_blip3o_checkpoint
+
+    # Only the requested weight file is visible to the loader
+    view = Path(tempfile.mkdtemp())
+    (view / "config.json").symlink_to(model_path / "config.json")
+    (view / weight_name).symlink_to(model_path / weight_name)
+    model, _, _ = load_blip3o_checkpoint(view, device=device, torch_dtype=dtype)
+    return model
+
+
+def run_worker(args):
+    """One load in this (fresh) process; prints a JSON line."""
+    import contextlib
+    import io
+
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    model_path = Path(args.checkpoint_dir)
+
+    # Import cost is excluded: only the load is timed
+    import src.modules.models.blip3o_dit  # noqa: F401
+    import src.modules.models.checkpoint_loader  # noqa: F401
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args._worker == "legacy":
+            model = legacy_load(model_path, device, dtype)
+        elif args._worker == "fast_safetensors":
+            model = fast_load(model_path, device, dtype, "model.safetensors")
+        else:
+            model = fast_load(model_path, device, dtype, "pytorch_model.bin")
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        'seconds': seconds,
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_increase_mb': peak_rss_mb() - rss_before,
+        'num_parameters': sum(p.numel() for p in model.parameters()),
+    }))
+
+
+def write_checkpoint(args, checkpoint_dir: Path):
+    import contextlib
+    import io
+    from safetensors.torch import save_file
+    from src.modules.config.blip3o_config import get_small_blip3o_config
+    from src.modules.models.blip3o_dit import BLIP3oDiTModel
+
+    config = get_small_blip3o_config()
+    config.dim = args.model_dim
+    config.n_layers = args.num_layers
+    config.n_heads = args.num_heads
+    config.n_kv_heads = args.num_heads
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = BLIP3oDiTModel(config)
+
+    state_dict = {k: v.contiguous() for k, v in model.state_dict().items()}
+    save_file(state_dict, str(checkpoint_dir / "model.safetensors"))
+    torch.save(state_dict, checkpoint_dir / "pytorch_model.bin")
+    with open(checkpoint_dir / "config.json", "w") as f:
+        json.dump({
+            'input_size': config.input_size, 'dim': config.dim, 'n_layers': config.n_layers,
+            'n_heads': config.n_heads, 'n_kv_heads': config.n_kv_heads,
+            'mlp_hidden_dim': config.mlp_hidden_dim, 'mlp_num_layers': config.mlp_num_layers,
+        }, f)
+    return sum(v.numel() * v.element_size() for v in state_dict.values()) / 1024 ** 2
+
+
+def run_mode(args, mode: str, checkpoint_dir: Path) -> dict:
+    runs = []
+    for _ in range(args.repeats):
+        output = subprocess.run(
+            [sys.executable, __file__, "--_worker", mode, "--checkpoint_dir", str(checkpoint_dir),
+             "--device", args.device, "--dtype", args.dtype],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    runs.sort(key=lambda r: r['seconds'])
+    median = runs[len(runs) // 2]
+    return {
+        'median_seconds': median['seconds'],
+        'peak_rss_increase_mb': max(r['peak_rss_increase_mb'] for r in runs),
+        'num_parameters': median['num_parameters'],
+    }
+
+
+def main():
+    args = parse_arguments()
+    if args._worker:
+        return run_worker(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint_dir = Path(args.checkpoint_dir) if args.checkpoint_dir else Path(tmp)
+        checkpoint_mb = None
+        if not args.checkpoint_dir:
+            checkpoint_mb = write_checkpoint(args, checkpoint_dir)
+
+        modes = {}
+        for mode in ("legacy", "fast_safetensors", "fast_bin"):
+            modes[mode] = run_mode(args, mode, checkpoint_dir)
+
+    legacy_seconds = modes['legacy']['median_seconds']
+    results = {
+        'device': args.device,
+        'dtype': args.dtype,
+        'model': {'dim': args.model_dim, 'n_layers': args.num_layers, 'n_heads': args.num_heads},
+        'checkpoint_mb_fp32': checkpoint_mb,
+        'modes': modes,
+        'speedup_safetensors': legacy_seconds / modes['fast_safetensors']['median_seconds'],
+        'speedup_bin': legacy_seconds / modes['fast_bin']['median_seconds'],
+        'torch_version': torch.__version__,
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
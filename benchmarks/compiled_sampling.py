@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark: eager vs compiled (torch.compile / CUDA graph) BLIP3-o sampling.
+
+Uses a small randomly initialised model, so it runs on CPU without checkpoints:
+    python benchmarks/compiled_sampling.py --device cpu --num_layers 2 --steps 10
+"""
+
+import sys
+import time
+import json
+import argparse
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.modules.config.blip3o_config import get_small_blip3o_config
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.inference.compiled_sampler import BLIP3oCompiledSampler
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Eager vs compiled BLIP3-o sampling benchmark")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--model_dim", type=int, default=256)
+    parser.add_argument("--num_layers", type=int, default=4)
+    parser.add_argument("--num_heads", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no_cuda_graph", action="store_true", help="Only torch.compile the step")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    return parser.parse_args()
+
+
+def synchronize(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device: torch.device, repeats: int) -> float:
+    """Median wall time in seconds over `repeats` runs (after one warmup run)."""
+    fn()
+    synchronize(device)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    args = parse_arguments()
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+
+    config = get_small_blip3o_config()
+    config.dim = args.model_dim
+    config.n_layers = args.num_layers
+    config.n_heads = args.num_heads
+    model = BLIP3oDiTModel(config).to(device=device, dtype=dtype).eval()
+
+    eva = torch.randn(args.batch_size, config.get_num_tokens(), config.eva_embedding_size, device=device, dtype=dtype)
+
+    def eager():
+        return model.generate(eva, num_inference_steps=args.steps, generator=torch.Generator(device).manual_seed(0))
+
+    sampler = BLIP3oCompiledSampler(
+        model,
+        batch_size=args.batch_size,
+        num_inference_steps=args.steps,
+        use_cuda_graph=False if args.no_cuda_graph else None,
+    )
+
+    def compiled():
+        return sampler(eva, generator=torch.Generator(device).manual_seed(0))
+
+    start = time.perf_counter()
+    compiled_output = compiled()
+    synchronize(device)
+    warmup_seconds = time.perf_counter() - start
+
+    eager_seconds = time_fn(eager, device, args.repeats)
+    compiled_seconds = time_fn(compiled, device, args.repeats)
+    max_abs_diff = (eager().float() - compiled_output.float()).abs().max().item()
+
+    results = {
+        'device': str(device),
+        'dtype': args.dtype,
+        'batch_size': args.batch_size,
+        'num_inference_steps': args.steps,
+        'model': {'dim': config.dim, 'n_layers': config.n_layers, 'n_heads': config.n_heads},
+        'cuda_graph': sampler.use_cuda_graph,
+        'compile_warmup_seconds': warmup_seconds,
+        'eager_seconds': eager_seconds,
+        'compiled_seconds': compiled_seconds,
+        'speedup': eager_seconds / compiled_seconds if compiled_seconds > 0 else float('inf'),
+        'max_abs_diff': max_abs_diff,
+        'torch_version': torch.__version__,
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
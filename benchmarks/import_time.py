@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: import time of the src.modules packages (CLI startup cost).
+
+Each import runs in a fresh interpreter under `python -X importtime`, so
+nothing is cached between measurements:
+    python benchmarks/import_time.py --repeats 5 --top 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# What the training / evaluation / extraction scripts actually import
+DEFAULT_TARGETS = [
+    "torch",
+    "src.modules",
+    "from src.modules.config import BLIP3oDiTConfig",
+    "from src.modules.datasets import create_chunked_dataloaders",
+    "from src.modules.evaluation import compute_retrieval_metrics",
+    "from src.modules.models import load_blip3o_checkpoint",
+    "from src.modules.inference import BLIP3oInference",
+    "from src.modules.trainers import BLIP3oTrainer",
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="BLIP3-o import time benchmark")
+    parser.add_argument("--targets", type=str, nargs="+", default=DEFAULT_TARGETS,
+                        help="Import statements to time, e.g. 'src.modules.datasets' "
+                             "or 'from src.modules import BLIP3oInference'")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Slowest modules to report per target")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    return parser.parse_args()
+
+
+def parse_importtime(stderr: str) -> dict:
+    """-X importtime lines ('import time: self | cumulative | name') -> {module: cumulative µs}."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def heavy_modules(cumulative: dict) -> dict:
+    """Which of the heavy optional dependencies were imported."""
+    return {
+        name: name in cumulative
+        for name in ("transformers", "wandb", "faiss", "PIL", "safetensors")
+    }
+
+
+def time_import(target: str) -> dict:
+    statement = target if target.startswith(("import ", "from ")) else f"import {target}"
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    wall_seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed:\n{result.stderr[-2000:]}")
+    return {'wall_seconds': wall_seconds, 'cumulative_us': parse_importtime(result.stderr)}
+
+
+def run_target(args, target: str) -> dict:
+    runs = sorted((time_import(target) for _ in range(args.repeats)), key=lambda r: r['wall_seconds'])
+    median = runs[len(runs) // 2]
+    cumulative = median['cumulative_us']
+    # Only top-level packages: their cumulative time already includes submodules
+    top_level = {name: us for name, us in cumulative.items() if "." not in name}
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    return {
+        'median_wall_seconds': median['wall_seconds'],
+        'num_modules': len(cumulative),
+        'imports_heavy': heavy_modules(cumulative),
+        'slowest_top_level_ms': {name: us / 1000 for name, us in slowest},
+    }
+
+
+def main():
+    args = parse_arguments()
+
+    targets = {}
+    for target in args.targets:
+        targets[target] = run_target(args, target)
+        print(f"⏱️ {target:<40} {targets[target]['median_wall_seconds']:.2f}s "
+              f"({targets[target]['num_modules']} modules)")
+
+    results = {
+        'python_version': sys.version.split()[0],
+        'repeats': args.repeats,
+        'targets': targets,
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: model, data and evaluation hot paths on CPU.
+
+Every case uses the small random configuration (get_small_blip3o_config),
+synthetic shards or random embeddings with fixed seeds and a fixed thread
+count, so runs are comparable across commits on the same machine:
+    python benchmarks/suite.py --output /tmp/bench.json
+    python benchmarks/suite.py --baseline benchmarks/baselines/cpu_small.json --threshold 0.25
+    python benchmarks/suite.py --cases "generate_*" "recall_*"
+
+With --baseline, a case whose minimum time over --repeats runs grew by more
+than --threshold (relative) is a regression and the exit code is 1. The
+minimum is compared rather than the median: on a shared machine noise only
+ever adds time, so the fastest run is the stablest estimate. Baselines are machine
+specific: regenerate one with --update_baseline on the machine that compares
+against it.
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import fnmatch
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from src.modules.config.blip3o_config import get_small_blip3o_config
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.datasets.blip3o_dataset import BLIP3oEmbeddingDataset, chunked_collate_fn
+from src.modules.evaluation.retrieval_metrics import compute_retrieval_metrics
+
+DEFAULT_BASELINE = REPO_ROOT / "benchmarks" / "baselines" / "cpu_small.json"
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="BLIP3-o CPU benchmark suite")
+    parser.add_argument("--cases", type=str, nargs="+", default=["*"], help="Case names or glob patterns")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--generate_steps", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--gallery_sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--num_shards", type=int, default=2)
+    parser.add_argument("--samples_per_shard", type=int, default=8)
+    parser.add_argument("--collate_batch_size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=min(4, os.cpu_count() or 1),
+                        help="torch.set_num_threads (fixed for comparability)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=str, default=None, help="Compare against this results JSON")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown vs the baseline counted as a regression")
+    parser.add_argument("--update_baseline", action="store_true",
+                        help=f"Write the results as the new baseline (--baseline or {DEFAULT_BASELINE.name})")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON")
+    return parser.parse_args()
+
+
+def time_fn(fn: Callable[[], None], repeats: int) -> Dict[str, float]:
+    """Median / min / max wall time in seconds over `repeats` runs (after one warmup run)."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'median_seconds': times[len(times) // 2], 'min_seconds': times[0], 'max_seconds': times[-1]}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def environment_metadata(args) -> dict:
+    return {
+        'python_version': sys.version.split()[0],
+        'torch_version': torch.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'cpu_count': os.cpu_count(),
+        'num_threads': torch.get_num_threads(),
+        'mkldnn': torch.backends.mkldnn.is_available(),
+        'git_commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'seed': args.seed,
+        'repeats': args.repeats,
+    }
+
+
+# Benchmark cases: each returns {case name: (fn, extra result fields)}
+
+def model_cases(args, config, model: BLIP3oDiTModel) -> Dict[str, tuple]:
+    num_tokens = config.get_num_tokens()
+    generator = torch.Generator().manual_seed(args.seed)
+    clip = torch.randn(args.batch_size, num_tokens, config.in_channels, generator=generator)
+    eva = torch.randn(args.batch_size, num_tokens, config.eva_embedding_size, generator=generator)
+    timestep = torch.rand(args.batch_size, generator=generator)
+
+    # One DiT block with the inputs the model feeds it
+    with torch.no_grad():
+        block_inputs = dict(
+            hidden_states=model.token_embedder.embed(clip),
+            encoder_hidden_states=model.eva_proj(eva),
+            timestep_emb=model.time_embed(model.get_timestep_embedding(timestep)),
+            image_rotary_emb=(model.rope_cos, model.rope_sin),
+        )
+    block = model.layers[0]
+
+    def block_forward():
+        with torch.no_grad():
+            block(**block_inputs)
+
+    hidden_states = block_inputs['hidden_states'].clone().requires_grad_(True)
+
+    def block_backward():
+        block.zero_grad(set_to_none=True)
+        hidden_states.grad = None
+        output = block(**dict(block_inputs, hidden_states=hidden_states))
+        output.float().pow(2).mean().backward()
+
+    def dit_forward():
+        with torch.no_grad():
+            model(clip, timestep, eva)
+
+    tokens = args.batch_size * num_tokens
+    cases = {
+        'attention_block_forward': (block_forward, {'tokens': tokens}),
+        'attention_block_backward': (block_backward, {'tokens': tokens}),
+        'dit_forward': (dit_forward, {'tokens': tokens}),
+    }
+    for steps in args.generate_steps:
+        def generate(steps=steps):
+            model.generate(eva, num_inference_steps=steps, generator=torch.Generator().manual_seed(args.seed))
+        cases[f'generate_{steps}_steps'] = (generate, {'num_inference_steps': steps})
+    return cases
+
+
+def write_synthetic_shards(directory: Path, config, num_shards: int, samples_per_shard: int, seed: int):
+    """Shards in the extraction format (embeddings_shard_*.pkl + embeddings_manifest.json)."""
+    generator = torch.Generator().manual_seed(seed)
+    num_tokens = config.get_num_tokens()
+    for shard_idx in range(num_shards):
+        shard = {
+            'clip_blip3o_embeddings': torch.randn(
+                samples_per_shard, num_tokens, config.in_channels, generator=generator),
+            'eva_blip3o_embeddings': torch.randn(
+                samples_per_shard, num_tokens, config.eva_embedding_size, generator=generator),
+            'captions': [f"caption {shard_idx}-{i}" for i in range(samples_per_shard)],
+        }
+        with open(directory / f"embeddings_shard_{shard_idx:05d}.pkl", 'wb') as f:
+            pickle.dump(shard, f)
+    with open(directory / "embeddings_manifest.json", 'w') as f:
+        json.dump({'total_shards': num_shards, 'total_samples': num_shards * samples_per_shard}, f)
+
+
+def data_cases(args, config, shard_dir: Path) -> Dict[str, tuple]:
+    num_samples = args.num_shards * args.samples_per_shard
+    shard_bytes = sum(path.stat().st_size for path in shard_dir.glob("embeddings_shard_*.pkl"))
+
+    def dataset_iterate():
+        dataset = BLIP3oEmbeddingDataset(
+            shard_dir,
+            split="all",
+            delete_after_use=False,
+            random_seed=args.seed,
+            expected_tokens=config.get_num_tokens(),
+        )
+        count = sum(1 for _ in dataset)
+        assert count == num_samples, f"iterated {count} of {num_samples} samples"
+
+    dataset = BLIP3oEmbeddingDataset(
+        shard_dir, split="all", delete_after_use=False, random_seed=args.seed,
+        expected_tokens=config.get_num_tokens(),
+    )
+    samples = []
+    for sample in dataset:
+        samples.append(sample)
+        if len(samples) == args.collate_batch_size:
+            break
+    while len(samples) < args.collate_batch_size:
+        samples.append(samples[len(samples) % num_samples])
+
+    def collate():
+        chunked_collate_fn(samples)
+
+    return {
+        'dataset_iterate': (dataset_iterate, {'samples': num_samples, 'bytes': shard_bytes}),
+        'collate': (collate, {'samples': args.collate_batch_size}),
+    }
+
+
+def retrieval_cases(args) -> Dict[str, tuple]:
+    cases = {}
+    for gallery_size in args.gallery_sizes:
+        generator = torch.Generator().manual_seed(args.seed)
+        images = torch.randn(gallery_size, 768, generator=generator)
+        texts = images + 0.5 * torch.randn(gallery_size, 768, generator=generator)
+        mapping = [[i] for i in range(gallery_size)]
+
+        def recall(images=images, texts=texts, mapping=mapping):
+            compute_retrieval_metrics(images, texts, mapping, k_values=(1, 5, 10))
+
+        cases[f'recall_at_k_{gallery_size}'] = (recall, {'samples': gallery_size})
+    return cases
+
+
+def selected(name: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def run_cases(args) -> Dict[str, dict]:
+    torch.manual_seed(args.seed)
+    config = get_small_blip3o_config()
+    results = {}
+
+    def run(cases: Dict[str, tuple]):
+        for name, (fn, extra) in cases.items():
+            if not selected(name, args.cases):
+                continue
+            timing = time_fn(fn, args.repeats)
+            result = dict(timing, **extra)
+            for unit in ('samples', 'tokens', 'bytes'):
+                if unit in extra:
+                    result[f'{unit}_per_second'] = extra[unit] / timing['median_seconds']
+            results[name] = result
+            print(f"⏱️ {name:<28} {timing['median_seconds'] * 1000:10.2f} ms")
+
+    model_case_names = ["attention_block_forward", "attention_block_backward", "dit_forward"]
+    model_case_names += [f"generate_{steps}_steps" for steps in args.generate_steps]
+    if any(selected(name, args.cases) for name in model_case_names):
+        model = BLIP3oDiTModel(config).eval()
+        run(model_cases(args, config, model))
+        del model
+
+    if selected("dataset_iterate", args.cases) or selected("collate", args.cases):
+        with tempfile.TemporaryDirectory(prefix="blip3o_bench_") as shard_dir:
+            write_synthetic_shards(Path(shard_dir), config, args.num_shards, args.samples_per_shard, args.seed)
+            run(data_cases(args, config, Path(shard_dir)))
+
+    run(retrieval_cases(args))
+    return results
+
+
+def compare_to_baseline(results: Dict[str, dict], baseline: dict, threshold: float) -> Dict[str, dict]:
+    """Relative change of each case's minimum time vs the baseline."""
+    comparison = {}
+    for name, result in results.items():
+        reference = baseline.get('cases', {}).get(name)
+        if reference is None:
+            comparison[name] = {'status': 'new'}
+            continue
+        ratio = result['min_seconds'] / reference['min_seconds']
+        if ratio > 1.0 + threshold:
+            status = 'regression'
+        elif ratio < 1.0 / (1.0 + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparison[name] = {
+            'status': status,
+            'baseline_min_seconds': reference['min_seconds'],
+            'ratio': ratio,
+        }
+    return comparison
+
+
+def environment_differences(current: dict, baseline: dict) -> Dict[str, tuple]:
+    keys = ('torch_version', 'machine', 'processor', 'cpu_count', 'num_threads')
+    return {
+        key: (baseline.get(key), current.get(key))
+        for key in keys if baseline.get(key) != current.get(key)
+    }
+
+
+def main():
+    args = parse_arguments()
+    torch.set_num_threads(args.threads)
+
+    results = {
+        'environment': environment_metadata(args),
+        'config': {
+            'model': 'get_small_blip3o_config',
+            'batch_size': args.batch_size,
+            'generate_steps': args.generate_steps,
+            'gallery_sizes': args.gallery_sizes,
+            'num_shards': args.num_shards,
+            'samples_per_shard': args.samples_per_shard,
+            'collate_batch_size': args.collate_batch_size,
+        },
+        'cases': run_cases(args),
+    }
+
+    exit_code = 0
+    if args.baseline and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = environment_differences(results['environment'], baseline.get('environment', {}))
+        if differences:
+            print(f"⚠️ Environment differs from the baseline (timings may not be comparable): {differences}")
+        if baseline.get('config') != results['config']:
+            print("⚠️ Benchmark configuration differs from the baseline")
+        comparison = compare_to_baseline(results['cases'], baseline, args.threshold)
+        regressions = [name for name, entry in comparison.items() if entry['status'] == 'regression']
+        results['comparison'] = {
+            'baseline': args.baseline,
+            'threshold': args.threshold,
+            'regressions': regressions,
+            'cases': comparison,
+        }
+        for name, entry in comparison.items():
+            if 'ratio' in entry:
+                print(f"{'❌' if entry['status'] == 'regression' else '✅'} {name:<28} "
+                      f"{entry['ratio']:.2f}x baseline ({entry['status']})")
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            exit_code = 1
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        baseline_path = Path(args.baseline) if args.baseline else DEFAULT_BASELINE
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline written to {baseline_path}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
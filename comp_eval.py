@@ -32,6 +32,29 @@ script_dir = Path(__file__).parent
 project_root = script_dir.parent
 sys.path.insert(0, str(project_root))
 sys.path.insert(0, str(project_root / "src"))
+sys.path.insert(0, str(script_dir))
+
+from src.modules.evaluation.similarity_engine import (
+    BlockedSimilarityEngine,
+    paired_similarity_statistics,
+)
+from src.modules.evaluation.ann_index import build_or_load_text_index, evaluate_ann_recall, index_matches
+from src.modules.evaluation.embedding_cache import cached_embeddings, create_embedding_cache, hash_item
+from src.modules.evaluation.coco_dataset import iter_image_batches, load_coco_samples as load_lazy_coco_samples
+from src.modules.inference.result_cache import draw_noise, sample_generators
+from src.modules.evaluation.distributed_eval import (
+    cleanup_distributed,
+    distributed_map,
+    get_dist_info,
+    init_distributed_evaluation,
+    is_main_process,
+)
+
+
+def _copy_generator(generator: torch.Generator) -> torch.Generator:
+    copy = torch.Generator(device=generator.device)
+    copy.set_state(generator.get_state())
+    return copy
 
 
 class FixedBLIP3oRecallEvaluator:
@@ -42,15 +65,44 @@ class FixedBLIP3oRecallEvaluator:
     to demonstrate the recall improvement from the fixed implementation.
     """
     
+    # Images per processor / vision-model call during embedding extraction
+    image_batch_size = 32
+    
     def __init__(
         self, 
         device: str = "auto",
         torch_dtype: Optional[torch.dtype] = None,
+        ann_backend: Optional[str] = None,
+        ann_index_path: Optional[str] = None,
+        ann_nprobe: int = 8,
+        ann_nlist: Optional[int] = None,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_cache_size_gb: float = 50.0,
     ):
-        """Initialize the FIXED evaluator."""
+        """
+        Initialize the FIXED evaluator.
+        
+        ann_backend ("auto", "ivf", "faiss", "exact") additionally reports
+        approximate recall@K through a text-embedding ANN index, persisted at
+        ann_index_path when given. embedding_cache_dir enables the persistent
+        CLIP/EVA embedding cache, so re-runs only pay for BLIP3-o generation.
+        """
         self.device = self._setup_device(device)
         self.torch_dtype = torch_dtype or torch.float32
         
+        # Optional approximate nearest-neighbor retrieval
+        self.ann_backend = ann_backend
+        self.ann_index_path = ann_index_path
+        self.ann_nprobe = ann_nprobe
+        self.ann_nlist = ann_nlist
+        self.ann_index = None
+        
+        # Persistent CLIP/EVA embedding cache shared across evaluators (opt-in)
+        self.embedding_cache = (
+            create_embedding_cache(embedding_cache_dir, embedding_cache_size_gb)
+            if embedding_cache_dir else None
+        )
+        
         # Will be loaded when needed
         self.clip_processor = None
         self.clip_model = None
@@ -106,74 +158,30 @@ class FixedBLIP3oRecallEvaluator:
         try:
             # Try importing FIXED model first
             try:
-                from src.modules.models.dual_supervision_blip3o_dit import FixedDualSupervisionBLIP3oDiTModel, create_blip3o_dit_model
+                from src.modules.models.dual_supervision_blip3o_dit import FixedDualSupervisionBLIP3oDiTModel as model_class
                 logger.info("🎯 Attempting to load FIXED model architecture")
                 is_fixed_model = True
             except ImportError:
                 # Fallback to standard model
-                from src.modules.models.blip3o_dit import BLIP3oDiTModel, create_blip3o_dit_model
+                from src.modules.models.blip3o_dit import BLIP3oDiTModel as model_class
                 logger.info("⚠️  Loading standard model (fixed components not available)")
                 is_fixed_model = False
             
-            from src.modules.config.blip3o_config import BLIP3oDiTConfig
+            from src.modules.models.checkpoint_loader import load_blip3o_checkpoint, load_checkpoint_config
             
             model_path = Path(model_path)
             
-            # Load configuration
-            config_file = model_path / "config.json"
-            if not config_file.exists():
-                config_file = model_path / "blip3o_model_config.json"
-            
-            if not config_file.exists():
-                raise FileNotFoundError(f"No config file found in {model_path}")
-            
-            with open(config_file, 'r') as f:
-                config_dict = json.load(f)
-            
-            # Create configuration
-            config = BLIP3oDiTConfig(**config_dict)
-            
-            # Create model using factory function
-            self.blip3o_model = create_blip3o_dit_model(
-                config=config,
+            # Built on the meta device; weights memory-mapped straight to device / dtype
+            self.blip3o_model, _, load_info = load_blip3o_checkpoint(
+                model_path,
+                device=self.device,
+                torch_dtype=self.torch_dtype,
+                model_class=model_class,
                 load_clip_projection=True,
-                enable_dual_supervision=True,
             )
-            
-            # Load weights
-            model_files = [
-                model_path / "pytorch_model.bin",
-                model_path / "model.safetensors",
-                model_path / "pytorch_model.safetensors"
-            ]
-            
-            model_file = None
-            for file_path in model_files:
-                if file_path.exists():
-                    model_file = file_path
-                    break
-            
-            if model_file is None:
-                raise FileNotFoundError(f"No model weights found in {model_path}")
-            
-            # Load weights
-            if model_file.suffix == ".bin":
-                state_dict = torch.load(model_file, map_location=self.device)
-            else:
-                from safetensors.torch import load_file
-                state_dict = load_file(str(model_file))
-            
-            # Load state dict with compatibility for missing keys
-            missing_keys, unexpected_keys = self.blip3o_model.load_state_dict(state_dict, strict=False)
-            
-            if missing_keys:
-                logger.warning(f"Missing keys (may be expected for FIXED model): {missing_keys}")
-            if unexpected_keys:
-                logger.warning(f"Unexpected keys: {unexpected_keys}")
-            
-            # Move to device
-            self.blip3o_model = self.blip3o_model.to(device=self.device, dtype=self.torch_dtype)
-            self.blip3o_model.eval()
+            self.blip3o_config_dict = load_checkpoint_config(model_path)
+            self.blip3o_model_path = str(model_path)
+            logger.info(f"   Weights: {load_info['weight_file']} ({load_info['load_seconds']:.2f}s)")
             
             # Check model capabilities
             self.model_capabilities = self._check_model_capabilities()
@@ -187,6 +195,58 @@ class FixedBLIP3oRecallEvaluator:
             logger.error(f"Failed to load BLIP3-o model: {e}")
             raise
     
+    def _load_blip3o_state_dict(self, model_path: Path):
+        """Load checkpoint weights into the current BLIP3-o model (memory-mapped, on device)."""
+        from src.modules.models.checkpoint_loader import load_checkpoint_state_dict
+        
+        state_dict = load_checkpoint_state_dict(model_path, device=self.device, dtype=self.torch_dtype)
+        
+        # Load state dict with compatibility for missing keys
+        missing_keys, unexpected_keys = self.blip3o_model.load_state_dict(state_dict, strict=False)
+        
+        if missing_keys:
+            logger.warning(f"Missing keys (may be expected for FIXED model): {missing_keys}")
+        if unexpected_keys:
+            logger.warning(f"Unexpected keys: {unexpected_keys}")
+        
+        return missing_keys, unexpected_keys
+    
+    def swap_blip3o_weights(self, model_path: str):
+        """
+        Switch to another checkpoint, reusing the loaded DiT when possible.
+        
+        Checkpoints of the same architecture (identical config) only have their
+        weights copied into the existing model; anything else is a full load.
+        A checkpoint that does not cover every parameter is also fully reloaded,
+        so no weights of the previous checkpoint survive the swap.
+        """
+        from src.modules.models.checkpoint_loader import load_checkpoint_config
+        
+        model_path = Path(model_path)
+        if self.blip3o_model is None:
+            return self.load_blip3o_model(str(model_path))
+        
+        try:
+            config_dict = load_checkpoint_config(model_path)
+        except FileNotFoundError:
+            return self.load_blip3o_model(str(model_path))
+        if config_dict != getattr(self, 'blip3o_config_dict', None):
+            logger.info("Checkpoint architecture differs, rebuilding BLIP3-o model")
+            self.blip3o_model = None
+            gc.collect()
+            return self.load_blip3o_model(str(model_path))
+        
+        logger.info(f"Swapping BLIP3-o weights: {model_path}")
+        missing_keys, _ = self._load_blip3o_state_dict(model_path)
+        if missing_keys:
+            logger.info("Checkpoint is missing parameters, rebuilding BLIP3-o model instead of keeping stale weights")
+            self.blip3o_model = None
+            gc.collect()
+            return self.load_blip3o_model(str(model_path))
+        self.blip3o_model = self.blip3o_model.to(device=self.device, dtype=self.torch_dtype)
+        self.blip3o_model.eval()
+        self.blip3o_model_path = str(model_path)
+    
     def _check_model_capabilities(self) -> Dict[str, bool]:
         """Check what capabilities the loaded model has."""
         capabilities = {
@@ -207,6 +267,7 @@ class FixedBLIP3oRecallEvaluator:
         else:
             return sum(p.numel() for p in self.blip3o_model.parameters())
     
+    @cached_embeddings("clip_text", "clip_model", "clip_processor")
     def extract_clip_text_embeddings(self, captions: List[str]) -> torch.Tensor:
         """Extract CLIP text embeddings."""
         with torch.no_grad():
@@ -223,23 +284,25 @@ class FixedBLIP3oRecallEvaluator:
         
         return text_embeddings.cpu().float()
     
+    @cached_embeddings("clip_image_features", "clip_model", "clip_processor")
     def extract_clip_vision_global_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """Extract CLIP vision global embeddings (CLS token + visual projection)."""
         global_embeddings = []
         
         with torch.no_grad():
-            for img in images:
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+            for batch in iter_image_batches(images, self.image_batch_size):
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
-                vision_embeddings = self.clip_model.get_image_features(**inputs)  # [1, 768]
+                vision_embeddings = self.clip_model.get_image_features(**inputs)  # [b, 768]
                 vision_embeddings = F.normalize(vision_embeddings, p=2, dim=-1)
                 
-                global_embeddings.append(vision_embeddings.squeeze(0).cpu().float())  # [768]
+                global_embeddings.append(vision_embeddings.cpu().float())  # [b, 768]
         
-        return torch.stack(global_embeddings)  # [B, 768]
+        return torch.cat(global_embeddings)  # [B, 768]
     
+    @cached_embeddings("eva_patch", "eva_model", "eva_processor")
     def extract_eva_vision_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """Extract EVA-CLIP vision embeddings for BLIP3-o conditioning."""
         eva_embeddings = []
@@ -247,11 +310,8 @@ class FixedBLIP3oRecallEvaluator:
         logger.info(f"Extracting EVA embeddings for {len(images)} images...")
         
         with torch.no_grad():
-            for i, img in enumerate(images):
-                if i % 100 == 0:
-                    logger.debug(f"Processing EVA image {i}/{len(images)}")
-                
-                inputs = self.eva_processor(images=img, return_tensors="pt")
+            for batch in iter_image_batches(images, self.image_batch_size):
+                inputs = self.eva_processor(images=batch, return_tensors="pt")
                 pixel_values = inputs['pixel_values'].to(device=self.device, dtype=self.torch_dtype)
                 
                 vision_outputs = self.eva_model.vision_model(
@@ -268,9 +328,9 @@ class FixedBLIP3oRecallEvaluator:
                 assert num_patches == 256, f"Expected 256 patches, got {num_patches}"
                 assert hidden_dim == 4096, f"Expected 4096 dimensions, got {hidden_dim}"
                 
-                eva_embeddings.append(patch_embeddings.squeeze(0).cpu().float())  # [256, 4096]
+                eva_embeddings.append(patch_embeddings.cpu().float())  # [b, 256, 4096]
         
-        result = torch.stack(eva_embeddings)  # [B, 256, 4096]
+        result = torch.cat(eva_embeddings)  # [B, 256, 4096]
         logger.info(f"EVA embeddings extracted: {result.shape}")
         
         return result
@@ -279,7 +339,8 @@ class FixedBLIP3oRecallEvaluator:
         self, 
         eva_embeddings: torch.Tensor, 
         num_inference_steps: int = 50,
-        generation_mode: str = "auto"
+        generation_mode: str = "auto",
+        sampler_kwargs: Optional[Dict] = None,
     ) -> torch.Tensor:
         """
         FIXED: Generate CLIP embeddings using FIXED BLIP3-o model with global generation.
@@ -288,6 +349,11 @@ class FixedBLIP3oRecallEvaluator:
             eva_embeddings: EVA-CLIP conditioning [B, 256, 4096]
             num_inference_steps: Number of sampling steps
             generation_mode: "auto", "global", "patch", or "dual"
+            sampler_kwargs: Extra generate() arguments; "seed" draws each sample's
+                initial noise (shaped for the generation mode) and any later
+                random draws from its own (seed, EVA hash) generator and
+                generates in fixed-size batches, so results do not depend on
+                batching or sharding
         
         Returns:
             Generated CLIP embeddings [B, 768] (global) or [B, 256, 1024] (patch)
@@ -311,6 +377,29 @@ class FixedBLIP3oRecallEvaluator:
                 generation_mode = "standard"  # Fallback for standard models
                 logger.info("🔄 Auto-selected STANDARD generation mode (standard model)")
         
+        sampler_kwargs = dict(sampler_kwargs or {})
+        seed = sampler_kwargs.pop('seed', None)
+        noise, generators = None, None
+        if seed is not None:
+            # Per-sample noise keyed by the EVA conditioning: the same image gets the same
+            # noise however the samples are batched or sharded across --distributed ranks
+            generators = sample_generators([hash_item(row) for row in eva_embeddings], seed)
+            global_generation = (
+                self.model_capabilities.get('supports_generation_modes', False)
+                and generation_mode in ("global", "dual")
+            )
+            if global_generation:
+                global_proj = getattr(self.blip3o_model, 'global_velocity_proj', None)
+                sample_shape = (getattr(global_proj, 'out_features', 768),)
+            else:
+                sample_shape = (eva_embeddings.shape[1], self.blip3o_model.config.in_channels)
+            noise = draw_noise(generators, sample_shape, device=self.device, dtype=self.torch_dtype)
+            if not global_generation:
+                # Patch-space sampling draws nothing after the initial noise
+                generators = None
+            # Global generation draws dummy patch inputs every step: they come from
+            # the same per-sample generators (passed as generate(generator=[...]))
+        
         generated_embeddings = []
         
         with torch.no_grad():
@@ -320,7 +409,25 @@ class FixedBLIP3oRecallEvaluator:
             
             for i in range(0, num_samples, batch_size):
                 end_idx = min(i + batch_size, num_samples)
+                num_valid = end_idx - i
                 batch_eva = eva_embeddings[i:end_idx]
+                batch_kwargs = sampler_kwargs
+                if noise is not None:
+                    batch_noise = noise[i:end_idx]
+                    batch_generators = generators[i:end_idx] if generators is not None else None
+                    if num_valid < batch_size:
+                        # Seeded runs pad the last batch: GEMMs may round differently per batch size
+                        pad = [num_valid - 1] * (batch_size - num_valid)
+                        batch_eva = torch.cat([batch_eva, batch_eva[pad]])
+                        batch_noise = torch.cat([batch_noise, batch_noise[pad]])
+                        if batch_generators is not None:
+                            # Padding rows draw from copies: the last real row's stream stays its own
+                            batch_generators = batch_generators + [
+                                _copy_generator(batch_generators[-1]) for _ in pad
+                            ]
+                    batch_kwargs = {**sampler_kwargs, 'noise': batch_noise}
+                    if batch_generators is not None:
+                        batch_kwargs['generator'] = batch_generators
                 
                 logger.debug(f"Processing batch {i//batch_size + 1}/{(num_samples + batch_size - 1)//batch_size}")
                 
@@ -332,6 +439,7 @@ class FixedBLIP3oRecallEvaluator:
                             encoder_hidden_states=batch_eva,
                             num_inference_steps=num_inference_steps,
                             generation_mode="global",  # Generate directly in global space
+                            **batch_kwargs,
                         )
                         
                     elif generation_mode == "patch" and self.model_capabilities.get('supports_generation_modes', False):
@@ -342,6 +450,7 @@ class FixedBLIP3oRecallEvaluator:
                             num_inference_steps=num_inference_steps,
                             generation_mode="patch",
                             return_global_only=True,  # Convert to global for evaluation
+                            **batch_kwargs,
                         )
                         
                     elif generation_mode == "dual" and self.model_capabilities.get('supports_generation_modes', False):
@@ -351,6 +460,7 @@ class FixedBLIP3oRecallEvaluator:
                             encoder_hidden_states=batch_eva,
                             num_inference_steps=num_inference_steps,
                             generation_mode="dual",
+                            **batch_kwargs,
                         )
                         generated = results['global_generation']  # Use global result
                         
@@ -361,6 +471,7 @@ class FixedBLIP3oRecallEvaluator:
                             encoder_hidden_states=batch_eva,
                             num_inference_steps=num_inference_steps,
                             return_global_only=True,  # Ensure global output
+                            **batch_kwargs,
                         )
                     
                     # Verify shape
@@ -373,13 +484,12 @@ class FixedBLIP3oRecallEvaluator:
                     
                     # Ensure normalization
                     generated = F.normalize(generated, p=2, dim=-1)
-                    generated_embeddings.append(generated.cpu().float())
+                    generated_embeddings.append(generated[:num_valid].cpu().float())
                     
                 except Exception as e:
+                    # No placeholder embeddings: recall on them would be silently meaningless
                     logger.error(f"Error in generation for batch {i//batch_size + 1}: {e}")
-                    # Create dummy output to maintain batch consistency
-                    dummy_output = torch.zeros(batch_eva.shape[0], 768)
-                    generated_embeddings.append(dummy_output)
+                    raise
         
         # Concatenate all batches
         result = torch.cat(generated_embeddings, dim=0)  # [B, 768]
@@ -405,46 +515,37 @@ class FixedBLIP3oRecallEvaluator:
         image_embeddings = F.normalize(image_embeddings, p=2, dim=-1)
         text_embeddings = F.normalize(text_embeddings, p=2, dim=-1)
         
-        # Compute similarity matrix: [N_images, N_texts]
-        similarity_matrix = torch.mm(image_embeddings, text_embeddings.t())
-        
-        logger.info(f"Similarity matrix shape: {similarity_matrix.shape}")
-        logger.info(f"Similarity range: [{similarity_matrix.min():.4f}, {similarity_matrix.max():.4f}]")
-        logger.info(f"Similarity mean: {similarity_matrix.mean():.4f} ± {similarity_matrix.std():.4f}")
-        
-        # Compute recall for each K value
-        recall_results = {}
-        
+        # Blocked scoring: recall@K / mAP / MRR / median rank in both directions and
+        # similarity statistics without materializing the [N_images, N_texts] matrix
+        engine = BlockedSimilarityEngine(normalize=False)
+        recall_results = engine.retrieval_metrics(image_embeddings, text_embeddings, image_to_text_mapping, k_values)
+        
+        logger.info(f"Similarity matrix shape: ({len(image_embeddings)}, {len(text_embeddings)}) (blocked)")
+        logger.info(f"Similarity range: [{recall_results['similarity_min']:.4f}, {recall_results['similarity_max']:.4f}]")
+        logger.info(f"Similarity mean: {recall_results['similarity_mean']:.4f} ± {recall_results['similarity_std']:.4f}")
+        
+        # Debug first few retrievals
+        logger.info("Sample image-to-text retrievals (first 5):")
+        top_scores, top_indices = engine.topk(image_embeddings[:5], text_embeddings, 1)
+        for i in range(min(5, len(image_to_text_mapping))):
+            correct_texts = image_to_text_mapping[i]
+            retrieved_text = top_indices[i, 0].item()
+            is_correct = retrieved_text in correct_texts
+            logger.info(f"  Image {i}: retrieved text {retrieved_text} (sim={top_scores[i, 0].item():.4f}), "
+                       f"correct={is_correct}, target_texts={correct_texts}")
+        
+        total_queries = len(image_to_text_mapping)
         for k in k_values:
-            correct_retrievals = 0
-            total_queries = len(image_to_text_mapping)
-            
-            # Get top-k text indices for each image
-            _, top_k_indices = torch.topk(similarity_matrix, k=k, dim=1)  # [N_images, k]
-            
-            # Debug first few retrievals for k=1
-            if k == 1:
-                logger.info("Sample image-to-text retrievals (first 5):")
-                for i in range(min(5, len(image_to_text_mapping))):
-                    correct_texts = image_to_text_mapping[i]
-                    retrieved_text = top_k_indices[i, 0].item()
-                    similarity_score = similarity_matrix[i, retrieved_text].item()
-                    is_correct = retrieved_text in correct_texts
-                    logger.info(f"  Image {i}: retrieved text {retrieved_text} (sim={similarity_score:.4f}), "
-                               f"correct={is_correct}, target_texts={correct_texts}")
-            
-            # Check if any of the top-k retrieved texts belong to the query image
-            for img_idx, correct_text_indices in enumerate(image_to_text_mapping):
-                retrieved_indices = top_k_indices[img_idx].cpu().numpy()
-                
-                # Check if any retrieved index is in the correct text indices
-                if any(ret_idx in correct_text_indices for ret_idx in retrieved_indices):
-                    correct_retrievals += 1
-            
-            recall_at_k = correct_retrievals / total_queries if total_queries > 0 else 0
-            recall_results[f'recall@{k}'] = recall_at_k
-            
-            logger.info(f"Recall@{k}: {correct_retrievals}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+            recall_at_k = recall_results[f'recall@{k}']
+            logger.info(f"Recall@{k}: {round(recall_at_k * total_queries)}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+        logger.info(f"mAP: {recall_results['mAP']:.4f}, MRR: {recall_results['MRR']:.4f}, "
+                    f"median rank: {recall_results['median_rank']:.0f}")
+        logger.info(f"Text-to-image Recall@1: {recall_results['t2i_recall@1']:.4f}")
+        
+        if self.ann_backend:
+            recall_results.update(self.compute_ann_recall(
+                image_embeddings, text_embeddings, image_to_text_mapping, k_values
+            ))
         
         # Additional metrics
         recall_results['num_queries'] = len(image_to_text_mapping)
@@ -454,6 +555,36 @@ class FixedBLIP3oRecallEvaluator:
         
         return recall_results
     
+    def compute_ann_recall(
+        self,
+        image_embeddings: torch.Tensor,
+        text_embeddings: torch.Tensor,
+        image_to_text_mapping: List[List[int]],
+        k_values: List[int] = [1, 5, 10]
+    ) -> Dict[str, float]:
+        """Approximate image-to-text recall through the text ANN index, next to exact search."""
+        # Text embeddings are shared by all methods: the index is built (or loaded) once
+        # and reused only while it was built over this exact gallery
+        if not index_matches(self.ann_index, text_embeddings):
+            self.ann_index = build_or_load_text_index(
+                text_embeddings,
+                index_path=self.ann_index_path,
+                backend=self.ann_backend,
+                nprobe=self.ann_nprobe,
+                nlist=self.ann_nlist,
+            )
+        
+        ann_results = evaluate_ann_recall(
+            self.ann_index, image_embeddings, text_embeddings, image_to_text_mapping, k_values
+        )
+        for k in k_values:
+            logger.info(f"ANN Recall@{k}: {ann_results[f'ann_recall@{k}']:.4f} "
+                        f"(exact {ann_results[f'exact_recall@{k}']:.4f}, "
+                        f"neighbor recall {ann_results[f'ann_neighbor_recall@{k}']:.4f})")
+        logger.info(f"ANN query time: {ann_results['ann_query_time_s']:.3f}s "
+                    f"vs exact {ann_results['exact_query_time_s']:.3f}s ({ann_results['ann_speedup']:.1f}x)")
+        return ann_results
+    
     def compute_cosine_similarity(
         self, 
         embeddings1: torch.Tensor, 
@@ -464,51 +595,21 @@ class FixedBLIP3oRecallEvaluator:
         embeddings1 = F.normalize(embeddings1, p=2, dim=-1)
         embeddings2 = F.normalize(embeddings2, p=2, dim=-1)
         
-        # Compute pairwise cosine similarities
-        sim_matrix = embeddings1 @ embeddings2.t()  # [N, N]
-        
-        # Extract diagonal (matching pairs)
-        diagonal_sims = torch.diag(sim_matrix).cpu().numpy()
-        
-        # Compute statistics
-        mean_sim = np.mean(diagonal_sims)
-        std_sim = np.std(diagonal_sims)
-        min_sim = np.min(diagonal_sims)
-        max_sim = np.max(diagonal_sims)
-        
-        # Compute off-diagonal similarities (non-matching pairs)
-        mask = torch.eye(sim_matrix.size(0), dtype=torch.bool)
-        off_diag_sims = sim_matrix[~mask].cpu().numpy()
+        # Matching-pair and non-matching statistics without an [N, N] matrix
+        statistics = paired_similarity_statistics(embeddings1, embeddings2)
         
         # Compute Pearson correlation
         pearson_corr, _ = pearsonr(embeddings1.flatten().cpu().numpy(), 
                                    embeddings2.flatten().cpu().numpy())
         
-        return {
-            'mean_cosine_sim': mean_sim,
-            'std_cosine_sim': std_sim,
-            'min_cosine_sim': min_sim,
-            'max_cosine_sim': max_sim,
-            'mean_non_matching_sim': np.mean(off_diag_sims),
-            'pearson_correlation': pearson_corr,
-            'num_pairs': len(diagonal_sims)
-        }
+        statistics['pearson_correlation'] = pearson_corr
+        return statistics
     
-    def evaluate_method(
+    def prepare_text_embeddings(
         self,
-        images: List[Image.Image],
         captions_per_image: List[List[str]],
-        method: str,
-        k_values: List[int] = [1, 5, 10],
-        num_inference_steps: int = 50,
-        generation_mode: str = "auto",  # NEW: Control generation mode
-    ) -> Tuple[Dict[str, float], torch.Tensor]:
-        """Evaluate a specific method and return embeddings."""
-        logger.info(f"Evaluating method: {method}")
-        
-        # Extract text embeddings (same for all methods)
-        logger.info("Extracting text embeddings...")
-        all_text_embeddings = []
+    ) -> Tuple[torch.Tensor, List[List[int]]]:
+        """Text embeddings of all captions (flattened) and the image->text mapping."""
         image_to_text_mapping = []
         text_idx = 0
         
@@ -520,16 +621,48 @@ class FixedBLIP3oRecallEvaluator:
                 text_idx += 1
             image_to_text_mapping.append(current_text_indices)
         
-        # Extract all captions
+        # Extract all captions (sharded across ranks in distributed runs)
         all_captions = [caption for caption_list in captions_per_image for caption in caption_list]
-        text_embeddings = self.extract_clip_text_embeddings(all_captions)
+        text_embeddings = distributed_map(self.extract_clip_text_embeddings, all_captions)
+        return text_embeddings, image_to_text_mapping
+    
+    def evaluate_method(
+        self,
+        images: List[Image.Image],
+        captions_per_image: List[List[str]],
+        method: str,
+        k_values: List[int] = [1, 5, 10],
+        num_inference_steps: int = 50,
+        generation_mode: str = "auto",  # NEW: Control generation mode
+        text_embeddings: Optional[torch.Tensor] = None,
+        image_to_text_mapping: Optional[List[List[int]]] = None,
+        eva_embeddings: Optional[torch.Tensor] = None,
+        sampler_kwargs: Optional[Dict] = None,
+    ) -> Tuple[Dict[str, float], torch.Tensor]:
+        """
+        Evaluate a specific method and return embeddings.
+        
+        text_embeddings / image_to_text_mapping and eva_embeddings may be passed
+        in precomputed (see evaluation/sweep_eval.py), so repeated evaluations
+        only pay for BLIP3-o generation.
+        
+        In distributed runs (see src/modules/evaluation/distributed_eval.py) every
+        rank extracts / generates its shard of the images and the embeddings are
+        gathered in order, so all ranks compute the same metrics.
+        """
+        logger.info(f"Evaluating method: {method}")
+        
+        # Extract text embeddings (same for all methods)
+        if text_embeddings is None or image_to_text_mapping is None:
+            logger.info("Extracting text embeddings...")
+            text_embeddings, image_to_text_mapping = self.prepare_text_embeddings(captions_per_image)
         
         # Extract image embeddings based on method
         logger.info(f"Extracting image embeddings using {method} method...")
         
         if method == "clip_baseline":
             # Use CLIP's standard image features
-            image_embeddings = self.extract_clip_vision_global_embeddings(images)
+            image_embeddings = distributed_map(self.extract_clip_vision_global_embeddings, images)
             method_description = "CLIP ViT-L/14 image features"
             
         elif method == "blip3o_fixed":
@@ -538,19 +671,25 @@ class FixedBLIP3oRecallEvaluator:
             
             logger.info("=== FIXED BLIP3-o Evaluation Pipeline ===")
             logger.info("Step 1: Extracting EVA-CLIP embeddings...")
-            
-            # Extract EVA embeddings first
-            eva_embeddings = self.extract_eva_vision_embeddings(images)
-            logger.info(f"EVA embeddings extracted: {eva_embeddings.shape}")
-            
             logger.info("Step 2: Generating CLIP embeddings using FIXED BLIP3-o...")
             
-            # Generate CLIP embeddings using FIXED BLIP3-o
-            image_embeddings = self.generate_blip3o_embeddings_fixed(
-                eva_embeddings, 
-                num_inference_steps, 
-                generation_mode
-            )
+            def generate_shard(shard_eva: torch.Tensor) -> torch.Tensor:
+                return self.generate_blip3o_embeddings_fixed(
+                    shard_eva,
+                    num_inference_steps,
+                    generation_mode,
+                    sampler_kwargs=sampler_kwargs,
+                )
+            
+            # EVA extraction + generation per shard (EVA embeddings never leave the rank)
+            if eva_embeddings is None:
+                image_embeddings = distributed_map(
+                    lambda shard_images: generate_shard(self.extract_eva_vision_embeddings(shard_images)),
+                    images,
+                )
+            else:
+                logger.info(f"Using precomputed EVA embeddings: {eva_embeddings.shape}")
+                image_embeddings = distributed_map(generate_shard, eva_embeddings)
             logger.info(f"BLIP3-o embeddings generated: {image_embeddings.shape}")
             
             method_description = f"FIXED BLIP3-o embeddings (EVA → DiT → {generation_mode} generation)"
@@ -587,8 +726,6 @@ class FixedBLIP3oRecallEvaluator:
         })
         
         # Memory cleanup
-        if method == "blip3o_fixed":
-            del eva_embeddings
         gc.collect()
         torch.cuda.empty_cache()
         
@@ -596,68 +733,8 @@ class FixedBLIP3oRecallEvaluator:
 
 
 def load_coco_samples(coco_root: Path, num_samples: int = 1000) -> Tuple[List[Image.Image], List[List[str]], List[int]]:
-    """Load COCO validation samples."""
-    logger.info(f"Loading {num_samples} COCO validation samples...")
-    
-    # Load COCO annotations
-    annotations_file = coco_root / "annotations" / "captions_val2017.json"
-    images_dir = coco_root / "images" / "val2017"
-    
-    if not annotations_file.exists():
-        raise FileNotFoundError(f"COCO annotations not found: {annotations_file}")
-    if not images_dir.exists():
-        raise FileNotFoundError(f"COCO images not found: {images_dir}")
-    
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    
-    # Create image info mapping
-    images_info = {img['id']: img for img in coco_data['images']}
-    
-    # Group annotations by image
-    image_captions = {}
-    for ann in coco_data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in image_captions:
-            image_captions[image_id] = []
-        image_captions[image_id].append(ann['caption'])
-    
-    # Load samples
-    images = []
-    captions_per_image = []
-    image_ids = []
-    
-    loaded_count = 0
-    for image_id, captions in image_captions.items():
-        if loaded_count >= num_samples:
-            break
-        
-        if image_id not in images_info:
-            continue
-        
-        image_info = images_info[image_id]
-        image_path = images_dir / image_info['file_name']
-        
-        # Check if image file exists
-        if not image_path.exists():
-            logger.warning(f"Image file not found: {image_path}")
-            continue
-        
-        try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
-            
-            images.append(image)
-            captions_per_image.append(captions[:5])  # Max 5 captions per image
-            image_ids.append(image_id)
-            loaded_count += 1
-            
-        except Exception as e:
-            logger.warning(f"Error loading image {image_path}: {e}")
-            continue
-    
-    logger.info(f"Successfully loaded {len(images)} images with {sum(len(caps) for caps in captions_per_image)} captions")
-    return images, captions_per_image, image_ids
+    """Load COCO validation samples (images decoded lazily, see src/modules/evaluation/coco_dataset.py)."""
+    return load_lazy_coco_samples(coco_root, num_samples)
 
 
 def main():
@@ -679,9 +756,32 @@ def main():
     parser.add_argument("--generation_mode", type=str, default="auto",
                        choices=["auto", "global", "patch", "dual"],
                        help="BLIP3-o generation mode (auto, global, patch, dual)")
+    parser.add_argument("--ann_backend", type=str, default=None,
+                       choices=["auto", "ivf", "faiss", "exact"],
+                       help="Also report approximate recall through a text ANN index")
+    parser.add_argument("--ann_index_path", type=str, default=None,
+                       help="Path to persist / reuse the text ANN index")
+    parser.add_argument("--ann_nprobe", type=int, default=8,
+                       help="IVF lists scanned per query")
+    parser.add_argument("--ann_nlist", type=int, default=None,
+                       help="IVF lists (default: 4 * sqrt(num_texts))")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None,
+                       help="Directory of the persistent CLIP/EVA embedding cache (disabled if not set)")
+    parser.add_argument("--embedding_cache_size_gb", type=float, default=50.0,
+                       help="Embedding cache size cap (least recently used entries are evicted)")
+    parser.add_argument("--distributed", action="store_true",
+                       help="Shard extraction / generation across torchrun ranks (rank 0 reports)")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Sampling seed; noise is drawn per sample from (seed, EVA conditioning), "
+                            "so --distributed runs match single-process runs")
     
     args = parser.parse_args()
     
+    # Sharded evaluation: one process per GPU (torchrun), identical metrics to one process
+    if args.distributed:
+        rank, world_size = init_distributed_evaluation()
+        logger.info(f"Distributed evaluation: rank {rank}/{world_size}")
+    
     # Convert paths
     coco_root = Path(args.coco_root)
     blip3o_model_path = Path(args.blip3o_model_path)
@@ -697,7 +797,15 @@ def main():
     
     # Initialize FIXED evaluator
     logger.info("Initializing FIXED BLIP3-o Recall Evaluator...")
-    evaluator = FixedBLIP3oRecallEvaluator(device=args.device)
+    evaluator = FixedBLIP3oRecallEvaluator(
+        device=args.device,
+        ann_backend=args.ann_backend,
+        ann_index_path=args.ann_index_path if is_main_process() else None,
+        ann_nprobe=args.ann_nprobe,
+        ann_nlist=args.ann_nlist,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size_gb=args.embedding_cache_size_gb,
+    )
     
     # Load CLIP models
     evaluator.load_clip_models()
@@ -734,6 +842,7 @@ def main():
                 k_values=args.k_values,
                 num_inference_steps=args.num_inference_steps,
                 generation_mode=args.generation_mode,
+                sampler_kwargs={'seed': args.seed},
             )
             
             method_time = time.time() - method_start_time
@@ -743,16 +852,17 @@ def main():
             all_embeddings[method] = embeddings
             
             # Print results for this method
-            print(f"\n📊 {method.upper()} Results:")
-            print(f"Method: {results['method_description']}")
-            print(f"Time: {method_time:.2f}s")
-            if method == "blip3o_fixed":
-                print(f"Generation mode: {results['generation_mode']}")
-                print(f"Model type: {'FIXED' if results['model_capabilities'].get('is_fixed_model', False) else 'Standard'}")
-            for k in args.k_values:
-                if f'recall@{k}' in results:
-                    recall_k = results[f'recall@{k}']
-                    print(f"  Recall@{k:2d}: {recall_k:.4f} ({recall_k*100:.2f}%)")
+            if is_main_process():
+                print(f"\n📊 {method.upper()} Results:")
+                print(f"Method: {results['method_description']}")
+                print(f"Time: {method_time:.2f}s")
+                if method == "blip3o_fixed":
+                    print(f"Generation mode: {results['generation_mode']}")
+                    print(f"Model type: {'FIXED' if results['model_capabilities'].get('is_fixed_model', False) else 'Standard'}")
+                for k in args.k_values:
+                    if f'recall@{k}' in results:
+                        recall_k = results[f'recall@{k}']
+                        print(f"  Recall@{k:2d}: {recall_k:.4f} ({recall_k*100:.2f}%)")
             
         except Exception as e:
             logger.error(f"Failed to evaluate method {method}: {e}")
@@ -766,7 +876,15 @@ def main():
         blip3o_emb = all_embeddings["blip3o_fixed"]
         
         similarity_metrics = evaluator.compute_cosine_similarity(clip_emb, blip3o_emb)
-        
+    
+    total_time = time.time() - start_time
+    
+    # Every rank holds the gathered embeddings / metrics: only rank 0 reports
+    if not is_main_process():
+        cleanup_distributed()
+        return 0
+    
+    if similarity_metrics:
         # Print similarity results
         print("\n🔍 Cosine Similarity Metrics (CLIP vs FIXED BLIP3-o):")
         print(f"  Mean Cosine Similarity: {similarity_metrics['mean_cosine_sim']:.4f}")
@@ -776,8 +894,6 @@ def main():
         print(f"  Mean Non-matching Similarity: {similarity_metrics['mean_non_matching_sim']:.4f}")
         print(f"  Pearson Correlation: {similarity_metrics['pearson_correlation']:.4f}")
     
-    total_time = time.time() - start_time
-    
     # Print comprehensive results
     print("\n" + "="*80)
     print("📊 FIXED BLIP3-O RECALL EVALUATION RESULTS")
@@ -866,6 +982,7 @@ def main():
                 'generation_mode': args.generation_mode,
                 'total_time': total_time,
                 'device': str(evaluator.device),
+                'world_size': get_dist_info()[1],
                 'k_values': args.k_values,
                 'num_inference_steps': args.num_inference_steps,
                 'evaluation_type': 'fixed_blip3o_with_global_generation',
@@ -883,6 +1000,7 @@ def main():
         
         logger.info(f"Results saved to: {save_path}")
     
+    cleanup_distributed()
     return 0
 
 
@@ -33,6 +33,19 @@ import sys
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.modules.evaluation.similarity_engine import (
+    BlockedSimilarityEngine,
+)
+from src.modules.evaluation.embedding_cache import cached_embeddings, create_embedding_cache
+from src.modules.evaluation.coco_dataset import iter_image_batches, load_coco_samples as load_lazy_coco_samples
+from src.modules.evaluation.distributed_eval import (
+    cleanup_distributed,
+    distributed_map,
+    init_distributed_evaluation,
+    is_main_process,
+)
+
 # Try to import BLIP3o modules (graceful failure if not available)
 try:
     from src.modules.inference.blip3o_inference import BLIP3oInference
@@ -70,10 +83,16 @@ class ComprehensiveRecallEvaluator:
     - BLIP3o model (EVA → BLIP3o DiT)
     """
     
+    # Images per processor / vision-model call during embedding extraction
+    image_batch_size = 32
+    
     def __init__(self, 
                  device: str = "auto", 
                  torch_dtype: Optional[torch.dtype] = None,
-                 blip3o_model_path: Optional[str] = None):
+                 blip3o_model_path: Optional[str] = None,
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size_gb: float = 50.0,
+                 seed: Optional[int] = 0):
         """
         Initialize the evaluator.
         
@@ -81,10 +100,21 @@ class ComprehensiveRecallEvaluator:
             device: Device to use ("auto", "cuda", "cpu")
             torch_dtype: Data type for models
             blip3o_model_path: Path to BLIP3o model (for BLIP3o evaluation)
+            embedding_cache_dir: Persistent CLIP/EVA embedding cache directory (None disables it)
+            embedding_cache_size_gb: Embedding cache size cap
+            seed: Sampling seed; each sample's noise is keyed by (seed, EVA conditioning),
+                so sharded (--distributed) runs match single-process runs (None: unseeded)
         """
         self.device = self._setup_device(device)
         self.torch_dtype = torch_dtype or torch.float32
         self.blip3o_model_path = blip3o_model_path
+        self.seed = seed
+        
+        # Persistent CLIP/EVA embedding cache shared across evaluators (opt-in)
+        self.embedding_cache = (
+            create_embedding_cache(embedding_cache_dir, embedding_cache_size_gb)
+            if embedding_cache_dir else None
+        )
         
         # Load models
         self._load_clip_model()
@@ -178,6 +208,7 @@ class ComprehensiveRecallEvaluator:
             self.blip3o_inference = None
             raise
     
+    @cached_embeddings("clip_text", "clip_model", "clip_processor")
     def extract_clip_text_embeddings(self, captions: List[str]) -> torch.Tensor:
         """
         Extract CLIP text embeddings (same as main codebase).
@@ -204,6 +235,7 @@ class ComprehensiveRecallEvaluator:
         
         return text_embeddings.cpu().float()
     
+    @cached_embeddings("clip_cls_projected", "clip_model", "clip_processor")
     def extract_clip_vision_global_tokens(self, images: List[Image.Image]) -> torch.Tensor:
         """
         Extract CLIP vision global tokens (CLS token + visual projection).
@@ -220,9 +252,9 @@ class ComprehensiveRecallEvaluator:
         global_embeddings = []
         
         with torch.no_grad():
-            for img in images:
+            for batch in iter_image_batches(images, self.image_batch_size):
                 # Process image (same as in main codebase)
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
@@ -234,21 +266,22 @@ class ComprehensiveRecallEvaluator:
                 )
                 
                 # Extract CLS token (global representation)
-                # vision_outputs.last_hidden_state: [1, 257, 1024] 
+                # vision_outputs.last_hidden_state: [b, 257, 1024] 
                 # Index 0 is CLS token, indices 1-256 are patch tokens
-                cls_token = vision_outputs.last_hidden_state[:, 0, :]  # [1, 1024]
+                cls_token = vision_outputs.last_hidden_state[:, 0, :]  # [b, 1024]
                 
                 # Apply CLIP's visual projection to align with text space
                 # This converts 1024-dim vision features → 768-dim aligned features
-                vision_projected = self.clip_model.visual_projection(cls_token)  # [1, 768]
+                vision_projected = self.clip_model.visual_projection(cls_token)  # [b, 768]
                 
                 # Normalize to unit norm (same as text embeddings)
                 vision_projected = F.normalize(vision_projected, p=2, dim=-1)
                 
-                global_embeddings.append(vision_projected.squeeze(0).cpu().float())  # [768]
+                global_embeddings.append(vision_projected.cpu().float())  # [b, 768]
         
-        return torch.stack(global_embeddings)  # [B, 768]
+        return torch.cat(global_embeddings)  # [B, 768]
     
+    @cached_embeddings("clip_patch_mean_projected", "clip_model", "clip_processor")
     def extract_clip_vision_patch_averaged(self, images: List[Image.Image]) -> torch.Tensor:
         """
         Extract CLIP vision embeddings using patch averaging + visual projection.
@@ -265,9 +298,9 @@ class ComprehensiveRecallEvaluator:
         patch_averaged_embeddings = []
         
         with torch.no_grad():
-            for img in images:
+            for batch in iter_image_batches(images, self.image_batch_size):
                 # Process image (same as in main codebase)
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
@@ -279,23 +312,24 @@ class ComprehensiveRecallEvaluator:
                 )
                 
                 # Extract patch embeddings (remove CLS token)
-                # vision_outputs.last_hidden_state: [1, 257, 1024]
+                # vision_outputs.last_hidden_state: [b, 257, 1024]
                 # Indices 1-256 are patch tokens, index 0 is CLS token
-                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [1, 256, 1024]
+                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [b, 256, 1024]
                 
                 # Average patch embeddings to get global representation
-                patch_averaged = patch_embeddings.mean(dim=1)  # [1, 1024]
+                patch_averaged = patch_embeddings.mean(dim=1)  # [b, 1024]
                 
                 # Apply CLIP's visual projection to align with text space
-                vision_projected = self.clip_model.visual_projection(patch_averaged)  # [1, 768]
+                vision_projected = self.clip_model.visual_projection(patch_averaged)  # [b, 768]
                 
                 # Normalize to unit norm (same as text embeddings)
                 vision_projected = F.normalize(vision_projected, p=2, dim=-1)
                 
-                patch_averaged_embeddings.append(vision_projected.squeeze(0).cpu().float())  # [768]
+                patch_averaged_embeddings.append(vision_projected.cpu().float())  # [b, 768]
         
-        return torch.stack(patch_averaged_embeddings)  # [B, 768]
+        return torch.cat(patch_averaged_embeddings)  # [B, 768]
     
+    @cached_embeddings("eva_patch", "eva_model", "eva_processor")
     def extract_eva_vision_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """
         Extract EVA-CLIP vision embeddings (same method as training).
@@ -314,12 +348,9 @@ class ComprehensiveRecallEvaluator:
         logger.info(f"Extracting EVA embeddings for {len(images)} images...")
         
         with torch.no_grad():
-            for i, img in enumerate(images):
-                if i % 100 == 0:
-                    logger.debug(f"Processing EVA image {i}/{len(images)}")
-                
+            for batch in iter_image_batches(images, self.image_batch_size):
                 # Use same processing as in main codebase (extract_embeddings_g.py)
-                inputs = self.eva_processor(images=img, return_tensors="pt")
+                inputs = self.eva_processor(images=batch, return_tensors="pt")
                 pixel_values = inputs['pixel_values'].to(device=self.device, dtype=self.torch_dtype)
                 
                 # Get vision model outputs
@@ -330,7 +361,7 @@ class ComprehensiveRecallEvaluator:
                 )
                 
                 # Get patch embeddings (remove CLS token) → [1, 256, hidden_dim]
-                # vision_outputs.last_hidden_state: [1, 257, hidden_dim] where 257 = 1 CLS + 256 patches
+                # vision_outputs.last_hidden_state: [b, 257, hidden_dim] where 257 = 1 CLS + 256 patches
                 patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # Remove CLS token
                 batch_size, num_patches, hidden_dim = patch_embeddings.shape
                 
@@ -340,16 +371,16 @@ class ComprehensiveRecallEvaluator:
                 if hidden_dim != 4096:
                     logger.warning(f"Expected 4096 dimensions, got {hidden_dim}")
                 
-                # Reshape to 16x16 grid → [1, 16, 16, hidden_dim]
+                # Reshape to 16x16 grid → [b, 16, 16, hidden_dim]
                 grid_size = int(np.sqrt(num_patches))  # Should be 16
                 spatial_grid = patch_embeddings.reshape(batch_size, grid_size, grid_size, hidden_dim)
                 
-                # Convert to tokens format → [256, hidden_dim] and then back to [1, 256, hidden_dim]
-                tokens = spatial_grid.reshape(1, num_patches, hidden_dim)  # [1, 256, 4096]
+                # Convert back to tokens format → [b, 256, hidden_dim]
+                tokens = spatial_grid.reshape(batch_size, num_patches, hidden_dim)  # [b, 256, 4096]
                 
-                eva_embeddings.append(tokens.squeeze(0).cpu().float())  # [256, 4096]
+                eva_embeddings.append(tokens.cpu().float())  # [b, 256, 4096]
         
-        result = torch.stack(eva_embeddings)  # [B, 256, 4096]
+        result = torch.cat(eva_embeddings)  # [B, 256, 4096]
         logger.info(f"EVA embeddings extracted: {result.shape}")
         logger.info(f"EVA embedding range: [{result.min():.4f}, {result.max():.4f}]")
         
@@ -396,6 +427,7 @@ class ComprehensiveRecallEvaluator:
                     generated_clip = self.blip3o_inference.generate(
                         batch_eva,  # [batch_size, 256, 4096]
                         num_inference_steps=50,  # You can adjust this
+                        seed=self.seed,
                     )  # → [batch_size, 256, 1024]
                     
                     logger.debug(f"Generated CLIP shape: {generated_clip.shape}")
@@ -445,33 +477,6 @@ class ComprehensiveRecallEvaluator:
         
         return result  # [B, 768] - normalized
     
-    def compute_pairwise_cosine_similarity(self,
-                                         embeddings_a: torch.Tensor,
-                                         embeddings_b: torch.Tensor) -> torch.Tensor:
-        """
-        Compute pairwise cosine similarity matrix.
-        
-        Args:
-            embeddings_a: First set of embeddings [N, D]
-            embeddings_b: Second set of embeddings [M, D]
-            
-        Returns:
-            Similarity matrix [N, M]
-        """
-        # Ensure both tensors are on the same device
-        if embeddings_a.device != embeddings_b.device:
-            embeddings_a = embeddings_a.cpu()
-            embeddings_b = embeddings_b.cpu()
-        
-        # Normalize embeddings (should already be normalized, but ensure it)
-        embeddings_a = F.normalize(embeddings_a, p=2, dim=-1)
-        embeddings_b = F.normalize(embeddings_b, p=2, dim=-1)
-        
-        # Compute pairwise cosine similarity via matrix multiplication
-        similarity_matrix = torch.mm(embeddings_a, embeddings_b.t())
-        
-        return similarity_matrix
-    
     def compute_image_to_text_recall(self,
                                    image_embeddings: torch.Tensor,
                                    text_embeddings: torch.Tensor,
@@ -493,48 +498,32 @@ class ComprehensiveRecallEvaluator:
         image_embeddings = F.normalize(image_embeddings, p=2, dim=-1)
         text_embeddings = F.normalize(text_embeddings, p=2, dim=-1)
         
-        # Compute similarity matrix: [N_images, N_texts]
-        similarity_matrix = self.compute_pairwise_cosine_similarity(
-            image_embeddings, text_embeddings
-        )
-        
-        logger.info(f"Similarity matrix shape: {similarity_matrix.shape}")
-        logger.info(f"Similarity range: [{similarity_matrix.min():.4f}, {similarity_matrix.max():.4f}]")
-        logger.info(f"Similarity mean: {similarity_matrix.mean():.4f} ± {similarity_matrix.std():.4f}")
-        
-        # Compute recall for each K value
-        recall_results = {}
-        
+        # Blocked scoring: recall@K / mAP / MRR / median rank in both directions and
+        # similarity statistics without materializing the [N_images, N_texts] matrix
+        engine = BlockedSimilarityEngine(normalize=False)
+        recall_results = engine.retrieval_metrics(image_embeddings, text_embeddings, image_to_text_mapping, k_values)
+        
+        logger.info(f"Similarity matrix shape: ({len(image_embeddings)}, {len(text_embeddings)}) (blocked)")
+        logger.info(f"Similarity range: [{recall_results['similarity_min']:.4f}, {recall_results['similarity_max']:.4f}]")
+        logger.info(f"Similarity mean: {recall_results['similarity_mean']:.4f} ± {recall_results['similarity_std']:.4f}")
+        
+        # Debug first few retrievals
+        logger.info("Sample image-to-text retrievals (first 5):")
+        top_scores, top_indices = engine.topk(image_embeddings[:5], text_embeddings, 1)
+        for i in range(min(5, len(image_to_text_mapping))):
+            correct_texts = image_to_text_mapping[i]
+            retrieved_text = top_indices[i, 0].item()
+            is_correct = retrieved_text in correct_texts
+            logger.info(f"  Image {i}: retrieved text {retrieved_text} (sim={top_scores[i, 0].item():.4f}), "
+                       f"correct={is_correct}, target_texts={correct_texts}")
+        
+        total_queries = len(image_to_text_mapping)
         for k in k_values:
-            correct_retrievals = 0
-            total_queries = len(image_to_text_mapping)
-            
-            # Get top-k text indices for each image
-            _, top_k_indices = torch.topk(similarity_matrix, k=k, dim=1)  # [N_images, k]
-            
-            # Debug first few retrievals for k=1
-            if k == 1:
-                logger.info("Sample image-to-text retrievals (first 5):")
-                for i in range(min(5, len(image_to_text_mapping))):
-                    correct_texts = image_to_text_mapping[i]
-                    retrieved_text = top_k_indices[i, 0].item()
-                    similarity_score = similarity_matrix[i, retrieved_text].item()
-                    is_correct = retrieved_text in correct_texts
-                    logger.info(f"  Image {i}: retrieved text {retrieved_text} (sim={similarity_score:.4f}), "
-                               f"correct={is_correct}, target_texts={correct_texts}")
-            
-            # Check if any of the top-k retrieved texts belong to the query image
-            for img_idx, correct_text_indices in enumerate(image_to_text_mapping):
-                retrieved_indices = top_k_indices[img_idx].cpu().numpy()
-                
-                # Check if any retrieved index is in the correct text indices
-                if any(ret_idx in correct_text_indices for ret_idx in retrieved_indices):
-                    correct_retrievals += 1
-            
-            recall_at_k = correct_retrievals / total_queries if total_queries > 0 else 0
-            recall_results[f'recall@{k}'] = recall_at_k
-            
-            logger.info(f"Recall@{k}: {correct_retrievals}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+            recall_at_k = recall_results[f'recall@{k}']
+            logger.info(f"Recall@{k}: {round(recall_at_k * total_queries)}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+        logger.info(f"mAP: {recall_results['mAP']:.4f}, MRR: {recall_results['MRR']:.4f}, "
+                    f"median rank: {recall_results['median_rank']:.0f}")
+        logger.info(f"Text-to-image Recall@1: {recall_results['t2i_recall@1']:.4f}")
         
         # Additional metrics
         recall_results['num_queries'] = len(image_to_text_mapping)
@@ -560,6 +549,9 @@ class ComprehensiveRecallEvaluator:
             
         Returns:
             Dictionary with recall metrics
+        
+        Distributed runs extract each rank's shard of the images / captions and
+        gather the embeddings in order (src/modules/evaluation/distributed_eval.py).
         """
         logger.info(f"Evaluating recall using method: {method}")
         
@@ -579,17 +571,17 @@ class ComprehensiveRecallEvaluator:
         
         # Extract all captions
         all_captions = [caption for caption_list in captions_per_image for caption in caption_list]
-        text_embeddings = self.extract_clip_text_embeddings(all_captions)
+        text_embeddings = distributed_map(self.extract_clip_text_embeddings, all_captions)
         
         # Extract image embeddings based on method
         logger.info(f"Extracting image embeddings using {method} method...")
         
         if method == "global":
-            image_embeddings = self.extract_clip_vision_global_tokens(images)
+            image_embeddings = distributed_map(self.extract_clip_vision_global_tokens, images)
             method_description = "CLS token + visual projection"
             
         elif method == "patch":
-            image_embeddings = self.extract_clip_vision_patch_averaged(images)
+            image_embeddings = distributed_map(self.extract_clip_vision_patch_averaged, images)
             method_description = "Patch averaging + visual projection"
             
         elif method == "blip3o":
@@ -598,15 +590,15 @@ class ComprehensiveRecallEvaluator:
             
             logger.info("=== BLIP3o Evaluation Pipeline ===")
             logger.info("Step 1: Extracting EVA-CLIP embeddings...")
-            
-            # Extract EVA embeddings first
-            eva_embeddings = self.extract_eva_vision_embeddings(images)
-            logger.info(f"EVA embeddings extracted: {eva_embeddings.shape}")
-            
             logger.info("Step 2: Generating CLIP embeddings using BLIP3o DiT...")
             
-            # Generate CLIP embeddings using BLIP3o
-            image_embeddings = self.extract_blip3o_generated_embeddings(eva_embeddings)
+            # EVA extraction + BLIP3o generation per shard
+            image_embeddings = distributed_map(
+                lambda shard_images: self.extract_blip3o_generated_embeddings(
+                    self.extract_eva_vision_embeddings(shard_images)
+                ),
+                images,
+            )
             logger.info(f"BLIP3o embeddings generated: {image_embeddings.shape}")
             
             method_description = "EVA → BLIP3o DiT → visual projection"
@@ -807,13 +799,14 @@ def run_comprehensive_evaluation(evaluator: ComprehensiveRecallEvaluator,
             all_results[method] = results
             
             # Print results for this method
-            print(f"\n📊 {method.upper()} Results:")
-            print(f"Method: {results['method_description']}")
-            print(f"Time: {evaluation_time:.2f}s")
-            for k in k_values:
-                if f'recall@{k}' in results:
-                    recall_k = results[f'recall@{k}']
-                    print(f"  Recall@{k:2d}: {recall_k:.4f} ({recall_k*100:.2f}%)")
+            if is_main_process():
+                print(f"\n📊 {method.upper()} Results:")
+                print(f"Method: {results['method_description']}")
+                print(f"Time: {evaluation_time:.2f}s")
+                for k in k_values:
+                    if f'recall@{k}' in results:
+                        recall_k = results[f'recall@{k}']
+                        print(f"  Recall@{k:2d}: {recall_k:.4f} ({recall_k*100:.2f}%)")
             
         except Exception as e:
             logger.error(f"Failed to evaluate method {method}: {e}")
@@ -823,77 +816,8 @@ def run_comprehensive_evaluation(evaluator: ComprehensiveRecallEvaluator,
 
 
 def load_coco_samples(coco_root: Path, num_samples: int = 1000) -> Tuple[List[Image.Image], List[List[str]], List[int]]:
-    """
-    Load COCO validation samples.
-    
-    Args:
-        coco_root: Path to COCO dataset
-        num_samples: Number of samples to load
-        
-    Returns:
-        Tuple of (images, captions_per_image, image_ids)
-    """
-    logger.info(f"Loading {num_samples} COCO validation samples...")
-    
-    # Load COCO annotations
-    annotations_file = coco_root / "annotations" / "captions_val2017.json"
-    images_dir = coco_root / "images" / "val2017"
-    
-    if not annotations_file.exists():
-        raise FileNotFoundError(f"COCO annotations not found: {annotations_file}")
-    if not images_dir.exists():
-        raise FileNotFoundError(f"COCO images not found: {images_dir}")
-    
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    
-    # Create image info mapping
-    images_info = {img['id']: img for img in coco_data['images']}
-    
-    # Group annotations by image
-    image_captions = {}
-    for ann in coco_data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in image_captions:
-            image_captions[image_id] = []
-        image_captions[image_id].append(ann['caption'])
-    
-    # Load samples
-    images = []
-    captions_per_image = []
-    image_ids = []
-    
-    loaded_count = 0
-    for image_id, captions in image_captions.items():
-        if loaded_count >= num_samples:
-            break
-        
-        if image_id not in images_info:
-            continue
-        
-        image_info = images_info[image_id]
-        image_path = images_dir / image_info['file_name']
-        
-        # Check if image file exists
-        if not image_path.exists():
-            logger.warning(f"Image file not found: {image_path}")
-            continue
-        
-        try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
-            
-            images.append(image)
-            captions_per_image.append(captions[:5])  # Max 5 captions per image
-            image_ids.append(image_id)
-            loaded_count += 1
-            
-        except Exception as e:
-            logger.warning(f"Error loading image {image_path}: {e}")
-            continue
-    
-    logger.info(f"Successfully loaded {len(images)} images with {sum(len(caps) for caps in captions_per_image)} captions")
-    return images, captions_per_image, image_ids
+    """Load COCO validation samples (images decoded lazily, see src/modules/evaluation/coco_dataset.py)."""
+    return load_lazy_coco_samples(coco_root, num_samples)
 
 
 def main():
@@ -915,9 +839,22 @@ def main():
                        help="Path to save results JSON file")
     parser.add_argument("--k_values", nargs="+", type=int, default=[1, 5, 10],
                        help="K values for Recall@K computation")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None,
+                       help="Directory of the persistent CLIP/EVA embedding cache (disabled if not set)")
+    parser.add_argument("--embedding_cache_size_gb", type=float, default=50.0,
+                       help="Embedding cache size cap (least recently used entries are evicted)")
+    parser.add_argument("--distributed", action="store_true",
+                       help="Shard extraction / generation across torchrun ranks (rank 0 reports)")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Sampling seed; noise is drawn per sample from (seed, EVA conditioning), "
+                            "so --distributed runs match single-process runs")
     
     args = parser.parse_args()
     
+    # Sharded evaluation: one process per GPU (torchrun), identical metrics to one process
+    if args.distributed:
+        init_distributed_evaluation()
+    
     # Validate arguments
     if args.method in ["blip3o", "all"] and not args.blip3o_model_path:
         if not BLIP3O_AVAILABLE:
@@ -951,7 +888,10 @@ def main():
     logger.info("Initializing Comprehensive Recall Evaluator...")
     evaluator = ComprehensiveRecallEvaluator(
         device=args.device,
-        blip3o_model_path=args.blip3o_model_path
+        blip3o_model_path=args.blip3o_model_path,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size_gb=args.embedding_cache_size_gb,
+        seed=args.seed,
     )
     
     # Load COCO samples
@@ -990,6 +930,11 @@ def main():
     
     total_time = time.time() - start_time
     
+    # Every rank holds the same results: only rank 0 reports
+    if not is_main_process():
+        cleanup_distributed()
+        return
+    
     # Print comprehensive results
     print("\n" + "="*80)
     print("📊 COMPREHENSIVE RECALL EVALUATION RESULTS")
@@ -1084,6 +1029,8 @@ def main():
             json.dump(results_to_save, f, indent=2)
         
         logger.info(f"Results saved to: {save_path}")
+    
+    cleanup_distributed()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,10 @@ Key Metrics:
 - Spatial reconstruction analysis (16x16 grid)
 - Distribution and correlation analysis
 
+Evaluation is streaming (src/modules/evaluation/streaming_stats.py): batches
+update running moments, quantile sketches and 16x16 spatial accumulators, so
+the full [N, 256, 1024] tensors are never held in memory.
+
 Usage:
 python patch_reconstruction_evaluation.py \
     --coco_root ./data/coco \
@@ -40,6 +44,23 @@ import sys
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from src.modules.evaluation.embedding_cache import cached_embeddings, create_embedding_cache
+from src.modules.evaluation.coco_dataset import iter_image_batches, load_coco_samples as load_lazy_coco_samples
+from src.modules.evaluation.streaming_stats import (
+    StreamingDistributionStats,
+    compute_patch_distances,
+    create_streaming_patch_statistics,
+)
+from src.modules.evaluation.distributed_eval import (
+    cleanup_distributed,
+    gather_objects,
+    init_distributed_evaluation,
+    is_main_process,
+    merge_gathered,
+    shard_sequence,
+)
+
 # Try to import BLIP3o modules
 try:
     from src.modules.inference.blip3o_inference import BLIP3oInference
@@ -69,10 +90,16 @@ class PatchReconstructionEvaluator:
     how well BLIP3o DiT reconstructs the spatial structure of CLIP patch representations.
     """
     
+    # Images per processor / vision-model call during embedding extraction
+    image_batch_size = 32
+    
     def __init__(self, 
                  device: str = "auto",
                  torch_dtype: Optional[torch.dtype] = None,
-                 blip3o_model_path: Optional[str] = None):
+                 blip3o_model_path: Optional[str] = None,
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size_gb: float = 50.0,
+                 seed: Optional[int] = 0):
         """
         Initialize the evaluator.
         
@@ -80,10 +107,21 @@ class PatchReconstructionEvaluator:
             device: Device to use ("auto", "cuda", "cpu")
             torch_dtype: Data type for models
             blip3o_model_path: Path to BLIP3o model
+            embedding_cache_dir: Persistent CLIP/EVA embedding cache directory (None disables it)
+            embedding_cache_size_gb: Embedding cache size cap
+            seed: Sampling seed; each sample's noise is keyed by (seed, EVA conditioning),
+                so sharded (--distributed) runs match single-process runs (None: unseeded)
         """
         self.device = self._setup_device(device)
         self.torch_dtype = torch_dtype or torch.float32
         self.blip3o_model_path = blip3o_model_path
+        self.seed = seed
+        
+        # Persistent CLIP/EVA embedding cache shared across evaluators (opt-in)
+        self.embedding_cache = (
+            create_embedding_cache(embedding_cache_dir, embedding_cache_size_gb)
+            if embedding_cache_dir else None
+        )
         
         # Load models
         self._load_clip_model()
@@ -149,6 +187,7 @@ class PatchReconstructionEvaluator:
             self.blip3o_inference = None
             raise
     
+    @cached_embeddings("clip_patch", "clip_model", "clip_processor")
     def extract_clip_patch_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """
         Extract CLIP patch embeddings (without CLS token).
@@ -164,12 +203,9 @@ class PatchReconstructionEvaluator:
         logger.info(f"Extracting CLIP patch embeddings for {len(images)} images...")
         
         with torch.no_grad():
-            for i, img in enumerate(images):
-                if i % 100 == 0:
-                    logger.debug(f"Processing CLIP image {i}/{len(images)}")
-                
+            for batch in iter_image_batches(images, self.image_batch_size):
                 # Process image
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
@@ -181,18 +217,19 @@ class PatchReconstructionEvaluator:
                 )
                 
                 # Extract patch embeddings (remove CLS token)
-                # vision_outputs.last_hidden_state: [1, 257, 1024]
+                # vision_outputs.last_hidden_state: [b, 257, 1024]
                 # Index 0 is CLS token, indices 1-256 are patch tokens
-                patches = vision_outputs.last_hidden_state[:, 1:, :]  # [1, 256, 1024]
+                patches = vision_outputs.last_hidden_state[:, 1:, :]  # [b, 256, 1024]
                 
-                patch_embeddings.append(patches.squeeze(0).cpu().float())  # [256, 1024]
+                patch_embeddings.append(patches.cpu().float())  # [b, 256, 1024]
         
-        result = torch.stack(patch_embeddings)  # [B, 256, 1024]
+        result = torch.cat(patch_embeddings)  # [B, 256, 1024]
         logger.info(f"CLIP patch embeddings extracted: {result.shape}")
         logger.info(f"CLIP patch embedding range: [{result.min():.4f}, {result.max():.4f}]")
         
         return result
     
+    @cached_embeddings("eva_patch", "eva_model", "eva_processor")
     def extract_eva_patch_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """
         Extract EVA-CLIP patch embeddings.
@@ -208,12 +245,9 @@ class PatchReconstructionEvaluator:
         logger.info(f"Extracting EVA patch embeddings for {len(images)} images...")
         
         with torch.no_grad():
-            for i, img in enumerate(images):
-                if i % 100 == 0:
-                    logger.debug(f"Processing EVA image {i}/{len(images)}")
-                
+            for batch in iter_image_batches(images, self.image_batch_size):
                 # Process image
-                inputs = self.eva_processor(images=img, return_tensors="pt")
+                inputs = self.eva_processor(images=batch, return_tensors="pt")
                 pixel_values = inputs['pixel_values'].to(device=self.device, dtype=self.torch_dtype)
                 
                 # Get vision model outputs
@@ -224,12 +258,12 @@ class PatchReconstructionEvaluator:
                 )
                 
                 # Extract patch embeddings (remove CLS token)
-                # vision_outputs.last_hidden_state: [1, 257, 4096]
-                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [1, 256, 4096]
+                # vision_outputs.last_hidden_state: [b, 257, 4096]
+                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [b, 256, 4096]
                 
-                eva_embeddings.append(patch_embeddings.squeeze(0).cpu().float())  # [256, 4096]
+                eva_embeddings.append(patch_embeddings.cpu().float())  # [b, 256, 4096]
         
-        result = torch.stack(eva_embeddings)  # [B, 256, 4096]
+        result = torch.cat(eva_embeddings)  # [B, 256, 4096]
         logger.info(f"EVA patch embeddings extracted: {result.shape}")
         logger.info(f"EVA patch embedding range: [{result.min():.4f}, {result.max():.4f}]")
         
@@ -271,6 +305,7 @@ class PatchReconstructionEvaluator:
                     generated_patches = self.blip3o_inference.generate(
                         batch_eva,  # [batch_size, 256, 4096]
                         num_inference_steps=50,
+                        seed=self.seed,
                     )  # → [batch_size, 256, 1024]
                     
                     logger.debug(f"Generated patches shape: {generated_patches.shape}")
@@ -317,61 +352,42 @@ class PatchReconstructionEvaluator:
         logger.info(f"Computing distances for {B} samples, {num_tokens} tokens, {embed_dim} dimensions")
         
         with torch.no_grad():
+            # Row chunks through compute_patch_distances: one [chunk, 256, 1024]
+            # temporary instead of full-size differences / normalized copies
+            chunk_size = 256
+            chunks = [
+                compute_patch_distances(target_patches[i:i + chunk_size], predicted_patches[i:i + chunk_size])
+                for i in range(0, B, chunk_size)
+            ]
             distances = {}
             
             # 1. Token-wise L2 distances: [B, 256]
             # For each token position, compute L2 distance across the embedding dimension
-            token_wise_distances = torch.norm(
-                target_patches - predicted_patches, p=2, dim=-1
-            )  # [B, 256]
+            token_wise_distances = torch.cat([chunk['token_wise'] for chunk in chunks])
             distances['token_wise'] = token_wise_distances
             
             # 2. Per-sample L2 distances: [B]
             # For each sample, compute L2 distance across all tokens (flattened)
-            target_flat = target_patches.view(B, -1)  # [B, 256*1024]
-            predicted_flat = predicted_patches.view(B, -1)  # [B, 256*1024]
-            per_sample_distances = torch.norm(
-                target_flat - predicted_flat, p=2, dim=-1
-            )  # [B]
-            distances['per_sample'] = per_sample_distances
+            distances['per_sample'] = torch.cat([chunk['per_sample'] for chunk in chunks])
             
             # 3. Per-token average L2 distances: [256]
             # Average L2 distance for each token position across all samples
-            per_token_avg_distances = token_wise_distances.mean(dim=0)  # [256]
-            distances['per_token_avg'] = per_token_avg_distances
+            distances['per_token_avg'] = token_wise_distances.mean(dim=0)
             
             # 4. Global L2 distance: scalar
             # Overall L2 distance across all samples and tokens
-            global_distance = torch.norm(target_flat - predicted_flat, p=2)
-            distances['global'] = global_distance
+            squared_sum = sum(chunk['squared_sum'].sum() for chunk in chunks)
+            distances['global'] = torch.as_tensor(squared_sum).sqrt().float()
             
-            # 5. Normalized distances (divide by embedding norms)
-            target_norms = torch.norm(target_patches, p=2, dim=-1)  # [B, 256]
-            predicted_norms = torch.norm(predicted_patches, p=2, dim=-1)  # [B, 256]
-            
-            # Avoid division by zero
-            safe_target_norms = torch.clamp(target_norms, min=1e-8)
-            normalized_distances = token_wise_distances / safe_target_norms  # [B, 256]
-            distances['normalized_token_wise'] = normalized_distances
+            # 5. Normalized distances (divide by target embedding norms): [B, 256]
+            distances['normalized_token_wise'] = torch.cat([chunk['normalized_token_wise'] for chunk in chunks])
             
             # 6. Cosine distances for each token: [B, 256]
             # 1 - cosine similarity for each token
-            target_norm = F.normalize(target_patches, p=2, dim=-1)  # [B, 256, 1024]
-            predicted_norm = F.normalize(predicted_patches, p=2, dim=-1)  # [B, 256, 1024]
-            
-            cosine_similarities = (target_norm * predicted_norm).sum(dim=-1)  # [B, 256]
-            cosine_distances = 1.0 - cosine_similarities  # [B, 256]
-            distances['cosine_token_wise'] = cosine_distances
+            distances['cosine_token_wise'] = torch.cat([chunk['cosine_token_wise'] for chunk in chunks])
             
-            # 7. Spatial distances (16x16 grid analysis)
-            # Reshape to spatial grid and compute spatial statistics
-            spatial_target = target_patches.view(B, 16, 16, embed_dim)  # [B, 16, 16, 1024]
-            spatial_predicted = predicted_patches.view(B, 16, 16, embed_dim)  # [B, 16, 16, 1024]
-            
-            spatial_distances = torch.norm(
-                spatial_target - spatial_predicted, p=2, dim=-1
-            )  # [B, 16, 16]
-            distances['spatial'] = spatial_distances
+            # 7. Spatial distances (16x16 grid analysis): token-wise distances on the grid
+            distances['spatial'] = token_wise_distances.view(B, 16, 16)  # [B, 16, 16]
             
             logger.info("3D L2 distance computation completed")
             
@@ -398,23 +414,14 @@ class PatchReconstructionEvaluator:
                     'type': 'scalar'
                 }
             else:
-                # Multi-dimensional tensors
-                stats = {
-                    'mean': distance_tensor.mean().item(),
-                    'std': distance_tensor.std().item(),
-                    'min': distance_tensor.min().item(),
-                    'max': distance_tensor.max().item(),
-                    'median': distance_tensor.median().item(),
-                    'shape': list(distance_tensor.shape),
-                    'type': 'tensor'
-                }
+                # Multi-dimensional tensors: streamed in row chunks (torch.quantile
+                # fails beyond ~16M elements; the sketch is exact below its limit)
+                stream = StreamingDistributionStats(tuple(distance_tensor.shape[1:]))
+                for chunk in distance_tensor.split(4096):
+                    stream.update(chunk)
                 
-                # Add percentiles for detailed analysis
-                percentiles = [5, 25, 75, 95]
-                for p in percentiles:
-                    stats[f'p{p}'] = torch.quantile(distance_tensor.float(), p/100).item()
-                
-                statistics[distance_name] = stats
+                # Percentiles included for detailed analysis
+                statistics[distance_name] = stream.summary(percentiles=[5, 25, 75, 95])
         
         return statistics
     
@@ -482,58 +489,80 @@ class PatchReconstructionEvaluator:
         return spatial_analysis
     
     def evaluate_patch_reconstruction(self, 
-                                    images: List[Image.Image]) -> Dict[str, any]:
+                                    images: List[Image.Image],
+                                    batch_size: int = 32) -> Dict[str, any]:
         """
-        Run complete patch reconstruction evaluation.
+        Run complete patch reconstruction evaluation (streaming).
+        
+        Images are processed batch by batch (CLIP targets, EVA conditioning,
+        BLIP3o generation); each batch only updates running moments, quantile
+        sketches and 16x16 spatial accumulators, so memory does not grow with
+        the number of images. In distributed runs each rank streams its shard
+        and the accumulators are merged in rank order.
         
         Args:
-            images: List of PIL Images to evaluate
+            images: List (or lazy sequence) of PIL Images to evaluate
+            batch_size: Images per streaming step
             
         Returns:
             Complete evaluation results
         """
         logger.info("Starting patch reconstruction evaluation...")
-        logger.info(f"Evaluating {len(images)} images")
+        logger.info(f"Evaluating {len(images)} images in batches of {batch_size}")
         
-        # Extract CLIP patch embeddings (target)
-        logger.info("=== Extracting Target CLIP Patch Embeddings ===")
-        target_patches = self.extract_clip_patch_embeddings(images)
+        stream = create_streaming_patch_statistics(grid_size=16)
+        shapes = {}
         
-        # Extract EVA patch embeddings
-        logger.info("=== Extracting EVA Patch Embeddings ===")
-        eva_patches = self.extract_eva_patch_embeddings(images)
+        # This rank's contiguous shard (all images outside torch.distributed)
+        local_images = shard_sequence(images)
         
-        # Generate BLIP3o patch embeddings (predicted)
-        logger.info("=== Generating BLIP3o Patch Embeddings ===")
-        predicted_patches = self.generate_blip3o_patch_embeddings(eva_patches)
+        for start in tqdm(range(0, len(local_images), batch_size), desc="Patch reconstruction",
+                          disable=not is_main_process()):
+            batch_images = local_images[start:start + batch_size]
+            
+            # Extract CLIP patch embeddings (target)
+            target_patches = self.extract_clip_patch_embeddings(batch_images)
+            
+            # Extract EVA patch embeddings, generate BLIP3o patch embeddings (predicted)
+            eva_patches = self.extract_eva_patch_embeddings(batch_images)
+            predicted_patches = self.generate_blip3o_patch_embeddings(eva_patches)
+            
+            # Update streaming L2 distance metrics
+            stream.update(target_patches, predicted_patches)
+            shapes = {
+                'target_shape': list(target_patches.shape[1:]),
+                'predicted_shape': list(predicted_patches.shape[1:]),
+                'eva_shape': list(eva_patches.shape[1:]),
+            }
+            del target_patches, eva_patches, predicted_patches
         
-        # Compute L2 distances
-        logger.info("=== Computing L2 Distance Metrics ===")
-        distances = self.compute_3d_l2_distances(target_patches, predicted_patches)
+        # Merge per-rank accumulators (no-op in a single process)
+        stream = merge_gathered(stream)
+        shapes = next((rank_shapes for rank_shapes in gather_objects(shapes) if rank_shapes), {})
         
         # Compute statistics
         logger.info("=== Computing Distance Statistics ===")
-        statistics = self.compute_distance_statistics(distances)
+        statistics = stream.distance_statistics()
         
         # Analyze spatial patterns
         logger.info("=== Analyzing Spatial Patterns ===")
-        spatial_analysis = self.analyze_spatial_patterns(distances['spatial'])
+        spatial_analysis = stream.spatial_analysis()
         
         # Compile results
+        num_images = stream.num_samples
         results = {
             'evaluation_info': {
-                'num_images': len(images),
-                'target_shape': list(target_patches.shape),
-                'predicted_shape': list(predicted_patches.shape),
-                'eva_shape': list(eva_patches.shape),
+                'num_images': num_images,
+                'target_shape': [num_images] + shapes.get('target_shape', []),
+                'predicted_shape': [num_images] + shapes.get('predicted_shape', []),
+                'eva_shape': [num_images] + shapes.get('eva_shape', []),
+                'batch_size': batch_size,
+                'streaming': True,
             },
             'distance_statistics': statistics,
             'spatial_analysis': spatial_analysis,
-            'raw_distances': {
-                # Convert tensors to lists for JSON serialization
-                k: v.cpu().numpy().tolist() if isinstance(v, torch.Tensor) else v
-                for k, v in distances.items()
-            }
+            # Full [N, 256] distance tensors are not kept; per-sample distances are
+            'raw_distances': stream.raw_distances(),
         }
         
         logger.info("Patch reconstruction evaluation completed")
@@ -542,41 +571,8 @@ class PatchReconstructionEvaluator:
 
 
 def load_coco_samples(coco_root: Path, num_samples: int = 1000) -> Tuple[List[Image.Image], List[int]]:
-    """Load COCO validation samples for patch reconstruction evaluation."""
-    logger.info(f"Loading {num_samples} COCO validation samples...")
-    
-    annotations_file = coco_root / "annotations" / "captions_val2017.json"
-    images_dir = coco_root / "images" / "val2017"
-    
-    if not annotations_file.exists():
-        raise FileNotFoundError(f"COCO annotations not found: {annotations_file}")
-    if not images_dir.exists():
-        raise FileNotFoundError(f"COCO images not found: {images_dir}")
-    
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    
-    # Get unique images
-    images_info = {img['id']: img for img in coco_data['images']}
-    
-    images = []
-    image_ids = []
-    
-    for image_id, image_info in list(images_info.items())[:num_samples]:
-        image_path = images_dir / image_info['file_name']
-        
-        if not image_path.exists():
-            continue
-        
-        try:
-            image = Image.open(image_path).convert('RGB')
-            images.append(image)
-            image_ids.append(image_id)
-        except Exception as e:
-            logger.warning(f"Error loading image {image_path}: {e}")
-            continue
-    
-    logger.info(f"Successfully loaded {len(images)} images")
+    """Load COCO validation samples for patch reconstruction evaluation (images decoded lazily)."""
+    images, _, image_ids = load_lazy_coco_samples(coco_root, num_samples, order="images")
     return images, image_ids
 
 
@@ -630,11 +626,26 @@ def main():
                        help="Device to use (auto, cuda, cpu)")
     parser.add_argument("--save_results", type=str, default=None,
                        help="Path to save results JSON file")
+    parser.add_argument("--batch_size", type=int, default=32,
+                       help="Images per streaming evaluation step")
     parser.add_argument("--save_plots", type=str, default=None,
                        help="Directory to save visualization plots")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None,
+                       help="Directory of the persistent CLIP/EVA embedding cache (disabled if not set)")
+    parser.add_argument("--embedding_cache_size_gb", type=float, default=50.0,
+                       help="Embedding cache size cap (least recently used entries are evicted)")
+    parser.add_argument("--distributed", action="store_true",
+                       help="Shard the images across torchrun ranks (rank 0 reports)")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Sampling seed; noise is drawn per sample from (seed, EVA conditioning), "
+                            "so --distributed runs match single-process runs")
     
     args = parser.parse_args()
     
+    # Sharded evaluation: one process per GPU (torchrun), identical statistics to one process
+    if args.distributed:
+        init_distributed_evaluation()
+    
     # Validate arguments
     if not BLIP3O_AVAILABLE:
         logger.error("BLIP3o inference module not available")
@@ -652,7 +663,10 @@ def main():
     logger.info("Initializing Patch Reconstruction Evaluator...")
     evaluator = PatchReconstructionEvaluator(
         device=args.device,
-        blip3o_model_path=str(blip3o_model_path)
+        blip3o_model_path=str(blip3o_model_path),
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size_gb=args.embedding_cache_size_gb,
+        seed=args.seed,
     )
     
     # Load COCO samples
@@ -663,11 +677,16 @@ def main():
     logger.info("Running patch reconstruction evaluation...")
     start_time = time.time()
     
-    results = evaluator.evaluate_patch_reconstruction(images)
+    results = evaluator.evaluate_patch_reconstruction(images, batch_size=args.batch_size)
     
     evaluation_time = time.time() - start_time
     results['evaluation_time'] = evaluation_time
     
+    # Every rank holds the merged statistics: only rank 0 reports
+    if not is_main_process():
+        cleanup_distributed()
+        return
+    
     # Print results
     print_results(results)
     
@@ -683,6 +702,8 @@ def main():
     
     print(f"\n⏱️  Evaluation completed in {evaluation_time:.2f} seconds")
     print(f"📊 Key Insight: Average per-sample L2 distance = {results['distance_statistics']['per_sample']['mean']:.6f}")
+    
+    cleanup_distributed()
 
 
 if __name__ == "__main__":
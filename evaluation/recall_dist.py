@@ -28,12 +28,27 @@ import sys
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Add src to path
+# Add project root (and src) to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
+from src.modules.evaluation.similarity_engine import (
+    BlockedSimilarityEngine,
+)
+from src.modules.evaluation.ann_index import build_or_load_text_index, evaluate_ann_recall, index_matches
+from src.modules.evaluation.embedding_cache import cached_embeddings, create_embedding_cache, hash_item
+from src.modules.evaluation.coco_dataset import iter_image_batches, load_coco_samples as load_lazy_coco_samples
+from src.modules.evaluation.distributed_eval import (
+    cleanup_distributed,
+    distributed_map,
+    init_distributed_evaluation,
+    is_main_process,
+)
+
 # Try to import BLIP3o modules
 try:
     from src.modules.inference.blip3o_inference import BLIP3oInference
+    from src.modules.inference.result_cache import DEFAULT_SEEDED_BATCH_SIZE, generate_in_fixed_batches, sample_noise
     from src.modules.models.blip3o_dit import BLIP3oDiTModel, load_blip3o_dit_model
     from src.modules.config.blip3o_config import BLIP3oDiTConfig
     BLIP3O_AVAILABLE = True
@@ -53,10 +68,20 @@ class DualSupervisionRecallEvaluator:
     3. Comparison with baseline CLIP performance
     """
     
+    # Images per processor / vision-model call during embedding extraction
+    image_batch_size = 32
+    
     def __init__(self, 
                  device: str = "auto", 
                  torch_dtype: Optional[torch.dtype] = None,
-                 blip3o_model_path: Optional[str] = None):
+                 blip3o_model_path: Optional[str] = None,
+                 ann_backend: Optional[str] = None,
+                 ann_index_path: Optional[str] = None,
+                 ann_nprobe: int = 8,
+                 ann_nlist: Optional[int] = None,
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size_gb: float = 50.0,
+                 seed: Optional[int] = 0):
         """
         Initialize the dual supervision evaluator.
         
@@ -64,10 +89,33 @@ class DualSupervisionRecallEvaluator:
             device: Device to use ("auto", "cuda", "cpu")
             torch_dtype: Data type for models
             blip3o_model_path: Path to trained dual supervision model
+            ann_backend: Also report approximate recall through a text ANN index
+                ("auto", "ivf", "faiss", "exact"; None disables it)
+            ann_index_path: Path to persist / reuse the text ANN index
+            ann_nprobe: IVF lists scanned per query
+            ann_nlist: IVF lists (default: 4 * sqrt(num_texts))
+            embedding_cache_dir: Persistent CLIP/EVA embedding cache directory (None disables it)
+            embedding_cache_size_gb: Embedding cache size cap
+            seed: Sampling seed; each sample's noise is keyed by (seed, EVA conditioning),
+                so sharded (--distributed) runs match single-process runs (None: unseeded)
         """
         self.device = self._setup_device(device)
         self.torch_dtype = torch_dtype or torch.float32
         self.blip3o_model_path = blip3o_model_path
+        self.seed = seed
+        
+        # Optional approximate nearest-neighbor retrieval
+        self.ann_backend = ann_backend
+        self.ann_index_path = ann_index_path
+        self.ann_nprobe = ann_nprobe
+        self.ann_nlist = ann_nlist
+        self.ann_index = None
+        
+        # Persistent CLIP/EVA embedding cache shared across evaluators (opt-in)
+        self.embedding_cache = (
+            create_embedding_cache(embedding_cache_dir, embedding_cache_size_gb)
+            if embedding_cache_dir else None
+        )
         
         # Load baseline models for comparison
         self._load_clip_model()
@@ -161,6 +209,7 @@ class DualSupervisionRecallEvaluator:
             self.blip3o_model = None
             raise
     
+    @cached_embeddings("clip_text", "clip_model", "clip_processor")
     def extract_clip_text_embeddings(self, captions: List[str]) -> torch.Tensor:
         """Extract CLIP text embeddings for baseline comparison."""
         with torch.no_grad():
@@ -177,13 +226,14 @@ class DualSupervisionRecallEvaluator:
         
         return text_embeddings.cpu().float()
     
+    @cached_embeddings("clip_image_features", "clip_model", "clip_processor")
     def extract_clip_global_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """Extract CLIP global embeddings for baseline comparison."""
         global_embeddings = []
         
         with torch.no_grad():
-            for img in images:
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+            for batch in iter_image_batches(images, self.image_batch_size):
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
@@ -191,17 +241,18 @@ class DualSupervisionRecallEvaluator:
                 image_features = self.clip_model.get_image_features(**inputs)
                 image_features = F.normalize(image_features, p=2, dim=-1)
                 
-                global_embeddings.append(image_features.squeeze(0).cpu().float())
+                global_embeddings.append(image_features.cpu().float())
         
-        return torch.stack(global_embeddings)
+        return torch.cat(global_embeddings)
     
+    @cached_embeddings("clip_patch", "clip_model", "clip_processor")
     def extract_clip_patch_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """Extract CLIP patch embeddings for patch-level comparison."""
         patch_embeddings = []
         
         with torch.no_grad():
-            for img in images:
-                inputs = self.clip_processor(images=img, return_tensors="pt")
+            for batch in iter_image_batches(images, self.image_batch_size):
+                inputs = self.clip_processor(images=batch, return_tensors="pt")
                 inputs = {k: v.to(device=self.device, dtype=self.torch_dtype) 
                          for k, v in inputs.items()}
                 
@@ -212,18 +263,19 @@ class DualSupervisionRecallEvaluator:
                 )
                 
                 # Extract patch embeddings (remove CLS token)
-                patches = vision_outputs.last_hidden_state[:, 1:, :]  # [1, 256, 1024]
-                patch_embeddings.append(patches.squeeze(0).cpu().float())
+                patches = vision_outputs.last_hidden_state[:, 1:, :]  # [b, 256, 1024]
+                patch_embeddings.append(patches.cpu().float())
         
-        return torch.stack(patch_embeddings)
+        return torch.cat(patch_embeddings)
     
+    @cached_embeddings("eva_patch", "eva_model", "eva_processor")
     def extract_eva_embeddings(self, images: List[Image.Image]) -> torch.Tensor:
         """Extract EVA-CLIP embeddings for BLIP3o conditioning."""
         eva_embeddings = []
         
         with torch.no_grad():
-            for img in images:
-                inputs = self.eva_processor(images=img, return_tensors="pt")
+            for batch in iter_image_batches(images, self.image_batch_size):
+                inputs = self.eva_processor(images=batch, return_tensors="pt")
                 pixel_values = inputs['pixel_values'].to(device=self.device, dtype=self.torch_dtype)
                 
                 vision_outputs = self.eva_model.vision_model(
@@ -233,10 +285,10 @@ class DualSupervisionRecallEvaluator:
                 )
                 
                 # Get patch embeddings (remove CLS token)
-                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [1, 256, 4096]
-                eva_embeddings.append(patch_embeddings.squeeze(0).cpu().float())
+                patch_embeddings = vision_outputs.last_hidden_state[:, 1:, :]  # [b, 256, 4096]
+                eva_embeddings.append(patch_embeddings.cpu().float())
         
-        return torch.stack(eva_embeddings)
+        return torch.cat(eva_embeddings)
     
     def generate_dual_supervision_embeddings(self, eva_embeddings: torch.Tensor) -> Dict[str, torch.Tensor]:
         """
@@ -258,21 +310,36 @@ class DualSupervisionRecallEvaluator:
         
         eva_embeddings = eva_embeddings.to(device=self.device, dtype=self.torch_dtype)
         
+        def generate(return_global_only: bool) -> torch.Tensor:
+            if self.seed is None:
+                return self.blip3o_model.generate(
+                    encoder_hidden_states=eva_embeddings,
+                    num_inference_steps=50,
+                    return_global_only=return_global_only,
+                )
+            # Seeded: per-sample noise and fixed-size batches, independent of the rank's shard
+            noise = sample_noise(
+                [hash_item(row) for row in eva_embeddings], self.seed,
+                (eva_embeddings.shape[1], self.blip3o_model.config.in_channels),
+                device=self.device, dtype=self.torch_dtype,
+            )
+            return generate_in_fixed_batches(
+                lambda eva, batch_noise: self.blip3o_model.generate(
+                    encoder_hidden_states=eva,
+                    num_inference_steps=50,
+                    return_global_only=return_global_only,
+                    noise=batch_noise,
+                ),
+                eva_embeddings, noise, DEFAULT_SEEDED_BATCH_SIZE,
+            )
+        
         with torch.no_grad():
             # Generate using the model's generate method
             # This should return global embeddings by default
-            global_embeddings = self.blip3o_model.generate(
-                encoder_hidden_states=eva_embeddings,
-                num_inference_steps=50,
-                return_global_only=True,  # Get [B, 768] for recall
-            )
+            global_embeddings = generate(return_global_only=True)  # Get [B, 768] for recall
             
             # Also get patch embeddings for quality assessment
-            patch_embeddings = self.blip3o_model.generate(
-                encoder_hidden_states=eva_embeddings,
-                num_inference_steps=50,
-                return_global_only=False,  # Get [B, 256, 1024] patches
-            )
+            patch_embeddings = generate(return_global_only=False)  # Get [B, 256, 1024] patches
         
         logger.info(f"Generated global embeddings: {global_embeddings.shape if global_embeddings is not None else 'None'}")
         logger.info(f"Generated patch embeddings: {patch_embeddings.shape}")
@@ -296,33 +363,25 @@ class DualSupervisionRecallEvaluator:
         image_embeddings = F.normalize(image_embeddings, p=2, dim=-1)
         text_embeddings = F.normalize(text_embeddings, p=2, dim=-1)
         
-        # Compute similarity matrix
-        similarity_matrix = torch.mm(image_embeddings, text_embeddings.t())
+        # Blocked scoring: recall@K / mAP / MRR / median rank in both directions and
+        # similarity statistics without materializing the [N_images, N_texts] matrix
+        engine = BlockedSimilarityEngine(normalize=False)
+        recall_results = engine.retrieval_metrics(image_embeddings, text_embeddings, image_to_text_mapping, k_values)
         
-        logger.info(f"[{method_name}] Similarity matrix shape: {similarity_matrix.shape}")
-        logger.info(f"[{method_name}] Similarity range: [{similarity_matrix.min():.4f}, {similarity_matrix.max():.4f}]")
-        
-        # Compute recall for each K value
-        recall_results = {}
+        logger.info(f"[{method_name}] Similarity matrix shape: ({len(image_embeddings)}, {len(text_embeddings)}) (blocked)")
+        logger.info(f"[{method_name}] Similarity range: [{recall_results['similarity_min']:.4f}, {recall_results['similarity_max']:.4f}]")
         
+        total_queries = len(image_to_text_mapping)
         for k in k_values:
-            correct_retrievals = 0
-            total_queries = len(image_to_text_mapping)
-            
-            # Get top-k text indices for each image
-            _, top_k_indices = torch.topk(similarity_matrix, k=k, dim=1)
-            
-            # Check if any of the top-k retrieved texts belong to the query image
-            for img_idx, correct_text_indices in enumerate(image_to_text_mapping):
-                retrieved_indices = top_k_indices[img_idx].cpu().numpy()
-                
-                if any(ret_idx in correct_text_indices for ret_idx in retrieved_indices):
-                    correct_retrievals += 1
-            
-            recall_at_k = correct_retrievals / total_queries if total_queries > 0 else 0
-            recall_results[f'recall@{k}'] = recall_at_k
-            
-            logger.info(f"[{method_name}] Recall@{k}: {correct_retrievals}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+            recall_at_k = recall_results[f'recall@{k}']
+            logger.info(f"[{method_name}] Recall@{k}: {round(recall_at_k * total_queries)}/{total_queries} = {recall_at_k:.4f} ({recall_at_k*100:.2f}%)")
+        logger.info(f"[{method_name}] mAP: {recall_results['mAP']:.4f}, MRR: {recall_results['MRR']:.4f}, "
+                    f"median rank: {recall_results['median_rank']:.0f}, t2i Recall@1: {recall_results['t2i_recall@1']:.4f}")
+        
+        if self.ann_backend:
+            recall_results.update(self.compute_ann_recall(
+                image_embeddings, text_embeddings, image_to_text_mapping, k_values, method_name
+            ))
         
         # Additional metrics
         recall_results.update({
@@ -335,34 +394,80 @@ class DualSupervisionRecallEvaluator:
         
         return recall_results
     
-    def compute_patch_quality_metrics(
+    def compute_ann_recall(
+        self,
+        image_embeddings: torch.Tensor,
+        text_embeddings: torch.Tensor,
+        image_to_text_mapping: List[List[int]],
+        k_values: List[int] = [1, 5, 10],
+        method_name: str = "unknown"
+    ) -> Dict[str, float]:
+        """Approximate image-to-text recall through the text ANN index, next to exact search."""
+        # Text embeddings are shared by all methods: the index is built (or loaded) once
+        # and reused only while it was built over this exact gallery
+        if not index_matches(self.ann_index, text_embeddings):
+            self.ann_index = build_or_load_text_index(
+                text_embeddings,
+                index_path=self.ann_index_path,
+                backend=self.ann_backend,
+                nprobe=self.ann_nprobe,
+                nlist=self.ann_nlist,
+            )
+        
+        ann_results = evaluate_ann_recall(
+            self.ann_index, image_embeddings, text_embeddings, image_to_text_mapping, k_values
+        )
+        for k in k_values:
+            logger.info(f"[{method_name}] ANN Recall@{k}: {ann_results[f'ann_recall@{k}']:.4f} "
+                        f"(exact {ann_results[f'exact_recall@{k}']:.4f}, "
+                        f"neighbor recall {ann_results[f'ann_neighbor_recall@{k}']:.4f})")
+        logger.info(f"[{method_name}] ANN query time: {ann_results['ann_query_time_s']:.3f}s "
+                    f"vs exact {ann_results['exact_query_time_s']:.3f}s ({ann_results['ann_speedup']:.1f}x)")
+        return ann_results
+    
+    def compute_patch_quality_per_sample(
         self,
         generated_patches: torch.Tensor,
         target_patches: torch.Tensor,
-        method_name: str = "unknown"
+    ) -> Dict[str, torch.Tensor]:
+        """
+        Per-sample patch quality terms ([B] each).
+        
+        Every sample has the same number of tokens / elements, so the dataset
+        metrics are plain means of these rows - which lets distributed ranks
+        gather [B] vectors instead of [B, 256, 1024] patches.
+        """
+        with torch.no_grad():
+            generated_patches = generated_patches.float()
+            target_patches = target_patches.float()
+            return {
+                'mse': (generated_patches - target_patches).pow(2).flatten(1).mean(dim=1),
+                'cosine_similarity': F.cosine_similarity(generated_patches.flatten(1), target_patches.flatten(1), dim=1),
+                'l2_distance': torch.norm(generated_patches - target_patches, dim=-1).mean(dim=1),
+                'gen_norm': torch.norm(generated_patches, dim=-1).mean(dim=1),
+                'target_norm': torch.norm(target_patches, dim=-1).mean(dim=1),
+            }
+    
+    def compute_patch_quality_metrics(
+        self,
+        generated_patches: Optional[torch.Tensor] = None,
+        target_patches: Optional[torch.Tensor] = None,
+        method_name: str = "unknown",
+        per_sample: Optional[Dict[str, torch.Tensor]] = None,
     ) -> Dict[str, float]:
-        """Compute patch-level reconstruction quality metrics."""
+        """Compute patch-level reconstruction quality metrics (from patches or per-sample terms)."""
+        
+        if per_sample is None:
+            per_sample = self.compute_patch_quality_per_sample(generated_patches, target_patches)
         
         with torch.no_grad():
-            # Basic reconstruction metrics
-            mse_loss = F.mse_loss(generated_patches, target_patches).item()
-            
-            # Cosine similarity (token-wise)
-            gen_flat = generated_patches.flatten(1)
-            target_flat = target_patches.flatten(1)
-            cosine_sim = F.cosine_similarity(gen_flat, target_flat, dim=1).mean().item()
-            
-            # L2 distances per token
-            l2_distances = torch.norm(generated_patches - target_patches, dim=-1).mean().item()
-            
-            # Embedding norms
-            gen_norm = torch.norm(generated_patches, dim=-1).mean().item()
-            target_norm = torch.norm(target_patches, dim=-1).mean().item()
+            gen_norm = per_sample['gen_norm'].mean().item()
+            target_norm = per_sample['target_norm'].mean().item()
             
             metrics = {
-                'patch_mse': mse_loss,
-                'patch_cosine_similarity': cosine_sim,
-                'patch_l2_distance': l2_distances,
+                'patch_mse': per_sample['mse'].mean().item(),
+                'patch_cosine_similarity': per_sample['cosine_similarity'].mean().item(),
+                'patch_l2_distance': per_sample['l2_distance'].mean().item(),
                 'patch_gen_norm': gen_norm,
                 'patch_target_norm': target_norm,
                 'patch_norm_ratio': gen_norm / (target_norm + 1e-8),
@@ -392,6 +497,11 @@ class DualSupervisionRecallEvaluator:
             
         Returns:
             Dictionary mapping method names to their results
+        
+        In distributed runs every rank extracts / generates its shard of the
+        images and the outputs are gathered in order (see
+        src/modules/evaluation/distributed_eval.py), so all ranks return the
+        same results.
         """
         logger.info("Starting comprehensive dual supervision evaluation...")
         logger.info(f"Evaluating {len(images)} images")
@@ -413,14 +523,14 @@ class DualSupervisionRecallEvaluator:
             image_to_text_mapping.append(current_text_indices)
         
         all_captions = [caption for caption_list in captions_per_image for caption in caption_list]
-        text_embeddings = self.extract_clip_text_embeddings(all_captions)
+        text_embeddings = distributed_map(self.extract_clip_text_embeddings, all_captions)
         
         # 1. BASELINE: CLIP Global Embeddings
         logger.info("\n" + "="*60)
         logger.info("🔍 BASELINE: CLIP Global Embeddings")
         logger.info("="*60)
         
-        clip_global_embeddings = self.extract_clip_global_embeddings(images)
+        clip_global_embeddings = distributed_map(self.extract_clip_global_embeddings, images)
         
         clip_results = self.compute_recall_metrics(
             image_embeddings=clip_global_embeddings,
@@ -437,11 +547,25 @@ class DualSupervisionRecallEvaluator:
             logger.info("🎯 DUAL SUPERVISION: BLIP3o Global Embeddings")
             logger.info("="*60)
             
-            # Extract EVA conditioning
-            eva_embeddings = self.extract_eva_embeddings(images)
+            def generate_shard(shard_images: List[Image.Image]) -> Dict[str, Optional[torch.Tensor]]:
+                # Extract EVA conditioning
+                eva_embeddings = self.extract_eva_embeddings(shard_images)
+                
+                # Generate dual supervision embeddings
+                dual_outputs = self.generate_dual_supervision_embeddings(eva_embeddings)
+                del eva_embeddings
+                
+                # Patch quality against the CLIP patch targets, reduced to per-sample terms
+                clip_patch_embeddings = self.extract_clip_patch_embeddings(shard_images)
+                patch_terms = self.compute_patch_quality_per_sample(
+                    dual_outputs['patch_embeddings'], clip_patch_embeddings
+                )
+                
+                shard_outputs = {f'patch_{key}': value for key, value in patch_terms.items()}
+                shard_outputs['global_embeddings'] = dual_outputs['global_embeddings']
+                return shard_outputs
             
-            # Generate dual supervision embeddings
-            dual_outputs = self.generate_dual_supervision_embeddings(eva_embeddings)
+            dual_outputs = distributed_map(generate_shard, images)
             
             # Test global embeddings for recall (primary goal)
             if dual_outputs['global_embeddings'] is not None:
@@ -461,14 +585,13 @@ class DualSupervisionRecallEvaluator:
             logger.info("📊 PATCH QUALITY: Reconstruction Analysis")
             logger.info("="*60)
             
-            # Extract CLIP patch targets
-            clip_patch_embeddings = self.extract_clip_patch_embeddings(images)
-            
             # Compute patch quality metrics
             patch_quality = self.compute_patch_quality_metrics(
-                generated_patches=dual_outputs['patch_embeddings'],
-                target_patches=clip_patch_embeddings,
-                method_name="BLIP3o_Patches"
+                method_name="BLIP3o_Patches",
+                per_sample={
+                    key[len('patch_'):]: value
+                    for key, value in dual_outputs.items() if key.startswith('patch_')
+                },
             )
             all_results['patch_quality'] = patch_quality
         
@@ -550,64 +673,8 @@ class DualSupervisionRecallEvaluator:
 
 
 def load_coco_samples(coco_root: Path, num_samples: int = 1000) -> Tuple[List[Image.Image], List[List[str]], List[int]]:
-    """Load COCO validation samples for evaluation."""
-    logger.info(f"Loading {num_samples} COCO validation samples...")
-    
-    annotations_file = coco_root / "annotations" / "captions_val2017.json"
-    images_dir = coco_root / "images" / "val2017"
-    
-    if not annotations_file.exists():
-        raise FileNotFoundError(f"COCO annotations not found: {annotations_file}")
-    if not images_dir.exists():
-        raise FileNotFoundError(f"COCO images not found: {images_dir}")
-    
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    
-    # Create image info mapping
-    images_info = {img['id']: img for img in coco_data['images']}
-    
-    # Group annotations by image
-    image_captions = {}
-    for ann in coco_data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in image_captions:
-            image_captions[image_id] = []
-        image_captions[image_id].append(ann['caption'])
-    
-    # Load samples
-    images = []
-    captions_per_image = []
-    image_ids = []
-    
-    loaded_count = 0
-    for image_id, captions in image_captions.items():
-        if loaded_count >= num_samples:
-            break
-        
-        if image_id not in images_info:
-            continue
-        
-        image_info = images_info[image_id]
-        image_path = images_dir / image_info['file_name']
-        
-        if not image_path.exists():
-            continue
-        
-        try:
-            image = Image.open(image_path).convert('RGB')
-            
-            images.append(image)
-            captions_per_image.append(captions[:5])  # Max 5 captions per image
-            image_ids.append(image_id)
-            loaded_count += 1
-            
-        except Exception as e:
-            logger.warning(f"Error loading image {image_path}: {e}")
-            continue
-    
-    logger.info(f"Successfully loaded {len(images)} images with {sum(len(caps) for caps in captions_per_image)} captions")
-    return images, captions_per_image, image_ids
+    """Load COCO validation samples (images decoded lazily, see src/modules/evaluation/coco_dataset.py)."""
+    return load_lazy_coco_samples(coco_root, num_samples)
 
 
 def main():
@@ -625,9 +692,31 @@ def main():
                        help="Path to save results JSON file")
     parser.add_argument("--k_values", nargs="+", type=int, default=[1, 5, 10],
                        help="K values for Recall@K computation")
+    parser.add_argument("--ann_backend", type=str, default=None,
+                       choices=["auto", "ivf", "faiss", "exact"],
+                       help="Also report approximate recall through a text ANN index")
+    parser.add_argument("--ann_index_path", type=str, default=None,
+                       help="Path to persist / reuse the text ANN index")
+    parser.add_argument("--ann_nprobe", type=int, default=8,
+                       help="IVF lists scanned per query")
+    parser.add_argument("--ann_nlist", type=int, default=None,
+                       help="IVF lists (default: 4 * sqrt(num_texts))")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None,
+                       help="Directory of the persistent CLIP/EVA embedding cache (disabled if not set)")
+    parser.add_argument("--embedding_cache_size_gb", type=float, default=50.0,
+                       help="Embedding cache size cap (least recently used entries are evicted)")
+    parser.add_argument("--distributed", action="store_true",
+                       help="Shard extraction / generation across torchrun ranks (rank 0 reports)")
+    parser.add_argument("--seed", type=int, default=0,
+                       help="Sampling seed; noise is drawn per sample from (seed, EVA conditioning), "
+                            "so --distributed runs match single-process runs")
     
     args = parser.parse_args()
     
+    # Sharded evaluation: one process per GPU (torchrun), identical metrics to one process
+    if args.distributed:
+        init_distributed_evaluation()
+    
     # Validate arguments
     if not BLIP3O_AVAILABLE:
         logger.error("BLIP3o modules not available")
@@ -646,7 +735,14 @@ def main():
     logger.info("Initializing Dual Supervision Recall Evaluator...")
     evaluator = DualSupervisionRecallEvaluator(
         device=args.device,
-        blip3o_model_path=str(model_path)
+        blip3o_model_path=str(model_path),
+        ann_backend=args.ann_backend,
+        ann_index_path=args.ann_index_path if is_main_process() else None,
+        ann_nprobe=args.ann_nprobe,
+        ann_nlist=args.ann_nlist,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size_gb=args.embedding_cache_size_gb,
+        seed=args.seed,
     )
     
     # Load COCO samples
@@ -665,6 +761,11 @@ def main():
     
     evaluation_time = time.time() - start_time
     
+    # Every rank holds the same results: only rank 0 reports
+    if not is_main_process():
+        cleanup_distributed()
+        return
+    
     # Print results
     evaluator.print_comparison_results(results)
     
@@ -705,6 +806,8 @@ def main():
             print(f"📈 Good progress! Continue training for better results.")
         else:
             print(f"🔧 Consider adjusting architecture or training parameters.")
+    
+    cleanup_distributed()
 
 
 if __name__ == "__main__":
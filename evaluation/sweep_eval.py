@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+BLIP3-o Evaluation Sweep: checkpoints × sampler step counts
+
+Running comp_eval.py once per checkpoint / step count reloads CLIP, EVA-CLIP-8B
+and the DiT and re-extracts everything each time. The sweep instead:
+1. Loads CLIP and EVA-CLIP once
+2. Extracts CLIP text embeddings, EVA conditioning (and the CLIP baseline) once
+3. Loops over checkpoints, swapping only the DiT weights
+   (FixedBLIP3oRecallEvaluator.swap_blip3o_weights)
+4. For each checkpoint, runs every sampler config through
+   FixedBLIP3oRecallEvaluator.evaluate_method with the precomputed embeddings
+5. Writes one consolidated results table (CSV + JSON)
+
+Only settings that BLIP3oDiTModel.generate actually reads are sweepable:
+num_inference_steps (and a fixed seed). guidance_scale / eta are accepted
+but ignored by generate, and it has no generation modes, so sweeping them
+would only report identical runs under different labels; sampler configs
+with other keys are rejected.
+
+Usage:
+    python evaluation/sweep_eval.py --coco_root <path> \\
+        --checkpoints ckpt_a ckpt_b --num_inference_steps 10 25 50 \\
+        --seed 0 --output_dir results/sweep
+"""
+
+import sys
+import csv
+import gc
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from comp_eval import FixedBLIP3oRecallEvaluator, load_coco_samples
+
+# Columns of the consolidated table, in order (recall@K columns are inserted per K)
+TABLE_COLUMNS = [
+    "checkpoint", "generation_mode", "num_inference_steps", "seed",
+]
+# Sampler settings BLIP3oDiTModel.generate reads (everything else would be a no-op axis)
+SWEEPABLE_SAMPLER_KEYS = ("num_inference_steps", "seed")
+METRIC_COLUMNS = [
+    "mAP", "MRR", "median_rank", "t2i_recall@1", "mean_cosine_sim_vs_clip", "generation_time",
+]
+
+
+def expand_sampler_configs(
+    num_inference_steps: Sequence[int],
+    seed: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """One sampler config per step count."""
+    return [{"num_inference_steps": steps, "seed": seed} for steps in num_inference_steps]
+
+
+def validate_sampler_configs(sampler_configs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Reject sampler settings generate() does not read, before any run starts."""
+    for config in sampler_configs:
+        unsupported = sorted(set(config) - set(SWEEPABLE_SAMPLER_KEYS))
+        if unsupported:
+            raise ValueError(
+                f"Unsupported sampler settings {unsupported} in {config}: BLIP3oDiTModel.generate "
+                f"only varies with {list(SWEEPABLE_SAMPLER_KEYS)}"
+            )
+        steps = config.get("num_inference_steps", 50)
+        if not isinstance(steps, int) or steps < 1:
+            raise ValueError(f"num_inference_steps must be a positive integer: {config}")
+    return sampler_configs
+
+
+class EvaluationSweep:
+    """
+    Runs many BLIP3-o evaluations against one set of encoder outputs.
+
+    Everything that does not depend on the DiT (text embeddings, the
+    image->text mapping, EVA conditioning, CLIP baseline features) is computed
+    once in prepare() and passed to evaluate_method for every run.
+    """
+
+    def __init__(
+        self,
+        evaluator: FixedBLIP3oRecallEvaluator,
+        k_values: Sequence[int] = (1, 5, 10),
+        include_clip_baseline: bool = True,
+    ):
+        self.evaluator = evaluator
+        self.k_values = list(k_values)
+        self.include_clip_baseline = include_clip_baseline
+
+        self.images = None
+        self.captions_per_image = None
+        self.text_embeddings = None
+        self.image_to_text_mapping = None
+        self.eva_embeddings = None
+        self.clip_embeddings = None
+        self.rows: List[Dict[str, Any]] = []
+
+    def prepare(self, images, captions_per_image: List[List[str]]):
+        """Extract every DiT-independent input once."""
+        self.images = images
+        self.captions_per_image = captions_per_image
+
+        start = time.time()
+        logger.info("Sweep: extracting text embeddings (once)...")
+        self.text_embeddings, self.image_to_text_mapping = self.evaluator.prepare_text_embeddings(captions_per_image)
+
+        logger.info("Sweep: extracting EVA-CLIP conditioning (once)...")
+        self.eva_embeddings = self.evaluator.extract_eva_vision_embeddings(images)
+
+        if self.include_clip_baseline:
+            baseline_results, self.clip_embeddings = self.evaluator.evaluate_method(
+                images=images,
+                captions_per_image=captions_per_image,
+                method="clip_baseline",
+                k_values=self.k_values,
+                text_embeddings=self.text_embeddings,
+                image_to_text_mapping=self.image_to_text_mapping,
+            )
+            self.rows.append(self._make_row("clip_baseline", "N/A", {}, baseline_results, 0.0))
+
+        logger.info(f"Sweep: shared inputs ready in {time.time() - start:.1f}s")
+
+    def _make_row(
+        self,
+        checkpoint: str,
+        generation_mode: str,
+        sampler_config: Dict[str, Any],
+        results: Dict[str, Any],
+        generation_time: float,
+    ) -> Dict[str, Any]:
+        row = {
+            "checkpoint": checkpoint,
+            "generation_mode": generation_mode,
+            "num_inference_steps": sampler_config.get("num_inference_steps"),
+            "seed": sampler_config.get("seed"),
+        }
+        if "error" in results:
+            row["error"] = results["error"]
+            return row
+        for k in self.k_values:
+            row[f"recall@{k}"] = results.get(f"recall@{k}")
+        for column in METRIC_COLUMNS:
+            row[column] = results.get(column)
+        row["generation_time"] = generation_time
+        return row
+
+    def run_checkpoint(
+        self,
+        checkpoint: str,
+        sampler_configs: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Evaluate one checkpoint for all sampler configs."""
+        if self.eva_embeddings is None:
+            raise ValueError("Call prepare() before running the sweep")
+        validate_sampler_configs(sampler_configs)
+
+        self.evaluator.swap_blip3o_weights(checkpoint)
+        rows = []
+
+        for sampler_config in sampler_configs:
+            sampler_kwargs = {key: value for key, value in sampler_config.items()
+                              if key != "num_inference_steps" and value is not None}
+            run_name = f"{Path(checkpoint).name} | {sampler_config}"
+            logger.info(f"\n{'='*60}\n🔍 Sweep run: {run_name}\n{'='*60}")
+
+            start = time.time()
+            try:
+                results, embeddings = self.evaluator.evaluate_method(
+                    images=self.images,
+                    captions_per_image=self.captions_per_image,
+                    method="blip3o_fixed",
+                    k_values=self.k_values,
+                    num_inference_steps=sampler_config.get("num_inference_steps", 50),
+                    text_embeddings=self.text_embeddings,
+                    image_to_text_mapping=self.image_to_text_mapping,
+                    eva_embeddings=self.eva_embeddings,
+                    sampler_kwargs=sampler_kwargs,
+                )
+                if self.clip_embeddings is not None:
+                    similarity = self.evaluator.compute_cosine_similarity(self.clip_embeddings, embeddings)
+                    results["mean_cosine_sim_vs_clip"] = similarity["mean_cosine_sim"]
+                del embeddings
+            except Exception as e:
+                logger.error(f"Sweep run failed ({run_name}): {e}")
+                results = {"error": str(e)}
+
+            row = self._make_row(str(checkpoint), results.get("generation_mode", "N/A"), sampler_config,
+                                 results, time.time() - start)
+            rows.append(row)
+            self.rows.append(row)
+            gc.collect()
+
+        return rows
+
+    def run(
+        self,
+        checkpoints: Sequence[str],
+        sampler_configs: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Full sweep; returns the rows of the consolidated table."""
+        validate_sampler_configs(sampler_configs)
+        for checkpoint in checkpoints:
+            try:
+                self.run_checkpoint(checkpoint, sampler_configs)
+            except Exception as e:
+                logger.error(f"Failed to load checkpoint {checkpoint}: {e}")
+                self.rows.append({"checkpoint": str(checkpoint), "error": str(e)})
+        return self.rows
+
+    def columns(self) -> List[str]:
+        recall_columns = [f"recall@{k}" for k in self.k_values]
+        columns = TABLE_COLUMNS + recall_columns + METRIC_COLUMNS
+        if any("error" in row for row in self.rows):
+            columns.append("error")
+        return columns
+
+    def save_table(self, output_dir: Path, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Path]:
+        """Write the consolidated table as CSV and JSON."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        csv_path = output_dir / "sweep_results.csv"
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns(), extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+        json_path = output_dir / "sweep_results.json"
+        with open(json_path, "w") as f:
+            json.dump({"sweep_info": metadata or {}, "results": self.rows}, f, indent=2, default=str)
+
+        logger.info(f"Sweep table saved to: {csv_path}")
+        return {"csv": csv_path, "json": json_path}
+
+    def print_table(self):
+        """Print the consolidated table, best recall@1 first."""
+        def sort_key(row):
+            value = row.get("recall@1")
+            return -value if isinstance(value, (int, float)) else float("inf")
+
+        print("\n" + "=" * 100)
+        print("📊 BLIP3-O EVALUATION SWEEP")
+        print("=" * 100)
+        print(f"{'Checkpoint':<30} {'Mode':<8} {'Steps':<6} {'Seed':<5} {'R@1':<8} {'R@5':<8} {'R@10':<8} {'Time':<8}")
+        print("-" * 100)
+        for row in sorted(self.rows, key=sort_key):
+            name = Path(row["checkpoint"]).name[:29]
+            if "error" in row:
+                print(f"{name:<30} ERROR: {row['error'][:60]}")
+                continue
+            recalls = [
+                f"{row[f'recall@{k}']*100:.1f}%" if row.get(f"recall@{k}") is not None else "N/A"
+                for k in (1, 5, 10)
+            ]
+            steps = row.get("num_inference_steps") or "-"
+            seed = row.get("seed")
+            seed = str(seed) if seed is not None else "-"
+            print(f"{name:<30} {str(row['generation_mode']):<8} {str(steps):<6} {seed:<5} "
+                  f"{recalls[0]:<8} {recalls[1]:<8} {recalls[2]:<8} {row.get('generation_time', 0):.1f}s")
+        print("=" * 100)
+
+
+def create_evaluation_sweep(
+    device: str = "auto",
+    k_values: Sequence[int] = (1, 5, 10),
+    include_clip_baseline: bool = True,
+    **evaluator_kwargs
+) -> EvaluationSweep:
+    """Factory function: evaluator with CLIP / EVA-CLIP loaded, wrapped in a sweep."""
+    evaluator = FixedBLIP3oRecallEvaluator(device=device, **evaluator_kwargs)
+    evaluator.load_clip_models()
+    return EvaluationSweep(evaluator, k_values=k_values, include_clip_baseline=include_clip_baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLIP3-o evaluation sweep (checkpoints × sampler step counts)")
+    parser.add_argument("--coco_root", type=str, required=True,
+                       help="Path to MS-COCO dataset root directory")
+    parser.add_argument("--checkpoints", nargs="+", type=str, required=True,
+                       help="BLIP3-o model directories to evaluate")
+    parser.add_argument("--num_samples", type=int, default=1000,
+                       help="Number of COCO samples to evaluate")
+    parser.add_argument("--device", type=str, default="auto",
+                       help="Device to use (auto, cuda, cpu)")
+    parser.add_argument("--k_values", nargs="+", type=int, default=[1, 5, 10],
+                       help="K values for Recall@K computation")
+    parser.add_argument("--num_inference_steps", nargs="+", type=int, default=[50],
+                       help="Sampling step counts to sweep")
+    parser.add_argument("--sampler_configs", type=str, default=None,
+                       help="JSON file with a list of sampler config dicts with num_inference_steps / seed "
+                            "keys (overrides --num_inference_steps)")
+    parser.add_argument("--seed", type=int, default=None,
+                       help="Sampling seed (same noise for every run)")
+    parser.add_argument("--no_clip_baseline", action="store_true",
+                       help="Skip the CLIP baseline row")
+    parser.add_argument("--output_dir", type=str, default="./results/sweep",
+                       help="Directory for the consolidated results table")
+    parser.add_argument("--embedding_cache_dir", type=str, default=None,
+                       help="Directory of the persistent CLIP/EVA embedding cache (disabled if not set)")
+    parser.add_argument("--embedding_cache_size_gb", type=float, default=50.0,
+                       help="Embedding cache size cap (least recently used entries are evicted)")
+
+    args = parser.parse_args()
+
+    coco_root = Path(args.coco_root)
+    if not coco_root.exists():
+        logger.error(f"COCO root not found: {coco_root}")
+        return 1
+    missing = [ckpt for ckpt in args.checkpoints if not Path(ckpt).exists()]
+    if missing:
+        logger.error(f"Checkpoints not found: {missing}")
+        return 1
+
+    if args.sampler_configs:
+        with open(args.sampler_configs, "r") as f:
+            sampler_configs = json.load(f)
+    else:
+        sampler_configs = expand_sampler_configs(args.num_inference_steps, args.seed)
+    try:
+        validate_sampler_configs(sampler_configs)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+
+    num_runs = len(args.checkpoints) * len(sampler_configs)
+    logger.info(f"Sweep: {len(args.checkpoints)} checkpoints × {len(sampler_configs)} sampler configs = {num_runs} runs")
+
+    sweep = create_evaluation_sweep(
+        device=args.device,
+        k_values=args.k_values,
+        include_clip_baseline=not args.no_clip_baseline,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size_gb=args.embedding_cache_size_gb,
+    )
+
+    logger.info(f"Loading {args.num_samples} COCO validation samples...")
+    images, captions_per_image, image_ids = load_coco_samples(coco_root, args.num_samples)
+
+    start_time = time.time()
+    sweep.prepare(images, captions_per_image)
+    sweep.run(args.checkpoints, sampler_configs)
+    total_time = time.time() - start_time
+
+    sweep.print_table()
+    paths = sweep.save_table(args.output_dir, metadata={
+        "dataset": "MS-COCO 2017 Validation",
+        "num_images": len(images),
+        "num_captions": sum(len(caps) for caps in captions_per_image),
+        "checkpoints": args.checkpoints,
+        "sampler_configs": sampler_configs,
+        "k_values": args.k_values,
+        "device": str(sweep.evaluator.device),
+        "total_time": total_time,
+    })
+    print(f"\n💾 Results: {paths['csv']}")
+    print(f"⏱️  Total sweep time: {total_time:.1f}s ({num_runs} runs)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
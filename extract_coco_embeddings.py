@@ -9,6 +9,13 @@ CRITICAL FIX:
 - Proper index handling in batch processing loop
 - Explicit alignment verification for each sample
 - Debug output to catch alignment issues early
+- Batched: every encoder / the DiT generator runs once per batch (not per image)
+- Output streamed batch by batch into a memory-mapped store
+  (src/modules/utils/memmap_store.py) instead of one pickle at the end;
+  --save_legacy_formats still writes the v1 .pkl / .npz files
+- --result_cache_dir: generated CLIP embeddings are served from a result cache
+  (src/modules/inference/result_cache.py) keyed by EVA conditioning, checkpoint,
+  sampler settings and seed; only cache misses run the DiT
 
 Usage:
     python extract_coco_embeddings_FIXED.py --blip3o_model_path <path> --coco_root <path> [options]
@@ -106,6 +113,26 @@ def parse_arguments():
         "--force_reextract", action="store_true",
         help="Force re-extraction even if embeddings already exist"
     )
+    parser.add_argument(
+        "--num_workers", type=int, default=4,
+        help="Dataloader workers (image decoding)"
+    )
+    parser.add_argument(
+        "--save_legacy_formats", action="store_true",
+        help="Also write the single-file pickle / NPZ outputs of the v1 format"
+    )
+    parser.add_argument(
+        "--result_cache_dir", type=str, default=None,
+        help="Cache generated CLIP embeddings here (seeded with --random_seed); reruns skip the DiT"
+    )
+    parser.add_argument(
+        "--result_cache_max_gb", type=float, default=10.0,
+        help="Size cap of the on-disk result cache"
+    )
+    parser.add_argument(
+        "--result_cache_ttl_hours", type=float, default=None,
+        help="Expire result cache entries older than this"
+    )
     parser.add_argument(
         "--debug_alignment", action="store_true",
         help="Enable detailed alignment debugging"
@@ -139,11 +166,10 @@ def validate_paths(args):
     if not annotations_file.exists():
         raise FileNotFoundError(f"COCO annotations file not found: {annotations_file}")
     
-    # Count available data
+    # Count available data (persisted annotation index, no full JSON parse after the first run)
+    from src.modules.evaluation.coco_dataset import load_coco_annotation_index
     num_images = len(list(images_dir.glob("*.jpg")))
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    num_captions = len(coco_data['annotations'])
+    num_captions = load_coco_annotation_index(coco_path, split="val2017").num_captions
     
     print(f"✅ Paths validated:")
     print(f"   BLIP3-o model: {blip3o_path}")
@@ -183,38 +209,133 @@ def verify_sample_alignment(image_id: int, caption: str, image_path: str,
     return True
 
 def load_coco_annotations(coco_root: str) -> Dict:
-    """Load COCO annotations for alignment verification."""
-    annotations_file = Path(coco_root) / "annotations" / "captions_val2017.json"
-    
-    with open(annotations_file, 'r') as f:
-        coco_data = json.load(f)
-    
-    # Create image_id to captions mapping
-    id_to_captions = {}
-    for ann in coco_data['annotations']:
-        image_id = ann['image_id']
-        if image_id not in id_to_captions:
-            id_to_captions[image_id] = []
-        id_to_captions[image_id].append(ann['caption'])
-    
-    return id_to_captions
+    """Load COCO annotations for alignment verification (from the persisted annotation index)."""
+    from src.modules.evaluation.coco_dataset import load_coco_annotation_index
+    return load_coco_annotation_index(coco_root, split="val2017").captions_by_image_id()
+
+def verify_batch_alignment(image_ids: List[int], captions: List[str], image_paths: List[str],
+                           coco_annotations: Dict, start_idx: int, debug: bool = False) -> int:
+    """Verify a whole batch; returns the number of misaligned samples."""
+    errors = 0
+    for i in range(len(image_ids)):
+        sample_idx = start_idx + i
+        is_aligned = verify_sample_alignment(
+            image_ids[i], captions[i], image_paths[i], coco_annotations,
+            sample_idx, debug=(debug and sample_idx < 10)
+        )
+        if not is_aligned:
+            errors += 1
+    return errors
+
+def create_cached_generation(evaluator, args, logger):
+    """
+    Wrap evaluator.generate_clip_from_eva with the two-tier result cache.
+
+    Returns (generate_fn, cache). Misses get per-sample noise seeded by
+    (--random_seed, EVA hash), so cached and fresh embeddings are identical.
+    Returns (None, None) if generate_clip_from_eva takes no noise argument:
+    its unseeded results must not be stored under a seed-keyed namespace.
+    """
+    import inspect
+    from src.modules.inference.result_cache import (
+        create_result_cache, checkpoint_fingerprint, generation_namespace,
+    )
+
+    if 'noise' not in inspect.signature(evaluator.generate_clip_from_eva).parameters:
+        logger.warning("generate_clip_from_eva takes no noise argument: results are not seed-reproducible, "
+                       "result cache disabled")
+        return None, None
+
+    cache = create_result_cache(
+        cache_dir=args.result_cache_dir,
+        disk_max_gb=args.result_cache_max_gb,
+        ttl_hours=args.result_cache_ttl_hours,
+    )
+    namespace = generation_namespace(
+        checkpoint_id=checkpoint_fingerprint(args.blip3o_model_path),
+        seed=args.random_seed,
+        num_inference_steps=getattr(evaluator, 'num_inference_steps', 50),
+        output="global_768",
+        sampler=type(evaluator).__name__,
+        dtype=getattr(evaluator, 'torch_dtype', None),
+        batch_size=args.batch_size,
+    )
+
+    def generate(eva_embeddings, noise):
+        return evaluator.generate_clip_from_eva(eva_embeddings, noise=noise)
+
+    def generate_fn(eva_embeddings):
+        return cache.cached_generate(
+            generate,
+            eva_embeddings,
+            namespace,
+            seed=args.random_seed,
+            sample_shape=(eva_embeddings.shape[1], 1024),  # CLIP patch tokens [256, 1024]
+            batch_size=args.batch_size,
+        )
+
+    return generate_fn, cache
+
+def extract_batch_embeddings(evaluator, images: List, captions: List[str],
+                             save_raw_embeddings: bool = False,
+                             generate_fn=None) -> Dict[str, torch.Tensor]:
+    """
+    Run one batch through every encoder / generator (one call per model).
+
+    Every output row i belongs to images[i] / captions[i]; a model returning a
+    different number of rows raises instead of silently shifting samples.
+    generate_fn (e.g. from create_cached_generation) replaces
+    evaluator.generate_clip_from_eva.
+    """
+    # Extract CLIP vision embeddings (with visual projection → 768-dim)
+    clip_vision_emb = evaluator.extract_clip_vision_embeddings(images)
+
+    # Extract EVA-CLIP vision embeddings, then generate CLIP embeddings from EVA (→ 768-dim)
+    eva_vision_emb = evaluator.extract_eva_vision_embeddings(images)
+    if generate_fn is not None:
+        generated_clip_emb = generate_fn(eva_vision_emb)
+    else:
+        generated_clip_emb = evaluator.generate_clip_from_eva(eva_vision_emb)
+
+    # Extract text embeddings (already 768-dim, aligned)
+    text_emb = evaluator.extract_clip_text_embeddings(captions)
+
+    outputs = {
+        'clip_vision_embeddings': clip_vision_emb,      # [B, 768]
+        'generated_clip_embeddings': generated_clip_emb,  # [B, 768]
+        'text_embeddings': text_emb,                    # [B, 768]
+    }
+
+    # Optional: raw embeddings before projection
+    if save_raw_embeddings:
+        outputs['clip_vision_raw'] = evaluator._extract_clip_vision_raw(images)        # [B, 1024]
+        outputs['generated_clip_raw'] = evaluator._generate_clip_from_eva_raw(eva_vision_emb)  # [B, 1024]
+
+    # 🔧 ALIGNMENT GUARD: every output must have exactly one row per sample
+    for name, tensor in outputs.items():
+        if tensor.shape[0] != len(images):
+            raise ValueError(f"{name}: {tensor.shape[0]} rows for a batch of {len(images)} samples")
+
+    return {name: tensor.detach().cpu() for name, tensor in outputs.items()}
 
 def extract_embeddings_FIXED(args, logger, temp_manager):
-    """FIXED embedding extraction with proper alignment."""
-    
+    """FIXED embedding extraction with proper alignment (batched, streamed to a memory-mapped store)."""
+    from src.modules.utils.memmap_store import create_array_writer, open_array_store
+
     # Set random seed for reproducibility
     torch.manual_seed(args.random_seed)
     np.random.seed(args.random_seed)
-    
+
     print("\n🚀 FIXED COCO EMBEDDING EXTRACTION")
     print("=" * 50)
     print("🔧 CRITICAL FIXES:")
     print("   • Fixed batch index alignment bug")
-    print("   • Added per-sample alignment verification") 
+    print("   • Added per-sample alignment verification")
     print("   • Explicit index handling in extraction loop")
     print("   • Debug output for alignment tracking")
+    print("   • Whole batches per model call, streamed to a memory-mapped store")
     print("=" * 50)
-    
+
     # Load COCO annotations for alignment verification
     if args.debug_alignment:
         print("📋 Loading COCO annotations for alignment verification...")
@@ -222,16 +343,16 @@ def extract_embeddings_FIXED(args, logger, temp_manager):
         print(f"✅ Loaded annotations for {len(coco_annotations)} images")
     else:
         coco_annotations = None
-    
+
     # Setup output directory using temp manager
     if temp_manager:
         # Create structured embeddings directory
         embeddings_base_dir = temp_manager.get_embeddings_dir()
         coco_eval_dir = temp_manager.create_embeddings_subdirectory("coco_val_evaluation_FIXED")
-        
+
         # Setup model cache
         temp_manager.setup_model_cache()
-        
+
         print(f"✅ Using temp manager structured storage:")
         print(f"   Base embeddings dir: {embeddings_base_dir}")
         print(f"   COCO eval dir: {coco_eval_dir}")
@@ -240,168 +361,147 @@ def extract_embeddings_FIXED(args, logger, temp_manager):
         coco_eval_dir = Path("./results/coco_embeddings_FIXED")
         coco_eval_dir.mkdir(parents=True, exist_ok=True)
         print(f"⚠️  Using fallback directory: {coco_eval_dir}")
-    
+
     # Generate output filename
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_name = f"coco_val_embeddings_FIXED_{args.num_samples}samples_{timestamp}"
-    
+    store_dir = coco_eval_dir / output_name
+
     # Initialize evaluator
     logger.info("Initializing BLIP3-o evaluator...")
     from src.modules.evaluation.evaluator import BLIP3oEvaluator
-    
+
     evaluator = BLIP3oEvaluator(
         blip3o_model_path=args.blip3o_model_path,
         device=args.device,
     )
-    
+
+    # Optional result cache for the generated CLIP embeddings
+    generate_fn, result_cache = None, None
+    if args.result_cache_dir:
+        generate_fn, result_cache = create_cached_generation(evaluator, args, logger)
+        if result_cache is not None:
+            print(f"🗄️  Result cache: {args.result_cache_dir} (seed {args.random_seed})")
+
     # Create COCO dataloader - CRITICAL: shuffle=False
     logger.info(f"Creating COCO dataloader for {args.num_samples} samples...")
     from src.modules.evaluation.coco_dataset import create_coco_dataloader
-    
+
     dataloader = create_coco_dataloader(
         coco_root=args.coco_root,
         batch_size=args.batch_size,
         max_samples=args.num_samples,
         shuffle=False,  # 🔧 CRITICAL: No shuffling!
-        num_workers=4,
+        num_workers=args.num_workers,
     )
-    
+
     print(f"\n📊 Dataloader Configuration:")
     print(f"   Batch size: {args.batch_size}")
     print(f"   Max samples: {args.num_samples}")
     print(f"   Shuffle: False")
     print(f"   Number of batches: {len(dataloader)}")
-    
-    # Storage for embeddings
-    embeddings_data = {
-        # Main embeddings (768-dim, projected and normalized)
-        'clip_vision_embeddings': [],      # CLIP vision + visual projection [N, 768]
-        'generated_clip_embeddings': [],   # EVA→BLIP3o + visual projection [N, 768]
-        'text_embeddings': [],             # CLIP text embeddings [N, 768]
-        
-        # Metadata
-        'image_ids': [],                   # Image IDs
-        'captions': [],                    # Corresponding captions (first caption per image)
-        'image_paths': [],                 # Image file paths
-        
-        # Extraction info
-        'metadata': {
-            'extraction_date': str(datetime.datetime.now()),
-            'num_samples': 0,
-            'model_path': str(args.blip3o_model_path),
-            'coco_root': str(args.coco_root),
-            'embedding_dim': 768,
-            'random_seed': args.random_seed,
-            'shuffle_used': False,
-            'alignment_verified': True,  # Will be updated
-            'device': str(evaluator.device),
-            'batch_size': args.batch_size,
-            'evaluation_method': 'single_caption_per_image',
-            'temp_manager_used': temp_manager is not None,
-            'storage_location': str(coco_eval_dir),
-            'format_version': 'coco_val_evaluation_FIXED_v1',
-            'alignment_fix_applied': True,
-        }
+
+    # Extraction info
+    metadata = {
+        'extraction_date': str(datetime.datetime.now()),
+        'num_samples': 0,
+        'model_path': str(args.blip3o_model_path),
+        'coco_root': str(args.coco_root),
+        'embedding_dim': 768,
+        'random_seed': args.random_seed,
+        'shuffle_used': False,
+        'alignment_verified': True,  # Will be updated
+        'device': str(evaluator.device),
+        'batch_size': args.batch_size,
+        'evaluation_method': 'single_caption_per_image',
+        'temp_manager_used': temp_manager is not None,
+        'storage_location': str(coco_eval_dir),
+        'format_version': 'coco_val_evaluation_FIXED_v2_memmap',
+        'alignment_fix_applied': True,
+        'batched_extraction': True,
     }
-    
-    # Optional raw embeddings (before projection)
-    if args.save_raw_embeddings:
-        embeddings_data.update({
-            'clip_vision_raw': [],         # CLIP vision before projection [N, 1024]  
-            'generated_clip_raw': [],      # Generated before projection [N, 1024]
-        })
-    
+
+    # Embeddings go straight into preallocated memory-mapped arrays, metadata
+    # (image_id, caption, image_path) into records.jsonl, one row per sample
+    writer = create_array_writer(store_dir, capacity=args.num_samples, metadata=metadata)
+
     logger.info("Starting FIXED embedding extraction...")
-    print(f"\n⚡ Extracting embeddings with ALIGNMENT FIXES...")
-    
+    print(f"\n⚡ Extracting embeddings with ALIGNMENT FIXES (batched)...")
+    print(f"   Output store: {store_dir}")
+
     total_processed = 0
     alignment_errors = 0
+    failed_samples = 0
     start_time = time.time()
-    
+
     for batch_idx, batch in enumerate(tqdm(dataloader, desc="Processing batches")):
-        images = batch['images']
-        captions_batch = batch['captions']
-        image_ids = batch['image_ids']
-        image_paths = batch['image_paths']
-        
-        # 🔧 CRITICAL FIX: Use proper indexing instead of zip
-        batch_size_actual = len(images)
-        
-        for i in range(batch_size_actual):
-            if total_processed >= args.num_samples:
-                break
-            
-            try:
-                # 🔧 FIXED: Use consistent indexing
-                image = images[i]
-                caption_list = captions_batch[i]
-                image_id = image_ids[i]
-                image_path = image_paths[i]
-                
-                # Use first caption (standard evaluation protocol)
-                caption = caption_list[0]
-                
-                # 🔧 ALIGNMENT VERIFICATION: Check alignment for each sample
-                if args.debug_alignment and coco_annotations:
-                    is_aligned = verify_sample_alignment(
-                        image_id, caption, image_path, coco_annotations, 
-                        total_processed, debug=(total_processed < 10)
-                    )
-                    if not is_aligned:
-                        alignment_errors += 1
-                        if alignment_errors < 10:  # Show first 10 errors
-                            print(f"⚠️  Alignment error in sample {total_processed}")
-                
-                # Extract CLIP vision embeddings (with visual projection → 768-dim)
-                clip_vision_emb = evaluator.extract_clip_vision_embeddings([image])
-                clip_vision_final = clip_vision_emb.squeeze(0).cpu()  # [768]
-                
-                # Extract EVA-CLIP vision embeddings  
-                eva_vision_emb = evaluator.extract_eva_vision_embeddings([image])
-                
-                # Generate CLIP embeddings from EVA (with visual projection → 768-dim)
-                generated_clip_emb = evaluator.generate_clip_from_eva(eva_vision_emb)
-                generated_clip_final = generated_clip_emb.squeeze(0).cpu()  # [768]
-                
-                # Extract text embeddings (already 768-dim, aligned)
-                text_emb = evaluator.extract_clip_text_embeddings([caption])
-                text_final = text_emb.squeeze(0).cpu()  # [768]
-                
-                # Optional: Extract raw embeddings before projection
-                if args.save_raw_embeddings:
-                    clip_vision_raw = evaluator._extract_clip_vision_raw([image])
-                    clip_raw_final = clip_vision_raw.squeeze(0).cpu()  # [1024]
-                    
-                    generated_clip_raw = evaluator._generate_clip_from_eva_raw(eva_vision_emb)
-                    generated_raw_final = generated_clip_raw.squeeze(0).cpu()  # [1024]
-                    
-                    embeddings_data['clip_vision_raw'].append(clip_raw_final)
-                    embeddings_data['generated_clip_raw'].append(generated_raw_final)
-                
-                # 🔧 FIXED: Store with explicit alignment
-                embeddings_data['clip_vision_embeddings'].append(clip_vision_final)
-                embeddings_data['generated_clip_embeddings'].append(generated_clip_final)
-                embeddings_data['text_embeddings'].append(text_final)
-                embeddings_data['image_ids'].append(image_id)
-                embeddings_data['captions'].append(caption)
-                embeddings_data['image_paths'].append(image_path)
-                
-                total_processed += 1
-                
-                # Progress update
-                if total_processed % 100 == 0:
-                    logger.info(f"Processed {total_processed}/{args.num_samples} samples")
-                    if args.debug_alignment:
-                        error_rate = alignment_errors / total_processed * 100
-                        print(f"   Alignment error rate: {error_rate:.1f}%")
-                
-            except Exception as e:
-                logger.error(f"Error processing sample {total_processed}: {e}")
-                continue
-        
-        if total_processed >= args.num_samples:
+        # 🔧 FIXED: Truncate the whole batch consistently (never zip lists of different lengths)
+        remaining = args.num_samples - total_processed
+        if remaining <= 0:
             break
-    
+        images = batch['images'][:remaining]
+        image_ids = list(batch['image_ids'][:remaining])
+        image_paths = list(batch['image_paths'][:remaining])
+
+        # Use first caption (standard evaluation protocol)
+        captions = [caption_list[0] for caption_list in batch['captions'][:remaining]]
+
+        # 🔧 ALIGNMENT VERIFICATION: Check alignment for each sample of the batch
+        if args.debug_alignment and coco_annotations:
+            batch_errors = verify_batch_alignment(
+                image_ids, captions, image_paths, coco_annotations,
+                total_processed, debug=True
+            )
+            if batch_errors and alignment_errors < 10:  # Show the first errors
+                print(f"⚠️  {batch_errors} alignment error(s) in batch {batch_idx}")
+            alignment_errors += batch_errors
+
+        try:
+            batch_embeddings = extract_batch_embeddings(
+                evaluator, images, captions, args.save_raw_embeddings, generate_fn
+            )
+            keep = list(range(len(images)))
+        except Exception as e:
+            # Fall back to single samples so one bad image does not cost the whole batch
+            logger.error(f"Error processing batch {batch_idx}, retrying per sample: {e}")
+            per_sample, keep = [], []
+            for i in range(len(images)):
+                try:
+                    per_sample.append(extract_batch_embeddings(
+                        evaluator, [images[i]], [captions[i]], args.save_raw_embeddings, generate_fn
+                    ))
+                    keep.append(i)
+                except Exception as sample_error:
+                    logger.error(f"Error processing sample {total_processed + i}: {sample_error}")
+                    failed_samples += 1
+            if not keep:
+                continue
+            batch_embeddings = {
+                name: torch.cat([sample[name] for sample in per_sample])
+                for name in per_sample[0]
+            }
+
+        # 🔧 FIXED: Store with explicit alignment (embedding row i ↔ record i)
+        records = [
+            {'image_id': int(image_ids[i]), 'caption': captions[i], 'image_path': str(image_paths[i])}
+            for i in keep
+        ]
+        writer.append(batch_embeddings, records=records)
+
+        previous = total_processed
+        total_processed += len(keep)
+
+        # Progress update
+        if total_processed // 100 > previous // 100:
+            logger.info(f"Processed {total_processed}/{args.num_samples} samples")
+            if args.debug_alignment:
+                error_rate = alignment_errors / total_processed * 100
+                print(f"   Alignment error rate: {error_rate:.1f}%")
+
+    if total_processed == 0:
+        writer.close()
+        raise RuntimeError("No samples were extracted")
+
     # Final alignment report
     if args.debug_alignment:
         final_error_rate = alignment_errors / total_processed * 100
@@ -410,91 +510,65 @@ def extract_embeddings_FIXED(args, logger, temp_manager):
         print(f"   Alignment errors: {alignment_errors}")
         print(f"   Error rate: {final_error_rate:.2f}%")
         print(f"   Success rate: {100 - final_error_rate:.2f}%")
-        
-        embeddings_data['metadata']['alignment_error_rate'] = final_error_rate
-        embeddings_data['metadata']['alignment_errors'] = alignment_errors
-    
-    # Convert lists to tensors
-    logger.info("Converting embeddings to tensors...")
-    
-    embeddings_data['clip_vision_embeddings'] = torch.stack(embeddings_data['clip_vision_embeddings'])
-    embeddings_data['generated_clip_embeddings'] = torch.stack(embeddings_data['generated_clip_embeddings'])
-    embeddings_data['text_embeddings'] = torch.stack(embeddings_data['text_embeddings'])
-    
-    if args.save_raw_embeddings:
-        embeddings_data['clip_vision_raw'] = torch.stack(embeddings_data['clip_vision_raw'])
-        embeddings_data['generated_clip_raw'] = torch.stack(embeddings_data['generated_clip_raw'])
-    
+
+        metadata['alignment_error_rate'] = final_error_rate
+        metadata['alignment_errors'] = alignment_errors
+
+    if result_cache is not None:
+        cache_stats = result_cache.get_stats()
+        metadata['result_cache'] = cache_stats
+        print(f"\n🗄️  Result cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, "
+              f"{cache_stats['misses']} misses (hit rate {cache_stats['hit_rate']:.1%})")
+        result_cache.close()
+
     # Update metadata
-    embeddings_data['metadata']['num_samples'] = total_processed
-    embeddings_data['metadata']['processing_time'] = time.time() - start_time
-    embeddings_data['metadata']['actual_shapes'] = {
-        'clip_vision_embeddings': list(embeddings_data['clip_vision_embeddings'].shape),
-        'generated_clip_embeddings': list(embeddings_data['generated_clip_embeddings'].shape),
-        'text_embeddings': list(embeddings_data['text_embeddings'].shape),
+    metadata['num_samples'] = total_processed
+    metadata['failed_samples'] = failed_samples
+    metadata['processing_time'] = time.time() - start_time
+    writer.close(metadata)
+
+    store = open_array_store(store_dir)
+    metadata['actual_shapes'] = {
+        name: list(store.array(name).shape)
+        for name in ['clip_vision_embeddings', 'generated_clip_embeddings', 'text_embeddings']
     }
-    
-    # Validate embeddings
+
+    # Validate embeddings (reads the memory-mapped arrays, nothing was kept in memory)
     logger.info("Validating extracted embeddings...")
-    
+
     def validate_normalization(emb_tensor, name):
-        norms = torch.norm(emb_tensor, p=2, dim=-1)
+        norms = torch.norm(emb_tensor.float(), p=2, dim=-1)
         mean_norm = norms.mean().item()
         std_norm = norms.std().item()
         max_dev = torch.abs(norms - 1.0).max().item()
         is_normalized = abs(mean_norm - 1.0) < 0.01 and max_dev < 0.1
-        
+
         logger.info(f"  {name}: mean norm = {mean_norm:.6f}, std = {std_norm:.6f}, max_dev = {max_dev:.6f}")
         return is_normalized
-    
-    clip_vision_normalized = validate_normalization(embeddings_data['clip_vision_embeddings'], "CLIP vision")
-    generated_normalized = validate_normalization(embeddings_data['generated_clip_embeddings'], "Generated")
-    text_normalized = validate_normalization(embeddings_data['text_embeddings'], "Text")
-    
-    embeddings_data['metadata']['normalization_check'] = {
+
+    clip_vision_normalized = validate_normalization(store['clip_vision_embeddings'], "CLIP vision")
+    generated_normalized = validate_normalization(store['generated_clip_embeddings'], "Generated")
+    text_normalized = validate_normalization(store['text_embeddings'], "Text")
+
+    metadata['normalization_check'] = {
         'clip_vision_normalized': clip_vision_normalized,
         'generated_normalized': generated_normalized,
         'text_normalized': text_normalized,
     }
-    
-    # Save embeddings to structured location
-    logger.info(f"Saving FIXED embeddings to structured location...")
-    
-    # Save as pickle (most flexible)
-    pickle_path = coco_eval_dir / f"{output_name}.pkl"
-    logger.info(f"Saving embeddings to {pickle_path}...")
-    
-    with open(pickle_path, 'wb') as f:
-        pickle.dump(embeddings_data, f)
-    
+
     # Save metadata as JSON (human readable)
     json_path = coco_eval_dir / f"{output_name}_metadata.json"
     with open(json_path, 'w') as f:
-        # Convert tensors to lists for JSON serialization
-        metadata_json = embeddings_data['metadata'].copy()
-        json.dump(metadata_json, f, indent=2)
-    
-    # Save embeddings as NPZ (for easy loading with numpy)
-    npz_path = coco_eval_dir / f"{output_name}.npz"
-    logger.info(f"Saving embeddings to {npz_path}...")
-    
-    npz_data = {
-        'clip_vision_embeddings': embeddings_data['clip_vision_embeddings'].numpy(),
-        'generated_clip_embeddings': embeddings_data['generated_clip_embeddings'].numpy(),
-        'text_embeddings': embeddings_data['text_embeddings'].numpy(),
-        'image_ids': np.array(embeddings_data['image_ids']),
-        'captions': np.array(embeddings_data['captions']),
-        'image_paths': np.array(embeddings_data['image_paths']),
-    }
-    
-    if 'clip_vision_raw' in embeddings_data:
-        npz_data['clip_vision_raw'] = embeddings_data['clip_vision_raw'].numpy()
-        npz_data['generated_clip_raw'] = embeddings_data['generated_clip_raw'].numpy()
-    
-    np.savez_compressed(npz_path, **npz_data)
-    
+        json.dump(metadata, f, indent=2)
+
+    # Optional single-file copies for older tooling (materializes everything in memory)
+    pickle_path, npz_path = None, None
+    if args.save_legacy_formats:
+        pickle_path, npz_path = save_legacy_formats(store, metadata, coco_eval_dir, output_name, logger)
+
     return {
-        'embedding_file': pickle_path,
+        'embedding_file': pickle_path or store_dir,
+        'store_dir': store_dir,
         'metadata_file': json_path,
         'npz_file': npz_path,
         'num_samples': total_processed,
@@ -504,6 +578,33 @@ def extract_embeddings_FIXED(args, logger, temp_manager):
         'reused_existing': False
     }
 
+def save_legacy_formats(store, metadata: Dict, coco_eval_dir: Path, output_name: str, logger) -> Tuple[Path, Path]:
+    """Write the pickle / NPZ files of the v1 format from a memory-mapped store."""
+    embeddings_data = {name: store[name].clone() for name in store.fields}
+    embeddings_data['image_ids'] = store.record_field('image_id')
+    embeddings_data['captions'] = store.record_field('caption')
+    embeddings_data['image_paths'] = store.record_field('image_path')
+    embeddings_data['metadata'] = metadata
+
+    # Save as pickle (most flexible)
+    pickle_path = coco_eval_dir / f"{output_name}.pkl"
+    logger.info(f"Saving embeddings to {pickle_path}...")
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(embeddings_data, f)
+
+    # Save embeddings as NPZ (for easy loading with numpy)
+    npz_path = coco_eval_dir / f"{output_name}.npz"
+    logger.info(f"Saving embeddings to {npz_path}...")
+    npz_data = {name: store.array(name) for name in store.fields}
+    npz_data.update({
+        'image_ids': np.array(embeddings_data['image_ids']),
+        'captions': np.array(embeddings_data['captions']),
+        'image_paths': np.array(embeddings_data['image_paths']),
+    })
+    np.savez_compressed(npz_path, **npz_data)
+
+    return pickle_path, npz_path
+
 def main():
     """Main extraction function."""
     project_root = setup_paths()
@@ -547,9 +648,11 @@ def main():
         print(f"⏱️  Processing time: {result['processing_time']:.1f} seconds")
         print(f"📁 Storage directory: {result['storage_dir']}")
         print(f"📄 Files created:")
-        print(f"   Primary: {result['embedding_file'].name}")
+        print(f"   Memmap store: {result['store_dir'].name}/")
         print(f"   Metadata: {result['metadata_file'].name}")
-        print(f"   NumPy: {result['npz_file'].name}")
+        if result['npz_file'] is not None:
+            print(f"   Pickle: {result['embedding_file'].name}")
+            print(f"   NumPy: {result['npz_file'].name}")
         
         if args.debug_alignment:
             print(f"🔍 Alignment verification:")
@@ -568,11 +671,17 @@ def main():
         print("   Fixed batch indexing: ✅")
         print("   Per-sample verification: ✅")
         print("   Explicit alignment tracking: ✅")
+        print("   Batched extraction: ✅")
         
         print("")
         print("🚀 Next Steps - Test the Fix:")
-        print(f"   # Quick evaluation on FIXED embeddings:")
-        print(f"   python fixed_quick_evaluation.py --embeddings_file {result['embedding_file']} --skip_normalization")
+        if result['npz_file'] is not None:
+            print(f"   # Quick evaluation on FIXED embeddings:")
+            print(f"   python fixed_quick_evaluation.py --embeddings_file {result['embedding_file']} --skip_normalization")
+        else:
+            # The quick evaluator reads the single-file pickle, not the memmap store
+            print(f"   # Quick evaluation needs the v1 pickle: re-run with --save_legacy_formats, or open the store with")
+            print(f"   # src.modules.utils.memmap_store.open_array_store('{result['store_dir']}')")
         print("")
         print("🎯 Expected Results with FIXES:")
         print("   • CLIP R@1: 25-35% (consistent across all sample sizes)")
@@ -14,42 +14,29 @@ __version__ = "1.0.0"
 __author__ = "BLIP3-o Implementation Team"
 __description__ = "BLIP3-o Diffusion Transformer with Flow Matching"
 
-# Core imports for convenience
-from .modules.config.blip3o_config import (
-    BLIP3oDiTConfig,
-    FlowMatchingConfig,
-    TrainingConfig,
-    get_default_blip3o_config,
-    get_default_flow_matching_config,
-    get_default_training_config,
-)
+from .modules.utils.lazy_imports import lazy_exports
 
-from .modules.models.blip3o_dit import (
-    BLIP3oDiTModel,
-    create_blip3o_dit_model,
-)
-
-from .modules.losses.flow_matching_loss import (
-    BLIP3oFlowMatchingLoss,
-    FlowMatchingLoss,
-    create_blip3o_flow_matching_loss,
-)
-
-from .modules.datasets.blip3o_dataset import (
-    BLIP3oEmbeddingDataset,
-    create_chunked_dataloader,
-    create_chunked_dataloaders,
-)
-
-from .modules.trainers.blip3o_trainer import (
-    BLIP3oTrainer,
-    create_blip3o_training_args,
-)
-
-from .modules.inference.blip3o_inference import (
-    BLIP3oInference,
-    load_blip3o_inference,
-)
+# Core imports for convenience, imported on first access (PEP 562)
+_EXPORTS = {
+    "BLIP3oDiTConfig": ".modules.config.blip3o_config",
+    "FlowMatchingConfig": ".modules.config.blip3o_config",
+    "TrainingConfig": ".modules.config.blip3o_config",
+    "get_default_blip3o_config": ".modules.config.blip3o_config",
+    "get_default_flow_matching_config": ".modules.config.blip3o_config",
+    "get_default_training_config": ".modules.config.blip3o_config",
+    "BLIP3oDiTModel": ".modules.models.blip3o_dit",
+    "create_blip3o_dit_model": ".modules.models.blip3o_dit",
+    "BLIP3oFlowMatchingLoss": ".modules.losses.flow_matching_loss",
+    "FlowMatchingLoss": ".modules.losses.flow_matching_loss",
+    "create_blip3o_flow_matching_loss": ".modules.losses.flow_matching_loss",
+    "BLIP3oEmbeddingDataset": ".modules.datasets.blip3o_dataset",
+    "create_chunked_dataloader": ".modules.datasets.blip3o_dataset",
+    "create_chunked_dataloaders": ".modules.datasets.blip3o_dataset",
+    "BLIP3oTrainer": ".modules.trainers.blip3o_trainer",
+    "create_blip3o_training_args": ".modules.trainers.blip3o_trainer",
+    "BLIP3oInference": ".modules.inference.blip3o_inference",
+    "load_blip3o_inference": ".modules.inference.blip3o_inference",
+}
 
 __all__ = [
     # Config
@@ -81,4 +68,6 @@ __all__ = [
     # Inference
     "BLIP3oInference",
     "load_blip3o_inference",
-]
\ No newline at end of file
+]
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals(), submodules=("modules",))
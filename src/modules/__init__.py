@@ -8,11 +8,16 @@ This package contains all the core modules for BLIP3-o DiT implementation:
 - datasets: Data loading utilities
 - trainers: Training utilities
 - inference: Inference utilities
+- evaluation: Retrieval metrics for recall evaluation
 """
 
-from .config import *
-from .models import *
-from .losses import *
-from .datasets import *
-from .trainers import *
-from .inference import *
\ No newline at end of file
+from .utils.lazy_imports import lazy_reexports, reexported_names
+
+_SUBPACKAGES = ("config", "models", "losses", "datasets", "trainers", "inference", "evaluation")
+
+# Subpackages (and their public names) are imported on first access, so
+# `import src.modules.datasets` does not pay for transformers / wandb.
+__getattr__, __dir__ = lazy_reexports(__name__, _SUBPACKAGES, globals())
+
+# Star imports export every subpackage's public names (resolved lazily on access)
+__all__ = reexported_names(__name__, _SUBPACKAGES)
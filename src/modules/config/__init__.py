@@ -5,24 +5,32 @@ Contains configuration classes for:
 - Model architecture (BLIP3oDiTConfig)
 - Flow matching loss (FlowMatchingConfig)
 - Training parameters (TrainingConfig)
+- EMA of the model weights (EMAConfig)
 """
 
-from .blip3o_config import (
-    BLIP3oDiTConfig,
-    FlowMatchingConfig,
-    TrainingConfig,
-    get_default_blip3o_config,
-    get_default_flow_matching_config,
-    get_default_training_config,
-    get_dual_supervision_training_config,
-)
+from ..utils.lazy_imports import lazy_exports
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "BLIP3oDiTConfig": ".blip3o_config",
+    "FlowMatchingConfig": ".blip3o_config",
+    "TrainingConfig": ".blip3o_config",
+    "EMAConfig": ".blip3o_config",
+    "get_default_blip3o_config": ".blip3o_config",
+    "get_default_flow_matching_config": ".blip3o_config",
+    "get_default_training_config": ".blip3o_config",
+    "get_dual_supervision_training_config": ".blip3o_config",
+}
 
 __all__ = [
     "BLIP3oDiTConfig",
     "FlowMatchingConfig",
     "TrainingConfig",
+    "EMAConfig",
     "get_default_blip3o_config",
     "get_default_flow_matching_config",
     "get_default_training_config",
     "get_dual_supervision_training_config",
-]
\ No newline at end of file
+]
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
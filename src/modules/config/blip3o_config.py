@@ -15,6 +15,10 @@ from typing import Optional, Dict, Any, Union
 import math
 
 
+# Activation checkpointing policies understood by BLIP3oDiTModel
+GRADIENT_CHECKPOINTING_POLICIES = ("none", "full", "every_k", "attention", "ffn", "auto")
+
+
 class BLIP3oDiTConfig(PretrainedConfig):
     """
     Configuration class for BLIP3-o Diffusion Transformer with Dual Supervision support.
@@ -31,7 +35,7 @@ class BLIP3oDiTConfig(PretrainedConfig):
         # ========================
         
         # Input configuration
-        input_size: int = 16,              # Grid size (16x16 = 256 tokens)
+        input_size: int = 16,              # Grid size (16x16 = 256 tokens; 24 or 32 for higher-resolution features)
         patch_size: int = 1,               # Patch size (pre-tokenized, so 1)
         in_channels: int = 1024,           # CLIP embedding dimension
         
@@ -67,6 +71,8 @@ class BLIP3oDiTConfig(PretrainedConfig):
         
         # Memory optimization
         _gradient_checkpointing: bool = True,    # Enable gradient checkpointing
+        gradient_checkpointing_policy: str = "full",  # Which activations to recompute (see GRADIENT_CHECKPOINTING_POLICIES)
+        gradient_checkpointing_every_k: int = 2,      # Layer interval for the "every_k" policy
         
         # RoPE configuration  
         rope_base: float = 10000.0,        # RoPE base frequency
@@ -82,6 +88,7 @@ class BLIP3oDiTConfig(PretrainedConfig):
         # Attention optimizations
         use_flash_attention: bool = False,     # Use Flash Attention (if available)
         attention_dropout: float = 0.0,       # Attention dropout rate
+        attention_chunk_size: Optional[int] = None,  # Queries per attention chunk (None = full attention)
         
         # Feed-forward configuration
         intermediate_size: Optional[int] = None,  # FFN intermediate size (defaults to 4 * dim)
@@ -121,6 +128,8 @@ class BLIP3oDiTConfig(PretrainedConfig):
         # Training configuration
         self.learn_sigma = learn_sigma
         self._gradient_checkpointing = _gradient_checkpointing
+        self.gradient_checkpointing_policy = gradient_checkpointing_policy
+        self.gradient_checkpointing_every_k = gradient_checkpointing_every_k
         self.rope_base = rope_base
         self.rope_scaling = rope_scaling
         self.initializer_range = initializer_range
@@ -128,6 +137,7 @@ class BLIP3oDiTConfig(PretrainedConfig):
         # Advanced configuration
         self.use_flash_attention = use_flash_attention
         self.attention_dropout = attention_dropout
+        self.attention_chunk_size = attention_chunk_size
         self.intermediate_size = intermediate_size
         self.hidden_dropout = hidden_dropout
         self.max_position_embeddings = max_position_embeddings
@@ -162,6 +172,11 @@ class BLIP3oDiTConfig(PretrainedConfig):
         assert 0.0 <= self.mlp_dropout <= 1.0, "MLP dropout must be between 0 and 1"
         assert self.mlp_activation in ["gelu", "relu", "silu"], f"Unknown activation: {self.mlp_activation}"
         
+        # Checkpointing validation
+        assert self.gradient_checkpointing_policy in GRADIENT_CHECKPOINTING_POLICIES, \
+            f"Unknown checkpointing policy: {self.gradient_checkpointing_policy}"
+        assert self.gradient_checkpointing_every_k > 0, "Checkpointing interval must be positive"
+        
         # Flow matching validation
         assert self.learn_sigma is False, "BLIP3-o uses flow matching, learn_sigma must be False"
         
@@ -169,7 +184,9 @@ class BLIP3oDiTConfig(PretrainedConfig):
         assert self.in_channels == 1024, "CLIP embedding dimension must be 1024"
         assert self.eva_embedding_size == 4096, "EVA-CLIP dimension must be 4096"
         assert self.patch_size == 1, "Features are pre-tokenized, patch_size must be 1"
-        assert self.input_size == 16, "Input size must be 16 for 256 tokens (16×16)"
+        assert self.input_size * self.input_size <= self.max_position_embeddings, \
+            f"{self.input_size}x{self.input_size} grid exceeds max_position_embeddings ({self.max_position_embeddings})"
+        assert self.attention_chunk_size is None or self.attention_chunk_size > 0, "Attention chunk size must be positive"
     
     def get_num_tokens(self) -> int:
         """Get total number of tokens (patches)."""
@@ -272,6 +289,28 @@ class TrainingConfig:
         assert self.gradient_accumulation_steps > 0, "Gradient accumulation steps must be positive"
 
 
+@dataclass
+class EMAConfig:
+    """
+    Configuration for the EMA of the model weights (see trainers/ema.py).
+    """
+    
+    decay: float = 0.9999             # Per-optimizer-step decay
+    update_every: int = 1             # Update interval in optimizer steps (decay is compounded)
+    start_step: int = 0               # First step averaged (earlier weights move too fast)
+    use_warmup: bool = True           # Ramp the decay as (1 + step) / (10 + step)
+    dtype: Optional[str] = None       # "float32", "bfloat16", "float16" (None: parameter dtype)
+    offload_to_cpu: bool = False      # Keep the averaged weights in (pinned) host memory
+    evaluate_with_ema: bool = True    # Run evaluation (and best-model selection) on the EMA weights
+    
+    def __post_init__(self):
+        """Validate EMA configuration."""
+        assert 0.0 < self.decay < 1.0, f"EMA decay must be in (0, 1): {self.decay}"
+        assert self.update_every > 0, "EMA update interval must be positive"
+        assert self.start_step >= 0, "EMA start step must be non-negative"
+        assert self.dtype in [None, "float32", "bfloat16", "float16"], f"Invalid EMA dtype: {self.dtype}"
+
+
 # ========================
 # Factory Functions
 # ========================
@@ -347,11 +386,14 @@ def get_dual_supervision_config(
             "mlp_activation": base_config.mlp_activation,
             "learn_sigma": base_config.learn_sigma,
             "_gradient_checkpointing": base_config._gradient_checkpointing,
+            "gradient_checkpointing_policy": base_config.gradient_checkpointing_policy,
+            "gradient_checkpointing_every_k": base_config.gradient_checkpointing_every_k,
             "rope_base": base_config.rope_base,
             "rope_scaling": base_config.rope_scaling,
             "initializer_range": base_config.initializer_range,
             "use_flash_attention": base_config.use_flash_attention,
             "attention_dropout": base_config.attention_dropout,
+            "attention_chunk_size": base_config.attention_chunk_size,
             "intermediate_size": base_config.intermediate_size,
             "hidden_dropout": base_config.hidden_dropout,
             "max_position_embeddings": base_config.max_position_embeddings,
@@ -501,6 +543,7 @@ def get_preset_config(preset_name: str) -> BLIP3oDiTConfig:
 __all__ = [
     # Main configuration classes
     "BLIP3oDiTConfig",
+    "GRADIENT_CHECKPOINTING_POLICIES",
     "FlowMatchingConfig",
     "TrainingConfig",
     
@@ -3,11 +3,121 @@ Memory-Optimized Configuration for BLIP3-o Multi-GPU Training
 Provides various model sizes and memory optimization strategies
 """
 
-from typing import Dict, Any, Tuple
+import math
+import torch
+import torch.nn as nn
+from typing import Dict, Any, Tuple, Optional, Sequence
 from ..config.blip3o_config import BLIP3oDiTConfig
 from transformers import TrainingArguments
 
 
+# Share of a layer's saved activations held by each branch of BLIP3oAttentionBlock
+# (self-attn: norm, q/k/v, rotated q/k, output; cross-attn: norm, projections;
+# FFN: norm + 4x-wide pre/post-GELU hidden states)
+ATTENTION_ACTIVATION_FRACTION = 0.55
+FFN_ACTIVATION_FRACTION = 0.45
+# A checkpointed layer still keeps its input hidden states
+CHECKPOINTED_LAYER_FRACTION = 0.05
+# Extra forward compute paid in backward, as a fraction of one forward pass
+ATTENTION_RECOMPUTE_FRACTION = 0.5
+FFN_RECOMPUTE_FRACTION = 0.5
+
+
+# Bytes per element for each precision mode. "fp16"/"bf16" mean autocast (AMP):
+# activations in half precision, fp32 master weights, gradients and optimizer states
+PRECISION_BYTES = {"fp32": 4, "fp16": 2, "bf16": 2}
+OPTIMIZER_STATE_BYTES = {"fp32": 4, "8bit": 1}
+
+# Frozen CLIPModel (ViT-L/14, vision + text towers) held in fp32 to compute
+# global targets: the dual supervision trainer and its loss each load one.
+# The CLIPModels stay in host memory; only their visual_projection
+# (in_channels -> 768 Linear, no bias) is moved to the GPU
+FROZEN_CLIP_PARAMS = 428_000_000
+FROZEN_CLIP_COPIES = 2
+CLIP_PROJECTION_DIM = 768
+
+
+def get_layer_activation_elements(config: BLIP3oDiTConfig) -> Dict[str, int]:
+    """
+    Elements saved for backward by one BLIP3oAttentionBlock, per sample.
+    
+    Counts the tensors autograd keeps in each branch (norm inputs/outputs, scaled
+    inputs, projections, attention outputs, FFN hidden states).
+    
+    Returns:
+        Dictionary with 'attention' (self + cross-attention), 'ffn' and 'input'
+        (what a checkpointed layer still keeps) element counts
+    """
+    tokens = config.input_size * config.input_size
+    token_dim = tokens * config.dim
+    return {
+        # Self-attention: norm in/out, scaled, q/k/v, rotated q/k, contiguous
+        # q/k/v, output, reshaped output, projected output
+        # Cross-attention: norm in/out, scaled, encoder norm in/out, q/k/v
+        # projections, output, projected output
+        'attention': 13 * token_dim + 12 * token_dim,
+        # FFN: norm in/out, scaled, 4x hidden pre/post GELU, output
+        'ffn': 4 * token_dim + 8 * token_dim,
+        'input': token_dim,
+    }
+
+
+def get_activation_retention(
+    policy: str = "none",
+    every_k: int = 2,
+    layer_elements: Optional[Dict[str, int]] = None,
+) -> float:
+    """
+    Fraction of layer activations kept alive for backward under a checkpointing policy.
+    
+    Args:
+        policy: Checkpointing policy ("none", "full", "every_k", "attention", "ffn")
+        every_k: Layer interval for "every_k"
+        layer_elements: Per-branch element counts from get_layer_activation_elements
+            (default: fixed branch fractions)
+        
+    Returns:
+        Retained fraction in (0, 1]
+    """
+    if layer_elements is not None:
+        total = layer_elements['attention'] + layer_elements['ffn']
+        attention_fraction = layer_elements['attention'] / total
+        ffn_fraction = layer_elements['ffn'] / total
+        checkpointed_fraction = layer_elements['input'] / total
+    else:
+        attention_fraction = ATTENTION_ACTIVATION_FRACTION
+        ffn_fraction = FFN_ACTIVATION_FRACTION
+        checkpointed_fraction = CHECKPOINTED_LAYER_FRACTION
+    
+    if policy == "none":
+        return 1.0
+    if policy == "full":
+        return checkpointed_fraction
+    if policy == "every_k":
+        checkpointed = 1.0 / max(1, every_k)
+        return 1.0 - checkpointed * (1.0 - checkpointed_fraction)
+    if policy == "attention":
+        return 1.0 - attention_fraction + checkpointed_fraction
+    if policy == "ffn":
+        return 1.0 - ffn_fraction + checkpointed_fraction
+    raise ValueError(f"Unknown checkpointing policy: {policy}")
+
+
+def get_recompute_overhead(policy: str = "none", every_k: int = 2) -> float:
+    """Extra forward compute (fraction of one forward pass) paid by a checkpointing policy."""
+    if policy == "none":
+        return 0.0
+    if policy == "full":
+        return 1.0
+    if policy == "every_k":
+        return 1.0 / max(1, every_k)
+    if policy == "attention":
+        return ATTENTION_RECOMPUTE_FRACTION
+    if policy == "ffn":
+        return FFN_RECOMPUTE_FRACTION
+    raise ValueError(f"Unknown checkpointing policy: {policy}")
+
+
 def get_memory_optimized_model_configs() -> Dict[str, BLIP3oDiTConfig]:
     """
     Get memory-optimized model configurations for different GPU setups.
@@ -159,71 +269,457 @@ def get_memory_optimized_training_args(
     )
 
 
-def estimate_memory_usage(config: BLIP3oDiTConfig, batch_size: int) -> Dict[str, float]:
+def count_model_parameters(config: BLIP3oDiTConfig) -> Dict[str, int]:
+    """
+    Count BLIP3oDiTModel parameters from the config.
+    
+    Returns:
+        Dictionary with 'trainable' and 'frozen' (CLIP visual projection) parameter counts
+    """
+    dim = config.dim
+    time_embed_dim = min(dim, 1024)
+    
+    # Token embedder (projection + positional embedding), timestep MLP, EVA projection
+    embed_params = (
+        config.in_channels * dim + dim +
+        config.input_size * config.input_size * dim +
+        time_embed_dim * dim + dim + dim * dim + dim +
+        config.eva_embedding_size * dim + dim
+    )
+    
+    # Transformer layers
+    layer_params = config.n_layers * (
+        # Self-attention (Q, K, V, output projections with bias)
+        4 * (dim * dim + dim) +
+        # Cross-attention (nn.MultiheadAttention in/out projections with bias)
+        4 * (dim * dim + dim) +
+        # FFN
+        dim * dim * 4 + dim * 4 +
+        dim * 4 * dim + dim +
+        # LayerNorms (norm1-3 + cross_norm) and timestep conditioning
+        4 * 2 * dim +
+        dim * dim * 6 + dim * 6
+    )
+    
+    # Output projection and global adaptation MLP
+    output_params = 2 * dim + dim * config.in_channels + config.in_channels
+    mlp_hidden = getattr(config, 'mlp_hidden_dim', 2048)
+    mlp_layers = getattr(config, 'mlp_num_layers', 3)
+    mlp_dims = [config.in_channels] + [mlp_hidden] * (mlp_layers - 1) + [config.in_channels]
+    mlp_params = sum(d_in * d_out + d_out for d_in, d_out in zip(mlp_dims[:-1], mlp_dims[1:]))
+    mlp_params += 2 * mlp_hidden * (mlp_layers - 1)  # LayerNorm after each hidden layer
+    
+    return {
+        'trainable': embed_params + layer_params + output_params + mlp_params,
+        'frozen': config.in_channels * CLIP_PROJECTION_DIM,  # CLIP visual projection (no bias)
+    }
+
+
+def estimate_memory_usage(
+    config: BLIP3oDiTConfig,
+    batch_size: int,
+    checkpointing_policy: str = "none",
+    checkpointing_every_k: int = 2,
+    precision: str = "fp32",
+    optimizer_state_precision: str = "fp32",
+    include_frozen_clip: bool = True,
+    calibration: Optional[Dict[str, Any]] = None,
+) -> Dict[str, float]:
     """
     Estimate memory usage for a given configuration.
     
+    Parameters, gradients and optimizer states are counted from the model
+    structure; activations from the tensors each block saves for backward (or,
+    with a calibration from profile_memory_usage, from the measured per-sample
+    slope of a real forward/backward).
+    
     Args:
         config: Model configuration
         batch_size: Batch size per GPU
+        checkpointing_policy: Activation checkpointing policy applied to the layers
+        checkpointing_every_k: Layer interval for the "every_k" policy
+        precision: "fp32", or "fp16"/"bf16" autocast (half-precision activations,
+            fp32 master weights)
+        optimizer_state_precision: "fp32" or "8bit" AdamW states
+        include_frozen_clip: Count the frozen CLIP visual projections the trainer and loss
+            move to the GPU for targets (their full CLIPModels are reported as host memory)
+        calibration: Measured activation profile from profile_memory_usage
         
     Returns:
-        Dictionary with memory estimates in GB
+        Dictionary with memory estimates in GB (GPU memory, except
+        'frozen_clip_host_memory_gb')
     """
-    # Rough parameter estimation
-    embed_params = config.in_channels * config.dim + config.eva_embedding_size * config.dim
+    if precision not in PRECISION_BYTES:
+        raise ValueError(f"Unknown precision '{precision}'. Available: {list(PRECISION_BYTES)}")
+    if optimizer_state_precision not in OPTIMIZER_STATE_BYTES:
+        raise ValueError(f"Unknown optimizer state precision '{optimizer_state_precision}'")
     
-    # Transformer layers
-    layer_params = config.n_layers * (
-        # Self-attention
-        3 * config.dim * config.dim +  # Q, K, V projections
-        config.dim * config.dim +       # Output projection
-        # Cross-attention
-        config.dim * config.dim +       # Q projection
-        2 * config.dim * config.dim +   # K, V projections
-        config.dim * config.dim +       # Output projection
-        # FFN
-        config.dim * config.dim * 4 +   # Up projection
-        config.dim * 4 * config.dim +   # Down projection
-        # LayerNorms and other
-        config.dim * 8                  # Various norms and projections
-    )
+    gb = 1024**3
+    param_counts = count_model_parameters(config)
+    trainable_params = param_counts['trainable']
+    total_params = trainable_params + param_counts['frozen']
+    activation_bytes = PRECISION_BYTES[precision]
     
-    output_params = config.dim * config.in_channels
-    total_params = embed_params + layer_params + output_params
+    # Memory estimates (in GB): fp32 weights (master weights under autocast)
+    model_memory = total_params * 4 / gb
     
-    # Memory estimates (in GB)
-    model_memory = total_params * 4 / (1024**3)  # FP32 parameters
+    # Autocast keeps half-precision copies of the weights used in the step
+    autocast_cache_memory = total_params * activation_bytes / gb if precision != "fp32" else 0.0
     
-    # Activation memory (rough estimate)
-    sequence_length = config.input_size * config.input_size  # 256 tokens
-    activation_memory = (
-        batch_size * sequence_length * config.dim * config.n_layers * 8  # Activations
-    ) / (1024**3)
+    # Gradients (fp32, trainable only) and AdamW exp_avg / exp_avg_sq
+    gradient_memory = trainable_params * 4 / gb
+    optimizer_memory = trainable_params * 2 * OPTIMIZER_STATE_BYTES[optimizer_state_precision] / gb
     
-    # Gradient memory (same as model for training)
-    gradient_memory = model_memory
+    # Frozen CLIP visual projections the trainer and the loss move to the GPU for global
+    # targets; the CLIPModels they come from stay in host memory
+    frozen_memory = (
+        FROZEN_CLIP_COPIES * config.in_channels * CLIP_PROJECTION_DIM * 4 / gb if include_frozen_clip else 0.0
+    )
+    frozen_clip_host_memory = FROZEN_CLIP_COPIES * FROZEN_CLIP_PARAMS * 4 / gb if include_frozen_clip else 0.0
+    
+    # Activation memory
+    layer_elements = get_layer_activation_elements(config)
+    retention = get_activation_retention(checkpointing_policy, checkpointing_every_k, layer_elements)
     
-    # Optimizer states (AdamW: 2x gradients)
-    optimizer_memory = model_memory * 2
+    if calibration is not None:
+        # Measured slopes/intercept. Only the transformer layers' share depends on the
+        # checkpointing policy: it is rescaled if profiled under another policy, while
+        # inputs, EVA projection, output head and loss temporaries are taken as measured
+        calibration_retention = get_activation_retention(
+            calibration.get('checkpointing_policy', "none"),
+            calibration.get('checkpointing_every_k', checkpointing_every_k),
+            layer_elements,
+        )
+        policy_scale = retention / calibration_retention
+        precision_scale = activation_bytes / PRECISION_BYTES[calibration.get('precision', "fp32")]
+        per_sample_bytes = (
+            calibration['layer_bytes_per_sample'] * policy_scale +
+            calibration['other_bytes_per_sample']
+        )
+        activation_memory = (
+            calibration['activation_fixed_bytes'] +
+            per_sample_bytes * batch_size * precision_scale
+        ) / gb
+    else:
+        tokens = config.input_size * config.input_size
+        layer_activations = (layer_elements['attention'] + layer_elements['ffn']) * retention
+        # Inputs (patch + 4096-dim EVA conditioning), projected conditioning shared
+        # by all cross-attention K/V, output projection and loss temporaries
+        io_activations = (
+            tokens * config.in_channels * 4 +
+            tokens * config.eva_embedding_size +
+            tokens * config.dim * 2
+        )
+        activation_memory = (
+            batch_size * (config.n_layers * layer_activations + io_activations) * activation_bytes
+        ) / gb
     
-    total_training_memory = model_memory + activation_memory + gradient_memory + optimizer_memory
+    total_training_memory = (
+        model_memory + autocast_cache_memory + activation_memory +
+        gradient_memory + optimizer_memory + frozen_memory
+    )
     
     return {
         'model_memory_gb': model_memory,
+        'autocast_cache_memory_gb': autocast_cache_memory,
         'activation_memory_gb': activation_memory,
         'gradient_memory_gb': gradient_memory,
         'optimizer_memory_gb': optimizer_memory,
+        'frozen_memory_gb': frozen_memory,
+        'frozen_clip_host_memory_gb': frozen_clip_host_memory,
         'total_training_memory_gb': total_training_memory,
-        'inference_memory_gb': model_memory + activation_memory * 0.5,  # Less activation memory
+        'inference_memory_gb': model_memory + frozen_memory + activation_memory * 0.5,  # Less activation memory
         'parameters_millions': total_params / 1e6,
+        'trainable_parameters_millions': trainable_params / 1e6,
     }
 
 
+def profile_memory_usage(
+    model: nn.Module,
+    batch_sizes: Sequence[int] = (1, 2),
+    device: Optional[torch.device] = None,
+    precision: str = "fp32",
+) -> Dict[str, Any]:
+    """
+    Measure activation memory with short forward/backward runs.
+    
+    Bytes saved for backward are counted with saved-tensor hooks (deduplicated
+    by storage, parameters excluded) and attributed to the transformer layer that
+    saved them, so the profile is exact on CPU and device-independent. On CUDA
+    the peak allocated memory of each run is recorded as well.
+    
+    Checkpointing is switched off while profiling (checkpointed regions save
+    through their own hooks and would be invisible); estimate_memory_usage
+    scales the measured per-layer bytes to the policy being estimated.
+    
+    Args:
+        model: BLIP3-o DiT model (moved to `device`; left in its original train/eval mode)
+        batch_sizes: At least two batch sizes used to fit bytes = fixed + per_sample * B
+        device: Device to profile on (default: the model's device)
+        precision: "fp32", or "fp16"/"bf16" autocast
+        
+    Returns:
+        Calibration dictionary for estimate_memory_usage
+    """
+    if len(set(batch_sizes)) < 2:
+        raise ValueError("Need at least two distinct batch sizes to fit the activation slope")
+    if precision not in PRECISION_BYTES:
+        raise ValueError(f"Unknown precision '{precision}'. Available: {list(PRECISION_BYTES)}")
+    
+    if device is None:
+        device = next(model.parameters()).device
+    device = torch.device(device)
+    model.to(device)
+    was_training = model.training
+    model.train()
+    
+    config = model.config
+    num_tokens = config.input_size * config.input_size
+    parameter_storages = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    
+    scope = ["other"]
+    
+    def enter_layer(name):
+        def hook(module, args):
+            if torch.is_grad_enabled():
+                scope.append(name)
+        return hook
+    
+    def exit_layer(module, args, output):
+        if torch.is_grad_enabled() and len(scope) > 1:
+            scope.pop()
+    
+    handles = []
+    for index, layer in enumerate(getattr(model, 'layers', [])):
+        handles.append(layer.register_forward_pre_hook(enter_layer(f"layer_{index}")))
+        handles.append(layer.register_forward_hook(exit_layer))
+    
+    activation_bytes = {}
+    per_layer_bytes = {}
+    peak_allocated_bytes = {}
+    
+    checkpointing_enabled = getattr(model, '_gradient_checkpointing', False)
+    if checkpointing_enabled:
+        model._gradient_checkpointing = False
+        model._apply_checkpointing_policy()
+    
+    try:
+        for batch_size in sorted(set(batch_sizes)):
+            seen_storages = set()
+            counts: Dict[str, int] = {}
+            del scope[1:]
+            
+            def pack(tensor):
+                storage = tensor.untyped_storage()
+                pointer = storage.data_ptr()
+                if pointer not in parameter_storages and pointer not in seen_storages:
+                    seen_storages.add(pointer)
+                    counts[scope[-1]] = counts.get(scope[-1], 0) + storage.nbytes()
+                return tensor
+            
+            hidden_states = torch.randn(batch_size, num_tokens, config.in_channels, device=device)
+            timestep = torch.rand(batch_size, device=device)
+            encoder_hidden_states = torch.randn(batch_size, num_tokens, config.eva_embedding_size, device=device)
+            
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+                baseline = torch.cuda.memory_allocated(device)
+            
+            with torch.autocast(
+                device_type=device.type,
+                dtype=torch.float16 if precision == "fp16" else torch.bfloat16,
+                enabled=precision != "fp32",
+            ):
+                with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+                    outputs = model(hidden_states, timestep, encoder_hidden_states, return_dict=True)
+                    loss = outputs['patch_output'].float().pow(2).mean()
+                    if outputs.get('global_output') is not None:
+                        loss = loss + outputs['global_output'].float().pow(2).mean()
+            loss.backward()
+            
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+                peak_allocated_bytes[batch_size] = torch.cuda.max_memory_allocated(device) - baseline
+            
+            activation_bytes[batch_size] = sum(counts.values())
+            per_layer_bytes[batch_size] = dict(sorted(counts.items()))
+            model.zero_grad(set_to_none=True)
+            del outputs, loss
+    finally:
+        for handle in handles:
+            handle.remove()
+        if checkpointing_enabled:
+            model._gradient_checkpointing = True
+            model._apply_checkpointing_policy()
+        model.train(was_training)
+    
+    # Least-squares lines through (batch_size, bytes): total, transformer layers
+    # (policy-dependent) and everything else (inputs, projections, head, loss)
+    sizes = sorted(activation_bytes)
+    
+    def fit_line(values: Dict[int, float]) -> Tuple[float, float]:
+        mean_size = sum(sizes) / len(sizes)
+        mean_bytes = sum(values[b] for b in sizes) / len(sizes)
+        slope = (
+            sum((b - mean_size) * (values[b] - mean_bytes) for b in sizes) /
+            sum((b - mean_size) ** 2 for b in sizes)
+        )
+        return slope, mean_bytes - slope * mean_size
+    
+    layer_bytes = {
+        b: sum(count for name, count in per_layer_bytes[b].items() if name.startswith("layer_"))
+        for b in sizes
+    }
+    per_sample, fixed = fit_line(activation_bytes)
+    layer_per_sample, _ = fit_line(layer_bytes)
+    other_per_sample, _ = fit_line({b: activation_bytes[b] - layer_bytes[b] for b in sizes})
+    fixed = max(0.0, fixed)
+    
+    analytic = estimate_memory_usage(config, 1, "none", precision=precision)['activation_memory_gb'] * (1024**3)
+    
+    return {
+        'batch_sizes': sizes,
+        'activation_bytes': activation_bytes,
+        'per_layer_bytes': per_layer_bytes,
+        'peak_allocated_bytes': peak_allocated_bytes,
+        'activation_bytes_per_sample': per_sample,
+        'layer_bytes_per_sample': layer_per_sample,
+        'other_bytes_per_sample': other_per_sample,
+        'activation_fixed_bytes': fixed,
+        'analytic_scale': per_sample / analytic if analytic > 0 else None,
+        'precision': precision,
+        'checkpointing_policy': "none",
+        'checkpointing_every_k': getattr(model, 'gradient_checkpointing_every_k', 2),
+        'device': str(device),
+    }
+
+
+def find_max_batch_size(
+    config: BLIP3oDiTConfig,
+    memory_budget_gb: float,
+    target_global_batch_size: Optional[int] = None,
+    num_gpus: int = 1,
+    headroom: float = 0.9,
+    max_batch_size: int = 4096,
+    batch_size_multiple: int = 1,
+    **estimate_kwargs,
+) -> Dict[str, Any]:
+    """
+    Find the largest per-device batch that fits a memory budget, plus gradient accumulation.
+    
+    Args:
+        config: Model configuration
+        memory_budget_gb: Available memory per GPU in GB
+        target_global_batch_size: Desired effective batch (per_device * num_gpus * accumulation);
+            None keeps accumulation at 1
+        num_gpus: Number of data-parallel GPUs
+        headroom: Fraction of the budget the estimate may use (allocator fragmentation, CUDA context)
+        max_batch_size: Upper bound of the search
+        batch_size_multiple: Round the per-device batch down to a multiple of this
+        **estimate_kwargs: Forwarded to estimate_memory_usage (precision, checkpointing_policy,
+            calibration, ...)
+        
+    Returns:
+        Dictionary with 'per_device_batch_size', 'gradient_accumulation_steps',
+        'effective_batch_size', 'estimated_memory_gb', 'fits'
+    """
+    usable_gb = memory_budget_gb * headroom
+    
+    def fits(batch_size: int) -> bool:
+        return estimate_memory_usage(config, batch_size, **estimate_kwargs)['total_training_memory_gb'] <= usable_gb
+    
+    if not fits(1):
+        best = 1
+        fits_budget = False
+    else:
+        # Exponential probe, then binary search (memory is monotone in batch size)
+        low, high = 1, 2
+        while high <= max_batch_size and fits(high):
+            low, high = high, high * 2
+        high = min(high, max_batch_size + 1)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle
+        best = low
+        fits_budget = True
+    
+    if batch_size_multiple > 1 and best >= batch_size_multiple:
+        best = (best // batch_size_multiple) * batch_size_multiple
+    
+    if target_global_batch_size is not None:
+        per_step = best * num_gpus
+        accumulation = max(1, math.ceil(target_global_batch_size / per_step))
+        # Smallest per-device batch giving the same number of accumulation steps
+        best = min(best, max(1, math.ceil(target_global_batch_size / (accumulation * num_gpus))))
+    else:
+        accumulation = 1
+    
+    return {
+        'per_device_batch_size': best,
+        'gradient_accumulation_steps': accumulation,
+        'effective_batch_size': best * num_gpus * accumulation,
+        'estimated_memory_gb': estimate_memory_usage(config, best, **estimate_kwargs)['total_training_memory_gb'],
+        'fits': fits_budget,
+    }
+
+
+def select_checkpointing_policy(
+    config: BLIP3oDiTConfig,
+    batch_size: int,
+    memory_budget_gb: float,
+    headroom: float = 0.9,
+    every_k_candidates: Tuple[int, ...] = (4, 3, 2),
+    **estimate_kwargs,
+) -> Dict[str, Any]:
+    """
+    Pick the activation checkpointing policy with the least recompute that fits a memory budget.
+    
+    Args:
+        config: Model configuration
+        batch_size: Batch size per GPU
+        memory_budget_gb: Available memory per GPU in GB
+        headroom: Fraction of the budget the estimate may use
+        every_k_candidates: Layer intervals tried for the "every_k" policy
+        **estimate_kwargs: Forwarded to estimate_memory_usage (precision, calibration, ...)
+        
+    Returns:
+        Dictionary with 'policy', 'every_k', 'estimated_memory_gb', 'recompute_overhead', 'fits'
+    """
+    candidates = [("none", 1), ("ffn", 1), ("attention", 1)]
+    candidates += [("every_k", k) for k in every_k_candidates]
+    candidates += [("full", 1)]
+    
+    evaluated = []
+    for policy, every_k in candidates:
+        memory_info = estimate_memory_usage(config, batch_size, policy, every_k, **estimate_kwargs)
+        evaluated.append({
+            'policy': policy,
+            'every_k': every_k,
+            'estimated_memory_gb': memory_info['total_training_memory_gb'],
+            'recompute_overhead': get_recompute_overhead(policy, every_k),
+            'fits': memory_info['total_training_memory_gb'] <= memory_budget_gb * headroom,
+        })
+    
+    fitting = [c for c in evaluated if c['fits']]
+    if not fitting:
+        # Nothing fits: save as much as possible
+        return evaluated[-1]
+    
+    # Least recompute first, then lowest memory
+    fitting.sort(key=lambda c: (c['recompute_overhead'], c['estimated_memory_gb']))
+    return fitting[0]
+
+
 def recommend_configuration(
     available_gpu_memory_gb: float,
     num_gpus: int,
-    target_batch_size: int = None
+    target_batch_size: int = None,
+    precision: str = "fp32",
+    checkpointing_policy: str = "full",
 ) -> Tuple[str, BLIP3oDiTConfig, Dict[str, Any]]:
     """
     Recommend the best configuration based on available resources.
@@ -232,6 +728,8 @@ def recommend_configuration(
         available_gpu_memory_gb: Available memory per GPU in GB
         num_gpus: Number of available GPUs
         target_batch_size: Desired batch size (optional)
+        precision: Training precision passed to estimate_memory_usage
+        checkpointing_policy: Activation checkpointing policy passed to estimate_memory_usage
         
     Returns:
         Tuple of (recommended_size, config, memory_info)
@@ -245,7 +743,9 @@ def recommend_configuration(
         test_batch_sizes = [4, 6, 8, 12, 16] if target_batch_size is None else [target_batch_size]
         
         for batch_size in test_batch_sizes:
-            memory_info = estimate_memory_usage(config, batch_size)
+            memory_info = estimate_memory_usage(
+                config, batch_size, checkpointing_policy=checkpointing_policy, precision=precision
+            )
             
             if memory_info['total_training_memory_gb'] <= available_gpu_memory_gb * 0.9:  # 90% usage
                 recommendations.append({
@@ -260,7 +760,9 @@ def recommend_configuration(
     
     if not recommendations:
         # If nothing fits, recommend the smallest config
-        return 'tiny', configs['tiny'], estimate_memory_usage(configs['tiny'], 4)
+        return 'tiny', configs['tiny'], estimate_memory_usage(
+            configs['tiny'], 4, checkpointing_policy=checkpointing_policy, precision=precision
+        )
     
     # Sort by memory efficiency (higher is better, but not too close to limit)
     recommendations.sort(key=lambda x: (x['memory_efficiency'], x['total_effective_batch']), reverse=True)
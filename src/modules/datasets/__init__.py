@@ -7,19 +7,22 @@ Contains:
 - Collation functions
 """
 
-from .blip3o_dataset import (
-    BLIP3oEmbeddingDataset,
-    chunked_collate_fn,
-    create_chunked_dataloader,
-    create_chunked_dataloaders,
-    test_chunked_dataset,
-)
+from ..utils.lazy_imports import lazy_exports
 
-# Create aliases for backward compatibility
-create_blip3o_dataloader = create_chunked_dataloader
-create_blip3o_dataloaders = create_chunked_dataloaders
-blip3o_collate_fn = chunked_collate_fn
-test_blip3o_dataset = test_chunked_dataset
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "BLIP3oEmbeddingDataset": ".blip3o_dataset",
+    "chunked_collate_fn": ".blip3o_dataset",
+    "create_chunked_dataloader": ".blip3o_dataset",
+    "create_chunked_dataloaders": ".blip3o_dataset",
+    "test_chunked_dataset": ".blip3o_dataset",
+
+    # Aliases for backward compatibility
+    "create_blip3o_dataloader": ".blip3o_dataset:create_chunked_dataloader",
+    "create_blip3o_dataloaders": ".blip3o_dataset:create_chunked_dataloaders",
+    "blip3o_collate_fn": ".blip3o_dataset:chunked_collate_fn",
+    "test_blip3o_dataset": ".blip3o_dataset:test_chunked_dataset",
+}
 
 __all__ = [
     "BLIP3oEmbeddingDataset",
@@ -35,4 +38,6 @@ __all__ = [
     "create_blip3o_dataloaders",
     "blip3o_collate_fn",
     "test_blip3o_dataset",
-]
\ No newline at end of file
+]
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
@@ -16,6 +16,8 @@ import time
 import gc
 import os
 
+from ..utils.instrumentation import COLLATE, NORMALIZE, SHARD_LOAD, attach_worker_timings, timer
+
 logger = logging.getLogger(__name__)
 
 
@@ -220,7 +222,7 @@ class BLIP3oEmbeddingDataset(IterableDataset):
         logger.debug(f"Loading shard: {shard_path}")
         
         try:
-            with open(shard_path, 'rb') as f:
+            with timer(SHARD_LOAD), open(shard_path, 'rb') as f:
                 shard_data = pickle.load(f)
             
             # Validate shard data
@@ -228,7 +230,8 @@ class BLIP3oEmbeddingDataset(IterableDataset):
             
             # Normalize embeddings if requested
             if self.normalize_embeddings:
-                shard_data = self._normalize_shard_embeddings(shard_data)
+                with timer(NORMALIZE):
+                    shard_data = self._normalize_shard_embeddings(shard_data)
             
             return shard_data
             
@@ -422,25 +425,32 @@ class BLIP3oEmbeddingDataset(IterableDataset):
 
 
 def chunked_collate_fn(batch: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Custom collate function for chunked dataset."""
-    # Stack tensor data
-    eva_embeddings = torch.stack([item['eva_embeddings'] for item in batch])
-    clip_embeddings = torch.stack([item['clip_embeddings'] for item in batch])
-    
-    # Collect metadata
-    captions = [item['caption'] for item in batch]
-    keys = [item['key'] for item in batch]
-    shard_indices = [item['shard_idx'] for item in batch]
-    sample_indices = [item['sample_idx'] for item in batch]
+    """
+    Custom collate function for chunked dataset.
     
-    return {
-        'eva_embeddings': eva_embeddings,
-        'clip_embeddings': clip_embeddings,
-        'captions': captions,
-        'keys': keys,
-        'shard_indices': shard_indices,
-        'sample_indices': sample_indices,
-    }
+    In DataLoader workers the worker's timings (shard load, normalize, collate)
+    ride along under WORKER_TIMINGS_KEY; the trainers merge them on consumption.
+    """
+    with timer(COLLATE):
+        # Stack tensor data
+        eva_embeddings = torch.stack([item['eva_embeddings'] for item in batch])
+        clip_embeddings = torch.stack([item['clip_embeddings'] for item in batch])
+        
+        # Collect metadata
+        captions = [item['caption'] for item in batch]
+        keys = [item['key'] for item in batch]
+        shard_indices = [item['shard_idx'] for item in batch]
+        sample_indices = [item['sample_idx'] for item in batch]
+        
+        collated = {
+            'eva_embeddings': eva_embeddings,
+            'clip_embeddings': clip_embeddings,
+            'captions': captions,
+            'keys': keys,
+            'shard_indices': shard_indices,
+            'sample_indices': sample_indices,
+        }
+    return attach_worker_timings(collated)
 
 
 def create_chunked_dataloader(
@@ -0,0 +1,128 @@
+"""
+Evaluation utilities for BLIP3-o DiT.
+
+Contains:
+- Vectorized retrieval metrics (recall@K, mAP, MRR, median rank) shared by the
+  recall evaluators
+- BlockedSimilarityEngine: memory-bounded blocked similarity / top-k / metrics
+  for large galleries (the full similarity matrix is never built)
+- ANN text indexes (torch IVF-flat, faiss IVF/HNSW when installed) with exact
+  vs approximate recall@K and latency reporting
+- Persistent, memory-mapped CLIP/EVA embedding cache shared by the evaluators
+- Lazy, streaming COCO caption dataset with a persisted annotation index
+- Streaming (mergeable) moments, quantile sketches and spatial accumulators
+  for patch reconstruction statistics
+- Sharded multi-process (torchrun) evaluation helpers: contiguous shards,
+  ordered all-gather of embeddings and merged streaming statistics
+"""
+
+from ..utils.lazy_imports import lazy_exports
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "mapping_to_ground_truth": ".retrieval_metrics",
+    "compute_query_statistics": ".retrieval_metrics",
+    "summarize_query_statistics": ".retrieval_metrics",
+    "compute_retrieval_metrics_from_similarity": ".retrieval_metrics",
+    "compute_retrieval_metrics": ".retrieval_metrics",
+    "BlockedSimilarityEngine": ".similarity_engine",
+    "create_similarity_engine": ".similarity_engine",
+    "mapping_to_positive_indices": ".similarity_engine",
+    "invert_mapping": ".similarity_engine",
+    "paired_similarity_statistics": ".similarity_engine",
+    "FAISS_AVAILABLE": ".ann_index",
+    "ANN_BACKENDS": ".ann_index",
+    "IVFFlatIndex": ".ann_index",
+    "FaissIndex": ".ann_index",
+    "ExactIndex": ".ann_index",
+    "create_ann_index": ".ann_index",
+    "load_ann_index": ".ann_index",
+    "build_or_load_text_index": ".ann_index",
+    "evaluate_ann_recall": ".ann_index",
+    "index_matches": ".ann_index",
+    "EmbeddingCache": ".embedding_cache",
+    "create_embedding_cache": ".embedding_cache",
+    "cached_embeddings": ".embedding_cache",
+    "model_namespace": ".embedding_cache",
+    "hash_item": ".embedding_cache",
+    "get_default_cache_dir": ".embedding_cache",
+    "COCOAnnotationIndex": ".coco_dataset",
+    "COCOCaptionDataset": ".coco_dataset",
+    "LazyCOCOImages": ".coco_dataset",
+    "iter_image_batches": ".coco_dataset",
+    "load_coco_annotation_index": ".coco_dataset",
+    "coco_collate_fn": ".coco_dataset",
+    "create_coco_dataloader": ".coco_dataset",
+    "load_coco_samples": ".coco_dataset",
+    "RunningMoments": ".streaming_stats",
+    "StreamingQuantileSketch": ".streaming_stats",
+    "StreamingDistributionStats": ".streaming_stats",
+    "StreamingPatchDistanceStatistics": ".streaming_stats",
+    "compute_patch_distances": ".streaming_stats",
+    "create_streaming_patch_statistics": ".streaming_stats",
+    "get_dist_info": ".distributed_eval",
+    "is_main_process": ".distributed_eval",
+    "init_distributed_evaluation": ".distributed_eval",
+    "cleanup_distributed": ".distributed_eval",
+    "shard_range": ".distributed_eval",
+    "shard_sequence": ".distributed_eval",
+    "gather_objects": ".distributed_eval",
+    "gather_tensor": ".distributed_eval",
+    "distributed_map": ".distributed_eval",
+    "merge_gathered": ".distributed_eval",
+}
+
+__all__ = [
+    "mapping_to_ground_truth",
+    "compute_query_statistics",
+    "summarize_query_statistics",
+    "compute_retrieval_metrics_from_similarity",
+    "compute_retrieval_metrics",
+    "BlockedSimilarityEngine",
+    "create_similarity_engine",
+    "mapping_to_positive_indices",
+    "invert_mapping",
+    "paired_similarity_statistics",
+    "FAISS_AVAILABLE",
+    "ANN_BACKENDS",
+    "IVFFlatIndex",
+    "FaissIndex",
+    "ExactIndex",
+    "create_ann_index",
+    "load_ann_index",
+    "build_or_load_text_index",
+    "evaluate_ann_recall",
+    "index_matches",
+    "EmbeddingCache",
+    "create_embedding_cache",
+    "cached_embeddings",
+    "model_namespace",
+    "hash_item",
+    "get_default_cache_dir",
+    "COCOAnnotationIndex",
+    "COCOCaptionDataset",
+    "LazyCOCOImages",
+    "iter_image_batches",
+    "load_coco_annotation_index",
+    "coco_collate_fn",
+    "create_coco_dataloader",
+    "load_coco_samples",
+    "RunningMoments",
+    "StreamingQuantileSketch",
+    "StreamingDistributionStats",
+    "StreamingPatchDistanceStatistics",
+    "compute_patch_distances",
+    "create_streaming_patch_statistics",
+    "get_dist_info",
+    "is_main_process",
+    "init_distributed_evaluation",
+    "cleanup_distributed",
+    "shard_range",
+    "shard_sequence",
+    "gather_objects",
+    "gather_tensor",
+    "distributed_map",
+    "merge_gathered",
+]
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
@@ -0,0 +1,543 @@
+"""
+Approximate nearest-neighbor indexes over text embeddings for recall evaluation.
+
+Brute-force scoring (even blocked) is O(N_images * N_texts); for
+million-caption galleries an inverted-file index only scores the texts in the
+`nprobe` closest clusters of each query. Backends:
+- "ivf": IVF-flat in pure torch (spherical k-means coarse quantizer, exact
+  inner products inside the probed lists)
+- "faiss": faiss.IndexIVFFlat / IndexHNSWFlat when faiss-cpu is installed
+- "exact": brute force through BlockedSimilarityEngine (same interface, for
+  reference)
+
+Indexes can be built, saved and loaded, and evaluate_ann_recall reports
+recall@K in exact and approximate modes together with query latency, so the
+accuracy / latency trade-off can be measured directly.
+"""
+
+import json
+import time
+import torch
+import torch.nn.functional as F
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .similarity_engine import BlockedSimilarityEngine, mapping_to_positive_indices
+
+logger = logging.getLogger(__name__)
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    faiss = None
+    FAISS_AVAILABLE = False
+
+ANN_BACKENDS = ("auto", "ivf", "faiss", "exact")
+
+
+def embedding_fingerprint(embeddings: torch.Tensor) -> List[float]:
+    """Cheap fingerprint of an embedding matrix, used to detect stale persisted indexes."""
+    embeddings = embeddings.detach().float().cpu()
+    return [float(embeddings.shape[0]), float(embeddings.shape[1]),
+            embeddings.sum().item(), embeddings[:, 0].abs().sum().item()]
+
+
+def _fingerprints_match(a: Optional[List[float]], b: List[float], rtol: float = 1e-4) -> bool:
+    if a is None or len(a) != len(b):
+        return False
+    return all(abs(x - y) <= rtol * max(1.0, abs(y)) for x, y in zip(a, b))
+
+
+def index_matches(index, embeddings: torch.Tensor) -> bool:
+    """True if `index` was built over exactly these embeddings (by fingerprint)."""
+    return index is not None and _fingerprints_match(getattr(index, 'fingerprint', None), embedding_fingerprint(embeddings))
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index with flat (uncompressed) lists, implemented in torch.
+
+    Vectors are stored sorted by cluster so every list is a contiguous slice.
+    Search scores each query against the centroids, then against the vectors of
+    its `nprobe` best lists, merging a running top-k list by list.
+    """
+
+    backend = "ivf"
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        kmeans_iters: int = 10,
+        kmeans_sample_size: int = 262144,
+        normalize: bool = True,
+        device: Optional[Union[str, torch.device]] = None,
+        query_block_size: int = 4096,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            nlist: Number of clusters (default: 4 * sqrt(N) at build time)
+            nprobe: Lists scanned per query
+            kmeans_iters: Lloyd iterations of the coarse quantizer
+            kmeans_sample_size: Vectors sampled to train the quantizer
+            normalize: L2-normalize vectors and queries (cosine similarity)
+            device: Device for build / search (default: embeddings' device)
+            query_block_size: Queries searched at a time
+            seed: Random seed for k-means initialization
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.kmeans_sample_size = kmeans_sample_size
+        self.normalize = normalize
+        self.device = torch.device(device) if device is not None else None
+        self.query_block_size = query_block_size
+        self.seed = seed
+
+        self.centroids: Optional[torch.Tensor] = None  # [nlist, D]
+        self.vectors: Optional[torch.Tensor] = None    # [N, D], sorted by list
+        self.ids: Optional[torch.Tensor] = None        # [N], original index of each stored vector
+        self.list_offsets: Optional[torch.Tensor] = None  # [nlist + 1]
+        self.fingerprint: Optional[List[float]] = None
+        self.build_time = 0.0
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def _prepare(self, embeddings: torch.Tensor) -> torch.Tensor:
+        device = self.device or embeddings.device
+        embeddings = embeddings.detach().to(device=device, dtype=torch.float32)
+        return F.normalize(embeddings, p=2, dim=-1) if self.normalize else embeddings
+
+    def _assign(self, vectors: torch.Tensor, centroids: torch.Tensor) -> torch.Tensor:
+        assignments = []
+        for start in range(0, vectors.shape[0], self.query_block_size):
+            assignments.append((vectors[start:start + self.query_block_size] @ centroids.t()).argmax(dim=1))
+        return torch.cat(assignments)
+
+    def _train_centroids(self, vectors: torch.Tensor, nlist: int) -> torch.Tensor:
+        """Spherical k-means on a sample of the vectors."""
+        generator = torch.Generator().manual_seed(self.seed)
+        num_vectors = vectors.shape[0]
+        if num_vectors > self.kmeans_sample_size:
+            sample = vectors[torch.randperm(num_vectors, generator=generator)[:self.kmeans_sample_size].to(vectors.device)]
+        else:
+            sample = vectors
+
+        centroids = sample[torch.randperm(sample.shape[0], generator=generator)[:nlist].to(vectors.device)].clone()
+        for _ in range(self.kmeans_iters):
+            assignment = self._assign(sample, centroids)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, sample)
+            counts = torch.bincount(assignment, minlength=nlist)
+            # Empty clusters keep their previous centroid
+            updated = counts > 0
+            centroids[updated] = sums[updated] / counts[updated].unsqueeze(1).to(sums.dtype)
+            if self.normalize:
+                centroids = F.normalize(centroids, p=2, dim=-1)
+        return centroids
+
+    def build(self, embeddings: torch.Tensor) -> "IVFFlatIndex":
+        """Train the coarse quantizer and fill the inverted lists."""
+        start_time = time.time()
+        vectors = self._prepare(embeddings)
+        num_vectors = vectors.shape[0]
+        nlist = self.nlist or max(1, int(4 * num_vectors ** 0.5))
+        nlist = min(nlist, num_vectors)
+
+        centroids = self._train_centroids(vectors, nlist)
+        assignment = self._assign(vectors, centroids)
+        order = torch.argsort(assignment, stable=True)
+        counts = torch.bincount(assignment, minlength=nlist)
+
+        self.nlist = nlist
+        self.centroids = centroids
+        self.vectors = vectors[order].contiguous()
+        self.ids = order
+        self.list_offsets = torch.cat([counts.new_zeros(1), counts.cumsum(0)])
+        self.fingerprint = embedding_fingerprint(embeddings)
+        self.build_time = time.time() - start_time
+
+        logger.info(f"Built IVF-flat index: {num_vectors} vectors, {nlist} lists "
+                    f"(largest {int(counts.max())}) in {self.build_time:.2f}s")
+        return self
+
+    def search(
+        self,
+        queries: torch.Tensor,
+        k: int,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Approximate top-k.
+
+        Returns:
+            (scores [N_queries, k], indices [N_queries, k]) best first; indices
+            are -1 (score -inf) where fewer than k candidates were scanned
+        """
+        if self.centroids is None:
+            raise RuntimeError("Index is empty, call build() or load() first")
+        queries = self._prepare(queries).to(self.vectors.device)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        k = min(k, self.ntotal)
+
+        all_scores, all_indices = [], []
+        offsets = self.list_offsets.tolist()
+        for q_start in range(0, queries.shape[0], self.query_block_size):
+            block = queries[q_start:q_start + self.query_block_size]
+            probes = (block @ self.centroids.t()).topk(nprobe, dim=1).indices
+
+            top_scores = block.new_full((block.shape[0], k), float('-inf'))
+            top_positions = torch.full((block.shape[0], k), -1, dtype=torch.long, device=block.device)
+
+            # Group queries by probed list: one matmul per non-empty list
+            probed_lists, inverse = probes.flatten().unique(return_inverse=True)
+            query_rows = torch.arange(block.shape[0], device=block.device).repeat_interleave(nprobe)
+            for list_position, list_id in enumerate(probed_lists.tolist()):
+                begin, end = offsets[list_id], offsets[list_id + 1]
+                if end == begin:
+                    continue
+                rows = query_rows[inverse == list_position]
+                scores = block[rows] @ self.vectors[begin:end].t()
+                list_k = min(k, end - begin)
+                list_scores, list_positions = scores.topk(list_k, dim=1)
+
+                merged_scores = torch.cat([top_scores[rows], list_scores], dim=1)
+                merged_positions = torch.cat([top_positions[rows], list_positions + begin], dim=1)
+                merged_scores, order = merged_scores.topk(k, dim=1)
+                top_scores[rows] = merged_scores
+                top_positions[rows] = merged_positions.gather(1, order)
+
+            indices = torch.where(top_positions >= 0, self.ids[top_positions.clamp(min=0)], top_positions)
+            all_scores.append(top_scores)
+            all_indices.append(indices)
+
+        return torch.cat(all_scores), torch.cat(all_indices)
+
+    def save(self, path: Union[str, Path]):
+        """Persist the index to a single torch file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({
+            'backend': self.backend,
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'normalize': self.normalize,
+            'centroids': self.centroids.cpu(),
+            'vectors': self.vectors.cpu(),
+            'ids': self.ids.cpu(),
+            'list_offsets': self.list_offsets.cpu(),
+            'fingerprint': self.fingerprint,
+        }, path)
+        logger.info(f"Saved IVF-flat index to {path}")
+
+    @classmethod
+    def load(cls, path: Union[str, Path], device: Optional[Union[str, torch.device]] = None) -> "IVFFlatIndex":
+        state = torch.load(path, map_location="cpu")
+        index = cls(nlist=state['nlist'], nprobe=state['nprobe'], normalize=state['normalize'], device=device)
+        target = index.device or torch.device("cpu")
+        index.centroids = state['centroids'].to(target)
+        index.vectors = state['vectors'].to(target)
+        index.ids = state['ids'].to(target)
+        index.list_offsets = state['list_offsets']
+        index.fingerprint = state['fingerprint']
+        logger.info(f"Loaded IVF-flat index from {path}: {index.ntotal} vectors, {index.nlist} lists")
+        return index
+
+
+class FaissIndex:
+    """faiss-cpu IVF-flat or HNSW index (inner product on normalized vectors)."""
+
+    backend = "faiss"
+
+    def __init__(
+        self,
+        index_type: str = "ivf",
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        normalize: bool = True,
+    ):
+        """
+        Args:
+            index_type: "ivf" (IndexIVFFlat) or "hnsw" (IndexHNSWFlat)
+            nlist: IVF clusters (default: 4 * sqrt(N) at build time)
+            nprobe: IVF lists scanned per query
+            hnsw_m: HNSW graph degree
+            ef_search: HNSW search beam width
+            normalize: L2-normalize vectors and queries (cosine similarity)
+        """
+        if not FAISS_AVAILABLE:
+            raise ImportError("faiss is not installed (pip install faiss-cpu)")
+        if index_type not in ("ivf", "hnsw"):
+            raise ValueError(f"Unknown faiss index_type: {index_type}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.normalize = normalize
+        self.index = None
+        self.fingerprint: Optional[List[float]] = None
+        self.build_time = 0.0
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.index is None else self.index.ntotal
+
+    def _prepare(self, embeddings: torch.Tensor):
+        embeddings = embeddings.detach().float().cpu()
+        if self.normalize:
+            embeddings = F.normalize(embeddings, p=2, dim=-1)
+        return embeddings.contiguous().numpy()
+
+    def _apply_search_parameters(self):
+        if self.index_type == "ivf":
+            self.index.nprobe = self.nprobe
+        else:
+            self.index.hnsw.efSearch = self.ef_search
+
+    def build(self, embeddings: torch.Tensor) -> "FaissIndex":
+        start_time = time.time()
+        vectors = self._prepare(embeddings)
+        num_vectors, dim = vectors.shape
+
+        if self.index_type == "ivf":
+            self.nlist = min(self.nlist or max(1, int(4 * num_vectors ** 0.5)), num_vectors)
+            quantizer = faiss.IndexFlatIP(dim)
+            self.index = faiss.IndexIVFFlat(quantizer, dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(vectors)
+        else:
+            self.index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        self.index.add(vectors)
+        self._apply_search_parameters()
+
+        self.fingerprint = embedding_fingerprint(embeddings)
+        self.build_time = time.time() - start_time
+        logger.info(f"Built faiss {self.index_type} index: {num_vectors} vectors in {self.build_time:.2f}s")
+        return self
+
+    def search(
+        self,
+        queries: torch.Tensor,
+        k: int,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.index is None:
+            raise RuntimeError("Index is empty, call build() or load() first")
+        if nprobe is not None and self.index_type == "ivf":
+            self.index.nprobe = nprobe
+        scores, indices = self.index.search(self._prepare(queries), min(k, self.ntotal))
+        self._apply_search_parameters()
+        return torch.from_numpy(scores), torch.from_numpy(indices).long()
+
+    def save(self, path: Union[str, Path]):
+        """Persist the faiss index plus a JSON sidecar with the search settings."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(self.index, str(path))
+        with open(path.with_suffix(path.suffix + ".json"), 'w') as f:
+            json.dump({
+                'backend': self.backend,
+                'index_type': self.index_type,
+                'nlist': self.nlist,
+                'nprobe': self.nprobe,
+                'hnsw_m': self.hnsw_m,
+                'ef_search': self.ef_search,
+                'normalize': self.normalize,
+                'fingerprint': self.fingerprint,
+            }, f, indent=2)
+        logger.info(f"Saved faiss index to {path}")
+
+    @classmethod
+    def load(cls, path: Union[str, Path], device=None) -> "FaissIndex":
+        path = Path(path)
+        with open(path.with_suffix(path.suffix + ".json"), 'r') as f:
+            meta = json.load(f)
+        index = cls(index_type=meta['index_type'], nlist=meta['nlist'], nprobe=meta['nprobe'],
+                    hnsw_m=meta['hnsw_m'], ef_search=meta['ef_search'], normalize=meta['normalize'])
+        index.index = faiss.read_index(str(path))
+        index.fingerprint = meta['fingerprint']
+        index._apply_search_parameters()
+        logger.info(f"Loaded faiss {index.index_type} index from {path}: {index.ntotal} vectors")
+        return index
+
+
+class ExactIndex:
+    """Brute-force index with the ANN interface (reference for exact recall)."""
+
+    backend = "exact"
+
+    def __init__(self, normalize: bool = True, nlist: Optional[int] = None, nprobe: Optional[int] = None, **engine_kwargs):
+        # nlist / nprobe are accepted (and ignored) for interchangeability with the ANN backends
+        self.normalize = normalize
+        self.engine = BlockedSimilarityEngine(normalize=normalize, **engine_kwargs)
+        self.vectors: Optional[torch.Tensor] = None
+        self.fingerprint: Optional[List[float]] = None
+        self.build_time = 0.0
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def build(self, embeddings: torch.Tensor) -> "ExactIndex":
+        self.vectors = embeddings.detach()
+        self.fingerprint = embedding_fingerprint(embeddings)
+        return self
+
+    def search(self, queries: torch.Tensor, k: int, nprobe: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.engine.topk(queries, self.vectors, k)
+
+    def save(self, path: Union[str, Path]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        torch.save({'backend': self.backend, 'normalize': self.normalize,
+                    'vectors': self.vectors.cpu(), 'fingerprint': self.fingerprint}, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], device=None) -> "ExactIndex":
+        state = torch.load(path, map_location="cpu")
+        index = cls(normalize=state['normalize'], device=device)
+        index.vectors = state['vectors']
+        index.fingerprint = state['fingerprint']
+        return index
+
+
+def create_ann_index(backend: str = "auto", **kwargs):
+    """
+    Factory function for ANN indexes.
+
+    Args:
+        backend: "auto" (faiss if installed, else "ivf"), "ivf", "faiss" or "exact"
+        **kwargs: Passed to the index constructor
+    """
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f"Unknown ANN backend: {backend}. Choose from {ANN_BACKENDS}")
+    if backend == "auto":
+        backend = "faiss" if FAISS_AVAILABLE else "ivf"
+    if backend == "faiss":
+        return FaissIndex(**kwargs)
+    if backend == "exact":
+        return ExactIndex(**kwargs)
+    return IVFFlatIndex(**kwargs)
+
+
+def load_ann_index(path: Union[str, Path], device: Optional[Union[str, torch.device]] = None):
+    """Load an index saved by any backend (faiss indexes have a .json sidecar)."""
+    path = Path(path)
+    if path.with_suffix(path.suffix + ".json").exists():
+        return FaissIndex.load(path)
+    backend = torch.load(path, map_location="cpu").get('backend', 'ivf')
+    if backend == "exact":
+        return ExactIndex.load(path, device=device)
+    return IVFFlatIndex.load(path, device=device)
+
+
+def build_or_load_text_index(
+    text_embeddings: torch.Tensor,
+    index_path: Optional[Union[str, Path]] = None,
+    backend: str = "auto",
+    rebuild: bool = False,
+    **index_kwargs
+):
+    """
+    Load a persisted text-embedding index, or build (and persist) a new one.
+
+    A persisted index is only reused when its fingerprint matches the given
+    embeddings; otherwise it is rebuilt and overwritten.
+    """
+    fingerprint = embedding_fingerprint(text_embeddings)
+    if index_path is not None and Path(index_path).exists() and not rebuild:
+        index = load_ann_index(index_path)
+        if _fingerprints_match(index.fingerprint, fingerprint):
+            return index
+        logger.warning(f"Index at {index_path} does not match the text embeddings, rebuilding")
+
+    index = create_ann_index(backend, **index_kwargs).build(text_embeddings)
+    if index_path is not None:
+        index.save(index_path)
+    return index
+
+
+def _recall_from_topk(top_indices: torch.Tensor, positives: List[List[int]], k_values: Sequence[int], prefix: str) -> Dict[str, float]:
+    positive_indices = mapping_to_positive_indices(positives)
+    top_indices = top_indices.cpu()
+    hits = ((top_indices.unsqueeze(2) == positive_indices.unsqueeze(1)) & (positive_indices >= 0).unsqueeze(1)).any(dim=2)
+    hits_at = hits.cummax(dim=1).values
+    has_positive = (positive_indices >= 0).any(dim=1)
+    return {
+        f'{prefix}recall@{k}': hits_at[has_positive, min(k, hits_at.shape[1]) - 1].float().mean().item()
+        for k in k_values
+    }
+
+
+def evaluate_ann_recall(
+    index,
+    image_embeddings: torch.Tensor,
+    text_embeddings: Optional[torch.Tensor],
+    image_to_text_mapping: List[List[int]],
+    k_values: Sequence[int] = (1, 5, 10),
+    nprobe: Optional[int] = None,
+    exact: bool = True,
+) -> Dict[str, float]:
+    """
+    Image->text recall@K through an ANN text index, optionally next to exact search.
+
+    Returns:
+        'ann_recall@K', 'ann_query_time_s', 'ann_queries_per_second', 'ann_build_time_s'
+        and, with exact=True (requires text_embeddings), 'exact_recall@K',
+        'exact_query_time_s', 'ann_speedup' and 'ann_neighbor_recall@K' (fraction
+        of the exact top-K returned by the index)
+    """
+    max_k = max(k_values)
+    num_queries = image_embeddings.shape[0]
+
+    start_time = time.time()
+    _, ann_indices = index.search(image_embeddings, max_k, nprobe=nprobe)
+    ann_time = time.time() - start_time
+
+    results = _recall_from_topk(ann_indices, image_to_text_mapping, k_values, "ann_")
+    results.update({
+        'ann_backend': index.backend,
+        'ann_query_time_s': ann_time,
+        'ann_queries_per_second': num_queries / max(ann_time, 1e-9),
+        'ann_build_time_s': index.build_time,
+        'ann_gallery_size': index.ntotal,
+    })
+    if nprobe is not None or hasattr(index, 'nprobe'):
+        results['ann_nprobe'] = nprobe or getattr(index, 'nprobe', None)
+
+    if exact and text_embeddings is not None:
+        engine = BlockedSimilarityEngine(normalize=getattr(index, 'normalize', True))
+        start_time = time.time()
+        _, exact_indices = engine.topk(image_embeddings, text_embeddings, max_k)
+        exact_time = time.time() - start_time
+
+        results.update(_recall_from_topk(exact_indices, image_to_text_mapping, k_values, "exact_"))
+        results['exact_query_time_s'] = exact_time
+        results['ann_speedup'] = exact_time / max(ann_time, 1e-9)
+        ann_indices, exact_indices = ann_indices.cpu(), exact_indices.cpu()
+        for k in k_values:
+            found = (ann_indices[:, :k].unsqueeze(2) == exact_indices[:, :k].unsqueeze(1)).any(dim=1)
+            results[f'ann_neighbor_recall@{k}'] = found.float().mean().item()
+
+    return results
+
+
+__all__ = [
+    "FAISS_AVAILABLE",
+    "ANN_BACKENDS",
+    "IVFFlatIndex",
+    "FaissIndex",
+    "ExactIndex",
+    "create_ann_index",
+    "load_ann_index",
+    "build_or_load_text_index",
+    "evaluate_ann_recall",
+    "embedding_fingerprint",
+    "index_matches",
+]
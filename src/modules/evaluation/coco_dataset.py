@@ -0,0 +1,458 @@
+"""
+Lazy, streaming MS-COCO caption dataset shared by the evaluation scripts.
+
+Replaces the per-script load_coco_samples copies that decoded every image up
+front into a Python list and re-scanned the annotation JSON with dict loops on
+every run:
+- COCOAnnotationIndex: compact index (image id -> file name, caption offsets)
+  built once with NumPy and persisted next to the annotations as .npz. Strings
+  are packed into UTF-8 byte buffers, so DataLoader workers share it without
+  copy-on-access of Python objects.
+- COCOCaptionDataset: decodes images lazily in __getitem__, optionally applying
+  a preprocessing transform inside the DataLoader workers.
+- LazyCOCOImages: a sequence of PIL images that decodes on access; iterating it
+  prefetches through parallel DataLoader workers, so decoding overlaps with
+  encoding and host memory stays flat.
+"""
+
+import os
+import json
+import hashlib
+import torch
+import numpy as np
+import logging
+from collections.abc import Sequence as SequenceABC
+from pathlib import Path
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+
+
+def _pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into one UTF-8 byte buffer plus [N + 1] offsets."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets
+
+
+def _unpack_string(buffer: np.ndarray, offsets: np.ndarray, index: int) -> str:
+    return buffer[offsets[index]:offsets[index + 1]].tobytes().decode("utf-8")
+
+
+class COCOAnnotationIndex:
+    """
+    Compact COCO caption index.
+
+    Images are stored in the annotation file's `images` order; captions are
+    grouped per image. `annotation_order` lists the images that have captions
+    in order of their first caption annotation (the order the evaluation
+    scripts have always used).
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.image_ids = arrays["image_ids"]
+        self.file_name_bytes = arrays["file_name_bytes"]
+        self.file_name_offsets = arrays["file_name_offsets"]
+        self.caption_bytes = arrays["caption_bytes"]
+        self.caption_offsets = arrays["caption_offsets"]
+        self.image_caption_offsets = arrays["image_caption_offsets"]
+        self.annotation_order = arrays["annotation_order"]
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    @property
+    def num_captions(self) -> int:
+        return len(self.caption_offsets) - 1
+
+    def file_name(self, position: int) -> str:
+        return _unpack_string(self.file_name_bytes, self.file_name_offsets, position)
+
+    def captions(self, position: int, max_captions: Optional[int] = None) -> List[str]:
+        start, end = self.image_caption_offsets[position], self.image_caption_offsets[position + 1]
+        if max_captions is not None:
+            end = min(end, start + max_captions)
+        return [_unpack_string(self.caption_bytes, self.caption_offsets, c) for c in range(start, end)]
+
+    def num_captions_of(self, position: int) -> int:
+        return int(self.image_caption_offsets[position + 1] - self.image_caption_offsets[position])
+
+    def captions_by_image_id(self) -> Dict[int, List[str]]:
+        """image_id -> all captions (for alignment checks)."""
+        return {int(image_id): self.captions(position) for position, image_id in enumerate(self.image_ids)}
+
+    @classmethod
+    def from_annotations(cls, annotations_file: Union[str, Path]) -> "COCOAnnotationIndex":
+        with open(annotations_file, "r") as f:
+            coco_data = json.load(f)
+
+        image_ids = np.array([img["id"] for img in coco_data["images"]], dtype=np.int64)
+        file_names = [img["file_name"] for img in coco_data["images"]]
+        ann_image_ids = np.array([ann["image_id"] for ann in coco_data["annotations"]], dtype=np.int64)
+        ann_captions = [ann["caption"] for ann in coco_data["annotations"]]
+
+        # Position of each annotation's image in the images list (-1: unknown image)
+        sorter = np.argsort(image_ids, kind="stable")
+        found = np.searchsorted(image_ids, ann_image_ids, sorter=sorter)
+        found = np.clip(found, 0, len(image_ids) - 1)
+        ann_positions = sorter[found]
+        ann_positions[image_ids[ann_positions] != ann_image_ids] = -1
+        valid = ann_positions >= 0
+
+        # Group captions by image (stable: annotation order within an image)
+        valid_indices = np.nonzero(valid)[0]
+        grouped = valid_indices[np.argsort(ann_positions[valid_indices], kind="stable")]
+        counts = np.bincount(ann_positions[valid_indices], minlength=len(image_ids))
+        image_caption_offsets = np.zeros(len(image_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=image_caption_offsets[1:])
+
+        # Images with captions, ordered by their first caption annotation
+        first_annotation = np.full(len(image_ids), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_annotation, ann_positions[valid_indices], valid_indices)
+        with_captions = np.nonzero(counts > 0)[0]
+        annotation_order = with_captions[np.argsort(first_annotation[with_captions], kind="stable")]
+
+        file_name_bytes, file_name_offsets = _pack_strings(file_names)
+        caption_bytes, caption_offsets = _pack_strings([ann_captions[i] for i in grouped])
+
+        return cls({
+            "image_ids": image_ids,
+            "file_name_bytes": file_name_bytes,
+            "file_name_offsets": file_name_offsets,
+            "caption_bytes": caption_bytes,
+            "caption_offsets": caption_offsets,
+            "image_caption_offsets": image_caption_offsets,
+            "annotation_order": annotation_order.astype(np.int64),
+        })
+
+    def save(self, path: Union[str, Path], source_signature: Optional[List[int]] = None):
+        np.savez(
+            path,
+            image_ids=self.image_ids,
+            file_name_bytes=self.file_name_bytes,
+            file_name_offsets=self.file_name_offsets,
+            caption_bytes=self.caption_bytes,
+            caption_offsets=self.caption_offsets,
+            image_caption_offsets=self.image_caption_offsets,
+            annotation_order=self.annotation_order,
+            source_signature=np.array(source_signature or [], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> Tuple["COCOAnnotationIndex", List[int]]:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+        return cls(arrays), arrays["source_signature"].tolist()
+
+
+def _source_signature(annotations_file: Path) -> List[int]:
+    stat = annotations_file.stat()
+    return [INDEX_FORMAT_VERSION, stat.st_size, int(stat.st_mtime)]
+
+
+def _index_cache_paths(annotations_file: Path) -> List[Path]:
+    """Next to the annotations, or in the user cache when that is read-only."""
+    digest = hashlib.sha256(str(annotations_file.resolve()).encode("utf-8")).hexdigest()[:16]
+    cache_root = Path(os.environ.get("BLIP3O_COCO_INDEX_CACHE", Path.home() / ".cache" / "blip3o" / "coco"))
+    return [
+        annotations_file.with_suffix(".index.npz"),
+        cache_root / f"{annotations_file.stem}_{digest}.index.npz",
+    ]
+
+
+def load_coco_annotation_index(
+    coco_root: Union[str, Path],
+    split: str = "val2017",
+    rebuild: bool = False,
+) -> COCOAnnotationIndex:
+    """Load the persisted annotation index for a split, building it on first use."""
+    annotations_file = Path(coco_root) / "annotations" / f"captions_{split}.json"
+    if not annotations_file.exists():
+        raise FileNotFoundError(f"COCO annotations not found: {annotations_file}")
+
+    signature = _source_signature(annotations_file)
+    candidates = _index_cache_paths(annotations_file)
+
+    if not rebuild:
+        for path in candidates:
+            if not path.exists():
+                continue
+            try:
+                index, stored_signature = COCOAnnotationIndex.load(path)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable COCO index {path}: {e}")
+                continue
+            if stored_signature == signature:
+                return index
+
+    logger.info(f"Building COCO annotation index from {annotations_file}...")
+    index = COCOAnnotationIndex.from_annotations(annotations_file)
+    for path in candidates:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + f".tmp{os.getpid()}.npz")
+            index.save(tmp_path, signature)
+            os.replace(tmp_path, path)
+            logger.info(f"Saved COCO annotation index ({len(index)} images, {index.num_captions} captions) to {path}")
+            break
+        except OSError:
+            continue
+    return index
+
+
+class COCOCaptionDataset(Dataset):
+    """
+    COCO images with their captions, decoded lazily.
+
+    Each item is a dict with 'image' (RGB PIL image, or the output of
+    `transform`), 'captions', 'image_id', 'image_path' and 'index'.
+    """
+
+    def __init__(
+        self,
+        coco_root: Union[str, Path],
+        split: str = "val2017",
+        max_samples: Optional[int] = None,
+        max_captions: Optional[int] = 5,
+        order: str = "annotations",
+        transform: Optional[Callable[[Image.Image], Any]] = None,
+        check_files: bool = True,
+    ):
+        """
+        Args:
+            coco_root: COCO root with annotations/ and images/<split>/
+            split: Split name (e.g. "val2017")
+            max_samples: Number of images to keep (None: all)
+            max_captions: Captions per image (None: all)
+            order: "annotations" (images with captions, by first caption annotation)
+                or "images" (annotation file's images list)
+            transform: Applied to each decoded image inside the workers
+            check_files: Skip images whose file is missing
+        """
+        if order not in ("annotations", "images"):
+            raise ValueError(f"Unknown order: {order}")
+        self.coco_root = Path(coco_root)
+        self.images_dir = self.coco_root / "images" / split
+        if not self.images_dir.exists():
+            raise FileNotFoundError(f"COCO images not found: {self.images_dir}")
+
+        self.index = load_coco_annotation_index(coco_root, split)
+        self.max_captions = max_captions
+        self.transform = transform
+
+        candidates = self.index.annotation_order if order == "annotations" else np.arange(len(self.index))
+        positions = []
+        for position in candidates.tolist():
+            if max_samples is not None and len(positions) >= max_samples:
+                break
+            if check_files and not (self.images_dir / self.index.file_name(position)).exists():
+                logger.warning(f"Image file not found: {self.images_dir / self.index.file_name(position)}")
+                continue
+            positions.append(position)
+        self.positions = np.array(positions, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def image_path(self, idx: int) -> Path:
+        return self.images_dir / self.index.file_name(int(self.positions[idx]))
+
+    def image_id(self, idx: int) -> int:
+        return int(self.index.image_ids[self.positions[idx]])
+
+    def captions(self, idx: int) -> List[str]:
+        return self.index.captions(int(self.positions[idx]), self.max_captions)
+
+    def load_image(self, idx: int) -> Image.Image:
+        with Image.open(self.image_path(idx)) as image:
+            return image.convert("RGB")
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        image = self.load_image(idx)
+        return {
+            "image": self.transform(image) if self.transform is not None else image,
+            "captions": self.captions(idx),
+            "image_id": self.image_id(idx),
+            "image_path": str(self.image_path(idx)),
+            "index": idx,
+        }
+
+
+def coco_collate_fn(batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Batch COCO items; transformed images that are tensors are stacked, PIL images stay a list."""
+    images = [item["image"] for item in batch]
+    if images and isinstance(images[0], torch.Tensor):
+        images = torch.stack(images)
+    return {
+        "images": images,
+        "captions": [item["captions"] for item in batch],
+        "image_ids": [item["image_id"] for item in batch],
+        "image_paths": [item["image_path"] for item in batch],
+        "indices": [item["index"] for item in batch],
+    }
+
+
+def create_coco_dataloader(
+    coco_root: Union[str, Path],
+    batch_size: int = 8,
+    max_samples: Optional[int] = None,
+    shuffle: bool = False,
+    num_workers: int = 4,
+    transform: Optional[Callable[[Image.Image], Any]] = None,
+    split: str = "val2017",
+    max_captions: Optional[int] = 5,
+    order: str = "annotations",
+    dataset: Optional[COCOCaptionDataset] = None,
+    **kwargs
+) -> DataLoader:
+    """
+    DataLoader over COCOCaptionDataset (decoding + `transform` run in the workers).
+
+    Batches are dicts with 'images', 'captions', 'image_ids', 'image_paths', 'indices'.
+    """
+    if dataset is None:
+        dataset = COCOCaptionDataset(
+            coco_root, split=split, max_samples=max_samples, max_captions=max_captions,
+            order=order, transform=transform,
+        )
+    if num_workers > 0:
+        kwargs.setdefault("prefetch_factor", 4)
+        kwargs.setdefault("persistent_workers", False)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        collate_fn=coco_collate_fn,
+        pin_memory=torch.cuda.is_available() and transform is not None,
+        **kwargs
+    )
+
+
+class LazyCOCOImages(SequenceABC):
+    """
+    Sequence of RGB PIL images backed by COCOCaptionDataset.
+
+    Indexing decodes a single image; iteration streams through a DataLoader
+    with `num_workers` parallel decoders. Slicing returns another lazy view.
+    """
+
+    def __init__(self, dataset: COCOCaptionDataset, indices: Optional[Sequence[int]] = None, num_workers: int = 4):
+        self.dataset = dataset
+        self.indices = list(range(len(dataset))) if indices is None else list(indices)
+        self.num_workers = num_workers
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return LazyCOCOImages(self.dataset, self.indices[item], self.num_workers)
+        return self.dataset.load_image(self.indices[item])
+
+    def _subset(self, transform: Optional[Callable] = None) -> Dataset:
+        dataset = self.dataset
+        if transform is not None:
+            dataset = _TransformedView(dataset, transform)
+        return torch.utils.data.Subset(dataset, self.indices)
+
+    def iter_batches(
+        self,
+        batch_size: int = 32,
+        transform: Optional[Callable[[Image.Image], Any]] = None,
+        num_workers: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream batches (see coco_collate_fn); `transform` runs in the workers."""
+        num_workers = self.num_workers if num_workers is None else num_workers
+        loader = DataLoader(
+            self._subset(transform),
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=num_workers if len(self) > 1 else 0,
+            collate_fn=coco_collate_fn,
+            prefetch_factor=4 if num_workers > 0 and len(self) > 1 else None,
+        )
+        yield from loader
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        for batch in self.iter_batches(batch_size=8):
+            yield from batch["images"]
+
+    def content_hashes(self) -> List[str]:
+        """Hashes of the encoded image files (cheaper than hashing decoded pixels)."""
+        hashes = []
+        for idx in self.indices:
+            with open(self.dataset.image_path(idx), "rb") as f:
+                hashes.append(hashlib.sha256(b"file:" + f.read()).hexdigest())
+        return hashes
+
+
+def iter_image_batches(images: Sequence[Image.Image], batch_size: int = 32) -> Iterator[List[Image.Image]]:
+    """
+    Yield lists of at most `batch_size` PIL images, so callers can run one
+    processor call per batch. LazyCOCOImages decode through their DataLoader
+    workers (iter_batches); plain sequences are sliced.
+    """
+    if isinstance(images, LazyCOCOImages):
+        for batch in images.iter_batches(batch_size=batch_size):
+            yield batch["images"]
+        return
+    for start in range(0, len(images), batch_size):
+        yield list(images[start:start + batch_size])
+
+
+class _TransformedView(Dataset):
+    """Dataset view that applies a transform to the decoded image."""
+
+    def __init__(self, dataset: COCOCaptionDataset, transform: Callable):
+        self.dataset = dataset
+        self.transform = transform
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        item = self.dataset[idx]
+        item["image"] = self.transform(item["image"])
+        return item
+
+
+def load_coco_samples(
+    coco_root: Union[str, Path],
+    num_samples: int = 1000,
+    split: str = "val2017",
+    max_captions: Optional[int] = 5,
+    order: str = "annotations",
+    num_workers: int = 4,
+) -> Tuple[LazyCOCOImages, List[List[str]], List[int]]:
+    """
+    Lazy replacement for the evaluation scripts' eager loaders.
+
+    Returns:
+        (images, captions_per_image, image_ids) where images is a LazyCOCOImages
+        sequence (decoded on access)
+    """
+    logger.info(f"Loading {num_samples} COCO {split} samples (lazy)...")
+    dataset = COCOCaptionDataset(coco_root, split=split, max_samples=num_samples,
+                                 max_captions=max_captions, order=order)
+    captions_per_image = [dataset.captions(idx) for idx in range(len(dataset))]
+    image_ids = [dataset.image_id(idx) for idx in range(len(dataset))]
+    logger.info(f"Indexed {len(dataset)} images with {sum(len(caps) for caps in captions_per_image)} captions")
+    return LazyCOCOImages(dataset, num_workers=num_workers), captions_per_image, image_ids
+
+
+__all__ = [
+    "COCOAnnotationIndex",
+    "COCOCaptionDataset",
+    "LazyCOCOImages",
+    "iter_image_batches",
+    "load_coco_annotation_index",
+    "coco_collate_fn",
+    "create_coco_dataloader",
+    "load_coco_samples",
+]
@@ -0,0 +1,192 @@
+"""
+Sharded multi-process evaluation (torchrun, one process per GPU).
+
+Every rank takes a contiguous shard of the images (or captions), runs
+extraction / generation on its own device, and the per-rank outputs are
+all-gathered in rank order. Concatenating contiguous shards in rank order
+restores the original sample order, so retrieval metrics computed on the
+gathered embeddings are identical to the single-process path. Streaming
+statistics (see streaming_stats.py) are gathered as objects and merged instead
+of gathering [N, 256, 1024] tensors.
+
+Launch with e.g.:
+    torchrun --nproc_per_node 4 comp_eval.py --distributed ...
+Works with NCCL on GPUs and gloo on CPU (WORLD_SIZE unset = single process).
+"""
+
+import os
+import logging
+import datetime
+import torch
+import torch.distributed as dist
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+TensorOrDict = Union[torch.Tensor, Dict[str, Optional[torch.Tensor]]]
+
+
+def get_dist_info() -> Tuple[int, int]:
+    """(rank, world_size); (0, 1) outside torch.distributed."""
+    if not dist.is_available() or not dist.is_initialized():
+        return 0, 1
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_main_process() -> bool:
+    return get_dist_info()[0] == 0
+
+
+def init_distributed_evaluation(
+    backend: Optional[str] = None,
+    timeout_minutes: int = 120,
+) -> Tuple[int, int]:
+    """
+    Initialize the default process group from the torchrun environment.
+
+    Single-process runs (WORLD_SIZE unset or 1) are a no-op. With NCCL each rank
+    is pinned to cuda:LOCAL_RANK, so device "cuda"/"auto" refers to its own GPU.
+    Non-main ranks only log warnings.
+
+    Returns:
+        (rank, world_size)
+    """
+    if dist.is_available() and dist.is_initialized():
+        return get_dist_info()
+
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size <= 1 or not dist.is_available():
+        return 0, 1
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if backend is None:
+        backend = "nccl" if torch.cuda.is_available() else "gloo"
+    if backend == "nccl":
+        torch.cuda.set_device(local_rank)
+
+    dist.init_process_group(backend=backend, timeout=datetime.timedelta(minutes=timeout_minutes))
+    rank, world_size = get_dist_info()
+
+    if rank != 0:
+        logging.getLogger().setLevel(logging.WARNING)
+    logger.info(f"Distributed evaluation: {world_size} ranks ({backend})")
+    return rank, world_size
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+def shard_range(num_items: int, rank: Optional[int] = None, world_size: Optional[int] = None) -> Tuple[int, int]:
+    """Contiguous [start, end) range of a rank; shard sizes differ by at most one."""
+    if rank is None or world_size is None:
+        rank, world_size = get_dist_info()
+    base, remainder = divmod(num_items, world_size)
+    start = rank * base + min(rank, remainder)
+    return start, start + base + (1 if rank < remainder else 0)
+
+
+def shard_sequence(items: Sequence, rank: Optional[int] = None, world_size: Optional[int] = None) -> Sequence:
+    """This rank's contiguous slice (lists, tensors and lazy image sequences)."""
+    start, end = shard_range(len(items), rank, world_size)
+    return items[start:end]
+
+
+def _communication_device() -> torch.device:
+    if dist.get_backend() == "nccl":
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def gather_objects(obj: Any) -> List[Any]:
+    """All-gather picklable objects; list in rank order (on every rank)."""
+    rank, world_size = get_dist_info()
+    if world_size == 1:
+        return [obj]
+    gathered = [None] * world_size
+    dist.all_gather_object(gathered, obj)
+    return gathered
+
+
+def gather_tensor(local: Optional[torch.Tensor]) -> Optional[torch.Tensor]:
+    """
+    All-gather variable-length shards along dim 0 and concatenate in rank order.
+
+    Ranks with an empty shard may pass None. The result (CPU, on every rank)
+    has the dtype and trailing shape of the non-empty shards.
+    """
+    rank, world_size = get_dist_info()
+    if world_size == 1:
+        return local
+
+    meta = (local.shape[0], tuple(local.shape[1:]), local.dtype) if local is not None else None
+    metas = gather_objects(meta)
+    reference = next((m for m in metas if m is not None), None)
+    if reference is None:
+        return None
+    _, trailing_shape, dtype = reference
+    sizes = [m[0] if m is not None else 0 for m in metas]
+    max_size = max(sizes)
+
+    device = _communication_device()
+    padded = torch.zeros((max_size,) + trailing_shape, dtype=dtype, device=device)
+    if local is not None and local.shape[0] > 0:
+        padded[:local.shape[0]] = local.to(device)
+
+    buffers = [torch.empty_like(padded) for _ in range(world_size)]
+    dist.all_gather(buffers, padded)
+    return torch.cat([buffer[:size] for buffer, size in zip(buffers, sizes)]).cpu()
+
+
+def _gather_output(local: Optional[TensorOrDict], keys: Optional[List[str]]) -> Optional[TensorOrDict]:
+    if keys is None:
+        return gather_tensor(local)
+    return {key: gather_tensor(local[key] if local is not None else None) for key in keys}
+
+
+def distributed_map(fn: Callable[[Sequence], TensorOrDict], items: Sequence) -> TensorOrDict:
+    """
+    fn(items) computed as fn(shard) on every rank, outputs gathered in order.
+
+    fn must map N items to N rows (a tensor, or a dict of tensors / None).
+    Single-process: plain fn(items).
+    """
+    rank, world_size = get_dist_info()
+    if world_size == 1:
+        return fn(items)
+
+    shard = shard_sequence(items, rank, world_size)
+    local = fn(shard) if len(shard) > 0 else None
+
+    # Dict outputs: agree on the keys (ranks with an empty shard have none)
+    keys = None
+    key_lists = gather_objects(sorted(local.keys()) if isinstance(local, dict) else None)
+    key_lists = [k for k in key_lists if k is not None]
+    if key_lists:
+        keys = key_lists[0]
+    return _gather_output(local, keys)
+
+
+def merge_gathered(local: Any) -> Any:
+    """Gather mergeable accumulators (e.g. StreamingPatchDistanceStatistics) and merge in rank order."""
+    gathered = gather_objects(local)
+    merged = gathered[0]
+    for other in gathered[1:]:
+        merged = merged.merge(other)
+    return merged
+
+
+__all__ = [
+    "get_dist_info",
+    "is_main_process",
+    "init_distributed_evaluation",
+    "cleanup_distributed",
+    "shard_range",
+    "shard_sequence",
+    "gather_objects",
+    "gather_tensor",
+    "distributed_map",
+    "merge_gathered",
+]
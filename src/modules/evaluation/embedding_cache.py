@@ -0,0 +1,356 @@
+"""
+Persistent, content-addressed cache for CLIP / EVA-CLIP evaluation embeddings.
+
+Every evaluation script re-encodes the same COCO captions and images with
+CLIP ViT-L/14 and EVA-CLIP-8B; only the DiT generation depends on the
+checkpoint. Every input item (one caption / image) is its own entry, keyed by:
+- the embedding kind (e.g. "clip_text", "eva_patch")
+- model name and revision (config._name_or_path / _commit_hash) and dtype
+- a hash of the processor (preprocessing) configuration
+- the content hash of the item (decoded image pixels / caption text)
+
+so a lookup for any list of items (a subset, another order, another shard
+split) reuses the rows already computed and only encodes the missing items.
+Each entry is a raw tensor file plus a small JSON header, loaded memory-mapped
+(torch.from_file) and assembled into the result in item order. Entries are
+shared by all evaluators through the same cache directory; the least recently
+used ones are evicted when the total size exceeds the cap.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import functools
+import torch
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENV = "BLIP3O_EMBEDDING_CACHE"
+DEFAULT_CACHE_SIZE_GB = 50.0
+
+
+def get_default_cache_dir() -> Path:
+    """$BLIP3O_EMBEDDING_CACHE, or ~/.cache/blip3o/embeddings."""
+    return Path(os.environ.get(CACHE_DIR_ENV, Path.home() / ".cache" / "blip3o" / "embeddings"))
+
+
+def _sha256(data: Union[bytes, str]) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_item(item: Any) -> str:
+    """Content hash of one input: decoded pixels for PIL images, UTF-8 text for strings."""
+    if isinstance(item, str):
+        return _sha256("text:" + item)
+    if hasattr(item, "tobytes") and hasattr(item, "mode") and hasattr(item, "size"):
+        header = f"image:{item.mode}:{item.size[0]}x{item.size[1]}:".encode("utf-8")
+        return _sha256(header + item.tobytes())
+    if isinstance(item, torch.Tensor):
+        tensor = item.detach().cpu().contiguous()
+        header = f"tensor:{tensor.dtype}:{tuple(tensor.shape)}:".encode("utf-8")
+        return _sha256(header + tensor.flatten().view(torch.uint8).numpy().tobytes())
+    return _sha256("repr:" + repr(item))
+
+
+def _config_hash(obj: Any) -> Optional[str]:
+    if obj is None:
+        return None
+    try:
+        config = obj.to_dict()
+    except Exception:
+        config = repr(obj)
+    return _sha256(json.dumps(config, sort_keys=True, default=str))
+
+
+def model_namespace(
+    kind: str,
+    model: Optional[torch.nn.Module] = None,
+    processor: Any = None,
+    model_name: Optional[str] = None,
+    dtype: Optional[torch.dtype] = None,
+    **extra
+) -> Dict[str, Any]:
+    """
+    Cache namespace for one embedding kind.
+
+    Args:
+        kind: What is extracted (same kind = same computation, shared across evaluators)
+        model: Encoder (name / revision read from its HF config)
+        processor: Preprocessor (its configuration is hashed)
+        model_name: Overrides the model's config._name_or_path
+        dtype: Compute dtype (default: the model's parameter dtype)
+        **extra: Any further settings that change the output
+    """
+    config = getattr(model, "config", None)
+    if dtype is None and model is not None:
+        dtype = next(model.parameters()).dtype
+    return {
+        "kind": kind,
+        "model": model_name or getattr(config, "_name_or_path", None),
+        "revision": getattr(config, "_commit_hash", None),
+        "preprocessing": _config_hash(processor),
+        "dtype": str(dtype) if dtype is not None else None,
+        **extra,
+    }
+
+
+def _contiguous_runs(positions: Sequence[int]) -> List[Tuple[int, int]]:
+    """[start, end) ranges covering sorted positions, e.g. [0, 1, 4] -> [(0, 2), (4, 5)]."""
+    runs = []
+    for position in positions:
+        if runs and runs[-1][1] == position:
+            runs[-1] = (runs[-1][0], position + 1)
+        else:
+            runs.append((position, position + 1))
+    return runs
+
+
+class EmbeddingCache:
+    """Disk-backed, memory-mapped embedding cache with LRU eviction under a size cap."""
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        max_size_gb: float = DEFAULT_CACHE_SIZE_GB,
+    ):
+        """
+        Args:
+            cache_dir: Cache directory (default: get_default_cache_dir())
+            max_size_gb: Total size cap; least recently used entries are evicted beyond it
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3)
+        self.hits = 0
+        self.misses = 0
+
+    def make_keys(self, namespace: Dict[str, Any], items: Sequence[Any]) -> List[str]:
+        """One entry key per input, from the namespace and the input's content hash."""
+        namespace_hash = _sha256(json.dumps(namespace, sort_keys=True, default=str))
+        if hasattr(items, "content_hashes"):
+            # Lazy image sequences hash their encoded files instead of decoding every image
+            item_hashes = items.content_hashes()
+        else:
+            item_hashes = [hash_item(item) for item in items]
+        return [_sha256(namespace_hash + ":" + item_hash) for item_hash in item_hashes]
+
+    def _paths(self, key: str):
+        return self.cache_dir / f"{key}.bin", self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        """Memory-mapped tensor for a key, or None."""
+        data_path, meta_path = self._paths(key)
+        if not data_path.exists() or not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            dtype = getattr(torch, meta["dtype"])
+            numel = 1
+            for dim in meta["shape"]:
+                numel *= dim
+            tensor = torch.from_file(str(data_path), shared=False, size=numel, dtype=dtype)
+            tensor = tensor.view(meta["shape"])
+        except Exception as e:
+            logger.warning(f"Corrupt embedding cache entry {key[:12]}, ignoring: {e}")
+            return None
+
+        # Modification time doubles as the LRU access time
+        now = time.time()
+        os.utime(data_path, (now, now))
+        return tensor
+
+    def put(
+        self,
+        key: str,
+        tensor: torch.Tensor,
+        namespace: Optional[Dict[str, Any]] = None,
+        enforce_cap: bool = True,
+    ) -> bool:
+        """
+        Store a tensor atomically (write to a temp file, then rename), then enforce the size cap.
+
+        The new entry itself is never evicted by this call; a tensor larger than
+        the whole cap is not stored. Returns whether the entry was written.
+        """
+        tensor = tensor.detach().cpu().contiguous()
+        if tensor.numel() * tensor.element_size() > self.max_size_bytes:
+            logger.warning(
+                f"Embedding cache entry {key[:12]} ({tuple(tensor.shape)}) exceeds the "
+                f"{self.max_size_bytes / 1024 ** 3:.2f} GB cap, not caching it"
+            )
+            return False
+        data_path, meta_path = self._paths(key)
+        suffix = f".tmp-{uuid.uuid4().hex}"
+        tmp_data = data_path.with_name(data_path.name + suffix)
+        tmp_meta = meta_path.with_name(meta_path.name + suffix)
+
+        tensor.flatten().view(torch.uint8).numpy().tofile(tmp_data)
+        with open(tmp_meta, "w") as f:
+            json.dump({
+                "shape": list(tensor.shape),
+                "dtype": str(tensor.dtype).replace("torch.", ""),
+                "namespace": namespace,
+                "created": time.time(),
+            }, f, default=str)
+        os.replace(tmp_meta, meta_path)
+        os.replace(tmp_data, data_path)
+
+        if enforce_cap:
+            self.evict(protect={key})
+        return True
+
+    def get_or_compute(
+        self,
+        namespace: Dict[str, Any],
+        items: Sequence[Any],
+        compute_fn: Callable[[Sequence[Any]], torch.Tensor],
+    ) -> torch.Tensor:
+        """
+        Rows for (namespace, items) in item order.
+
+        Cached items are read from their entries; compute_fn(items[start:end]) is
+        called once per contiguous run of missing items and must return one row
+        per item. The new rows are stored, then the size cap is enforced without
+        evicting them.
+        """
+        keys = self.make_keys(namespace, items)
+        if not keys:
+            return compute_fn(items)
+
+        rows: List[Optional[torch.Tensor]] = [self.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        logger.info(f"Embedding cache: {namespace.get('kind')} {len(keys) - len(missing)}/{len(keys)} items cached")
+
+        written = set()
+        for start, end in _contiguous_runs(missing):
+            computed = compute_fn(items[start:end])
+            if computed.shape[0] != end - start:
+                raise ValueError(f"compute_fn returned {computed.shape[0]} rows for {end - start} items")
+            computed = computed.detach().cpu()
+            for offset, row in enumerate(computed):
+                rows[start + offset] = row
+                try:
+                    if self.put(keys[start + offset], row, namespace, enforce_cap=False):
+                        written.add(keys[start + offset])
+                except OSError as e:
+                    logger.warning(f"Could not write embedding cache entry: {e}")
+        if written:
+            self.evict(protect=written)
+
+        return torch.stack(rows)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Cached entries with their size and last access time, least recently used first."""
+        entries = []
+        for data_path in self.cache_dir.glob("*.bin"):
+            try:
+                stat = data_path.stat()
+            except FileNotFoundError:
+                continue
+            meta_size = data_path.with_suffix(".json").stat().st_size if data_path.with_suffix(".json").exists() else 0
+            entries.append({
+                "key": data_path.stem,
+                "size_bytes": stat.st_size + meta_size,
+                "last_access": stat.st_mtime,
+            })
+        return sorted(entries, key=lambda entry: entry["last_access"])
+
+    def size_bytes(self) -> int:
+        return sum(entry["size_bytes"] for entry in self.entries())
+
+    def evict(self, max_size_bytes: Optional[int] = None, protect: Optional[Set[str]] = None) -> int:
+        """
+        Remove least recently used entries until the cache fits; returns the number removed.
+
+        Keys in `protect` (e.g. the entries just written) are never removed.
+        """
+        max_size_bytes = self.max_size_bytes if max_size_bytes is None else max_size_bytes
+        protect = protect or set()
+        entries = self.entries()
+        total = sum(entry["size_bytes"] for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total <= max_size_bytes:
+                break
+            if entry["key"] in protect:
+                continue
+            for path in self._paths(entry["key"]):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= entry["size_bytes"]
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} embedding cache entries ({total / 1024 ** 3:.2f} GB remaining)")
+        return removed
+
+    def clear(self):
+        """Remove all entries."""
+        self.evict(max_size_bytes=0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        entries = self.entries()
+        return {
+            "cache_dir": str(self.cache_dir),
+            "num_entries": len(entries),
+            "size_gb": sum(entry["size_bytes"] for entry in entries) / 1024 ** 3,
+            "max_size_gb": self.max_size_bytes / 1024 ** 3,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def cached_embeddings(kind: str, model_attr: str, processor_attr: str, model_name: Optional[str] = None):
+    """
+    Decorator for evaluator extraction methods `fn(self, items) -> Tensor`.
+
+    Uses `self.embedding_cache` when it is set (otherwise calls through). The
+    namespace is built from `kind` and the evaluator's `model_attr` /
+    `processor_attr` attributes, so evaluators computing the same kind share entries.
+    fn must return one row per item; on a partial hit it is only called on
+    slices of the missing items.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, items, *args, **kwargs):
+            cache = getattr(self, "embedding_cache", None)
+            if cache is None or args or kwargs:
+                return fn(self, items, *args, **kwargs)
+            namespace = model_namespace(
+                kind,
+                model=getattr(self, model_attr, None),
+                processor=getattr(self, processor_attr, None),
+                model_name=model_name,
+            )
+            return cache.get_or_compute(namespace, items, lambda missing_items: fn(self, missing_items))
+        return wrapper
+    return decorator
+
+
+def create_embedding_cache(
+    cache_dir: Optional[Union[str, Path]] = None,
+    max_size_gb: float = DEFAULT_CACHE_SIZE_GB,
+) -> EmbeddingCache:
+    """Factory function for EmbeddingCache."""
+    return EmbeddingCache(cache_dir=cache_dir, max_size_gb=max_size_gb)
+
+
+__all__ = [
+    "EmbeddingCache",
+    "create_embedding_cache",
+    "cached_embeddings",
+    "model_namespace",
+    "hash_item",
+    "get_default_cache_dir",
+]
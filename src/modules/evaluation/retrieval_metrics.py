@@ -0,0 +1,269 @@
+"""
+Vectorized retrieval metrics for BLIP3-o recall evaluation.
+
+Used by the recall evaluators (comp_eval.py, evaluation/recall_dist.py,
+evaluation/direct_clip_evaluation.py) through BlockedSimilarityEngine, and
+directly on precomputed similarity matrices. Everything is computed with tensor ops
+(no per-query Python loops):
+- One topk at max(K) per query block; recall@K for every K from the same result
+- A dense boolean ground-truth mask built from the image->text mapping
+- Rank of the first relevant item (MRR, median/mean rank) and average precision
+  (mAP) by counting gallery items scored above each relevant item
+Both directions (image->text and text->image) use the same code on the
+transposed mask.
+"""
+
+import torch
+import torch.nn.functional as F
+import logging
+from typing import Dict, List, Optional, Sequence, Union
+
+from ..utils.instrumentation import RETRIEVAL, timed
+
+logger = logging.getLogger(__name__)
+
+
+def mapping_to_ground_truth(
+    image_to_text_mapping: List[List[int]],
+    num_texts: Optional[int] = None,
+    device: Optional[torch.device] = None,
+) -> torch.Tensor:
+    """
+    Dense ground-truth mask from an image->text mapping.
+
+    Args:
+        image_to_text_mapping: Text indices belonging to each image
+        num_texts: Gallery size (default: max index + 1)
+        device: Device of the mask
+
+    Returns:
+        Bool tensor [N_images, N_texts], True where the text describes the image
+    """
+    lengths = torch.tensor([len(texts) for texts in image_to_text_mapping], dtype=torch.long)
+    rows = torch.repeat_interleave(torch.arange(len(image_to_text_mapping)), lengths)
+    cols = torch.tensor([idx for texts in image_to_text_mapping for idx in texts], dtype=torch.long)
+    if num_texts is None:
+        num_texts = int(cols.max()) + 1 if cols.numel() > 0 else 0
+
+    ground_truth = torch.zeros(len(image_to_text_mapping), num_texts, dtype=torch.bool)
+    ground_truth[rows, cols] = True
+    return ground_truth.to(device) if device is not None else ground_truth
+
+
+def compute_query_statistics(
+    similarity: torch.Tensor,
+    ground_truth: torch.Tensor,
+    max_k: int,
+    rank_window: int = 100,
+    rank_metrics: bool = True,
+    num_positives: Optional[torch.Tensor] = None,
+) -> Dict[str, torch.Tensor]:
+    """
+    Per-query retrieval statistics for one block of queries.
+
+    Relevant items inside the top `rank_window` are ranked from that single topk;
+    only queries with relevant items beyond it fall back to counting the gallery
+    items scored above each relevant item.
+
+    Args:
+        similarity: Scores [n_queries, n_gallery]
+        ground_truth: Bool mask [n_queries, n_gallery]
+        max_k: Largest K of interest
+        rank_window: Size of the topk used for ranking (>= max_k)
+        rank_metrics: Also compute ranks / average precision (recall@K only if False)
+        num_positives: Relevant items per query [n] (default: counted from ground_truth)
+
+    Returns:
+        Dictionary of per-query tensors:
+        - hits_at: [n, max_k] bool, a relevant item is within the top (j+1)
+        - first_rank: [n] long, 0-based rank of the best-scored relevant item
+        - average_precision: [n] float
+        - has_positive: [n] bool
+    """
+    ground_truth = ground_truth.to(similarity.device)
+    num_queries, num_gallery = similarity.shape
+    max_k = min(max_k, num_gallery)
+    window = min(max(max_k, rank_window), num_gallery) if rank_metrics else max_k
+
+    # Recall@K for all K from a single topk
+    _, top_indices = similarity.topk(window, dim=1)
+    top_hits = ground_truth.gather(1, top_indices)
+    hits_at = top_hits[:, :max_k].cummax(dim=1).values
+
+    if num_positives is None:
+        num_positives = ground_truth.sum(dim=1)
+    num_positives = num_positives.to(similarity.device)
+    has_positive = num_positives > 0
+    if not rank_metrics:
+        return {'hits_at': hits_at, 'has_positive': has_positive}
+    
+    max_positives = max(int(num_positives.max()), 1) if num_positives.numel() > 0 else 1
+
+    # Ranks of relevant items found in the window: their positions, best first
+    positions = torch.arange(window, device=similarity.device).expand(num_queries, -1)
+    positions = torch.where(top_hits, positions, torch.full_like(positions, num_gallery))
+    ranks = positions.sort(dim=1).values[:, :max_positives]
+    if ranks.shape[1] < max_positives:
+        ranks = F.pad(ranks, (0, max_positives - ranks.shape[1]), value=num_gallery)
+
+    # Relevant items beyond the window: rank = number of gallery items scored strictly higher
+    incomplete = top_hits.sum(dim=1) < num_positives
+    if incomplete.any():
+        rows = incomplete.nonzero(as_tuple=True)[0]
+        row_similarity = similarity[rows]
+        positive_scores = row_similarity.masked_fill(~ground_truth[rows], float('-inf'))
+        positive_scores, _ = positive_scores.topk(max_positives, dim=1)
+        ranks[rows] = torch.stack([
+            (row_similarity > positive_scores[:, p:p + 1]).sum(dim=1)
+            for p in range(max_positives)
+        ], dim=1)
+
+    order = torch.arange(max_positives, device=similarity.device).unsqueeze(0)
+    valid = order < num_positives.unsqueeze(1)
+    precision = (order + 1).float() / (ranks.float() + 1)
+    average_precision = (precision * valid).sum(dim=1) / num_positives.clamp(min=1)
+
+    return {
+        'hits_at': hits_at,
+        'first_rank': ranks[:, 0],
+        'average_precision': average_precision,
+        'has_positive': has_positive,
+    }
+
+
+def summarize_query_statistics(
+    statistics: Dict[str, torch.Tensor],
+    k_values: Sequence[int],
+    prefix: str = "",
+) -> Dict[str, float]:
+    """Reduce per-query statistics to recall@K, mAP, MRR and median/mean rank (1-based, when available)."""
+    has_positive = statistics['has_positive']
+    num_queries = int(has_positive.sum())
+    results = {}
+
+    if num_queries == 0:
+        for k in k_values:
+            results[f'{prefix}recall@{k}'] = 0.0
+        results.update({f'{prefix}mAP': 0.0, f'{prefix}MRR': 0.0,
+                        f'{prefix}median_rank': float('nan'), f'{prefix}mean_rank': float('nan')})
+        return results
+
+    hits_at = statistics['hits_at'][has_positive]
+    for k in k_values:
+        column = min(k, hits_at.shape[1]) - 1
+        results[f'{prefix}recall@{k}'] = hits_at[:, column].float().mean().item()
+
+    if 'first_rank' not in statistics:
+        return results
+
+    first_rank = statistics['first_rank'][has_positive].float() + 1
+
+    results[f'{prefix}mAP'] = statistics['average_precision'][has_positive].mean().item()
+    results[f'{prefix}MRR'] = (1.0 / first_rank).mean().item()
+    results[f'{prefix}median_rank'] = first_rank.median().item()
+    results[f'{prefix}mean_rank'] = first_rank.mean().item()
+    return results
+
+
+def _concatenate_statistics(blocks: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+    return {key: torch.cat([block[key] for block in blocks]) for key in blocks[0]}
+
+
+@timed(RETRIEVAL)
+def compute_retrieval_metrics_from_similarity(
+    similarity: torch.Tensor,
+    ground_truth: torch.Tensor,
+    k_values: Sequence[int] = (1, 5, 10),
+    prefix: str = "",
+    chunk_size: Optional[int] = None,
+    rank_metrics: bool = True,
+    num_positives: Optional[torch.Tensor] = None,
+) -> Dict[str, float]:
+    """
+    Retrieval metrics for queries (rows) against a gallery (columns).
+
+    Args:
+        similarity: Scores [n_queries, n_gallery]
+        ground_truth: Bool mask [n_queries, n_gallery]
+        k_values: K values for recall@K
+        prefix: Prefix for result keys (e.g. "t2i_")
+        chunk_size: Queries per block (bounds temporary memory)
+        rank_metrics: Also compute mAP / MRR / ranks
+        num_positives: Relevant items per query [n_queries] (default: counted from ground_truth)
+    """
+    chunk_size = chunk_size or similarity.shape[0]
+    if num_positives is None:
+        num_positives = ground_truth.sum(dim=1)
+    blocks = [
+        compute_query_statistics(
+            similarity[start:start + chunk_size].contiguous(),
+            ground_truth[start:start + chunk_size],
+            max(k_values),
+            rank_metrics=rank_metrics,
+            num_positives=num_positives[start:start + chunk_size],
+        )
+        for start in range(0, similarity.shape[0], chunk_size)
+    ]
+    return summarize_query_statistics(_concatenate_statistics(blocks), k_values, prefix)
+
+
+def compute_retrieval_metrics(
+    image_embeddings: torch.Tensor,
+    text_embeddings: torch.Tensor,
+    image_to_text_mapping: Union[List[List[int]], torch.Tensor],
+    k_values: Sequence[int] = (1, 5, 10),
+    bidirectional: bool = True,
+    chunk_size: Optional[int] = 1024,
+    normalize: bool = True,
+    rank_metrics: bool = True,
+    gallery_block_size: int = 16384,
+    num_workers: int = 0,
+) -> Dict[str, float]:
+    """
+    Image->text (and text->image) retrieval metrics from embeddings.
+
+    Scores are streamed in blocks by BlockedSimilarityEngine, so the full
+    similarity matrix is never built.
+
+    Args:
+        image_embeddings: [N_images, D]
+        text_embeddings: [N_texts, D]
+        image_to_text_mapping: Text indices per image, or a bool mask [N_images, N_texts]
+        k_values: K values for recall@K
+        bidirectional: Also compute text->image metrics (keys prefixed "t2i_")
+        chunk_size: Query rows scored at a time
+        normalize: L2-normalize embeddings (cosine similarity)
+        rank_metrics: Also compute mAP / MRR / ranks (recall@K only if False)
+        gallery_block_size: Gallery rows scored at a time
+        num_workers: Threads processing query blocks in parallel
+
+    Returns:
+        Dictionary with 'recall@K', 'mAP', 'MRR', 'median_rank', 'mean_rank'
+        (image->text), the same with a "t2i_" prefix, similarity statistics
+        and gallery counts
+    """
+    from .similarity_engine import BlockedSimilarityEngine
+
+    if isinstance(image_to_text_mapping, torch.Tensor):
+        rows, cols = image_to_text_mapping.nonzero(as_tuple=True)
+        counts = torch.bincount(rows, minlength=image_to_text_mapping.shape[0]).tolist()
+        image_to_text_mapping = [chunk.tolist() for chunk in cols.split(counts)]
+
+    engine = BlockedSimilarityEngine(
+        query_block_size=chunk_size or image_embeddings.shape[0],
+        gallery_block_size=gallery_block_size,
+        num_workers=num_workers,
+        normalize=normalize,
+    )
+    return engine.retrieval_metrics(
+        image_embeddings, text_embeddings, image_to_text_mapping, k_values, bidirectional, rank_metrics
+    )
+
+
+__all__ = [
+    "mapping_to_ground_truth",
+    "compute_query_statistics",
+    "summarize_query_statistics",
+    "compute_retrieval_metrics_from_similarity",
+    "compute_retrieval_metrics",
+]
@@ -0,0 +1,374 @@
+"""
+Blocked, memory-bounded similarity engine for large retrieval galleries.
+
+The full [N_queries, N_gallery] similarity matrix is never materialized: query
+blocks are scored against gallery blocks, a running top-k is merged block by
+block and similarity statistics (min/max/mean/std) are accumulated on the fly.
+Peak memory is O(query_block_size * gallery_block_size) regardless of gallery
+size (COCO 5k x 25k, Flickr30k, CC3M).
+
+Ranks of relevant items (for mAP / MRR / median rank) come from the running
+top-`rank_window`; only queries whose relevant items fall outside it get a
+second streaming pass that counts higher-scored gallery items.
+
+Query blocks can be processed by several worker threads (torch matmul/topk
+release the GIL, so blocks run on separate CPU cores without copying the
+gallery into subprocesses).
+"""
+
+import math
+import torch
+import torch.nn.functional as F
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .retrieval_metrics import summarize_query_statistics
+from ..utils.instrumentation import RETRIEVAL, timed
+
+logger = logging.getLogger(__name__)
+
+
+def mapping_to_positive_indices(mapping: List[List[int]]) -> torch.Tensor:
+    """
+    Pad a query->relevant-items mapping into an index tensor.
+
+    Returns:
+        Long tensor [N_queries, max_positives], padded with -1
+    """
+    max_positives = max((len(items) for items in mapping), default=0)
+    positives = torch.full((len(mapping), max(max_positives, 1)), -1, dtype=torch.long)
+    lengths = torch.tensor([len(items) for items in mapping], dtype=torch.long)
+    rows = torch.repeat_interleave(torch.arange(len(mapping)), lengths)
+    cols = torch.cat([torch.arange(n) for n in lengths.tolist()]) if len(mapping) > 0 else torch.zeros(0, dtype=torch.long)
+    positives[rows, cols] = torch.tensor([idx for items in mapping for idx in items], dtype=torch.long)
+    return positives
+
+
+def invert_mapping(image_to_text_mapping: List[List[int]], num_texts: int) -> List[List[int]]:
+    """text -> images mapping from an image -> texts mapping."""
+    text_to_images: List[List[int]] = [[] for _ in range(num_texts)]
+    for image_idx, text_indices in enumerate(image_to_text_mapping):
+        for text_idx in text_indices:
+            text_to_images[text_idx].append(image_idx)
+    return text_to_images
+
+
+def paired_similarity_statistics(embeddings1: torch.Tensor, embeddings2: torch.Tensor) -> Dict[str, float]:
+    """
+    Matching-pair and non-matching cosine statistics without an N x N matrix.
+
+    Matching pairs are row-wise dot products; the mean over all non-matching
+    pairs uses sum_ij <a_i, b_j> = <sum_i a_i, sum_j b_j>.
+    """
+    embeddings1 = F.normalize(embeddings1.float(), p=2, dim=-1)
+    embeddings2 = F.normalize(embeddings2.float().to(embeddings1.device), p=2, dim=-1)
+    num_pairs = embeddings1.shape[0]
+
+    diagonal = (embeddings1 * embeddings2).sum(dim=-1)
+    total = torch.dot(embeddings1.double().sum(dim=0), embeddings2.double().sum(dim=0))
+    num_non_matching = num_pairs * embeddings2.shape[0] - num_pairs
+    mean_non_matching = ((total - diagonal.double().sum()) / max(num_non_matching, 1)).item()
+
+    return {
+        'mean_cosine_sim': diagonal.mean().item(),
+        'std_cosine_sim': diagonal.std(unbiased=False).item() if num_pairs > 1 else 0.0,
+        'min_cosine_sim': diagonal.min().item(),
+        'max_cosine_sim': diagonal.max().item(),
+        'mean_non_matching_sim': mean_non_matching,
+        'num_pairs': num_pairs,
+    }
+
+
+class BlockedSimilarityEngine:
+    """
+    Tiled query x gallery scoring with running top-k and streaming statistics.
+
+    Peak temporary memory is about query_block_size * gallery_block_size scores
+    per worker.
+    """
+
+    def __init__(
+        self,
+        query_block_size: int = 1024,
+        gallery_block_size: int = 16384,
+        num_workers: int = 0,
+        device: Optional[Union[str, torch.device]] = None,
+        normalize: bool = True,
+        rank_window: int = 100,
+    ):
+        """
+        Args:
+            query_block_size: Query rows per block
+            gallery_block_size: Gallery rows per block
+            num_workers: Threads processing query blocks in parallel (0 = inline)
+            device: Device to score on (default: the query embeddings' device)
+            normalize: L2-normalize embeddings (cosine similarity)
+            rank_window: Running top-k size used to rank relevant items
+        """
+        self.query_block_size = query_block_size
+        self.gallery_block_size = gallery_block_size
+        self.num_workers = num_workers
+        self.device = torch.device(device) if device is not None else None
+        self.normalize = normalize
+        self.rank_window = rank_window
+
+    def _prepare(self, queries: torch.Tensor, gallery: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        device = self.device or queries.device
+        queries = queries.to(device=device, dtype=torch.float32)
+        gallery = gallery.to(device=device, dtype=torch.float32)
+        if self.normalize:
+            queries = F.normalize(queries, p=2, dim=-1)
+            gallery = F.normalize(gallery, p=2, dim=-1)
+        return queries, gallery
+
+    def _map_query_blocks(self, fn, num_queries: int) -> List:
+        starts = list(range(0, num_queries, self.query_block_size))
+        if self.num_workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                return list(executor.map(fn, starts))
+        return [fn(start) for start in starts]
+
+    def _score_block(
+        self,
+        query_block: torch.Tensor,
+        gallery: torch.Tensor,
+        k: int,
+        with_statistics: bool,
+    ) -> Dict[str, torch.Tensor]:
+        """Stream one query block over all gallery blocks."""
+        top_scores = query_block.new_empty(query_block.shape[0], 0)
+        top_indices = torch.empty(query_block.shape[0], 0, dtype=torch.long, device=query_block.device)
+        stats = {'min': math.inf, 'max': -math.inf, 'sum': 0.0, 'sum_sq': 0.0}
+
+        for g_start in range(0, gallery.shape[0], self.gallery_block_size):
+            scores = query_block @ gallery[g_start:g_start + self.gallery_block_size].t()
+
+            if with_statistics:
+                stats['min'] = min(stats['min'], scores.min().item())
+                stats['max'] = max(stats['max'], scores.max().item())
+                stats['sum'] += scores.sum(dtype=torch.float64).item()
+                stats['sum_sq'] += scores.pow(2).sum(dtype=torch.float64).item()
+
+            # Running top-k merge
+            block_k = min(k, scores.shape[1])
+            block_scores, block_indices = scores.topk(block_k, dim=1)
+            top_scores = torch.cat([top_scores, block_scores], dim=1)
+            top_indices = torch.cat([top_indices, block_indices + g_start], dim=1)
+            if top_scores.shape[1] > k:
+                top_scores, order = top_scores.topk(k, dim=1)
+                top_indices = top_indices.gather(1, order)
+
+        return {'scores': top_scores, 'indices': top_indices, 'stats': stats}
+
+    def topk(
+        self,
+        queries: torch.Tensor,
+        gallery: torch.Tensor,
+        k: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Top-k gallery items per query.
+
+        Returns:
+            (scores [N_queries, k], indices [N_queries, k]) best first
+        """
+        queries, gallery = self._prepare(queries, gallery)
+        k = min(k, gallery.shape[0])
+        blocks = self._map_query_blocks(
+            lambda start: self._score_block(queries[start:start + self.query_block_size], gallery, k, False),
+            queries.shape[0],
+        )
+        return torch.cat([b['scores'] for b in blocks]), torch.cat([b['indices'] for b in blocks])
+
+    @staticmethod
+    def _merge_statistics(block_stats: List[Dict[str, float]], count: int) -> Dict[str, float]:
+        total = sum(s['sum'] for s in block_stats)
+        total_sq = sum(s['sum_sq'] for s in block_stats)
+        mean = total / max(count, 1)
+        variance = max(total_sq / max(count, 1) - mean * mean, 0.0)
+        return {
+            'min': min(s['min'] for s in block_stats),
+            'max': max(s['max'] for s in block_stats),
+            'mean': mean,
+            'std': math.sqrt(variance * count / max(count - 1, 1)),
+            'count': count,
+        }
+
+    def similarity_statistics(self, queries: torch.Tensor, gallery: torch.Tensor) -> Dict[str, float]:
+        """Min / max / mean / std of all query x gallery similarities (streamed)."""
+        queries, gallery = self._prepare(queries, gallery)
+        blocks = self._map_query_blocks(
+            lambda start: self._score_block(queries[start:start + self.query_block_size], gallery, 1, True),
+            queries.shape[0],
+        )
+        return self._merge_statistics([b['stats'] for b in blocks], queries.shape[0] * gallery.shape[0])
+
+    def _count_higher(
+        self,
+        queries: torch.Tensor,
+        gallery: torch.Tensor,
+        positives: torch.Tensor,
+        thresholds: torch.Tensor,
+    ) -> torch.Tensor:
+        """
+        Ranks of relevant items from their scores [n, P] (sorted, best first), streamed.
+
+        Only non-relevant items are counted against each threshold; the p-th best
+        relevant item is then ranked p places further down. This keeps a relevant
+        item from being counted against itself when its score is recomputed with
+        different rounding.
+        """
+        counts = torch.zeros(thresholds.shape, dtype=torch.long, device=queries.device)
+        for g_start in range(0, gallery.shape[0], self.gallery_block_size):
+            scores = queries @ gallery[g_start:g_start + self.gallery_block_size].t()
+            local = positives - g_start
+            in_block = (local >= 0) & (local < scores.shape[1])
+            rows = torch.arange(scores.shape[0], device=scores.device).unsqueeze(1).expand_as(local)
+            scores[rows[in_block], local[in_block]] = float('-inf')
+            for p in range(thresholds.shape[1]):
+                counts[:, p] += (scores > thresholds[:, p:p + 1]).sum(dim=1)
+        return counts + torch.arange(thresholds.shape[1], device=queries.device).unsqueeze(0)
+
+    def query_statistics(
+        self,
+        queries: torch.Tensor,
+        gallery: torch.Tensor,
+        positives: torch.Tensor,
+        max_k: int,
+        rank_metrics: bool = True,
+        with_statistics: bool = False,
+    ) -> Dict[str, torch.Tensor]:
+        """
+        Per-query retrieval statistics (same keys as retrieval_metrics.compute_query_statistics).
+
+        Args:
+            queries: [N_queries, D]
+            gallery: [N_gallery, D]
+            positives: Relevant gallery indices [N_queries, P], padded with -1
+            max_k: Largest K of interest
+            rank_metrics: Also compute ranks / average precision
+            with_statistics: Also return streamed similarity statistics under 'similarity_stats'
+        """
+        queries, gallery = self._prepare(queries, gallery)
+        positives = positives.to(queries.device)
+        num_gallery = gallery.shape[0]
+        max_k = min(max_k, num_gallery)
+        window = min(max(max_k, self.rank_window), num_gallery) if rank_metrics else max_k
+
+        def process(start: int) -> Dict[str, torch.Tensor]:
+            query_block = queries[start:start + self.query_block_size]
+            block_positives = positives[start:start + self.query_block_size]
+            scored = self._score_block(query_block, gallery, window, with_statistics)
+
+            valid = block_positives >= 0
+            num_positives = valid.sum(dim=1)
+            top_hits = (scored['indices'].unsqueeze(2) == block_positives.unsqueeze(1)).any(dim=2)
+            result = {
+                'hits_at': top_hits[:, :max_k].cummax(dim=1).values,
+                'has_positive': num_positives > 0,
+                'stats': scored['stats'],
+            }
+            if not rank_metrics:
+                return result
+
+            # Positions of relevant items inside the window, best first
+            num_slots = block_positives.shape[1]
+            positions = torch.arange(window, device=queries.device).expand(query_block.shape[0], -1)
+            positions = torch.where(top_hits, positions, torch.full_like(positions, num_gallery))
+            ranks = positions.sort(dim=1).values[:, :num_slots]
+            if ranks.shape[1] < num_slots:
+                ranks = F.pad(ranks, (0, num_slots - ranks.shape[1]), value=num_gallery)
+
+            # Second streaming pass for queries with relevant items beyond the window
+            incomplete = top_hits.sum(dim=1) < num_positives
+            if incomplete.any():
+                rows = incomplete.nonzero(as_tuple=True)[0]
+                row_positives = block_positives[rows]
+                positive_scores = (
+                    query_block[rows].unsqueeze(1) * gallery[row_positives.clamp(min=0)]
+                ).sum(dim=-1)
+                positive_scores = positive_scores.masked_fill(row_positives < 0, float('-inf'))
+                positive_scores, _ = positive_scores.sort(dim=1, descending=True)
+                ranks[rows] = self._count_higher(query_block[rows], gallery, row_positives, positive_scores)
+
+            order = torch.arange(num_slots, device=queries.device).unsqueeze(0)
+            precision = (order + 1).float() / (ranks.float() + 1)
+            result['first_rank'] = ranks[:, 0]
+            result['average_precision'] = (precision * (order < num_positives.unsqueeze(1))).sum(dim=1) / num_positives.clamp(min=1)
+            return result
+
+        blocks = self._map_query_blocks(process, queries.shape[0])
+        statistics = {key: torch.cat([b[key] for b in blocks]) for key in blocks[0] if key != 'stats'}
+        if with_statistics:
+            statistics['similarity_stats'] = self._merge_statistics(
+                [b['stats'] for b in blocks], queries.shape[0] * num_gallery
+            )
+        return statistics
+
+    @timed(RETRIEVAL)
+    def retrieval_metrics(
+        self,
+        image_embeddings: torch.Tensor,
+        text_embeddings: torch.Tensor,
+        image_to_text_mapping: List[List[int]],
+        k_values: Sequence[int] = (1, 5, 10),
+        bidirectional: bool = True,
+        rank_metrics: bool = True,
+        with_statistics: bool = True,
+    ) -> Dict[str, float]:
+        """
+        Image->text (and text->image, "t2i_" keys) recall@K / mAP / MRR / ranks.
+
+        With with_statistics, the image x text similarity min/max/mean/std are
+        returned as 'similarity_min', 'similarity_max', 'similarity_mean', 'similarity_std'.
+        """
+        statistics = self.query_statistics(
+            image_embeddings, text_embeddings, mapping_to_positive_indices(image_to_text_mapping),
+            max(k_values), rank_metrics, with_statistics,
+        )
+        similarity_stats = statistics.pop('similarity_stats', None)
+        results = summarize_query_statistics(statistics, k_values)
+
+        if bidirectional:
+            text_to_image_mapping = invert_mapping(image_to_text_mapping, text_embeddings.shape[0])
+            t2i_statistics = self.query_statistics(
+                text_embeddings, image_embeddings, mapping_to_positive_indices(text_to_image_mapping),
+                max(k_values), rank_metrics,
+            )
+            results.update(summarize_query_statistics(t2i_statistics, k_values, prefix="t2i_"))
+
+        if similarity_stats is not None:
+            results.update({f'similarity_{key}': value for key, value in similarity_stats.items() if key != 'count'})
+
+        results.update({
+            'num_queries': image_embeddings.shape[0],
+            'num_gallery': text_embeddings.shape[0],
+            'avg_texts_per_image': sum(len(texts) for texts in image_to_text_mapping) / max(len(image_to_text_mapping), 1),
+            'embedding_dim': image_embeddings.shape[1],
+        })
+        return results
+
+
+def create_similarity_engine(
+    query_block_size: int = 1024,
+    gallery_block_size: int = 16384,
+    num_workers: int = 0,
+    **kwargs
+) -> BlockedSimilarityEngine:
+    """Factory function for BlockedSimilarityEngine."""
+    return BlockedSimilarityEngine(
+        query_block_size=query_block_size,
+        gallery_block_size=gallery_block_size,
+        num_workers=num_workers,
+        **kwargs
+    )
+
+
+__all__ = [
+    "BlockedSimilarityEngine",
+    "create_similarity_engine",
+    "mapping_to_positive_indices",
+    "invert_mapping",
+    "paired_similarity_statistics",
+]
@@ -0,0 +1,469 @@
+"""
+Streaming statistics for patch reconstruction evaluation.
+
+PatchReconstructionEvaluator used to keep the full target / predicted patch
+tensors [N, 256, 1024] (plus several same-size temporaries) in memory and ran
+torch.quantile on the full distance tensors, which fails beyond ~16M elements.
+The accumulators here consume one batch at a time and never hold the dataset:
+- RunningMoments: count / mean / variance / min / max (Chan et al. parallel
+  update in float64), elementwise over a fixed shape, e.g. the 16x16 grid
+- StreamingQuantileSketch: exact quantiles while the data is small, then an
+  adaptive-range histogram whose range doubles as needed (bounded memory,
+  error below one bin width)
+- StreamingPatchDistanceStatistics: every distance metric of
+  compute_3d_l2_distances, plus the spatial error accumulators
+All accumulators can be merged, so shards can be combined.
+"""
+
+import math
+import torch
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (5, 25, 75, 95)
+
+
+class RunningMoments:
+    """Streaming count / mean / variance / min / max over dim 0 of batches [b, *shape]."""
+
+    def __init__(self, shape: Tuple[int, ...] = ()):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = torch.zeros(self.shape, dtype=torch.float64)
+        self.m2 = torch.zeros(self.shape, dtype=torch.float64)
+        self.min = torch.full(self.shape, float('inf'), dtype=torch.float64)
+        self.max = torch.full(self.shape, float('-inf'), dtype=torch.float64)
+
+    def update(self, values: torch.Tensor):
+        """Add a batch of values [b, *shape] (scalars: any shape, flattened)."""
+        values = values.detach().to(device='cpu', dtype=torch.float64)
+        values = values.reshape(-1) if not self.shape else values.reshape(-1, *self.shape)
+        if values.shape[0] == 0:
+            return
+        batch_mean = values.mean(dim=0)
+        batch_m2 = ((values - batch_mean) ** 2).sum(dim=0)
+        self._combine(values.shape[0], batch_mean, batch_m2, values.amin(dim=0), values.amax(dim=0))
+
+    def _combine(self, count: int, mean: torch.Tensor, m2: torch.Tensor, minimum: torch.Tensor, maximum: torch.Tensor):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.min = torch.minimum(self.min, minimum)
+        self.max = torch.maximum(self.max, maximum)
+        self.count = total
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    @property
+    def variance(self) -> torch.Tensor:
+        """Unbiased variance (as torch.std / torch.var)."""
+        return self.m2 / max(self.count - 1, 1)
+
+    @property
+    def std(self) -> torch.Tensor:
+        return self.variance.sqrt()
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {'shape': self.shape, 'count': self.count, 'mean': self.mean, 'm2': self.m2,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_state_dict(cls, state: Dict[str, Any]) -> "RunningMoments":
+        moments = cls(tuple(state['shape']))
+        moments.count = state['count']
+        for key in ('mean', 'm2', 'min', 'max'):
+            setattr(moments, key, state[key].to(torch.float64))
+        return moments
+
+
+class StreamingQuantileSketch:
+    """
+    Quantiles of a stream of scalars in bounded memory.
+
+    Values are buffered (exact quantiles, matching torch.quantile / torch.median)
+    until `exact_limit` values have been seen; then they are folded into a
+    histogram of `num_bins` bins whose range starts at the observed
+    [min, max] and doubles whenever a value falls outside it.
+    """
+
+    def __init__(self, num_bins: int = 8192, exact_limit: int = 1 << 22):
+        if num_bins % 2:
+            raise ValueError("num_bins must be even")
+        self.num_bins = num_bins
+        self.exact_limit = exact_limit
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._buffer: List[torch.Tensor] = []
+        self.counts: Optional[torch.Tensor] = None
+        self.low = 0.0
+        self.width = 0.0
+
+    @property
+    def is_exact(self) -> bool:
+        return self.counts is None
+
+    def update(self, values: torch.Tensor):
+        values = values.detach().reshape(-1).to(device='cpu', dtype=torch.float32)
+        if values.numel() == 0:
+            return
+        self.count += values.numel()
+        self.min = min(self.min, values.min().item())
+        self.max = max(self.max, values.max().item())
+
+        if self.counts is None:
+            self._buffer.append(values.clone())
+            if self.count > self.exact_limit:
+                self._start_histogram()
+            return
+        self._add(values.double())
+
+    def _start_histogram(self):
+        values = torch.cat(self._buffer).double()
+        self._buffer = []
+        span = max(self.max - self.min, 1e-12 * max(1.0, abs(self.min)))
+        self.low = self.min
+        self.width = span / self.num_bins
+        self.counts = torch.zeros(self.num_bins, dtype=torch.float64)
+        self._add(values)
+        logger.debug(f"Quantile sketch switched to histogram mode ({self.num_bins} bins)")
+
+    def _high(self) -> float:
+        return self.low + self.width * self.num_bins
+
+    def _grow(self, left: bool):
+        """Double the range: pairs of bins merge into one half, the other half starts empty."""
+        half = self.num_bins // 2
+        merged = self.counts.view(half, 2).sum(dim=1)
+        empty = torch.zeros(half, dtype=torch.float64)
+        if left:
+            self.low -= self.width * self.num_bins
+            self.counts = torch.cat([empty, merged])
+        else:
+            self.counts = torch.cat([merged, empty])
+        self.width *= 2
+
+    def _add(self, values: torch.Tensor, weights: Optional[torch.Tensor] = None):
+        while values.min().item() < self.low:
+            self._grow(left=True)
+        while values.max().item() > self._high():
+            self._grow(left=False)
+        indices = ((values - self.low) / self.width).floor().long().clamp_(0, self.num_bins - 1)
+        self.counts += torch.bincount(indices, weights=weights, minlength=self.num_bins).double()
+
+    def merge(self, other: "StreamingQuantileSketch") -> "StreamingQuantileSketch":
+        """Fold another sketch in (histogram bins re-added at their centers)."""
+        if other.count == 0:
+            return self
+        if self.counts is None and other.counts is None:
+            self._buffer.extend(other._buffer)
+            self.count += other.count
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            if self.count > self.exact_limit:
+                self._start_histogram()
+            return self
+
+        if self.counts is None:
+            buffered = self._buffer
+            self._buffer = []
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            self.count += other.count
+            self.low, self.width = other.low, other.width
+            self.counts = other.counts.clone()
+            for values in buffered:
+                self._add(values.double())
+            return self
+
+        self.count += other.count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        if other.counts is None:
+            for values in other._buffer:
+                self._add(values.double())
+        else:
+            nonzero = other.counts.nonzero(as_tuple=True)[0]
+            centers = other.low + (nonzero.double() + 0.5) * other.width
+            self._add(centers, weights=other.counts[nonzero])
+        return self
+
+    def quantile(self, q: float) -> float:
+        """q-quantile (linear interpolation, as torch.quantile in exact mode)."""
+        if self.count == 0:
+            return float('nan')
+        if self.counts is None:
+            values = torch.cat(self._buffer).sort().values
+            position = q * (values.numel() - 1)
+            lower = int(math.floor(position))
+            upper = min(lower + 1, values.numel() - 1)
+            fraction = position - lower
+            return (values[lower] * (1 - fraction) + values[upper] * fraction).item()
+
+        cumulative = self.counts.cumsum(dim=0)
+        rank = q * self.count
+        index = int(torch.searchsorted(cumulative, torch.tensor([rank], dtype=torch.float64)).clamp(max=self.num_bins - 1))
+        previous = cumulative[index - 1].item() if index > 0 else 0.0
+        in_bin = self.counts[index].item()
+        fraction = (rank - previous) / in_bin if in_bin > 0 else 0.5
+        value = self.low + (index + fraction) * self.width
+        return min(max(value, self.min), self.max)
+
+    def median(self) -> float:
+        """Lower median in exact mode (as torch.median), the 0.5-quantile otherwise."""
+        if self.counts is None and self.count > 0:
+            values = torch.cat(self._buffer)
+            return values.kthvalue((values.numel() + 1) // 2).values.item()
+        return self.quantile(0.5)
+
+
+class StreamingDistributionStats:
+    """Moments plus quantile sketch of one distance metric."""
+
+    def __init__(self, sample_shape: Tuple[int, ...] = (), num_bins: int = 8192, exact_limit: int = 1 << 22):
+        self.sample_shape = tuple(sample_shape)
+        self.moments = RunningMoments()
+        self.sketch = StreamingQuantileSketch(num_bins=num_bins, exact_limit=exact_limit)
+        self.num_samples = 0
+
+    def update(self, values: torch.Tensor):
+        """values: [b, *sample_shape]"""
+        self.num_samples += values.shape[0]
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other: "StreamingDistributionStats") -> "StreamingDistributionStats":
+        self.num_samples += other.num_samples
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def summary(self, percentiles: Sequence[int] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """Same keys as PatchReconstructionEvaluator.compute_distance_statistics."""
+        stats = {
+            'mean': self.moments.mean.item(),
+            'std': self.moments.std.item(),
+            'min': self.moments.min.item(),
+            'max': self.moments.max.item(),
+            'median': self.sketch.median(),
+            'shape': [self.num_samples, *self.sample_shape],
+            'type': 'tensor',
+            'quantiles_exact': self.sketch.is_exact,
+        }
+        for p in percentiles:
+            stats[f'p{p}'] = self.sketch.quantile(p / 100)
+        return stats
+
+
+def compute_patch_distances(target_patches: torch.Tensor, predicted_patches: torch.Tensor) -> Dict[str, torch.Tensor]:
+    """
+    Per-token distance metrics of one batch [b, T, D] with a single [b, T, D] temporary.
+
+    Returns token_wise / normalized_token_wise / cosine_token_wise [b, T] and
+    per_sample [b] (as compute_3d_l2_distances), and squared_sum [b] (for the
+    global distance).
+    """
+    target_patches = target_patches.float()
+    predicted_patches = predicted_patches.float()
+
+    token_wise = torch.linalg.vector_norm(target_patches - predicted_patches, dim=-1)  # [b, T]
+    target_norms = torch.linalg.vector_norm(target_patches, dim=-1)
+    predicted_norms = torch.linalg.vector_norm(predicted_patches, dim=-1)
+    dots = torch.einsum('btd,btd->bt', target_patches, predicted_patches)
+
+    # Same epsilon handling as F.normalize (cosine) and the normalized distance
+    cosine = dots / (target_norms.clamp(min=1e-12) * predicted_norms.clamp(min=1e-12))
+    squared_sum = (token_wise.double() ** 2).sum(dim=1)
+
+    return {
+        'token_wise': token_wise,
+        'per_sample': squared_sum.sqrt().float(),
+        'normalized_token_wise': token_wise / target_norms.clamp(min=1e-8),
+        'cosine_token_wise': 1.0 - cosine,
+        'squared_sum': squared_sum,
+    }
+
+
+class StreamingPatchDistanceStatistics:
+    """
+    Accumulates all patch reconstruction metrics batch by batch.
+
+    Per-position (grid_size x grid_size) moments of the token-wise distance
+    provide the per-token averages and the spatial analysis; distribution
+    metrics keep moments and quantile sketches. Only per-sample distances
+    ([N] floats) are kept in full.
+    """
+
+    DISTRIBUTION_METRICS = ('token_wise', 'per_sample', 'normalized_token_wise', 'cosine_token_wise', 'spatial')
+
+    def __init__(
+        self,
+        grid_size: int = 16,
+        num_bins: int = 8192,
+        exact_limit: int = 1 << 22,
+        keep_per_sample: bool = True,
+    ):
+        self.grid_size = grid_size
+        self.num_tokens = grid_size * grid_size
+        self.keep_per_sample = keep_per_sample
+
+        token_shape = (self.num_tokens,)
+        self.distributions = {
+            'token_wise': StreamingDistributionStats(token_shape, num_bins, exact_limit),
+            'per_sample': StreamingDistributionStats((), num_bins, exact_limit),
+            'normalized_token_wise': StreamingDistributionStats(token_shape, num_bins, exact_limit),
+            'cosine_token_wise': StreamingDistributionStats(token_shape, num_bins, exact_limit),
+        }
+        self.position_moments = RunningMoments((grid_size, grid_size))
+        self.squared_sum = 0.0
+        self.per_sample_distances: List[torch.Tensor] = []
+        self.embed_dim = None
+
+    @property
+    def num_samples(self) -> int:
+        return self.position_moments.count
+
+    def update(self, target_patches: torch.Tensor, predicted_patches: torch.Tensor):
+        """Add one batch of target / predicted patch embeddings [b, grid*grid, D]."""
+        assert target_patches.shape == predicted_patches.shape, \
+            f"Shape mismatch: {target_patches.shape} vs {predicted_patches.shape}"
+        assert target_patches.shape[1] == self.num_tokens, \
+            f"Expected {self.num_tokens} tokens, got {target_patches.shape[1]}"
+        self.embed_dim = target_patches.shape[-1]
+
+        with torch.no_grad():
+            distances = compute_patch_distances(target_patches, predicted_patches)
+
+        for name, stats in self.distributions.items():
+            stats.update(distances[name])
+        self.position_moments.update(distances['token_wise'].view(-1, self.grid_size, self.grid_size))
+        self.squared_sum += distances['squared_sum'].sum().item()
+        if self.keep_per_sample:
+            self.per_sample_distances.append(distances['per_sample'].cpu())
+
+    def merge(self, other: "StreamingPatchDistanceStatistics") -> "StreamingPatchDistanceStatistics":
+        for name, stats in self.distributions.items():
+            stats.merge(other.distributions[name])
+        self.position_moments.merge(other.position_moments)
+        self.squared_sum += other.squared_sum
+        self.per_sample_distances.extend(other.per_sample_distances)
+        self.embed_dim = self.embed_dim or other.embed_dim
+        return self
+
+    def per_token_average(self) -> torch.Tensor:
+        """Average token-wise distance per position [grid*grid]."""
+        return self.position_moments.mean.flatten().float()
+
+    def distance_statistics(self, percentiles: Sequence[int] = DEFAULT_PERCENTILES) -> Dict[str, Dict[str, Any]]:
+        """Statistics in the format of PatchReconstructionEvaluator.compute_distance_statistics."""
+        statistics = {}
+        for name in ('token_wise', 'per_sample'):
+            statistics[name] = self.distributions[name].summary(percentiles)
+
+        # Distribution of the [256] per-position averages (small, exact)
+        per_token_avg = self.per_token_average()
+        statistics['per_token_avg'] = {
+            'mean': per_token_avg.mean().item(),
+            'std': per_token_avg.std().item(),
+            'min': per_token_avg.min().item(),
+            'max': per_token_avg.max().item(),
+            'median': per_token_avg.median().item(),
+            'shape': list(per_token_avg.shape),
+            'type': 'tensor',
+        }
+        for p in percentiles:
+            statistics['per_token_avg'][f'p{p}'] = torch.quantile(per_token_avg, p / 100).item()
+
+        statistics['global'] = {'value': math.sqrt(self.squared_sum), 'type': 'scalar'}
+        for name in ('normalized_token_wise', 'cosine_token_wise'):
+            statistics[name] = self.distributions[name].summary(percentiles)
+
+        # Spatial distances are the token-wise distances on the grid
+        statistics['spatial'] = dict(statistics['token_wise'])
+        statistics['spatial']['shape'] = [self.num_samples, self.grid_size, self.grid_size]
+        return statistics
+
+    def spatial_analysis(self) -> Dict[str, Any]:
+        """Spatial error analysis (as PatchReconstructionEvaluator.analyze_spatial_patterns)."""
+        grid = self.grid_size
+        avg_spatial_error = self.position_moments.mean.float()  # [grid, grid]
+
+        flat_errors = avg_spatial_error.flatten()
+        worst_patches = torch.topk(flat_errors, k=5, largest=True)
+        best_patches = torch.topk(flat_errors, k=5, largest=False)
+        worst_coords = [(idx.item() // grid, idx.item() % grid) for idx in worst_patches.indices]
+        best_coords = [(idx.item() // grid, idx.item() % grid) for idx in best_patches.indices]
+
+        # Every position has the same count, so region means are means of position means
+        half, quarter = grid // 2, grid // 4
+        quadrant_errors = {
+            'top_left': avg_spatial_error[:half, :half].mean().item(),
+            'top_right': avg_spatial_error[:half, half:].mean().item(),
+            'bottom_left': avg_spatial_error[half:, :half].mean().item(),
+            'bottom_right': avg_spatial_error[half:, half:].mean().item(),
+        }
+        center_errors = avg_spatial_error[quarter:grid - quarter, quarter:grid - quarter].mean().item()
+        edge_mask = torch.ones(grid, grid, dtype=torch.bool)
+        edge_mask[quarter:grid - quarter, quarter:grid - quarter] = False
+        edge_errors = avg_spatial_error[edge_mask].mean().item()
+
+        token_moments = self.distributions['token_wise'].moments
+        return {
+            'avg_spatial_error_map': avg_spatial_error.numpy().tolist(),
+            'std_spatial_error_map': self.position_moments.std.float().numpy().tolist(),
+            'worst_patches': {
+                'coordinates': worst_coords,
+                'errors': worst_patches.values.numpy().tolist()
+            },
+            'best_patches': {
+                'coordinates': best_coords,
+                'errors': best_patches.values.numpy().tolist()
+            },
+            'quadrant_errors': quadrant_errors,
+            'center_vs_edge': {
+                'center_error': center_errors,
+                'edge_error': edge_errors,
+                'center_vs_edge_ratio': center_errors / edge_errors if edge_errors > 0 else 0
+            },
+            'global_spatial_stats': {
+                'mean': token_moments.mean.item(),
+                'std': token_moments.std.item(),
+                'max_error_location': worst_coords[0],
+                'min_error_location': best_coords[0]
+            }
+        }
+
+    def raw_distances(self) -> Dict[str, Any]:
+        """Small raw outputs: per-sample distances [N], per-token averages [256], global distance."""
+        raw = {
+            'per_token_avg': self.per_token_average().numpy().tolist(),
+            'global': math.sqrt(self.squared_sum),
+        }
+        if self.keep_per_sample and self.per_sample_distances:
+            raw['per_sample'] = torch.cat(self.per_sample_distances).numpy().tolist()
+        return raw
+
+
+def create_streaming_patch_statistics(
+    grid_size: int = 16,
+    num_bins: int = 8192,
+    exact_limit: int = 1 << 22,
+    keep_per_sample: bool = True,
+) -> StreamingPatchDistanceStatistics:
+    """Factory function for StreamingPatchDistanceStatistics."""
+    return StreamingPatchDistanceStatistics(
+        grid_size=grid_size, num_bins=num_bins, exact_limit=exact_limit, keep_per_sample=keep_per_sample
+    )
+
+
+__all__ = [
+    "RunningMoments",
+    "StreamingQuantileSketch",
+    "StreamingDistributionStats",
+    "StreamingPatchDistanceStatistics",
+    "compute_patch_distances",
+    "create_streaming_patch_statistics",
+]
@@ -4,14 +4,89 @@ Inference utilities for BLIP3-o DiT.
 Contains:
 - BLIP3oInference: Main inference pipeline
 - Model loading and generation utilities
+- BLIP3oCompiledSampler: torch.compile / CUDA graph sampling loop
+- Streaming, memory-mapped generation results store and its lazy reader
+- DynamicBatchingServer: asyncio dynamic-batching serving layer + HTTP front end
+- ContinuousBatchingEngine / ContinuousBatchingServer: step-level continuous batching
+- GenerationResultCache: memory LRU + memory-mapped disk cache of seeded generations
+- ImageToCLIPPipeline: overlapped decode / preprocess / EVA / DiT / projection stages
 """
 
-from .blip3o_inference import (
-    BLIP3oInference,
-    load_blip3o_inference,
-)
+from ..utils.lazy_imports import lazy_exports
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "BLIP3oInference": ".blip3o_inference",
+    "load_blip3o_inference": ".blip3o_inference",
+    "BLIP3oCompiledSampler": ".compiled_sampler",
+    "create_compiled_sampler": ".compiled_sampler",
+    "GenerationResultsWriter": ".generation_store",
+    "GenerationResults": ".generation_store",
+    "select_intermediate_steps": ".generation_store",
+    "create_generation_writer": ".generation_store",
+    "load_generation_results": ".generation_store",
+    "ServingMetrics": ".serving",
+    "DynamicBatchingServer": ".serving",
+    "ServingHTTPFrontend": ".serving",
+    "request_generation": ".serving",
+    "request_metrics": ".serving",
+    "create_serving_server": ".serving",
+    "ContinuousRequest": ".continuous_batching",
+    "ContinuousBatchingEngine": ".continuous_batching",
+    "ContinuousBatchingServer": ".continuous_batching",
+    "create_continuous_batching_engine": ".continuous_batching",
+    "GenerationResultCache": ".result_cache",
+    "create_result_cache": ".result_cache",
+    "checkpoint_fingerprint": ".result_cache",
+    "generation_namespace": ".result_cache",
+    "sample_noise": ".result_cache",
+    "sample_generators": ".result_cache",
+    "draw_noise": ".result_cache",
+    "generate_in_fixed_batches": ".result_cache",
+    "StageStats": ".pipeline",
+    "PipelineStage": ".pipeline",
+    "OverlappedPipeline": ".pipeline",
+    "ImageToCLIPPipeline": ".pipeline",
+    "decode_image": ".pipeline",
+    "load_eva_clip": ".pipeline",
+    "create_image_to_clip_pipeline": ".pipeline",
+}
 
 __all__ = [
     "BLIP3oInference",
     "load_blip3o_inference",
-]
\ No newline at end of file
+    "BLIP3oCompiledSampler",
+    "create_compiled_sampler",
+    "GenerationResultsWriter",
+    "GenerationResults",
+    "select_intermediate_steps",
+    "create_generation_writer",
+    "load_generation_results",
+    "ServingMetrics",
+    "DynamicBatchingServer",
+    "ServingHTTPFrontend",
+    "request_generation",
+    "request_metrics",
+    "create_serving_server",
+    "ContinuousRequest",
+    "ContinuousBatchingEngine",
+    "ContinuousBatchingServer",
+    "create_continuous_batching_engine",
+    "GenerationResultCache",
+    "create_result_cache",
+    "checkpoint_fingerprint",
+    "generation_namespace",
+    "sample_noise",
+    "sample_generators",
+    "draw_noise",
+    "generate_in_fixed_batches",
+    "StageStats",
+    "PipelineStage",
+    "OverlappedPipeline",
+    "ImageToCLIPPipeline",
+    "decode_image",
+    "load_eva_clip",
+    "create_image_to_clip_pipeline",
+]
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
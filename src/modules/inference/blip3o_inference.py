@@ -10,6 +10,7 @@ from pathlib import Path
 import json
 import logging
 from typing import Optional, Dict, Any, List, Tuple, Union
+import math
 import numpy as np
 import pickle
 from tqdm import tqdm
@@ -17,7 +18,19 @@ from tqdm import tqdm
 from ..models.blip3o_dit import BLIP3oDiTModel
 from ..config.blip3o_config import BLIP3oDiTConfig
 from ..losses.flow_matching_loss import BLIP3oFlowMatchingLoss, create_blip3o_flow_matching_loss
-from ..datasets.blip3o_dataset import BLIP3oEmbeddingDataset, create_blip3o_dataloader
+from ..datasets.blip3o_dataset import BLIP3oEmbeddingDataset, create_blip3o_dataloader, create_chunked_dataloader
+from ..models.checkpoint_loader import load_blip3o_checkpoint
+from .compiled_sampler import BLIP3oCompiledSampler
+from .generation_store import GenerationResultsWriter, load_generation_results
+from .result_cache import (
+    GenerationResultCache,
+    checkpoint_fingerprint,
+    generation_namespace,
+    sample_noise,
+    generate_in_fixed_batches,
+    DEFAULT_SEEDED_BATCH_SIZE,
+)
+from ..evaluation.embedding_cache import hash_item
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +52,7 @@ class BLIP3oInference:
         device: str = "auto",
         torch_dtype: Optional[torch.dtype] = None,
         compile_model: bool = False,
+        use_ema_weights: bool = False,
     ):
         """
         Initialize BLIP3-o inference pipeline.
@@ -48,16 +62,27 @@ class BLIP3oInference:
             device: Device to use ("auto", "cuda", "cpu")
             torch_dtype: Data type for model (None for auto)
             compile_model: Whether to compile model for optimization
+            use_ema_weights: Load the EMA weights saved by the trainer
+                (ema_model.safetensors) instead of the live weights
         """
         self.model_path = Path(model_path)
         self.device = self._setup_device(device)
         self.torch_dtype = torch_dtype or torch.float32
         self.compile_model = compile_model
+        self.weights = "ema" if use_ema_weights else "live"
         
         # Load model and configuration
         self.model, self.config = self._load_model()
         self.flow_matching_loss = self._load_flow_matching_config()
         
+        # Optional fixed-shape compiled / CUDA-graph sampler (see enable_compiled_sampling)
+        self.compiled_sampler: Optional[BLIP3oCompiledSampler] = None
+        
+        # Optional cache of seeded generations (see enable_result_cache)
+        self.result_cache: Optional[GenerationResultCache] = None
+        self.seeded_batch_size = DEFAULT_SEEDED_BATCH_SIZE
+        self.checkpoint_id = checkpoint_fingerprint(self.model_path, weights=self.weights)
+        
         logger.info(f"BLIP3-o inference pipeline initialized")
         logger.info(f"Model path: {self.model_path}")
         logger.info(f"Device: {self.device}")
@@ -79,73 +104,13 @@ class BLIP3oInference:
         return device
     
     def _load_model(self) -> Tuple[BLIP3oDiTModel, BLIP3oDiTConfig]:
-        """Load trained BLIP3-o model and configuration."""
-        # Load model configuration
-        config_path = self.model_path / "config.json"
-        blip3o_config_path = self.model_path / "blip3o_model_config.json"
-        
-        if blip3o_config_path.exists():
-            config_file = blip3o_config_path
-        elif config_path.exists():
-            config_file = config_path
-        else:
-            raise FileNotFoundError(f"No config file found in {self.model_path}")
-        
-        with open(config_file, 'r') as f:
-            config_dict = json.load(f)
-        
-        # Create configuration
-        config = BLIP3oDiTConfig(**config_dict)
-        
-        # Create model
-        model = BLIP3oDiTModel(config)
-        
-        # Load model weights
-        model_files = [
-            self.model_path / "pytorch_model.bin",
-            self.model_path / "model.safetensors",
-            self.model_path / "pytorch_model.safetensors"
-        ]
-        
-        model_file = None
-        for file_path in model_files:
-            if file_path.exists():
-                model_file = file_path
-                break
-        
-        if model_file is None:
-            raise FileNotFoundError(f"No model weights found in {self.model_path}")
-        
-        # Load weights
-        if model_file.suffix == ".bin":
-            state_dict = torch.load(model_file, map_location=self.device)
-        else:
-            from safetensors.torch import load_file
-            state_dict = load_file(str(model_file))
-        
-        # Handle potential key mismatches
-        model_state_dict = model.state_dict()
-        filtered_state_dict = {}
-        
-        for key, value in state_dict.items():
-            if key in model_state_dict:
-                if model_state_dict[key].shape == value.shape:
-                    filtered_state_dict[key] = value
-                else:
-                    logger.warning(f"Shape mismatch for {key}: {model_state_dict[key].shape} vs {value.shape}")
-            else:
-                logger.warning(f"Unexpected key in state dict: {key}")
-        
-        missing_keys, unexpected_keys = model.load_state_dict(filtered_state_dict, strict=False)
-        
-        if missing_keys:
-            logger.warning(f"Missing keys: {missing_keys}")
-        if unexpected_keys:
-            logger.warning(f"Unexpected keys: {unexpected_keys}")
-        
-        # Move to device and set data type
-        model = model.to(device=self.device, dtype=self.torch_dtype)
-        model.eval()
+        """Load trained BLIP3-o model and configuration (meta-device / mmap fast path)."""
+        model, config, load_info = load_blip3o_checkpoint(
+            self.model_path,
+            device=self.device,
+            torch_dtype=self.torch_dtype,
+            weights=self.weights,
+        )
         
         # Compile model if requested
         if self.compile_model:
@@ -155,7 +120,7 @@ class BLIP3oInference:
             except Exception as e:
                 logger.warning(f"Model compilation failed: {e}")
         
-        logger.info(f"Model loaded successfully from {model_file}")
+        logger.info(f"Model loaded successfully from {load_info['weight_file']} in {load_info['load_seconds']:.2f}s")
         
         return model, config
     
@@ -175,6 +140,73 @@ class BLIP3oInference:
         
         return flow_matching_loss
     
+    def enable_compiled_sampling(
+        self,
+        batch_size: int = 8,
+        num_inference_steps: int = 50,
+        use_cuda_graph: Optional[bool] = None,
+        compile_step: bool = True,
+        compile_mode: Optional[str] = None,
+    ) -> BLIP3oCompiledSampler:
+        """
+        Route generate() through a compiled sampler for a fixed batch size.
+        
+        On CUDA the whole sampling loop is captured as a CUDA graph on the first
+        call; on CPU the per-step function is torch.compile'd. Calls with a
+        different num_inference_steps or return_intermediate=True fall back to
+        the eager model.generate().
+        """
+        self.compiled_sampler = BLIP3oCompiledSampler(
+            model=self.model,
+            batch_size=batch_size,
+            num_inference_steps=num_inference_steps,
+            generation_mode="patch",
+            return_global_only=True,
+            use_cuda_graph=use_cuda_graph,
+            compile_step=compile_step,
+            compile_mode=compile_mode,
+        )
+        logger.info(
+            f"Compiled sampling enabled: batch_size={batch_size}, steps={num_inference_steps}, "
+            f"cuda_graph={self.compiled_sampler.use_cuda_graph}"
+        )
+        return self.compiled_sampler
+    
+    def disable_compiled_sampling(self):
+        """Return to eager model.generate()."""
+        self.compiled_sampler = None
+    
+    def enable_result_cache(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        memory_max_mb: float = 256.0,
+        disk_max_gb: float = 10.0,
+        ttl_hours: Optional[float] = None,
+    ) -> GenerationResultCache:
+        """
+        Cache seeded generations (generate(..., seed=...)) in memory and on disk.
+        
+        Entries are keyed by the EVA conditioning, checkpoint id, sampler settings
+        and seed; unseeded calls are never cached.
+        """
+        self.result_cache = GenerationResultCache(
+            cache_dir=cache_dir,
+            memory_max_mb=memory_max_mb,
+            disk_max_gb=disk_max_gb,
+            ttl_hours=ttl_hours,
+        )
+        logger.info(f"Result cache enabled: {self.result_cache.cache_dir} (checkpoint {self.checkpoint_id})")
+        return self.result_cache
+    
+    def disable_result_cache(self):
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.result_cache = None
+    
+    def _uses_compiled_sampler(self, num_inference_steps: int, return_intermediate: bool) -> bool:
+        return (self.compiled_sampler is not None and not return_intermediate and
+                num_inference_steps == self.compiled_sampler.num_inference_steps)
+    
     @torch.no_grad()
     def generate(
         self,
@@ -184,6 +216,8 @@ class BLIP3oInference:
         generator: Optional[torch.Generator] = None,
         return_intermediate: bool = False,
         eta: float = 0.0,
+        seed: Optional[int] = None,
+        noise: Optional[torch.Tensor] = None,
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, List[torch.Tensor]]]:
         """
         Generate CLIP embeddings from EVA-CLIP conditioning.
@@ -196,6 +230,10 @@ class BLIP3oInference:
             generator: Random number generator for reproducibility
             return_intermediate: Whether to return intermediate states
             eta: DDIM parameter for stochasticity
+            seed: Per-sample deterministic noise seeded by (seed, EVA hash), generated in
+                fixed-size chunks so results do not depend on batching; served from the
+                result cache if enabled
+            noise: Explicit initial noise [batch_size, num_tokens, clip_dim] (overrides seed / generator)
             
         Returns:
             Generated CLIP embeddings [batch_size, num_tokens, clip_dim]
@@ -210,6 +248,53 @@ class BLIP3oInference:
         # Set model to evaluation mode
         self.model.eval()
         
+        # Seeded, batch-independent path: per-sample noise, fixed-size chunks, result cache
+        if seed is not None and noise is None and not return_intermediate:
+            compiled = self._uses_compiled_sampler(num_inference_steps, False)
+            batch_size = self.compiled_sampler.batch_size if compiled else self.seeded_batch_size
+            sample_shape = (eva_embeddings.shape[1], self.config.in_channels)
+            
+            def generate_chunk(eva, chunk_noise):
+                return self.generate(
+                    eva, num_inference_steps=num_inference_steps, guidance_scale=guidance_scale,
+                    eta=eta, noise=chunk_noise,
+                )
+            
+            if self.result_cache is None:
+                noise = sample_noise(
+                    [hash_item(row) for row in eva_embeddings], seed, sample_shape,
+                    device=self.device, dtype=self.torch_dtype,
+                )
+                return generate_in_fixed_batches(generate_chunk, eva_embeddings, noise, batch_size)
+            
+            # Only the cache misses are generated
+            namespace = generation_namespace(
+                checkpoint_id=self.checkpoint_id,
+                seed=seed,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                eta=eta,
+                sampler="compiled" if compiled else "eager",
+                dtype=self.torch_dtype,
+                batch_size=batch_size,
+            )
+            generated = self.result_cache.cached_generate(
+                generate_chunk, eva_embeddings, namespace,
+                seed=seed, sample_shape=sample_shape, batch_size=batch_size,
+            )
+            return generated.to(self.device)
+        
+        if seed is not None and noise is None:
+            noise = sample_noise(
+                [hash_item(row) for row in eva_embeddings], seed,
+                (eva_embeddings.shape[1], self.config.in_channels),
+                device=self.device, dtype=self.torch_dtype,
+            )
+        
+        # Fast path: fixed-shape compiled / CUDA-graph sampler
+        if self._uses_compiled_sampler(num_inference_steps, return_intermediate):
+            return self.compiled_sampler(eva_embeddings, generator=generator, noise=noise)
+        
         # Generate using model's built-in generation method
         # FIXED: Use correct parameter name for the underlying model
         if return_intermediate:
@@ -218,6 +303,7 @@ class BLIP3oInference:
                 num_inference_steps=num_inference_steps,
                 generator=generator,
                 return_intermediate=True,
+                noise=noise,
             )
             return generated_clip, intermediate_states
         else:
@@ -226,6 +312,7 @@ class BLIP3oInference:
                 num_inference_steps=num_inference_steps,
                 generator=generator,
                 return_intermediate=False,
+                noise=noise,
             )
             return generated_clip
     
@@ -251,43 +338,66 @@ class BLIP3oInference:
         output_path: Optional[Union[str, Path]] = None,
         compute_metrics: bool = True,
         save_intermediate: bool = False,
+        intermediate_every_n_steps: int = 10,
+        intermediate_sample_every: int = 1,
+        save_pickle: bool = False,
     ) -> Dict[str, Any]:
         """
         Generate CLIP embeddings for samples from a dataset.
         
+        With output_path, every batch is appended to a memory-mapped results
+        store (see generation_store.py) and the returned tensors are lazy,
+        memory-mapped views, so host memory does not grow with the run size.
+        Without output_path, results are kept in memory (small runs).
+        
         Args:
             dataset_path: Path to embeddings dataset
             num_samples: Number of samples to generate (None for all)
             batch_size: Batch size for generation
             num_inference_steps: Number of sampling steps
-            output_path: Path to save results
+            output_path: Results store directory (open with load_generation_results)
             compute_metrics: Whether to compute quality metrics
             save_intermediate: Whether to save intermediate states
+            intermediate_every_n_steps: Keep every N-th intermediate step (the last is always kept)
+            intermediate_sample_every: Keep intermediate states of every M-th sample
+            save_pickle: Also write the legacy single-pickle file (<output_path>.pkl, loads everything)
             
         Returns:
             Dictionary with generation results and metrics
         """
-        # Load dataset
-        dataset = BLIP3oEmbeddingDataset(
-            embeddings_path=dataset_path,
-            subset_size=num_samples,
-            normalize_embeddings=True,
-            split="all"
-        )
-        
-        # Create dataloader
-        dataloader = create_blip3o_dataloader(
-            embeddings_path=dataset_path,
+        # Create dataloader (chunked embeddings, deterministic order, shards kept on disk)
+        dataloader = create_chunked_dataloader(
+            chunked_embeddings_dir=dataset_path,
             batch_size=batch_size,
-            shuffle=False,
-            num_workers=0,  # Avoid multiprocessing in inference
             split="all",
-            subset_size=num_samples,
+            shuffle_shards=False,
+            shuffle_within_shard=False,
+            delete_after_use=False,
+            num_workers=0,  # Avoid multiprocessing in inference
         )
+        total_samples = len(dataloader.dataset)
+        if num_samples is not None:
+            total_samples = min(total_samples, num_samples)
         
-        logger.info(f"Generating samples for {len(dataset)} items in {len(dataloader)} batches")
+        logger.info(f"Generating samples for {total_samples} items in batches of {batch_size}")
         
-        # Storage for results
+        writer = None
+        if output_path is not None:
+            writer = GenerationResultsWriter(
+                output_path,
+                num_samples=total_samples,
+                intermediate_every_n_steps=intermediate_every_n_steps,
+                intermediate_sample_every=intermediate_sample_every,
+                metadata={
+                    'model_path': str(self.model_path),
+                    'weights': self.weights,
+                    'dataset_path': str(dataset_path),
+                    'num_inference_steps': num_inference_steps,
+                    'batch_size': batch_size,
+                },
+            )
+        
+        # In-memory storage (only without an output store)
         results = {
             'eva_embeddings': [],
             'clip_targets': [],
@@ -299,9 +409,18 @@ class BLIP3oInference:
         }
         
         # Generate samples
+        num_generated = 0
         for batch_idx, batch in enumerate(tqdm(dataloader, desc="Generating")):
-            eva_emb = batch['eva_embeddings'].to(device=self.device, dtype=self.torch_dtype)
-            clip_targets = batch['clip_embeddings']
+            remaining = total_samples - num_generated
+            if remaining <= 0:
+                break
+            batch_len = min(len(batch['keys']), remaining)
+            eva_emb = batch['eva_embeddings'][:batch_len].to(device=self.device, dtype=self.torch_dtype)
+            clip_targets = batch['clip_embeddings'][:batch_len]
+            captions = batch['captions'][:batch_len]
+            keys = batch['keys'][:batch_len]
+            num_generated += batch_len
+            intermediate = None
             
             # Generate CLIP embeddings - FIXED: Use correct method signature
             if save_intermediate:
@@ -310,7 +429,6 @@ class BLIP3oInference:
                     num_inference_steps=num_inference_steps,
                     return_intermediate=True,
                 )
-                results['intermediate_states'].append([state.cpu() for state in intermediate])
             else:
                 generated_clip = self.generate(
                     eva_emb,  # FIXED: Use positional argument
@@ -318,20 +436,38 @@ class BLIP3oInference:
                 )
             
             # Store results
-            results['eva_embeddings'].append(eva_emb.cpu())
-            results['clip_targets'].append(clip_targets)
-            results['generated_clip'].append(generated_clip.cpu())
-            results['captions'].extend(batch['captions'])
-            results['keys'].extend(batch['keys'])
-        
-        # Concatenate results
-        results['eva_embeddings'] = torch.cat(results['eva_embeddings'], dim=0)
-        results['clip_targets'] = torch.cat(results['clip_targets'], dim=0)
-        results['generated_clip'] = torch.cat(results['generated_clip'], dim=0)
+            if writer is not None:
+                writer.append(
+                    eva_embeddings=eva_emb,
+                    clip_targets=clip_targets,
+                    generated_clip=generated_clip,
+                    captions=captions,
+                    keys=keys,
+                    intermediate_states=intermediate,
+                )
+            else:
+                results['eva_embeddings'].append(eva_emb.cpu())
+                results['clip_targets'].append(clip_targets)
+                results['generated_clip'].append(generated_clip.cpu())
+                results['captions'].extend(captions)
+                results['keys'].extend(keys)
+                if intermediate is not None:
+                    results['intermediate_states'].append([state.cpu() for state in intermediate])
+            del intermediate
+        
+        if writer is not None:
+            # Flushed store: metrics below stream the memory-mapped arrays
+            writer.flush()
+            results = load_generation_results(writer.output_dir).to_dict()
+        else:
+            # Concatenate results
+            results['eva_embeddings'] = torch.cat(results['eva_embeddings'], dim=0)
+            results['clip_targets'] = torch.cat(results['clip_targets'], dim=0)
+            results['generated_clip'] = torch.cat(results['generated_clip'], dim=0)
         
         logger.info(f"Generated {results['generated_clip'].shape[0]} samples")
         
-        # Compute metrics
+        # Compute metrics (chunked, so memory-mapped results are streamed)
         if compute_metrics:
             results['generation_metrics'] = self._compute_generation_metrics(
                 generated=results['generated_clip'],
@@ -340,14 +476,16 @@ class BLIP3oInference:
             )
         
         # Save results
-        if output_path is not None:
-            output_path = Path(output_path)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(output_path, 'wb') as f:
-                pickle.dump(results, f)
+        if writer is not None:
+            writer.close(metadata={'generation_metrics': results['generation_metrics']})
+            results = load_generation_results(writer.output_dir).to_dict()
+            logger.info(f"Results saved to {writer.output_dir}")
             
-            logger.info(f"Results saved to {output_path}")
+            if save_pickle:
+                pickle_path = Path(writer.output_dir).with_suffix('.pkl')
+                with open(pickle_path, 'wb') as f:
+                    pickle.dump({key: value for key, value in results.items() if key != 'output_path'}, f)
+                logger.info(f"Legacy pickle saved to {pickle_path}")
         
         return results
     
@@ -356,40 +494,62 @@ class BLIP3oInference:
         generated: torch.Tensor,      # [N, 64, 768]
         targets: torch.Tensor,        # [N, 64, 768]
         eva_conditioning: torch.Tensor,  # [N, 64, 1280]
+        chunk_size: int = 256,
     ) -> Dict[str, float]:
-        """Compute comprehensive generation quality metrics."""
+        """
+        Compute comprehensive generation quality metrics.
+        
+        Rows are processed in chunks: per-sample terms are [N] vectors and the
+        distribution terms are float64 running sums, so memory-mapped results
+        are streamed from disk instead of materialized.
+        """
+        per_sample = {'cosine': [], 'l2': [], 'generated_norm': [], 'target_norm': [], 'token_cosine': []}
+        sums = {name: 0.0 for name in ('gen', 'gen_sq', 'tgt', 'tgt_sq', 'gen_var', 'tgt_var')}
+        num_elements = 0
+        num_tokens = 0
         
         with torch.no_grad():
-            # Flatten for similarity computation
-            generated_flat = generated.flatten(1)  # [N, 64*768]
-            targets_flat = targets.flatten(1)      # [N, 64*768]
-            
-            # Cosine similarity
-            cosine_similarities = nn.functional.cosine_similarity(
-                generated_flat, targets_flat, dim=1
-            )
-            
-            # L2 distances
-            l2_distances = torch.norm(generated - targets, dim=-1).mean(dim=1)  # [N]
-            
-            # Embedding norms
-            generated_norms = torch.norm(generated, dim=-1).mean(dim=1)  # [N]
-            target_norms = torch.norm(targets, dim=-1).mean(dim=1)       # [N]
+            for start in range(0, generated.shape[0], chunk_size):
+                gen = generated[start:start + chunk_size].float()
+                tgt = targets[start:start + chunk_size].float()
+                
+                # Flatten for similarity computation
+                per_sample['cosine'].append(nn.functional.cosine_similarity(gen.flatten(1), tgt.flatten(1), dim=1))
+                
+                # L2 distances, embedding norms and token-wise cosine similarity [n]
+                per_sample['l2'].append(torch.norm(gen - tgt, dim=-1).reshape(gen.shape[0], -1).mean(dim=1))
+                per_sample['generated_norm'].append(torch.norm(gen, dim=-1).reshape(gen.shape[0], -1).mean(dim=1))
+                per_sample['target_norm'].append(torch.norm(tgt, dim=-1).reshape(tgt.shape[0], -1).mean(dim=1))
+                per_sample['token_cosine'].append(
+                    nn.functional.cosine_similarity(gen, tgt, dim=-1).reshape(gen.shape[0], -1).mean(dim=1)
+                )
+                
+                # Distribution / variance sums (float64)
+                gen64, tgt64 = gen.double(), tgt.double()
+                sums['gen'] += gen64.sum().item()
+                sums['gen_sq'] += gen64.pow(2).sum().item()
+                sums['tgt'] += tgt64.sum().item()
+                sums['tgt_sq'] += tgt64.pow(2).sum().item()
+                sums['gen_var'] += gen.var(dim=-1).double().sum().item()
+                sums['tgt_var'] += tgt.var(dim=-1).double().sum().item()
+                num_elements += gen.numel()
+                num_tokens += gen.numel() // gen.shape[-1]
             
-            # Token-wise statistics
-            token_cosine_sims = nn.functional.cosine_similarity(
-                generated, targets, dim=-1
-            ).mean(dim=1)  # [N]
+            cosine_similarities = torch.cat(per_sample['cosine'])
+            l2_distances = torch.cat(per_sample['l2'])
+            generated_norms = torch.cat(per_sample['generated_norm'])
+            target_norms = torch.cat(per_sample['target_norm'])
+            token_cosine_sims = torch.cat(per_sample['token_cosine'])
             
             # Variance analysis
-            generated_var = generated.var(dim=-1).mean()
-            target_var = targets.var(dim=-1).mean()
+            generated_var = sums['gen_var'] / num_tokens
+            target_var = sums['tgt_var'] / num_tokens
             
-            # Distribution comparison
-            generated_mean = generated.mean()
-            target_mean = targets.mean()
-            generated_std = generated.std()
-            target_std = targets.std()
+            # Distribution comparison (unbiased std over all elements, as Tensor.std())
+            generated_mean = sums['gen'] / num_elements
+            target_mean = sums['tgt'] / num_elements
+            generated_std = math.sqrt(max(sums['gen_sq'] - num_elements * generated_mean ** 2, 0.0) / max(num_elements - 1, 1))
+            target_std = math.sqrt(max(sums['tgt_sq'] - num_elements * target_mean ** 2, 0.0) / max(num_elements - 1, 1))
             
             metrics = {
                 # Primary similarity metrics
@@ -412,17 +572,17 @@ class BLIP3oInference:
                 'token_cosine_sim_std': token_cosine_sims.std().item(),
                 
                 # Distribution metrics
-                'generated_mean': generated_mean.item(),
-                'target_mean': target_mean.item(),
-                'generated_std': generated_std.item(),
-                'target_std': target_std.item(),
-                'mean_difference': (generated_mean - target_mean).abs().item(),
-                'std_ratio': (generated_std / target_std).item(),
+                'generated_mean': generated_mean,
+                'target_mean': target_mean,
+                'generated_std': generated_std,
+                'target_std': target_std,
+                'mean_difference': abs(generated_mean - target_mean),
+                'std_ratio': generated_std / target_std,
                 
                 # Variance metrics
-                'generated_variance': generated_var.item(),
-                'target_variance': target_var.item(),
-                'variance_ratio': (generated_var / target_var).item(),
+                'generated_variance': generated_var,
+                'target_variance': target_var,
+                'variance_ratio': generated_var / target_var,
             }
         
         # Log metrics
@@ -562,6 +722,7 @@ def load_blip3o_inference(
     model_path: Union[str, Path],
     device: str = "auto",
     torch_dtype: Optional[torch.dtype] = None,
+    use_ema_weights: bool = False,
 ) -> BLIP3oInference:
     """
     Convenience function to load BLIP3-o inference pipeline.
@@ -570,6 +731,7 @@ def load_blip3o_inference(
         model_path: Path to trained model
         device: Device to use
         torch_dtype: Data type for model
+        use_ema_weights: Load the EMA weights instead of the live weights
         
     Returns:
         BLIP3oInference instance
@@ -578,4 +740,5 @@ def load_blip3o_inference(
         model_path=model_path,
         device=device,
         torch_dtype=torch_dtype,
+        use_ema_weights=use_ema_weights,
     )
\ No newline at end of file
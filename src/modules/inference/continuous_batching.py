@@ -0,0 +1,459 @@
+"""
+Continuous (step-level) batching for BLIP3-o flow-matching sampling.
+
+A request-level batcher (serving.py) runs every batch for the full
+num_inference_steps, so a request arriving one step after a batch started
+waits for the whole sampling loop. ContinuousBatchingEngine schedules at the
+granularity of a single Euler step instead:
+- a pool of in-flight samples, each with its own step counter (and its own
+  number of steps), kept contiguous in preallocated [max_batch_size, ...]
+  state / conditioning buffers
+- every iteration runs ONE batched forward_static over the whole pool with a
+  per-sample timestep vector; samples that finished integrating take their
+  final t=0 forward in the same pass
+- finished samples are retired (the last row moves into the free slot) and
+  waiting samples are admitted at every step boundary, so the pool stays full
+
+The per-sample math is exactly BLIP3oDiTModel.generate (patch-space Euler
+integration + final t=0 forward + global projection): samples never interact
+inside the DiT, so outputs match generate() for the same initial noise.
+
+ContinuousBatchingServer exposes the same asyncio submit() / metrics API as
+DynamicBatchingServer (so ServingHTTPFrontend can front either).
+"""
+
+import time
+import queue
+import torch
+import asyncio
+import logging
+import threading
+import torch.nn as nn
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .serving import ServingMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class ContinuousRequest:
+    """Handle of one submitted request (its rows finish independently)."""
+
+    def __init__(self, request_id: int, num_rows: int, num_inference_steps: int):
+        self.request_id = request_id
+        self.num_rows = num_rows
+        self.num_inference_steps = num_inference_steps
+        self.outputs: List[Optional[torch.Tensor]] = [None] * num_rows
+        self.num_finished = 0
+        self.submit_step: Optional[int] = None
+        self.finish_step: Optional[int] = None
+        self.user_data: Any = None
+
+    @property
+    def done(self) -> bool:
+        return self.num_finished == self.num_rows
+
+    def result(self) -> torch.Tensor:
+        if not self.done:
+            raise RuntimeError(f"Request {self.request_id} not finished ({self.num_finished}/{self.num_rows})")
+        return torch.stack(self.outputs)
+
+
+class _Slot:
+    __slots__ = ('request', 'row', 'num_steps', 'dt', 'step')
+
+    def __init__(self, request: ContinuousRequest, row: int):
+        self.request = request
+        self.row = row
+        self.num_steps = request.num_inference_steps
+        self.dt = 1.0 / self.num_steps
+        self.step = 0
+
+    @property
+    def finalizing(self) -> bool:
+        return self.step >= self.num_steps
+
+
+class ContinuousBatchingEngine:
+    """
+    Synchronous step-level scheduler over BLIP3oDiTModel.forward_static.
+
+    submit() queues samples, step() runs one scheduler iteration (admit,
+    one batched forward, retire), run_until_complete() drains everything.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        max_batch_size: int = 32,
+        default_num_inference_steps: int = 50,
+        return_global_only: bool = True,
+    ):
+        """
+        Args:
+            model: BLIP3-o DiT model (a torch.compile wrapper is unwrapped)
+            max_batch_size: Maximum number of in-flight samples (pool size)
+            default_num_inference_steps: Steps for requests that do not specify them
+            return_global_only: Return the [768] global embedding when the model
+                has a frozen CLIP projection, else the final patch output [256, 1024]
+        """
+        self.model = getattr(model, '_orig_mod', model)
+        self.model.eval()
+        self.max_batch_size = max_batch_size
+        self.default_num_inference_steps = default_num_inference_steps
+        self.return_global_only = return_global_only
+
+        parameter = next(self.model.parameters())
+        self.device = parameter.device
+        self.dtype = parameter.dtype
+
+        config = self.model.config
+        self.num_tokens = config.input_size * config.input_size
+        self.in_channels = config.in_channels
+        self.eva_dim = config.eva_embedding_size
+
+        # Contiguous in-flight pool: rows [0, len(self._slots)) are active
+        self._state = torch.zeros((max_batch_size, self.num_tokens, self.in_channels), device=self.device, dtype=self.dtype)
+        self._conditioning = torch.zeros((max_batch_size, self.num_tokens, self.eva_dim), device=self.device, dtype=self.dtype)
+        self._slots: List[_Slot] = []
+        self._waiting: Deque[Tuple[_Slot, torch.Tensor, torch.Tensor]] = deque()
+
+        self._next_request_id = 0
+        self.num_iterations = 0
+        self.total_active_rows = 0
+
+    @property
+    def num_active(self) -> int:
+        return len(self._slots)
+
+    @property
+    def num_waiting(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def has_work(self) -> bool:
+        return bool(self._slots or self._waiting)
+
+    @property
+    def mean_occupancy(self) -> float:
+        """Average fraction of the pool used per forward pass."""
+        if self.num_iterations == 0:
+            return 0.0
+        return self.total_active_rows / (self.num_iterations * self.max_batch_size)
+
+    def submit(
+        self,
+        eva_embeddings: torch.Tensor,
+        num_inference_steps: Optional[int] = None,
+        generator: Optional[torch.Generator] = None,
+        noise: Optional[torch.Tensor] = None,
+    ) -> ContinuousRequest:
+        """
+        Queue samples for generation; they are admitted at the next step boundary.
+
+        Args:
+            eva_embeddings: [T, D] or [b, T, D] EVA-CLIP conditioning
+            num_inference_steps: Euler steps for these samples
+            generator: RNG for the initial noise (drawn as in model.generate)
+            noise: Explicit initial noise [b, T, C] (overrides generator)
+        """
+        if eva_embeddings.dim() == 2:
+            eva_embeddings = eva_embeddings.unsqueeze(0)
+        if tuple(eva_embeddings.shape[1:]) != (self.num_tokens, self.eva_dim):
+            raise ValueError(f"Expected conditioning [b, {self.num_tokens}, {self.eva_dim}], "
+                             f"got {tuple(eva_embeddings.shape)}")
+        num_rows = eva_embeddings.shape[0]
+        eva_embeddings = eva_embeddings.to(device=self.device, dtype=self.dtype)
+
+        if noise is None:
+            noise = torch.randn(
+                (num_rows, self.num_tokens, self.in_channels),
+                device=self.device,
+                dtype=self.dtype,
+                generator=generator,
+            )
+        noise = noise.to(device=self.device, dtype=self.dtype)
+
+        request = ContinuousRequest(self._next_request_id, num_rows, num_inference_steps or self.default_num_inference_steps)
+        request.submit_step = self.num_iterations
+        self._next_request_id += 1
+        for row in range(num_rows):
+            self._waiting.append((_Slot(request, row), noise[row], eva_embeddings[row]))
+        return request
+
+    def _admit(self):
+        while self._waiting and len(self._slots) < self.max_batch_size:
+            slot, noise, conditioning = self._waiting.popleft()
+            index = len(self._slots)
+            self._state[index].copy_(noise)
+            self._conditioning[index].copy_(conditioning)
+            self._slots.append(slot)
+
+    def _retire(self, index: int):
+        """Free row `index` by moving the last active row into it."""
+        last = len(self._slots) - 1
+        if index != last:
+            self._state[index].copy_(self._state[last])
+            self._conditioning[index].copy_(self._conditioning[last])
+            self._slots[index] = self._slots[last]
+        self._slots.pop()
+
+    @torch.no_grad()
+    def step(self) -> List[ContinuousRequest]:
+        """
+        One scheduler iteration: admit, one batched forward, advance, retire.
+
+        Returns:
+            Requests completed in this iteration
+        """
+        self._admit()
+        num_active = len(self._slots)
+        if num_active == 0:
+            return []
+
+        # Per-sample timestep: step * dt while integrating, 0 for the final forward
+        timesteps = torch.tensor(
+            [0.0 if slot.finalizing else slot.step * slot.dt for slot in self._slots],
+            device=self.device, dtype=self.dtype,
+        )
+        state = self._state[:num_active]
+        velocity, pooled_features = self.model.forward_static(state, timesteps, self._conditioning[:num_active])
+
+        finalizing = [index for index, slot in enumerate(self._slots) if slot.finalizing]
+        if len(finalizing) < num_active:
+            # Euler step x_{t+dt} = x_t + dt * v_t (dt = 0 for finalizing rows, their state is done)
+            step_sizes = torch.tensor(
+                [0.0 if slot.finalizing else slot.dt for slot in self._slots],
+                device=self.device, dtype=self.dtype,
+            )
+            state.add_(step_sizes.view(-1, 1, 1) * velocity)
+
+        completed = []
+        if finalizing:
+            outputs = velocity[finalizing]
+            if self.return_global_only:
+                _, global_output = self.model._project_global(pooled_features[finalizing])
+                if global_output is not None:
+                    outputs = global_output
+            for output, index in zip(outputs, finalizing):
+                slot = self._slots[index]
+                slot.request.outputs[slot.row] = output.clone()
+                slot.request.num_finished += 1
+                if slot.request.done:
+                    slot.request.finish_step = self.num_iterations + 1
+                    completed.append(slot.request)
+
+        for slot in self._slots:
+            slot.step += 1
+        # Retire from the highest index so pending indices stay valid
+        for index in reversed(finalizing):
+            self._retire(index)
+
+        self.num_iterations += 1
+        self.total_active_rows += num_active
+        return completed
+
+    def run_until_complete(self) -> List[ContinuousRequest]:
+        """Step until the pool and the waiting queue are empty."""
+        completed = []
+        while self.has_work:
+            completed.extend(self.step())
+        return completed
+
+    def generate(
+        self,
+        eva_embeddings: torch.Tensor,
+        num_inference_steps: Optional[int] = None,
+        generator: Optional[torch.Generator] = None,
+    ) -> torch.Tensor:
+        """Blocking convenience: submit and drain (other queued work runs alongside)."""
+        request = self.submit(eva_embeddings, num_inference_steps, generator)
+        while not request.done:
+            self.step()
+        return request.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'num_active': self.num_active,
+            'num_waiting': self.num_waiting,
+            'num_iterations': self.num_iterations,
+            'mean_occupancy': self.mean_occupancy,
+            'max_batch_size': self.max_batch_size,
+        }
+
+
+class ContinuousBatchingServer:
+    """
+    asyncio front for ContinuousBatchingEngine (same API as DynamicBatchingServer).
+
+    The engine runs on a dedicated worker thread that admits new requests at
+    every step boundary; completions resolve the callers' futures on the
+    event loop.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        max_batch_size: int = 32,
+        num_inference_steps: int = 50,
+        return_global_only: bool = True,
+        max_queue_size: int = 4096,
+    ):
+        self.engine = ContinuousBatchingEngine(
+            model,
+            max_batch_size=max_batch_size,
+            default_num_inference_steps=num_inference_steps,
+            return_global_only=return_global_only,
+        )
+        self.max_batch_size = max_batch_size
+        self.num_inference_steps = num_inference_steps
+        self.max_queue_size = max_queue_size
+        self.metrics = ServingMetrics()
+
+        self._inbox: "queue.Queue" = queue.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._futures = set()
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._inbox.qsize() + self.engine.num_waiting
+
+    async def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stop_event.clear()
+        self._worker = threading.Thread(target=self._worker_loop, name="blip3o-continuous", daemon=True)
+        self._worker.start()
+        logger.info(f"Continuous batching server started (pool={self.max_batch_size})")
+
+    async def stop(self):
+        """Stop the worker; unfinished requests are failed."""
+        if self._worker is not None:
+            self._stop_event.set()
+            await asyncio.get_running_loop().run_in_executor(None, self._worker.join)
+            self._worker = None
+        for future in self._futures:
+            if not future.done():
+                future.set_exception(RuntimeError("Server stopped"))
+        self._futures.clear()
+
+    async def __aenter__(self) -> "ContinuousBatchingServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def submit(
+        self,
+        eva_embeddings: torch.Tensor,
+        num_inference_steps: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Queue one request ([T, D] or [b, T, D]) and wait for its result."""
+        if not self.running:
+            raise RuntimeError("Server is not running; call start() first")
+        single = eva_embeddings.dim() == 2
+        batch = eva_embeddings.unsqueeze(0) if single else eva_embeddings
+        expected = (self.engine.num_tokens, self.engine.eva_dim)
+        if batch.dim() != 3 or batch.shape[0] == 0 or tuple(batch.shape[1:]) != expected:
+            raise ValueError(f"Expected [T, D] or [b, T, D] conditioning with samples {expected}, "
+                             f"got {tuple(eva_embeddings.shape)}")
+        if self.queue_depth >= self.max_queue_size:
+            raise RuntimeError(f"Queue full ({self.max_queue_size} requests)")
+
+        future = self._loop.create_future()
+        future.add_done_callback(self._futures.discard)
+        self._futures.add(future)
+        arrival = time.perf_counter()
+        self._inbox.put((future, arrival, batch.detach().cpu(), num_inference_steps))
+        self.metrics.record_queue_depth(self.queue_depth)
+
+        result = await future
+        return result[0] if single else result
+
+    def _drain_inbox(self, block: bool):
+        """Hand every queued request to the engine (waits briefly only when idle)."""
+        try:
+            item = self._inbox.get(timeout=0.05) if block else self._inbox.get_nowait()
+            while True:
+                future, arrival, eva_embeddings, steps = item
+                try:
+                    request = self.engine.submit(eva_embeddings, steps)
+                    request.user_data = (future, arrival)
+                except Exception as e:
+                    self._loop.call_soon_threadsafe(self._fail, future, arrival, e)
+                item = self._inbox.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            # New requests join at this step boundary
+            self._drain_inbox(block=not self.engine.has_work)
+            if not self.engine.has_work:
+                continue
+
+            num_active = min(self.engine.num_active + self.engine.num_waiting, self.max_batch_size)
+            start = time.perf_counter()
+            try:
+                completed = self.engine.step()
+            except Exception as e:
+                logger.error(f"Continuous batching step failed: {e}")
+                self._fail_all(e)
+                continue
+            elapsed = time.perf_counter() - start
+            self._loop.call_soon_threadsafe(self.metrics.record_batch, 1, num_active, elapsed)
+
+            for request in completed:
+                future, arrival = request.user_data
+                self._loop.call_soon_threadsafe(self._resolve, future, arrival, request.result().cpu())
+
+    def _resolve(self, future: asyncio.Future, arrival: float, result: torch.Tensor):
+        self.metrics.record_request(time.perf_counter() - arrival, 0.0)
+        if not future.done():
+            future.set_result(result)
+
+    def _fail(self, future: asyncio.Future, arrival: float, error: Exception):
+        self.metrics.record_request(time.perf_counter() - arrival, 0.0, error=True)
+        if not future.done():
+            future.set_exception(error)
+
+    def _fail_all(self, error: Exception):
+        """Drop the engine's in-flight and waiting work after a failed step."""
+        requests = {slot.request.request_id: slot.request for slot in self.engine._slots}
+        requests.update({slot.request.request_id: slot.request for slot, _, _ in self.engine._waiting})
+        self.engine._slots.clear()
+        self.engine._waiting.clear()
+        for request in requests.values():
+            future, arrival = request.user_data
+            self._loop.call_soon_threadsafe(self._fail, future, arrival, error)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        metrics = self.metrics.snapshot(self.queue_depth)
+        metrics.update({f'engine_{key}': value for key, value in self.engine.get_stats().items()})
+        return metrics
+
+
+def create_continuous_batching_engine(
+    model: nn.Module,
+    max_batch_size: int = 32,
+    **kwargs
+) -> ContinuousBatchingEngine:
+    """Factory function for ContinuousBatchingEngine."""
+    return ContinuousBatchingEngine(model=model, max_batch_size=max_batch_size, **kwargs)
+
+
+__all__ = [
+    "ContinuousRequest",
+    "ContinuousBatchingEngine",
+    "ContinuousBatchingServer",
+    "create_continuous_batching_engine",
+]
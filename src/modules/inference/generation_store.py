@@ -0,0 +1,245 @@
+"""
+Streaming storage for BLIP3-o generation runs.
+
+GenerationResultsWriter appends each generated batch (EVA conditioning, CLIP
+targets, generated embeddings, captions / keys) into preallocated memory-mapped
+arrays (src/modules/utils/memmap_store.py) instead of accumulating Python
+lists and pickling one dict. Intermediate sampling states are subsampled
+(every N-th step, every M-th sample) and stored in float16, so
+save_intermediate no longer multiplies host memory by num_inference_steps.
+
+GenerationResults is the lazy reader: arrays are memory-mapped tensors that
+are only paged in when touched.
+"""
+
+import math
+import torch
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+from ..utils.memmap_store import MemmapArrayWriter, MemmapArrayReader
+
+logger = logging.getLogger(__name__)
+
+INTERMEDIATE_FIELD = "intermediate_states"
+RESULT_FIELDS = ("eva_embeddings", "clip_targets", "generated_clip")
+
+
+def select_intermediate_steps(num_steps: int, every_n_steps: int) -> List[int]:
+    """Step indices kept from a sampling trajectory: every N-th step and always the last."""
+    every_n_steps = max(1, every_n_steps)
+    steps = list(range(every_n_steps - 1, num_steps, every_n_steps))
+    if num_steps > 0 and (not steps or steps[-1] != num_steps - 1):
+        steps.append(num_steps - 1)
+    return steps
+
+
+class GenerationResultsWriter:
+    """
+    Appends generation batches into a memory-mapped results store.
+
+    Host memory stays at one batch (plus its kept intermediate states)
+    regardless of the number of samples.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        num_samples: int,
+        intermediate_every_n_steps: int = 10,
+        intermediate_sample_every: int = 1,
+        intermediate_dtype: torch.dtype = torch.float16,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Args:
+            output_dir: Store directory
+            num_samples: Total number of samples (store capacity)
+            intermediate_every_n_steps: Keep every N-th sampling step (the final step is always kept)
+            intermediate_sample_every: Keep intermediate states of every M-th sample
+            intermediate_dtype: Storage dtype of intermediate states
+            metadata: Free-form metadata (generation settings) written to the manifest
+        """
+        self.num_samples = num_samples
+        self.intermediate_every_n_steps = max(1, intermediate_every_n_steps)
+        self.intermediate_sample_every = max(1, intermediate_sample_every)
+        self.intermediate_dtype = intermediate_dtype
+        self.intermediate_steps: Optional[List[int]] = None
+
+        self._writer = MemmapArrayWriter(output_dir, capacity=num_samples, metadata=metadata)
+        self._intermediate_sample_indices: List[int] = []
+
+    @property
+    def output_dir(self) -> Path:
+        return self._writer.output_dir
+
+    def append(
+        self,
+        eva_embeddings: torch.Tensor,
+        clip_targets: torch.Tensor,
+        generated_clip: torch.Tensor,
+        captions: Sequence[str],
+        keys: Sequence[Any],
+        intermediate_states: Optional[Sequence[torch.Tensor]] = None,
+    ) -> int:
+        """Append one batch; returns the index of its first sample."""
+        start = self._writer.append(
+            {
+                'eva_embeddings': eva_embeddings,
+                'clip_targets': clip_targets,
+                'generated_clip': generated_clip,
+            },
+            records=[{'caption': caption, 'key': key} for caption, key in zip(captions, keys)],
+        )
+        if intermediate_states is not None:
+            self._append_intermediate(start, intermediate_states)
+        return start
+
+    def _append_intermediate(self, start: int, intermediate_states: Sequence[torch.Tensor]):
+        if self.intermediate_steps is None:
+            self.intermediate_steps = select_intermediate_steps(
+                len(intermediate_states), self.intermediate_every_n_steps
+            )
+
+        # Samples of this batch on the global every-M-th grid
+        batch_size = intermediate_states[0].shape[0]
+        first = -start % self.intermediate_sample_every
+        local_rows = list(range(first, batch_size, self.intermediate_sample_every))
+        if not local_rows:
+            return
+
+        # [b_kept, steps_kept, ...] in the (compressed) storage dtype
+        kept = torch.stack(
+            [intermediate_states[step][local_rows].detach().to('cpu', self.intermediate_dtype)
+             for step in self.intermediate_steps],
+            dim=1,
+        )
+        self._writer.write_field(
+            INTERMEDIATE_FIELD,
+            kept,
+            capacity=math.ceil(self.num_samples / self.intermediate_sample_every),
+        )
+        self._intermediate_sample_indices.extend(start + row for row in local_rows)
+
+    def flush(self):
+        """Make every appended batch readable (the store stays open)."""
+        self._writer.flush()
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None) -> Path:
+        """Finalize the store (records intermediate subsampling in the manifest)."""
+        metadata = dict(metadata or {})
+        if self._intermediate_sample_indices:
+            metadata['intermediate'] = {
+                'steps': self.intermediate_steps,
+                'sample_indices': self._intermediate_sample_indices,
+                'every_n_steps': self.intermediate_every_n_steps,
+                'sample_every': self.intermediate_sample_every,
+                'dtype': str(self.intermediate_dtype),
+            }
+        return self._writer.close(metadata)
+
+    def __enter__(self) -> "GenerationResultsWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class GenerationResults:
+    """
+    Lazy reader for a generation results store.
+
+    Tensors are memory-mapped (nothing is loaded until indexed); metrics and
+    generation settings come from the manifest.
+    """
+
+    def __init__(self, store_dir: Union[str, Path]):
+        self.store = MemmapArrayReader(store_dir)
+        self.store_dir = self.store.store_dir
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.store.metadata
+
+    @property
+    def eva_embeddings(self) -> torch.Tensor:
+        return self.store.tensor('eva_embeddings')
+
+    @property
+    def clip_targets(self) -> torch.Tensor:
+        return self.store.tensor('clip_targets')
+
+    @property
+    def generated_clip(self) -> torch.Tensor:
+        return self.store.tensor('generated_clip')
+
+    @property
+    def captions(self) -> List[str]:
+        return self.store.record_field('caption')
+
+    @property
+    def keys(self) -> List[Any]:
+        return self.store.record_field('key')
+
+    @property
+    def generation_metrics(self) -> Dict[str, float]:
+        return self.metadata.get('generation_metrics', {})
+
+    @property
+    def intermediate_states(self) -> Optional[torch.Tensor]:
+        """[num_kept_samples, num_kept_steps, ...] or None if not saved."""
+        if INTERMEDIATE_FIELD not in self.store:
+            return None
+        return self.store.tensor(INTERMEDIATE_FIELD)
+
+    @property
+    def intermediate_steps(self) -> List[int]:
+        return self.metadata.get('intermediate', {}).get('steps', [])
+
+    @property
+    def intermediate_sample_indices(self) -> List[int]:
+        return self.metadata.get('intermediate', {}).get('sample_indices', [])
+
+    def iter_batches(self, batch_size: int) -> Iterator[Dict[str, torch.Tensor]]:
+        """Stream aligned batches of eva_embeddings / clip_targets / generated_clip."""
+        return self.store.iter_batches(batch_size, RESULT_FIELDS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Same keys as the in-memory generate_from_dataset results (tensors stay memory-mapped)."""
+        return {
+            'eva_embeddings': self.eva_embeddings,
+            'clip_targets': self.clip_targets,
+            'generated_clip': self.generated_clip,
+            'captions': self.captions,
+            'keys': self.keys,
+            'generation_metrics': self.generation_metrics,
+            'intermediate_states': self.intermediate_states,
+            'output_path': str(self.store_dir),
+        }
+
+
+def create_generation_writer(
+    output_dir: Union[str, Path],
+    num_samples: int,
+    **kwargs
+) -> GenerationResultsWriter:
+    """Factory function for GenerationResultsWriter."""
+    return GenerationResultsWriter(output_dir=output_dir, num_samples=num_samples, **kwargs)
+
+
+def load_generation_results(store_dir: Union[str, Path]) -> GenerationResults:
+    """Open a store written by BLIP3oInference.generate_from_dataset."""
+    return GenerationResults(store_dir)
+
+
+__all__ = [
+    "GenerationResultsWriter",
+    "GenerationResults",
+    "select_intermediate_steps",
+    "create_generation_writer",
+    "load_generation_results",
+]
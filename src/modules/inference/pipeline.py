@@ -0,0 +1,433 @@
+"""
+End-to-end image -> generated CLIP embedding pipeline with overlapped stages.
+
+Getting a generated embedding from an image used to be separate synchronous
+steps (extract_eva_features, format_to_blip3o_tokens, BLIP3oInference.generate,
+pooling / projection), so the time per batch was the SUM of all steps.
+ImageToCLIPPipeline runs
+
+    decode -> preprocess -> EVA encode -> DiT sample -> project
+
+as stages on their own threads connected by bounded queues: while the DiT
+samples batch k, EVA-CLIP encodes batch k+1 and the CPU decodes batch k+2, so
+throughput is set by the slowest stage. GPU stages issue their work on their
+own CUDA stream (synchronized before the batch is handed on), so EVA encoding
+and DiT sampling kernels can overlap too.
+
+OverlappedPipeline is the generic part (any list of PipelineStage); every
+stage keeps throughput / busy / starved / blocked counters (get_stats()).
+"""
+
+import io
+import time
+import queue
+import torch
+import logging
+import threading
+import torch.nn as nn
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .result_cache import sample_noise
+from ..evaluation.embedding_cache import hash_item
+from ..utils.instrumentation import SAMPLING_STEP, timer
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+_POLL_SECONDS = 0.1
+
+
+class _StageFailure:
+    """Exception raised inside a stage, forwarded downstream to the consumer."""
+
+    def __init__(self, stage_name: str, error: BaseException):
+        self.stage_name = stage_name
+        self.error = error
+
+
+def _num_samples(batch: Any) -> int:
+    if isinstance(batch, dict):
+        batch = batch.get('keys', next(iter(batch.values()), []))
+    try:
+        return len(batch)
+    except TypeError:
+        return 1
+
+
+class StageStats:
+    """Counters of one stage (seconds are wall-clock on the stage thread)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.num_batches = 0
+        self.num_samples = 0
+        self.busy_seconds = 0.0      # running the stage function
+        self.starved_seconds = 0.0   # waiting for input
+        self.blocked_seconds = 0.0   # waiting for room downstream
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'num_batches': self.num_batches,
+            'num_samples': self.num_samples,
+            'busy_seconds': self.busy_seconds,
+            'starved_seconds': self.starved_seconds,
+            'blocked_seconds': self.blocked_seconds,
+            'samples_per_second': self.num_samples / self.busy_seconds if self.busy_seconds > 0 else 0.0,
+        }
+
+
+class PipelineStage:
+    """
+    One stage: fn(batch) -> batch, run on its own thread.
+
+    With a CUDA device the stage runs on its own stream, which is synchronized
+    before the output is handed to the next stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Any], Any],
+        device: Optional[Union[str, torch.device]] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.device = torch.device(device) if device is not None else None
+        self.stream = None
+        if self.device is not None and self.device.type == "cuda" and torch.cuda.is_available():
+            self.stream = torch.cuda.Stream(device=self.device)
+
+    @torch.no_grad()
+    def __call__(self, batch: Any) -> Any:
+        if self.stream is None:
+            return self.fn(batch)
+        with torch.cuda.stream(self.stream):
+            output = self.fn(batch)
+        self.stream.synchronize()
+        return output
+
+
+class OverlappedPipeline:
+    """
+    Stages on separate threads connected by bounded queues.
+
+    Each stage has one thread, so batches leave the pipeline in input order.
+    An exception in any stage stops the run and is re-raised by run().
+    """
+
+    def __init__(self, stages: Sequence[PipelineStage], queue_size: int = 2):
+        """
+        Args:
+            stages: Stages in execution order
+            queue_size: Capacity (in batches) of every inter-stage queue
+        """
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self.stats: Dict[str, StageStats] = {stage.name: StageStats(stage.name) for stage in self.stages}
+        self.wall_seconds = 0.0
+        self.num_output_batches = 0
+        self.num_output_samples = 0
+
+    def _put(self, out_queue: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue: queue.Queue, stop: threading.Event) -> Any:
+        while not stop.is_set():
+            try:
+                return in_queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, batches: Iterable, out_queue: queue.Queue, stop: threading.Event):
+        try:
+            for batch in batches:
+                if not self._put(out_queue, batch, stop):
+                    return
+        except BaseException as e:
+            self._put(out_queue, _StageFailure("input", e), stop)
+            return
+        self._put(out_queue, _END, stop)
+
+    def _run_stage(self, stage: PipelineStage, in_queue: queue.Queue, out_queue: queue.Queue,
+                   stop: threading.Event):
+        stats = self.stats[stage.name]
+        while True:
+            wait_start = time.perf_counter()
+            batch = self._get(in_queue, stop)
+            stats.starved_seconds += time.perf_counter() - wait_start
+            if batch is _END or isinstance(batch, _StageFailure):
+                self._put(out_queue, batch, stop)
+                return
+
+            busy_start = time.perf_counter()
+            try:
+                output = stage(batch)
+            except BaseException as e:
+                logger.error(f"Pipeline stage '{stage.name}' failed: {e}")
+                self._put(out_queue, _StageFailure(stage.name, e), stop)
+                return
+            stats.busy_seconds += time.perf_counter() - busy_start
+            stats.num_batches += 1
+            stats.num_samples += _num_samples(output)
+
+            put_start = time.perf_counter()
+            if not self._put(out_queue, output, stop):
+                return
+            stats.blocked_seconds += time.perf_counter() - put_start
+
+    def run(self, batches: Iterable) -> Iterator[Any]:
+        """Push batches through every stage; yields the last stage's outputs in order."""
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(batches, queues[0], stop),
+                                    name="pipeline-input", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(stage, queues[index], queues[index + 1], stop),
+                name=f"pipeline-{stage.name}", daemon=True,
+            ))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                output = queues[-1].get()
+                if output is _END:
+                    break
+                if isinstance(output, _StageFailure):
+                    raise RuntimeError(f"Pipeline stage '{output.stage_name}' failed") from output.error
+                self.num_output_batches += 1
+                self.num_output_samples += _num_samples(output)
+                yield output
+        finally:
+            # Also reached when the consumer stops early: unblock and join every thread
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_seconds += time.perf_counter() - start
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-stage counters, end-to-end throughput and the bottleneck (busiest) stage."""
+        stages = {name: stats.to_dict() for name, stats in self.stats.items()}
+        busiest = max(self.stats.values(), key=lambda s: s.busy_seconds)
+        return {
+            'stages': stages,
+            'wall_seconds': self.wall_seconds,
+            'num_samples': self.num_output_samples,
+            'samples_per_second': self.num_output_samples / self.wall_seconds if self.wall_seconds > 0 else 0.0,
+            'sum_of_stage_seconds': sum(s.busy_seconds for s in self.stats.values()),
+            'bottleneck_stage': busiest.name,
+        }
+
+    def reset_stats(self):
+        self.stats = {stage.name: StageStats(stage.name) for stage in self.stages}
+        self.wall_seconds = 0.0
+        self.num_output_batches = 0
+        self.num_output_samples = 0
+
+
+ImageSource = Union[str, Path, bytes, Any]  # path, encoded bytes or PIL image
+
+
+def decode_image(source: ImageSource):
+    """PIL RGB image from a path, encoded bytes or an already decoded image."""
+    from PIL import Image
+
+    if isinstance(source, (str, Path)):
+        image = Image.open(source)
+    elif isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = source
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+class ImageToCLIPPipeline:
+    """
+    decode -> preprocess -> EVA encode -> DiT sample -> project, overlapped.
+
+    The DiT stages reproduce BLIP3oDiTModel.generate (patch-space Euler
+    integration, final t=0 forward, frozen CLIP projection) split in two: the
+    Euler loop is "dit_sample", the final forward + projection is "project".
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        eva_model: nn.Module,
+        eva_processor: Any,
+        batch_size: int = 8,
+        num_inference_steps: int = 50,
+        return_global_only: bool = True,
+        seed: Optional[int] = None,
+        queue_size: int = 2,
+        eva_dtype: Optional[torch.dtype] = None,
+    ):
+        """
+        Args:
+            model: BLIP3oDiTModel (or BLIP3oInference.model)
+            eva_model: EVA-CLIP model exposing vision_model(pixel_values=...)
+            eva_processor: Image processor producing EVA-CLIP pixel_values
+            batch_size: Images per batch flowing through the pipeline
+            num_inference_steps: Euler steps of the DiT sampler
+            return_global_only: Global [B, 768] embeddings (else patch [B, 256, 1024])
+            seed: Per-sample noise seeded by (seed, EVA hash) as in BLIP3oInference.generate(seed=...)
+            queue_size: Batches buffered between consecutive stages
+            eva_dtype: EVA-CLIP input dtype (default: dtype of its parameters)
+        """
+        self.model = model.eval()
+        self.eva_model = eva_model.eval()
+        self.eva_processor = eva_processor
+        self.batch_size = batch_size
+        self.num_inference_steps = num_inference_steps
+        self.return_global_only = return_global_only
+        self.seed = seed
+
+        model_param = next(model.parameters())
+        self.device, self.dtype = model_param.device, model_param.dtype
+        eva_param = next(eva_model.parameters())
+        self.eva_device = eva_param.device
+        self.eva_dtype = eva_dtype or eva_param.dtype
+
+        self.pipeline = OverlappedPipeline(
+            [
+                PipelineStage("decode", self._decode),
+                PipelineStage("preprocess", self._preprocess),
+                PipelineStage("eva_encode", self._eva_encode, device=self.eva_device),
+                PipelineStage("dit_sample", self._dit_sample, device=self.device),
+                PipelineStage("project", self._project, device=self.device),
+            ],
+            queue_size=queue_size,
+        )
+
+    # ------------------------------------------------------------------ stages
+
+    def _decode(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        return {'keys': batch['keys'], 'images': [decode_image(source) for source in batch['sources']]}
+
+    def _preprocess(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        pixel_values = self.eva_processor(images=batch['images'], return_tensors="pt")['pixel_values']
+        if self.eva_device.type == "cuda":
+            pixel_values = pixel_values.pin_memory()
+        return {'keys': batch['keys'], 'pixel_values': pixel_values}
+
+    def _eva_encode(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        pixel_values = batch['pixel_values'].to(self.eva_device, self.eva_dtype, non_blocking=True)
+        vision_outputs = self.eva_model.vision_model(pixel_values=pixel_values, return_dict=True)
+        # Patch tokens without CLS: [B, 256, 4096] (the 16x16 grid in BLIP3-o token order)
+        eva_tokens = vision_outputs.last_hidden_state[:, 1:, :]
+        if eva_tokens.shape[1] != self.model.num_tokens:
+            raise ValueError(f"Expected {self.model.num_tokens} EVA patch tokens, got {eva_tokens.shape[1]}")
+        return {'keys': batch['keys'], 'eva': eva_tokens.to(self.device, self.dtype, non_blocking=True)}
+
+    def _initial_noise(self, eva: torch.Tensor) -> torch.Tensor:
+        sample_shape = (eva.shape[1], self.model.config.in_channels)
+        if self.seed is not None:
+            return sample_noise([hash_item(row) for row in eva], self.seed, sample_shape,
+                                device=self.device, dtype=self.dtype)
+        return torch.randn((eva.shape[0],) + sample_shape, device=self.device, dtype=self.dtype)
+
+    def _dit_sample(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        eva = batch['eva']
+        sample = self._initial_noise(eva)
+        dt = 1.0 / self.num_inference_steps
+        for step in range(self.num_inference_steps):
+            with timer(SAMPLING_STEP):
+                t = torch.full((eva.shape[0],), step * dt, device=self.device, dtype=self.dtype)
+                velocity, _ = self.model.forward_static(sample, t, eva)
+                sample = sample + dt * velocity
+        return {'keys': batch['keys'], 'eva': eva, 'sample': sample}
+
+    def _project(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        eva = batch['eva']
+        t = torch.zeros(eva.shape[0], device=self.device, dtype=self.dtype)
+        final_patch, final_pooled = self.model.forward_static(batch['sample'], t, eva)
+        output = final_patch
+        if self.return_global_only:
+            _, final_global = self.model._project_global(final_pooled)
+            if final_global is not None:
+                output = final_global
+        return {'keys': batch['keys'], 'embeddings': output.float().cpu()}
+
+    # --------------------------------------------------------------------- API
+
+    def _batches(self, sources: Iterable[ImageSource], keys: Optional[Iterable[Any]]) -> Iterator[Dict[str, Any]]:
+        batch_keys, batch_sources = [], []
+        key_iter = iter(keys) if keys is not None else None
+        for index, source in enumerate(sources):
+            batch_keys.append(next(key_iter) if key_iter is not None else index)
+            batch_sources.append(source)
+            if len(batch_sources) == self.batch_size:
+                yield {'keys': batch_keys, 'sources': batch_sources}
+                batch_keys, batch_sources = [], []
+        if batch_sources:
+            yield {'keys': batch_keys, 'sources': batch_sources}
+
+    def run(self, sources: Iterable[ImageSource], keys: Optional[Iterable[Any]] = None
+            ) -> Iterator[Tuple[List[Any], torch.Tensor]]:
+        """Stream (keys, embeddings) batches in input order; sources are consumed lazily."""
+        for batch in self.pipeline.run(self._batches(sources, keys)):
+            yield batch['keys'], batch['embeddings']
+
+    def embed(self, sources: Iterable[ImageSource]) -> torch.Tensor:
+        """All embeddings, row i for sources[i]."""
+        outputs = [embeddings for _, embeddings in self.run(sources)]
+        if not outputs:
+            raise ValueError("No images given")
+        return torch.cat(outputs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.pipeline.get_stats()
+
+
+def load_eva_clip(device: Union[str, torch.device] = "cuda", dtype: torch.dtype = torch.float16):
+    """EVA-CLIP-8B and its (CLIP) image processor, as in extract_embeddings_g.load_models."""
+    from transformers import AutoModel, CLIPImageProcessor
+
+    eva_model = AutoModel.from_pretrained(
+        "BAAI/EVA-CLIP-8B",
+        trust_remote_code=True,
+        torch_dtype=dtype,
+    ).to(device)
+    eva_processor = CLIPImageProcessor.from_pretrained("openai/clip-vit-large-patch14")
+    return eva_model.eval(), eva_processor
+
+
+def create_image_to_clip_pipeline(
+    inference: Any,
+    eva_model: Optional[nn.Module] = None,
+    eva_processor: Any = None,
+    **kwargs
+) -> ImageToCLIPPipeline:
+    """
+    Factory function for ImageToCLIPPipeline.
+
+    inference may be a BLIP3oInference or a BLIP3oDiTModel; EVA-CLIP-8B is
+    loaded on the model's device when eva_model is not given.
+    """
+    model = getattr(inference, 'model', inference)
+    if eva_model is None:
+        eva_model, eva_processor = load_eva_clip(device=next(model.parameters()).device)
+    return ImageToCLIPPipeline(model=model, eva_model=eva_model, eva_processor=eva_processor, **kwargs)
+
+
+__all__ = [
+    "StageStats",
+    "PipelineStage",
+    "OverlappedPipeline",
+    "ImageToCLIPPipeline",
+    "decode_image",
+    "load_eva_clip",
+    "create_image_to_clip_pipeline",
+]
@@ -0,0 +1,544 @@
+"""
+Two-tier result cache for generated CLIP embeddings.
+
+Repeated evaluation / extraction runs regenerate the same CLIP embeddings from
+the same EVA-CLIP conditioning with the same checkpoint. Each generated sample
+is cached under a key derived from:
+- a hash of the EVA conditioning bytes (dtype, shape and data of the row)
+- the checkpoint id (model directory + weight file size / mtime)
+- the sampler configuration (steps, guidance, eta, output mode, sampler, dtype)
+- the seed
+
+Tiers:
+- memory: LRU of CPU tensors bounded by bytes
+- disk: one memory-mapped slab file per (shape, dtype) plus a sqlite index with
+  creation / last-access times, TTL expiry and LRU eviction by total size
+
+Cached samples are only bit-identical to fresh ones if the fresh ones are
+deterministic, so seeded generation:
+- draws each sample's initial noise from its own generator seeded by
+  (seed, EVA hash): the noise of a sample does not depend on its batch
+- runs the DiT on chunks padded to a fixed batch size, since GEMM kernels may
+  round differently for different batch sizes (the batch size is part of the key)
+On GPU this additionally needs deterministic kernels
+(torch.use_deterministic_algorithms, no TF32 autotuning differences).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import torch
+import numpy as np
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from ..evaluation.embedding_cache import hash_item
+from ..models.checkpoint_loader import find_weight_file
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIR_ENV = "BLIP3O_RESULT_CACHE"
+INDEX_NAME = "index.sqlite"
+SLAB_GROW_ROWS = 256
+DEFAULT_SEEDED_BATCH_SIZE = 8
+
+# Generation callback: (eva_embeddings [b, T, D], noise [b, T, C] or None) -> [b, ...]
+GenerateFn = Callable[[torch.Tensor, Optional[torch.Tensor]], torch.Tensor]
+
+
+def get_default_result_cache_dir() -> Path:
+    """$BLIP3O_RESULT_CACHE, or ~/.cache/blip3o/generated."""
+    return Path(os.environ.get(RESULT_CACHE_DIR_ENV, Path.home() / ".cache" / "blip3o" / "generated"))
+
+
+def checkpoint_fingerprint(model_path: Union[str, Path], weights: str = "live") -> str:
+    """
+    Checkpoint id: resolved model directory plus name / size / mtime of its
+    weight file (live or EMA), so retraining into the same directory
+    invalidates the cache.
+    """
+    model_path = Path(model_path).resolve()
+    parts = [str(model_path)]
+    try:
+        weight_file = find_weight_file(model_path, weights=weights)
+        stat = weight_file.stat()
+        parts.append(f"{weight_file.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    except FileNotFoundError:
+        pass
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def generation_namespace(
+    checkpoint_id: str,
+    seed: int,
+    num_inference_steps: int,
+    guidance_scale: float = 1.0,
+    eta: float = 0.0,
+    output: str = "global",
+    sampler: str = "eager",
+    dtype: Optional[torch.dtype] = None,
+    **extra
+) -> str:
+    """Hash of everything besides the EVA conditioning that determines a generated sample."""
+    config = {
+        'checkpoint_id': checkpoint_id,
+        'seed': int(seed),
+        'num_inference_steps': int(num_inference_steps),
+        'guidance_scale': float(guidance_scale),
+        'eta': float(eta),
+        'output': output,
+        'sampler': sampler,
+        'dtype': str(dtype),
+        **extra,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def result_key(namespace: str, eva_hash: str) -> str:
+    return hashlib.sha256(f"{namespace}:{eva_hash}".encode("utf-8")).hexdigest()
+
+
+def sample_generators(eva_hashes: Sequence[str], seed: int) -> List[torch.Generator]:
+    """One CPU generator per sample, seeded from (seed, EVA hash)."""
+    generators = []
+    for eva_hash in eva_hashes:
+        digest = hashlib.sha256(f"{int(seed)}:{eva_hash}".encode("utf-8")).digest()
+        generator = torch.Generator(device="cpu")
+        generator.manual_seed(int.from_bytes(digest[:8], "little") & 0x7FFF_FFFF_FFFF_FFFF)
+        generators.append(generator)
+    return generators
+
+
+def draw_noise(
+    generators: Sequence[torch.Generator],
+    sample_shape: Tuple[int, ...],
+    device: Union[str, torch.device] = "cpu",
+    dtype: torch.dtype = torch.float32,
+) -> torch.Tensor:
+    """Noise [b, *sample_shape], row i drawn from generators[i] (which advance)."""
+    rows = [torch.randn(sample_shape, generator=generator, dtype=torch.float32) for generator in generators]
+    return torch.stack(rows).to(device=device, dtype=dtype)
+
+
+def sample_noise(
+    eva_hashes: Sequence[str],
+    seed: int,
+    sample_shape: Tuple[int, ...],
+    device: Union[str, torch.device] = "cpu",
+    dtype: torch.dtype = torch.float32,
+) -> torch.Tensor:
+    """
+    Initial noise [b, *sample_shape], one CPU generator per sample seeded from
+    (seed, EVA hash): the same conditioning always gets the same noise.
+    """
+    return draw_noise(sample_generators(eva_hashes, seed), sample_shape, device=device, dtype=dtype)
+
+
+def generate_in_fixed_batches(
+    generate_fn: GenerateFn,
+    eva_embeddings: torch.Tensor,
+    noise: Optional[torch.Tensor],
+    batch_size: int,
+) -> torch.Tensor:
+    """
+    generate_fn over chunks of exactly batch_size rows (the last chunk is padded
+    by repeating its last row), so a sample's result does not depend on how many
+    other samples were generated with it.
+    """
+    outputs = []
+    for start in range(0, eva_embeddings.shape[0], batch_size):
+        eva_chunk = eva_embeddings[start:start + batch_size]
+        noise_chunk = noise[start:start + batch_size] if noise is not None else None
+        num_valid = eva_chunk.shape[0]
+        if num_valid < batch_size:
+            pad = [num_valid - 1] * (batch_size - num_valid)
+            eva_chunk = torch.cat([eva_chunk, eva_chunk[pad]])
+            if noise_chunk is not None:
+                noise_chunk = torch.cat([noise_chunk, noise_chunk[pad]])
+        outputs.append(generate_fn(eva_chunk, noise_chunk)[:num_valid])
+    return torch.cat(outputs)
+
+
+def _tensor_nbytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def _slab_name(shape: Tuple[int, ...], dtype: torch.dtype) -> str:
+    return f"{str(dtype).replace('torch.', '')}_{'x'.join(str(s) for s in shape) or 'scalar'}"
+
+
+class _Slab:
+    """Raw [capacity, *shape] memory-mapped file with a free-slot list."""
+
+    def __init__(self, path: Path, shape: Tuple[int, ...], dtype: torch.dtype, capacity: int, used: Sequence[int]):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.row_numel = int(np.prod(shape)) if shape else 1
+        self.row_bytes = self.row_numel * torch.empty((), dtype=dtype).element_size()
+        self.capacity = 0
+        self.array: Optional[torch.Tensor] = None
+        self.free: List[int] = []
+        self._resize(capacity)
+        self.free = sorted(set(range(self.capacity)) - set(used), reverse=True)
+
+    def _resize(self, capacity: int):
+        self.array = None
+        if not self.path.exists():
+            self.path.touch()
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * self.row_bytes)
+        self.free = list(range(capacity - 1, self.capacity - 1, -1)) + self.free
+        self.capacity = capacity
+        if capacity > 0:
+            # Shared, writable mapping of the whole slab
+            self.array = torch.from_file(
+                str(self.path), shared=True, size=capacity * self.row_numel, dtype=self.dtype
+            ).view((capacity,) + tuple(self.shape))
+
+    def grow(self, rows: int = SLAB_GROW_ROWS):
+        self._resize(self.capacity + rows)
+
+    def read(self, slot: int) -> torch.Tensor:
+        return self.array[slot].clone()
+
+    def write(self, slot: int, value: torch.Tensor):
+        self.array[slot].copy_(value)
+
+
+class GenerationResultCache:
+    """
+    In-memory LRU + on-disk memory-mapped cache of generated samples.
+
+    get_many / put_many work on per-sample keys (see result_key); cached_generate
+    wraps a generation function so only cache misses are generated.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        memory_max_mb: float = 256.0,
+        disk_max_gb: float = 10.0,
+        ttl_hours: Optional[float] = None,
+        enable_disk: bool = True,
+    ):
+        """
+        Args:
+            cache_dir: Disk tier directory (default: get_default_result_cache_dir())
+            memory_max_mb: Size cap of the in-memory LRU tier (0 disables it)
+            disk_max_gb: Size cap of live disk entries; least recently used entries are evicted
+            ttl_hours: Entries older than this are treated as misses and removed (None: no expiry)
+            enable_disk: Memory tier only when False
+        """
+        self.memory_max_bytes = int(memory_max_mb * 1024 ** 2)
+        self.disk_max_bytes = int(disk_max_gb * 1024 ** 3)
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+
+        self._memory: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expired': 0,
+        }
+
+        self.cache_dir: Optional[Path] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._slabs: Dict[str, _Slab] = {}
+        self._disk_total = 0  # Running SUM(nbytes) of the entries table
+        if enable_disk:
+            self.cache_dir = Path(cache_dir) if cache_dir is not None else get_default_result_cache_dir()
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._open_index()
+
+    # ------------------------------------------------------------------ disk tier
+
+    def _open_index(self):
+        self._db = sqlite3.connect(str(self.cache_dir / INDEX_NAME), check_same_thread=False, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS slabs ("
+            "name TEXT PRIMARY KEY, dtype TEXT, shape TEXT, capacity INTEGER)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slab TEXT, slot INTEGER, nbytes INTEGER, "
+            "created REAL, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+        self._db.commit()
+
+        for name, dtype, shape, capacity in self._db.execute("SELECT name, dtype, shape, capacity FROM slabs"):
+            used = [slot for (slot,) in self._db.execute("SELECT slot FROM entries WHERE slab = ?", (name,))]
+            self._slabs[name] = _Slab(
+                self.cache_dir / f"{name}.bin",
+                tuple(json.loads(shape)),
+                getattr(torch, dtype.replace("torch.", "")),
+                capacity,
+                used,
+            )
+        self._disk_total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        self.purge_expired()
+
+    def _get_slab(self, shape: Tuple[int, ...], dtype: torch.dtype) -> _Slab:
+        name = _slab_name(shape, dtype)
+        if name not in self._slabs:
+            self._slabs[name] = _Slab(self.cache_dir / f"{name}.bin", shape, dtype, 0, [])
+            self._db.execute(
+                "INSERT OR REPLACE INTO slabs VALUES (?, ?, ?, 0)", (name, str(dtype), json.dumps(list(shape)))
+            )
+        return self._slabs[name]
+
+    def _disk_bytes(self) -> int:
+        return self._disk_total
+
+    def _delete_entries(self, rows: Sequence[Tuple[str, str, int, int]]):
+        """Delete (key, slab, slot, nbytes) rows and free their slots."""
+        for key, slab_name, slot, nbytes in rows:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._disk_total -= nbytes
+            slab = self._slabs.get(slab_name)
+            if slab is not None:
+                slab.free.append(slot)
+
+    def _evict_for(self, nbytes: int):
+        """Evict least recently used disk entries until nbytes more fit in the budget."""
+        excess = self._disk_total + nbytes - self.disk_max_bytes
+        while excess > 0:
+            row = self._db.execute(
+                "SELECT key, slab, slot, nbytes FROM entries ORDER BY last_access LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._delete_entries([row])
+            self.stats['evictions'] += 1
+            excess -= row[3]
+
+    def purge_expired(self) -> int:
+        """Remove disk entries older than the TTL; returns the number removed."""
+        if self._db is None or self.ttl_seconds is None:
+            return 0
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            rows = self._db.execute("SELECT key, slab, slot, nbytes FROM entries WHERE created < ?", (cutoff,)).fetchall()
+            self._delete_entries(rows)
+            self._db.commit()
+            self.stats['expired'] += len(rows)
+            return len(rows)
+
+    def _disk_get(self, keys: Sequence[str]) -> Dict[str, torch.Tensor]:
+        found = {}
+        now = time.time()
+        expired = []
+        for key in keys:
+            row = self._db.execute("SELECT slab, slot, created, nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                continue
+            slab_name, slot, created, nbytes = row
+            if self.ttl_seconds is not None and created < now - self.ttl_seconds:
+                expired.append((key, slab_name, slot, nbytes))
+                continue
+            found[key] = self._slabs[slab_name].read(slot)
+        if found:
+            self._db.executemany(
+                "UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+            )
+        if expired:
+            self._delete_entries(expired)
+            self.stats['expired'] += len(expired)
+        self._db.commit()
+        return found
+
+    def _disk_put(self, key: str, value: torch.Tensor):
+        nbytes = _tensor_nbytes(value)
+        if nbytes > self.disk_max_bytes:
+            return
+        existing = self._db.execute("SELECT slab, slot, nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+        if existing is not None:
+            self._delete_entries([(key,) + tuple(existing)])
+
+        self._evict_for(nbytes)
+        slab = self._get_slab(tuple(value.shape), value.dtype)
+        if not slab.free:
+            slab.grow()
+            self._db.execute("UPDATE slabs SET capacity = ? WHERE name = ?", (slab.capacity, _slab_name(slab.shape, slab.dtype)))
+        slot = slab.free.pop()
+        slab.write(slot, value)
+
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, _slab_name(slab.shape, slab.dtype), slot, nbytes, now, now),
+        )
+        self._disk_total += nbytes
+
+    # ---------------------------------------------------------------- memory tier
+
+    def _memory_get(self, key: str) -> Optional[torch.Tensor]:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: torch.Tensor):
+        nbytes = _tensor_nbytes(value)
+        if nbytes > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= _tensor_nbytes(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _tensor_nbytes(evicted)
+
+    # ------------------------------------------------------------------ public API
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, torch.Tensor]:
+        """Cached samples (CPU tensors) for the keys that hit; disk hits are promoted to memory."""
+        with self._lock:
+            found = {}
+            remaining = []
+            for key in keys:
+                value = self._memory_get(key)
+                if value is not None:
+                    found[key] = value
+                else:
+                    remaining.append(key)
+            self.stats['memory_hits'] += len(found)
+
+            if remaining and self._db is not None:
+                disk_found = self._disk_get(remaining)
+                for key, value in disk_found.items():
+                    self._memory_put(key, value)
+                found.update(disk_found)
+                self.stats['disk_hits'] += len(disk_found)
+
+            self.stats['misses'] += sum(1 for key in keys if key not in found)
+            return found
+
+    def put_many(self, keys: Sequence[str], values: torch.Tensor):
+        """Store one generated sample per key (values[i] belongs to keys[i])."""
+        if len(keys) != values.shape[0]:
+            raise ValueError(f"{len(keys)} keys for {values.shape[0]} samples")
+        values = values.detach().cpu()
+        with self._lock:
+            for key, value in zip(keys, values):
+                value = value.clone()
+                self._memory_put(key, value)
+                if self._db is not None:
+                    self._disk_put(key, value)
+            if self._db is not None:
+                self._db.commit()
+            self.stats['stores'] += len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit / miss counters plus tier sizes."""
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_mb'] = self._memory_bytes / 1024 ** 2
+            if self._db is not None:
+                stats['disk_entries'] = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                stats['disk_mb'] = self._disk_bytes() / 1024 ** 2
+            return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def clear(self):
+        """Drop every entry from both tiers (slab files are truncated)."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.execute("DELETE FROM slabs")
+                self._db.commit()
+                self._disk_total = 0
+                for slab in self._slabs.values():
+                    slab.array = None
+                    slab.path.unlink(missing_ok=True)
+                self._slabs.clear()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+            self._slabs.clear()
+
+    def cached_generate(
+        self,
+        generate_fn: GenerateFn,
+        eva_embeddings: torch.Tensor,
+        namespace: str,
+        seed: Optional[int] = None,
+        sample_shape: Optional[Tuple[int, ...]] = None,
+        batch_size: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        generate_fn(eva, noise) for the cache misses only; outputs in input order.
+
+        With a seed (and sample_shape), each miss gets its per-sample noise from
+        sample_noise(); with batch_size, misses are generated in fixed-size
+        chunks (generate_in_fixed_batches). Together they make cached and freshly
+        generated samples identical regardless of how samples are batched.
+        """
+        eva_hashes = [hash_item(row) for row in eva_embeddings]
+        keys = [result_key(namespace, eva_hash) for eva_hash in eva_hashes]
+        found = self.get_many(keys)
+
+        miss_rows = [i for i, key in enumerate(keys) if key not in found]
+        if miss_rows:
+            noise = None
+            if seed is not None and sample_shape is not None:
+                noise = sample_noise(
+                    [eva_hashes[i] for i in miss_rows], seed, sample_shape,
+                    device=eva_embeddings.device, dtype=eva_embeddings.dtype,
+                )
+            if batch_size is not None:
+                generated = generate_in_fixed_batches(generate_fn, eva_embeddings[miss_rows], noise, batch_size)
+            else:
+                generated = generate_fn(eva_embeddings[miss_rows], noise)
+            generated = generated.detach().cpu()
+            self.put_many([keys[i] for i in miss_rows], generated)
+            found.update(zip((keys[i] for i in miss_rows), generated))
+
+        return torch.stack([found[key] for key in keys])
+
+
+def create_result_cache(
+    cache_dir: Optional[Union[str, Path]] = None,
+    **kwargs
+) -> GenerationResultCache:
+    """Factory function for GenerationResultCache."""
+    return GenerationResultCache(cache_dir=cache_dir, **kwargs)
+
+
+__all__ = [
+    "GenerationResultCache",
+    "create_result_cache",
+    "checkpoint_fingerprint",
+    "generation_namespace",
+    "result_key",
+    "sample_noise",
+    "sample_generators",
+    "draw_noise",
+    "generate_in_fixed_batches",
+    "get_default_result_cache_dir",
+]
@@ -0,0 +1,598 @@
+"""
+Dynamic-batching serving layer for BLIP3-o generation.
+
+Calling BLIP3oInference.generate per request runs the full sampling loop at
+whatever batch size arrives (often 1), so the GPU spends most of its time on
+tiny kernels. DynamicBatchingServer queues incoming EVA conditioning, forms
+batches under a max-latency deadline (first request's arrival + max_wait_ms,
+or max_batch_size rows, whichever comes first), runs one batched generate on
+a dedicated worker thread and resolves per-request futures. Requests queue up
+while a batch is running, so batches grow with load.
+
+A small HTTP/1.1 front end (TCP or Unix socket) is included:
+- POST /generate: JSON {"eva_embeddings": [[...]], "num_inference_steps": 50}
+  or a torch.save'd tensor (application/octet-stream); answers in the same format
+- GET /metrics: queue depth, batch sizes, p50/p99 latency
+- GET /health
+
+Usage:
+    python -m src.modules.inference.serving --model_path ./checkpoints/blip3o --port 8765
+"""
+
+import io
+import json
+import time
+import torch
+import asyncio
+import logging
+import argparse
+import http.client
+import socket
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+GenerateFn = Callable[[torch.Tensor, int], torch.Tensor]
+
+
+class ServingMetrics:
+    """Request / batch counters and a sliding window of request latencies."""
+
+    def __init__(self, window: int = 10000):
+        self.latencies_ms: Deque[float] = deque(maxlen=window)
+        self.queue_wait_ms: Deque[float] = deque(maxlen=window)
+        self.batch_sizes: Deque[int] = deque(maxlen=window)
+        self.num_requests = 0
+        self.num_samples = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.max_queue_depth = 0
+        self.generate_time_s = 0.0
+        self.start_time = time.time()
+
+    def record_queue_depth(self, depth: int):
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def record_batch(self, num_requests: int, num_rows: int, generate_time_s: float):
+        self.num_batches += 1
+        self.num_samples += num_rows
+        self.batch_sizes.append(num_rows)
+        self.generate_time_s += generate_time_s
+
+    def record_request(self, latency_s: float, queue_wait_s: float, error: bool = False):
+        self.num_requests += 1
+        self.num_errors += int(error)
+        self.latencies_ms.append(latency_s * 1000.0)
+        self.queue_wait_ms.append(queue_wait_s * 1000.0)
+
+    @staticmethod
+    def _percentiles(values: Deque[float]) -> Dict[str, float]:
+        if not values:
+            return {'p50': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+        array = np.asarray(values)
+        return {
+            'p50': float(np.percentile(array, 50)),
+            'p99': float(np.percentile(array, 99)),
+            'mean': float(array.mean()),
+            'max': float(array.max()),
+        }
+
+    def snapshot(self, queue_depth: int = 0) -> Dict[str, Any]:
+        uptime = time.time() - self.start_time
+        return {
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'num_requests': self.num_requests,
+            'num_samples': self.num_samples,
+            'num_batches': self.num_batches,
+            'num_errors': self.num_errors,
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            'max_batch_size': max(self.batch_sizes) if self.batch_sizes else 0,
+            'latency_ms': self._percentiles(self.latencies_ms),
+            'queue_wait_ms': self._percentiles(self.queue_wait_ms),
+            'generate_utilization': self.generate_time_s / uptime if uptime > 0 else 0.0,
+            'samples_per_second': self.num_samples / uptime if uptime > 0 else 0.0,
+            'uptime_s': uptime,
+        }
+
+
+class _PendingRequest:
+    __slots__ = ('eva_embeddings', 'num_inference_steps', 'future', 'arrival')
+
+    def __init__(self, eva_embeddings: torch.Tensor, num_inference_steps: int, future: asyncio.Future):
+        self.eva_embeddings = eva_embeddings
+        self.num_inference_steps = num_inference_steps
+        self.future = future
+        self.arrival = time.perf_counter()
+
+    @property
+    def num_rows(self) -> int:
+        return self.eva_embeddings.shape[0]
+
+
+class DynamicBatchingServer:
+    """
+    asyncio request queue + deadline batcher in front of a batched generate function.
+
+    Only requests with the same num_inference_steps share a batch. Generation
+    runs on a single worker thread, so the event loop stays responsive.
+    """
+
+    def __init__(
+        self,
+        generate_fn: GenerateFn,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        num_inference_steps: int = 50,
+        max_queue_size: int = 4096,
+        sample_shape: Optional[Tuple[int, ...]] = None,
+    ):
+        """
+        Args:
+            generate_fn: (eva_embeddings [B, T, D], num_inference_steps) -> [B, ...]
+            max_batch_size: Maximum rows per generate call
+            max_wait_ms: Maximum time the first request of a batch waits for company
+            num_inference_steps: Default number of sampling steps
+            max_queue_size: Requests beyond this are rejected (backpressure)
+            sample_shape: Expected [T, D] of one conditioning sample (validated in submit if
+                given; without it, only requests of the same shape are batched together)
+        """
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self.num_inference_steps = num_inference_steps
+        self.max_queue_size = max_queue_size
+        self.sample_shape = tuple(sample_shape) if sample_shape is not None else None
+
+        self.metrics = ServingMetrics()
+        self._queue: Optional[asyncio.Queue] = None
+        self._carry: Optional[_PendingRequest] = None
+        self._inflight: List[_PendingRequest] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._batcher: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._batcher is not None and not self._batcher.done()
+
+    @property
+    def queue_depth(self) -> int:
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return depth + (1 if self._carry is not None else 0)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blip3o-generate")
+        self._batcher = asyncio.create_task(self._batch_loop())
+        logger.info(f"Dynamic batching server started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait_ms={self.max_wait_s * 1000:.1f})")
+
+    async def stop(self):
+        """Stop batching; requests still queued are failed."""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+
+        pending = list(self._inflight) + ([self._carry] if self._carry is not None else [])
+        self._inflight, self._carry = [], None
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Server stopped"))
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self) -> "DynamicBatchingServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def submit(
+        self,
+        eva_embeddings: torch.Tensor,
+        num_inference_steps: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        Queue one request and wait for its result.
+
+        Args:
+            eva_embeddings: [T, D] (one sample) or [b, T, D]
+            num_inference_steps: Sampling steps (default: server default)
+
+        Returns:
+            Generated embeddings for the request ([...] or [b, ...], matching the input)
+        """
+        if not self.running:
+            raise RuntimeError("Server is not running; call start() first")
+
+        single = eva_embeddings.dim() == 2
+        batch = eva_embeddings.unsqueeze(0) if single else eva_embeddings
+        if batch.dim() != 3 or batch.shape[0] == 0:
+            raise ValueError(f"Expected [T, D] or [b, T, D] conditioning, got {tuple(eva_embeddings.shape)}")
+        if self.sample_shape is not None and tuple(batch.shape[1:]) != self.sample_shape:
+            raise ValueError(f"Expected samples of shape {self.sample_shape}, got {tuple(batch.shape[1:])}")
+        if batch.shape[0] > self.max_batch_size:
+            raise ValueError(f"Request of {batch.shape[0]} samples exceeds max_batch_size={self.max_batch_size}")
+        if self._queue.full():
+            raise RuntimeError(f"Queue full ({self.max_queue_size} requests)")
+
+        future = asyncio.get_running_loop().create_future()
+        request = _PendingRequest(batch.detach().cpu(), num_inference_steps or self.num_inference_steps, future)
+        self._queue.put_nowait(request)
+        self.metrics.record_queue_depth(self.queue_depth)
+
+        result = await future
+        return result[0] if single else result
+
+    async def _next_request(self, timeout: Optional[float]) -> Optional[_PendingRequest]:
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            return self._queue.get_nowait() if not self._queue.empty() else None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _collect_batch(self) -> List[_PendingRequest]:
+        """First request + compatible followers (same steps and sample shape) until the deadline or max_batch_size rows."""
+        first = await self._next_request(None)
+        batch, rows = [first], first.num_rows
+        deadline = first.arrival + self.max_wait_s
+
+        while rows < self.max_batch_size:
+            request = await self._next_request(deadline - time.perf_counter())
+            if request is None:
+                break
+            if (request.num_inference_steps != first.num_inference_steps or
+                    request.eva_embeddings.shape[1:] != first.eva_embeddings.shape[1:] or
+                    rows + request.num_rows > self.max_batch_size):
+                self._carry = request  # Starts the next batch
+                break
+            batch.append(request)
+            rows += request.num_rows
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            # Drop requests whose callers went away
+            batch = [request for request in batch if not request.future.cancelled()]
+            if not batch:
+                continue
+
+            num_rows = sum(request.num_rows for request in batch)
+            steps = batch[0].num_inference_steps
+            dispatch = time.perf_counter()
+            self._inflight = batch
+            try:
+                # Inside the try: a bad batch fails its own requests, never the loop
+                eva_embeddings = torch.cat([request.eva_embeddings for request in batch], dim=0)
+                outputs = await loop.run_in_executor(self._executor, self._run_generate, eva_embeddings, steps)
+                if outputs.shape[0] != num_rows:
+                    raise RuntimeError(f"generate returned {outputs.shape[0]} rows for {num_rows} inputs")
+                error = None
+            except Exception as e:
+                logger.error(f"Batch generation failed ({len(batch)} requests): {e}")
+                outputs, error = None, e
+            finished = time.perf_counter()
+            self._inflight = []
+            self.metrics.record_batch(len(batch), num_rows, finished - dispatch)
+
+            start = 0
+            for request in batch:
+                if not request.future.done():
+                    if error is not None:
+                        request.future.set_exception(error)
+                    else:
+                        request.future.set_result(outputs[start:start + request.num_rows])
+                start += request.num_rows
+                self.metrics.record_request(finished - request.arrival, dispatch - request.arrival, error is not None)
+
+    def _run_generate(self, eva_embeddings: torch.Tensor, num_inference_steps: int) -> torch.Tensor:
+        with torch.no_grad():
+            return self.generate_fn(eva_embeddings, num_inference_steps).detach().cpu()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return self.metrics.snapshot(self.queue_depth)
+
+
+# ---------------------------------------------------------------------------
+# HTTP front end
+# ---------------------------------------------------------------------------
+
+def _serialize_tensor(tensor: torch.Tensor) -> bytes:
+    buffer = io.BytesIO()
+    torch.save(tensor, buffer)
+    return buffer.getvalue()
+
+
+def _deserialize_tensor(data: bytes) -> torch.Tensor:
+    return torch.load(io.BytesIO(data), map_location="cpu", weights_only=True)
+
+
+class ServingHTTPFrontend:
+    """Minimal HTTP/1.1 front end (one request per connection) over TCP or a Unix socket."""
+
+    STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable", 500: "Internal Server Error"}
+
+    def __init__(
+        self,
+        server: DynamicBatchingServer,
+        host: str = "127.0.0.1",
+        port: Optional[int] = 8765,
+        unix_socket: Optional[str] = None,
+        max_body_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.max_body_bytes = max_body_bytes
+        self._listener: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        await self.server.start()
+        if self.unix_socket:
+            Path(self.unix_socket).unlink(missing_ok=True)
+            self._listener = await asyncio.start_unix_server(self._handle, path=self.unix_socket)
+            logger.info(f"Serving on unix socket {self.unix_socket}")
+        else:
+            self._listener = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._listener.sockets[0].getsockname()[1]
+            logger.info(f"Serving on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.close()
+            await self._listener.wait_closed()
+            self._listener = None
+        await self.server.stop()
+        if self.unix_socket:
+            Path(self.unix_socket).unlink(missing_ok=True)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._listener.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0))
+            if length > self.max_body_bytes:
+                status, content_type, body = 400, "application/json", json.dumps({'error': 'Body too large'}).encode()
+            else:
+                payload = await reader.readexactly(length) if length else b""
+                status, content_type, body = await self._dispatch(method, path, headers, payload)
+        except Exception as e:
+            status, content_type, body = 500, "application/json", json.dumps({'error': str(e)}).encode()
+
+        writer.write(
+            f"HTTP/1.1 {status} {self.STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], payload: bytes) -> Tuple[int, str, bytes]:
+        if method == "GET" and path == "/health":
+            return 200, "application/json", json.dumps({'status': 'ok' if self.server.running else 'stopped'}).encode()
+        if method == "GET" and path == "/metrics":
+            return 200, "application/json", json.dumps(self.server.get_metrics()).encode()
+        if method != "POST" or not path.startswith("/generate"):
+            return 404, "application/json", json.dumps({'error': f'Unknown endpoint {method} {path}'}).encode()
+
+        binary = headers.get("content-type", "").startswith("application/octet-stream")
+        try:
+            if binary:
+                eva_embeddings = _deserialize_tensor(payload)
+                steps = headers.get("x-num-inference-steps")
+                steps = int(steps) if steps else None
+            else:
+                request = json.loads(payload)
+                eva_embeddings = torch.tensor(request["eva_embeddings"], dtype=torch.float32)
+                steps = request.get("num_inference_steps")
+        except Exception as e:
+            return 400, "application/json", json.dumps({'error': f'Invalid request: {e}'}).encode()
+
+        try:
+            result = await self.server.submit(eva_embeddings, steps)
+        except ValueError as e:
+            return 400, "application/json", json.dumps({'error': str(e)}).encode()
+        except RuntimeError as e:
+            return 503, "application/json", json.dumps({'error': str(e)}).encode()
+
+        if binary:
+            return 200, "application/octet-stream", _serialize_tensor(result)
+        return 200, "application/json", json.dumps({'embeddings': result.float().tolist()}).encode()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float = 300.0):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request_generation(
+    eva_embeddings: torch.Tensor,
+    host: str = "127.0.0.1",
+    port: Optional[int] = 8765,
+    unix_socket: Optional[str] = None,
+    num_inference_steps: Optional[int] = None,
+    timeout: float = 300.0,
+) -> torch.Tensor:
+    """Blocking client for POST /generate (binary tensor transport)."""
+    connection = (
+        _UnixHTTPConnection(unix_socket, timeout) if unix_socket
+        else http.client.HTTPConnection(host, port, timeout=timeout)
+    )
+    headers = {"Content-Type": "application/octet-stream"}
+    if num_inference_steps is not None:
+        headers["X-Num-Inference-Steps"] = str(num_inference_steps)
+    try:
+        connection.request("POST", "/generate", body=_serialize_tensor(eva_embeddings.cpu()), headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Generation request failed ({response.status}): {body.decode(errors='replace')}")
+        return _deserialize_tensor(body)
+    finally:
+        connection.close()
+
+
+def request_metrics(
+    host: str = "127.0.0.1",
+    port: Optional[int] = 8765,
+    unix_socket: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Blocking client for GET /metrics."""
+    connection = _UnixHTTPConnection(unix_socket) if unix_socket else http.client.HTTPConnection(host, port)
+    try:
+        connection.request("GET", "/metrics")
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def create_serving_server(
+    inference,
+    max_batch_size: int = 32,
+    max_wait_ms: float = 10.0,
+    num_inference_steps: int = 50,
+    **kwargs
+) -> DynamicBatchingServer:
+    """
+    DynamicBatchingServer around a BLIP3oInference pipeline.
+
+    Rows are validated against the model config; generation goes through
+    BLIP3oInference.generate (and its compiled sampler, when enabled).
+    """
+    config = inference.config
+    sample_shape = (config.input_size * config.input_size, config.eva_embedding_size)
+
+    def generate_fn(eva_embeddings: torch.Tensor, steps: int) -> torch.Tensor:
+        return inference.generate(eva_embeddings, num_inference_steps=steps)
+
+    return DynamicBatchingServer(
+        generate_fn=generate_fn,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        num_inference_steps=num_inference_steps,
+        sample_shape=sample_shape,
+        **kwargs
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLIP3-o dynamic-batching inference server")
+    parser.add_argument("--model_path", type=str, required=True,
+                        help="Path to trained BLIP3-o model")
+    parser.add_argument("--device", type=str, default="auto",
+                        help="Device to use (auto, cuda, cpu)")
+    parser.add_argument("--use_ema_weights", action="store_true",
+                        help="Serve the EMA weights (ema_model.safetensors)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="TCP host")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="TCP port")
+    parser.add_argument("--unix_socket", type=str, default=None,
+                        help="Serve on a Unix socket instead of TCP")
+    parser.add_argument("--max_batch_size", type=int, default=32,
+                        help="Maximum samples per batched generate")
+    parser.add_argument("--max_wait_ms", type=float, default=10.0,
+                        help="Maximum batching delay of the first request in a batch")
+    parser.add_argument("--num_inference_steps", type=int, default=50,
+                        help="Default number of sampling steps")
+    parser.add_argument("--compiled_sampling", action="store_true",
+                        help="Route generation through the compiled / CUDA-graph sampler")
+    parser.add_argument("--continuous_batching", action="store_true",
+                        help="Step-level continuous batching instead of request-level batches")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    from .blip3o_inference import BLIP3oInference
+
+    inference = BLIP3oInference(
+        model_path=args.model_path, device=args.device, use_ema_weights=args.use_ema_weights,
+    )
+    if args.continuous_batching:
+        from .continuous_batching import ContinuousBatchingServer
+
+        server = ContinuousBatchingServer(
+            inference.model,
+            max_batch_size=args.max_batch_size,
+            num_inference_steps=args.num_inference_steps,
+        )
+    else:
+        if args.compiled_sampling:
+            inference.enable_compiled_sampling(batch_size=args.max_batch_size,
+                                               num_inference_steps=args.num_inference_steps)
+        server = create_serving_server(
+            inference,
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms,
+            num_inference_steps=args.num_inference_steps,
+        )
+    frontend = ServingHTTPFrontend(server, host=args.host, port=args.port, unix_socket=args.unix_socket)
+
+    print(f"🚀 BLIP3-o server: max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms}")
+    try:
+        asyncio.run(frontend.serve_forever())
+    except KeyboardInterrupt:
+        print("🛑 Server stopped")
+
+
+__all__ = [
+    "ServingMetrics",
+    "DynamicBatchingServer",
+    "ServingHTTPFrontend",
+    "request_generation",
+    "request_metrics",
+    "create_serving_server",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -2,31 +2,43 @@
 Loss functions module for BLIP3-o DiT - FIXED for Dual Supervision
 """
 
-from .flow_matching_loss import (
-    FlowMatchingLoss,
-    BLIP3oFlowMatchingLoss,
-    create_blip3o_flow_matching_loss,
-)
+from ..utils.lazy_imports import lazy_exports
 
-# Import dual supervision components with better error handling
-DUAL_SUPERVISION_AVAILABLE = False
-try:
-    from .dual_supervision_flow_matching_loss import (
-        DualSupervisionFlowMatchingLoss,
-        create_dual_supervision_loss,
-    )
-    DUAL_SUPERVISION_AVAILABLE = True
-    print("✅ Dual supervision loss loaded successfully")
-    
-except ImportError as e:
-    DUAL_SUPERVISION_AVAILABLE = False
-    print(f"⚠️ Dual supervision loss import failed: {e}")
-    print("⚠️ Dual supervision loss not available")
+
+def _resolve_dual_supervision():
+    """Import the dual supervision loss on first use (sets DUAL_SUPERVISION_AVAILABLE)."""
+    global DUAL_SUPERVISION_AVAILABLE, DualSupervisionFlowMatchingLoss, create_dual_supervision_loss
     
-except Exception as e:
+    # Import dual supervision components with better error handling
     DUAL_SUPERVISION_AVAILABLE = False
-    print(f"⚠️ Unexpected error loading dual supervision loss: {e}")
-    print("⚠️ Dual supervision loss not available")
+    try:
+        from .dual_supervision_flow_matching_loss import (
+            DualSupervisionFlowMatchingLoss,
+            create_dual_supervision_loss,
+        )
+        DUAL_SUPERVISION_AVAILABLE = True
+        print("✅ Dual supervision loss loaded successfully")
+        
+    except ImportError as e:
+        DUAL_SUPERVISION_AVAILABLE = False
+        print(f"⚠️ Dual supervision loss import failed: {e}")
+        print("⚠️ Dual supervision loss not available")
+        
+    except Exception as e:
+        DUAL_SUPERVISION_AVAILABLE = False
+        print(f"⚠️ Unexpected error loading dual supervision loss: {e}")
+        print("⚠️ Dual supervision loss not available")
+
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "FlowMatchingLoss": ".flow_matching_loss",
+    "BLIP3oFlowMatchingLoss": ".flow_matching_loss",
+    "create_blip3o_flow_matching_loss": ".flow_matching_loss",
+    "DUAL_SUPERVISION_AVAILABLE": _resolve_dual_supervision,
+    "DualSupervisionFlowMatchingLoss": _resolve_dual_supervision,
+    "create_dual_supervision_loss": _resolve_dual_supervision,
+}
 
 __all__ = [
     "FlowMatchingLoss",
@@ -35,8 +47,4 @@ __all__ = [
     "DUAL_SUPERVISION_AVAILABLE",
 ]
 
-if DUAL_SUPERVISION_AVAILABLE:
-    __all__.extend([
-        "DualSupervisionFlowMatchingLoss",
-        "create_dual_supervision_loss",
-    ])
\ No newline at end of file
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
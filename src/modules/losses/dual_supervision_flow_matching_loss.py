@@ -6,6 +6,7 @@ KEY FIX: Adds global flow matching to train the model to generate directly in gl
 not just post-process from patches. This resolves the training-inference mismatch.
 """
 
+import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -55,6 +56,10 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         use_progressive_training: bool = True,
         min_timestep: float = 0.001,
         max_timestep: float = 0.999,
+        
+        # Flow matching draws (shared between trainer and loss)
+        noise_seed: Optional[int] = None,
+        reuse_noise_buffers: bool = False,
     ):
         super().__init__()
         
@@ -88,6 +93,13 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         self.max_timestep = max_timestep
         self.training_step = 0
         
+        # Per-step draws: optional seeded generator (offset by rank so DDP ranks
+        # do not share noise) and reusable buffers for the [B, 256, 1024] tensors
+        self.noise_seed = noise_seed
+        self.reuse_noise_buffers = reuse_noise_buffers
+        self._draw_generators: Dict[str, torch.Generator] = {}
+        self._draw_buffers: Dict[str, torch.Tensor] = {}
+        
         # Load frozen CLIP model for global loss computation
         self.clip_model_name = clip_model_name
         self._load_clip_model()
@@ -118,18 +130,93 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
             self.clip_visual_projection = nn.Linear(1024, 768, bias=False)
             self.clip_visual_projection.requires_grad_(False)
     
-    def sample_timesteps(self, batch_size: int, device: torch.device) -> torch.Tensor:
+    def sample_timesteps(
+        self,
+        batch_size: int,
+        device: torch.device,
+        generator: Optional[torch.Generator] = None,
+    ) -> torch.Tensor:
         """Enhanced timestep sampling with progressive training support."""
         if self.use_progressive_training and self.training:
             progress = min(1.0, self.training_step / 10000)
             t_min = self.min_timestep + (0.3 - self.min_timestep) * (1 - progress)
             t_max = 0.7 + (self.max_timestep - 0.7) * progress
-            timesteps = torch.rand(batch_size, device=device) * (t_max - t_min) + t_min
+            timesteps = torch.rand(batch_size, device=device, generator=generator) * (t_max - t_min) + t_min
         else:
-            timesteps = torch.rand(batch_size, device=device)
+            timesteps = torch.rand(batch_size, device=device, generator=generator)
         
         return timesteps
     
+    def _get_draw_generator(self, device: torch.device) -> Optional[torch.Generator]:
+        """Get the seeded generator for a device (None means the global RNG)."""
+        if self.noise_seed is None:
+            return None
+        
+        key = str(device)
+        if key not in self._draw_generators:
+            rank = int(os.environ.get("RANK", 0))
+            generator = torch.Generator(device=device)
+            generator.manual_seed(self.noise_seed + rank)
+            self._draw_generators[key] = generator
+        
+        return self._draw_generators[key]
+    
+    def _draw_normal(
+        self,
+        name: str,
+        like: torch.Tensor,
+        generator: Optional[torch.Generator],
+    ) -> torch.Tensor:
+        """Draw N(0, I) shaped like `like`, refilling a cached buffer when enabled."""
+        if not self.reuse_noise_buffers:
+            return torch.randn(like.shape, device=like.device, dtype=like.dtype, generator=generator)
+        
+        buffer = self._draw_buffers.get(name)
+        if (buffer is None or buffer.shape != like.shape or
+                buffer.device != like.device or buffer.dtype != like.dtype):
+            buffer = torch.empty_like(like, memory_format=torch.contiguous_format)
+            self._draw_buffers[name] = buffer
+        
+        return buffer.normal_(generator=generator)
+    
+    @torch.no_grad()
+    def sample_flow_draws(
+        self,
+        clip_patches: torch.Tensor,         # [B, 256, 1024]
+        global_dim: int = 768,
+        timesteps: Optional[torch.Tensor] = None,
+    ) -> Dict[str, torch.Tensor]:
+        """
+        Sample every random tensor needed for one flow matching step.
+        
+        The same draws must be used to build the noisy input (interpolate_data)
+        and the velocity target (forward), otherwise the target is computed
+        against a different source sample than the one the model saw.
+        
+        When reuse_noise_buffers is enabled the patch tensors are views of
+        cached buffers that are overwritten by the next call.
+        
+        Returns:
+            Dict with timesteps [B], x_0_patch / patch_noise [B, 256, 1024]
+            and x_0_global / global_noise [B, global_dim]
+        """
+        batch_size = clip_patches.shape[0]
+        device = clip_patches.device
+        generator = self._get_draw_generator(device)
+        
+        if timesteps is None:
+            timesteps = self.sample_timesteps(batch_size, device, generator=generator)
+        
+        global_like = clip_patches.new_empty((batch_size, global_dim))
+        
+        return {
+            'timesteps': timesteps,
+            'x_0_patch': self._draw_normal('x_0_patch', clip_patches, generator),
+            'patch_noise': self._draw_normal('patch_noise', clip_patches, generator),
+            'x_0_global': torch.randn(global_like.shape, device=device, dtype=global_like.dtype, generator=generator),
+            'global_noise': torch.randn(global_like.shape, device=device, dtype=global_like.dtype, generator=generator),
+        }
+    
     def get_noise_schedule(self, t: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         """Get noise schedule parameters for flow matching interpolation."""
         if self.schedule_type == "linear":
@@ -164,7 +251,9 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         while sigma_t.dim() < x_1.dim():
             sigma_t = sigma_t.unsqueeze(-1)
         
-        x_t = (1 - alpha_t) * x_0 + alpha_t * x_1 + sigma_t * noise
+        # x_t = (1 - alpha_t) * x_0 + alpha_t * x_1 + sigma_t * noise, in one output buffer
+        x_t = torch.lerp(x_0, x_1, alpha_t.to(x_1.dtype))
+        x_t.addcmul_(sigma_t.to(x_1.dtype), noise)
         return x_t
     
     def compute_velocity_target(
@@ -180,10 +269,10 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         
         if self.prediction_type == "v_prediction":
             if self.schedule_type == "linear":
-                dsigma_dt = -(self.sigma_max - self.sigma_min)
-                while t.dim() < x_1.dim():
-                    t = t.unsqueeze(-1)
-                dsigma_dt = torch.full_like(t, dsigma_dt)
+                # Constant d(sigma_t)/dt: v = x_1 - x_0 + (sigma_max - sigma_min) * noise
+                velocity_target = torch.sub(x_1, x_0)
+                velocity_target.add_(noise, alpha=self.sigma_max - self.sigma_min)
+                return velocity_target
             elif self.schedule_type == "cosine":
                 dsigma_dt = (self.sigma_max - self.sigma_min) * (math.pi / 2) * torch.sin(math.pi * t / 2)
                 while dsigma_dt.dim() < x_1.dim():
@@ -335,6 +424,7 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         timesteps: torch.Tensor,            # [B] - Timesteps
         eva_conditioning: Optional[torch.Tensor] = None,
         noise: Optional[torch.Tensor] = None,
+        flow_draws: Optional[Dict[str, torch.Tensor]] = None,
         
         return_metrics: bool = False,
     ) -> Tuple[torch.Tensor, Optional[Dict[str, float]]]:
@@ -343,6 +433,11 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         
         This is the KEY FIX that resolves the training-inference mismatch by training
         the model to generate directly in both patch and global spaces.
+        
+        Args:
+            flow_draws: Output of sample_flow_draws() that was used to build the
+                noisy model input. Velocity targets are computed from the same
+                x_0 / noise; any missing entries are sampled here.
         """
         batch_size = clip_patches.shape[0]
         device = clip_patches.device
@@ -353,20 +448,26 @@ class FixedDualSupervisionFlowMatchingLoss(nn.Module):
         # 2. Global-level supervision loss
         global_supervision_loss = self.compute_global_supervision_loss(dit_global_output, clip_global)
         
-        # FIXED: 3. Patch-level flow matching loss
-        if noise is None:
-            noise = torch.randn_like(clip_patches)
+        # Shared draws: reuse the trainer's x_0 / noise so targets match the model input
+        flow_draws = dict(flow_draws) if flow_draws is not None else {}
+        if noise is not None:
+            flow_draws.setdefault('patch_noise', noise)
+        required = ('x_0_patch', 'patch_noise', 'x_0_global', 'global_noise')
+        if any(key not in flow_draws for key in required):
+            sampled = self.sample_flow_draws(clip_patches, global_dim=clip_global.shape[-1], timesteps=timesteps)
+            for key in required:
+                flow_draws.setdefault(key, sampled[key])
         
-        # Create patch flow matching targets
-        x_0_patch = torch.randn_like(clip_patches)
-        patch_velocity_target = self.compute_velocity_target(x_0_patch, clip_patches, timesteps, noise)
+        # FIXED: 3. Patch-level flow matching loss
+        patch_velocity_target = self.compute_velocity_target(
+            flow_draws['x_0_patch'], clip_patches, timesteps, flow_draws['patch_noise']
+        )
         patch_flow_loss = self.compute_patch_flow_loss(dit_patch_output, patch_velocity_target)
         
         # FIXED: 4. Global-level flow matching loss (KEY FIX)
-        # Create global flow matching targets
-        x_0_global = torch.randn_like(clip_global)
-        global_noise = torch.randn_like(clip_global)
-        global_velocity_target = self.compute_velocity_target(x_0_global, clip_global, timesteps, global_noise)
+        global_velocity_target = self.compute_velocity_target(
+            flow_draws['x_0_global'], clip_global, timesteps, flow_draws['global_noise']
+        )
         global_flow_loss = self.compute_global_flow_loss(dit_global_output, global_velocity_target)
         
         # FIXED: Combined loss with proper weighting
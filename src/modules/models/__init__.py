@@ -2,46 +2,68 @@
 Model modules for BLIP3-o DiT - FIXED for Dual Supervision
 """
 
-from .blip3o_dit import (
-    BLIP3oDiTModel,
-    create_blip3o_dit_model as create_standard_blip3o_dit_model,
-)
+from ..utils.lazy_imports import lazy_exports
 
-# Import dual supervision model with better error handling
-DUAL_SUPERVISION_MODEL_AVAILABLE = False
-try:
-    from .dual_supervision_blip3o_dit import (
-        DualSupervisionBLIP3oDiTModel,
-        create_blip3o_dit_model as create_dual_supervision_blip3o_dit_model,
-        load_dual_supervision_blip3o_dit_model,
-    )
-    # Use dual supervision as default
-    create_blip3o_dit_model = create_dual_supervision_blip3o_dit_model
-    DUAL_SUPERVISION_MODEL_AVAILABLE = True
-    print("✅ Dual supervision model loaded successfully")
+
+def _resolve_dual_supervision():
+    """
+    Pick the dual supervision model as create_blip3o_dit_model if it imports,
+    else the standard one (on first use; sets DUAL_SUPERVISION_MODEL_AVAILABLE).
+    """
+    global create_blip3o_dit_model, DUAL_SUPERVISION_MODEL_AVAILABLE
+    global DualSupervisionBLIP3oDiTModel, load_dual_supervision_blip3o_dit_model
+    from .blip3o_dit import create_blip3o_dit_model as create_standard_blip3o_dit_model
     
-except ImportError as e:
-    # Use standard model as fallback
-    create_blip3o_dit_model = create_standard_blip3o_dit_model
+    # Import dual supervision model with better error handling
     DUAL_SUPERVISION_MODEL_AVAILABLE = False
-    print(f"⚠️ Dual supervision model import failed: {e}")
-    print("⚠️ Using standard model as fallback")
+    try:
+        from .dual_supervision_blip3o_dit import (
+            DualSupervisionBLIP3oDiTModel,
+            create_blip3o_dit_model as create_dual_supervision_blip3o_dit_model,
+            load_dual_supervision_blip3o_dit_model,
+        )
+        # Use dual supervision as default
+        create_blip3o_dit_model = create_dual_supervision_blip3o_dit_model
+        DUAL_SUPERVISION_MODEL_AVAILABLE = True
+        print("✅ Dual supervision model loaded successfully")
+        
+    except ImportError as e:
+        # Use standard model as fallback
+        create_blip3o_dit_model = create_standard_blip3o_dit_model
+        DUAL_SUPERVISION_MODEL_AVAILABLE = False
+        print(f"⚠️ Dual supervision model import failed: {e}")
+        print("⚠️ Using standard model as fallback")
+    
+    except Exception as e:
+        # Handle other errors
+        create_blip3o_dit_model = create_standard_blip3o_dit_model
+        DUAL_SUPERVISION_MODEL_AVAILABLE = False
+        print(f"⚠️ Unexpected error loading dual supervision model: {e}")
+        print("⚠️ Using standard model as fallback")
 
-except Exception as e:
-    # Handle other errors
-    create_blip3o_dit_model = create_standard_blip3o_dit_model
-    DUAL_SUPERVISION_MODEL_AVAILABLE = False
-    print(f"⚠️ Unexpected error loading dual supervision model: {e}")
-    print("⚠️ Using standard model as fallback")
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "BLIP3oDiTModel": ".blip3o_dit",
+    "create_standard_blip3o_dit_model": ".blip3o_dit:create_blip3o_dit_model",
+    "load_blip3o_checkpoint": ".checkpoint_loader",
+    "load_checkpoint_state_dict": ".checkpoint_loader",
+    "iter_checkpoint_tensors": ".checkpoint_loader",
+    "find_weight_file": ".checkpoint_loader",
+    "create_blip3o_dit_model": _resolve_dual_supervision,
+    "DUAL_SUPERVISION_MODEL_AVAILABLE": _resolve_dual_supervision,
+    "DualSupervisionBLIP3oDiTModel": _resolve_dual_supervision,
+    "load_dual_supervision_blip3o_dit_model": _resolve_dual_supervision,
+}
 
 __all__ = [
     "BLIP3oDiTModel",
     "create_blip3o_dit_model",
+    "load_blip3o_checkpoint",
+    "load_checkpoint_state_dict",
+    "iter_checkpoint_tensors",
+    "find_weight_file",
     "DUAL_SUPERVISION_MODEL_AVAILABLE",
 ]
 
-if DUAL_SUPERVISION_MODEL_AVAILABLE:
-    __all__.extend([
-        "DualSupervisionBLIP3oDiTModel",
-        "load_dual_supervision_blip3o_dit_model",
-    ])
\ No newline at end of file
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
@@ -14,15 +14,23 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from typing import Optional, Dict, Any, Tuple, List, Union
-from transformers import PreTrainedModel, CLIPModel
+from transformers import PreTrainedModel
 import math
 
 # Import our fixed config
-from ..config.blip3o_config import BLIP3oDiTConfig
+from ..config.blip3o_config import BLIP3oDiTConfig, GRADIENT_CHECKPOINTING_POLICIES
+from .sequence_parallel import (
+    get_sequence_parallel_info,
+    get_token_shard,
+    gather_tokens,
+    shard_tokens,
+    chunked_scaled_dot_product_attention,
+)
+from ..utils.instrumentation import SAMPLING_STEP, timer
 
 
 def get_3d_rotary_pos_embed(embed_dim, grid_size, temporal_size=1, base=10000.0):
-    """Create 3D rotary position embeddings for 256 tokens (16x16 grid)"""
+    """Create 3D rotary position embeddings for grid_size x grid_size tokens (256 for the default 16x16 grid)"""
     assert embed_dim % 4 == 0, f"embed_dim {embed_dim} must be divisible by 4 for 3D RoPE"
     dim_h = embed_dim // 4
     dim_w = embed_dim // 4
@@ -90,26 +98,42 @@ def apply_rotary_pos_emb(q, k, cos, sin):
 
 
 class SimpleTokenEmbedder(nn.Module):
-    """Simple embedding layer for pre-tokenized BLIP3-o features (256 tokens)"""
+    """Simple embedding layer for pre-tokenized BLIP3-o features (grid_size x grid_size tokens, 256 by default)"""
     
-    def __init__(self, in_channels: int, embed_dim: int, num_tokens: int = 256):
+    def __init__(self, in_channels: int, embed_dim: int, num_tokens: int = 256, grid_size: Optional[int] = None):
         super().__init__()
         self.in_channels = in_channels
         self.embed_dim = embed_dim
         self.num_tokens = num_tokens
+        self.grid_size = grid_size or int(math.isqrt(num_tokens))
+        assert self.grid_size * self.grid_size == num_tokens, f"{num_tokens} tokens do not form a square grid"
         
         self.proj = nn.Linear(in_channels, embed_dim, bias=True)
         self.pos_embed = nn.Parameter(torch.randn(1, num_tokens, embed_dim) * 0.02)
+    
+    def reset_parameters(self):
+        """Re-draw the positional embedding (e.g. when a checkpoint does not contain it)."""
+        nn.init.normal_(self.pos_embed, std=0.02)
+        
+    def embed(self, x: torch.Tensor, token_range: Optional[Tuple[int, int]] = None) -> torch.Tensor:
+        """
+        Projection + positional embedding only (no checks, no mask) for static-shape paths.
         
+        token_range: (start, end) grid positions of x when it holds a token shard
+        """
+        pos_embed = self.pos_embed
+        if token_range is not None:
+            pos_embed = pos_embed[:, token_range[0]:token_range[1]]
+        return self.proj(x) + pos_embed
+    
     def forward(self, x: torch.Tensor, image_rotary_emb: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
         batch_size, num_tokens, in_channels = x.shape
         assert num_tokens == self.num_tokens, f"Expected {self.num_tokens} tokens, got {num_tokens}"
         assert in_channels == self.in_channels, f"Expected {self.in_channels} channels, got {in_channels}"
         
-        embedded = self.proj(x)
-        embedded = embedded + self.pos_embed
+        embedded = self.embed(x)
         attention_mask = torch.ones(batch_size, num_tokens, device=x.device, dtype=torch.bool)
-        img_size = [(16, 16)] * batch_size
+        img_size = [(self.grid_size, self.grid_size)] * batch_size
         
         return embedded, attention_mask, img_size, image_rotary_emb
 
@@ -123,12 +147,20 @@ class BLIP3oAttentionBlock(nn.Module):
         num_attention_heads: int,
         cross_attention_dim: int,
         norm_eps: float = 1e-5,
+        attention_chunk_size: Optional[int] = None,
     ):
         super().__init__()
         self.dim = dim
         self.num_attention_heads = num_attention_heads
         self.head_dim = dim // num_attention_heads
         
+        # Queries per attention chunk (None = full attention matrix)
+        self.attention_chunk_size = attention_chunk_size
+        # Set by BLIP3oDiTModel.enable_sequence_parallel: hidden states hold a token
+        # shard and self-attention keys/values are gathered across the group
+        self.sequence_parallel = False
+        self.sequence_parallel_group = None
+        
         # Self-attention projections
         self.q_proj = nn.Linear(dim, dim, bias=True)
         self.k_proj = nn.Linear(dim, dim, bias=True)
@@ -162,6 +194,10 @@ class BLIP3oAttentionBlock(nn.Module):
         # Timestep conditioning
         self.time_proj = nn.Linear(dim, dim * 6)
         
+        # Sub-block activation checkpointing (set by the model's checkpointing policy)
+        self.checkpoint_attention = False
+        self.checkpoint_ffn = False
+        
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -171,13 +207,53 @@ class BLIP3oAttentionBlock(nn.Module):
         encoder_mask: Optional[torch.Tensor] = None,
         image_rotary_emb: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
     ) -> torch.Tensor:
-        batch_size, seq_len, _ = hidden_states.shape
-        assert seq_len == 256, f"Expected 256 tokens, got {seq_len}"
-        
         # Get timestep conditioning
         time_cond = self.time_proj(timestep_emb)
         scale_msa, gate_msa, scale_mlp, gate_mlp, scale_cross, gate_cross = time_cond.chunk(6, dim=-1)
         
+        # Selective checkpointing: only the flagged branch is recomputed in backward
+        use_checkpoint = self.training and torch.is_grad_enabled()
+        
+        if use_checkpoint and self.checkpoint_attention:
+            hidden_states = torch.utils.checkpoint.checkpoint(
+                self._attention_branch,
+                hidden_states, encoder_hidden_states,
+                scale_msa, gate_msa, scale_cross, gate_cross,
+                attention_mask, encoder_mask, image_rotary_emb,
+                use_reentrant=False
+            )
+        else:
+            hidden_states = self._attention_branch(
+                hidden_states, encoder_hidden_states,
+                scale_msa, gate_msa, scale_cross, gate_cross,
+                attention_mask, encoder_mask, image_rotary_emb,
+            )
+        
+        if use_checkpoint and self.checkpoint_ffn:
+            hidden_states = torch.utils.checkpoint.checkpoint(
+                self._ffn_branch, hidden_states, scale_mlp, gate_mlp,
+                use_reentrant=False
+            )
+        else:
+            hidden_states = self._ffn_branch(hidden_states, scale_mlp, gate_mlp)
+        
+        return hidden_states
+    
+    def _attention_branch(
+        self,
+        hidden_states: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        scale_msa: torch.Tensor,
+        gate_msa: torch.Tensor,
+        scale_cross: torch.Tensor,
+        gate_cross: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None,
+        encoder_mask: Optional[torch.Tensor] = None,
+        image_rotary_emb: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ) -> torch.Tensor:
+        """Self-attention + cross-attention sub-blocks (with residuals)."""
+        batch_size, seq_len, _ = hidden_states.shape
+        
         # Self-attention with manual projections
         residual = hidden_states
         norm_hidden = self.norm1(hidden_states)
@@ -199,28 +275,33 @@ class BLIP3oAttentionBlock(nn.Module):
         else:
             q_rot, k_rot = q, k
         
+        # Sequence parallel: local queries attend to the keys/values of all ranks
+        if self.sequence_parallel:
+            k_rot = gather_tokens(k_rot, dim=1, group=self.sequence_parallel_group)
+            v = gather_tokens(v, dim=1, group=self.sequence_parallel_group)
+        kv_len = k_rot.shape[1]
+        
         # Prepare for attention computation
         q_for_attn = q_rot.transpose(1, 2).contiguous().view(batch_size * self.num_attention_heads, seq_len, self.head_dim)
-        k_for_attn = k_rot.transpose(1, 2).contiguous().view(batch_size * self.num_attention_heads, seq_len, self.head_dim)
-        v_for_attn = v.transpose(1, 2).contiguous().view(batch_size * self.num_attention_heads, seq_len, self.head_dim)
+        k_for_attn = k_rot.transpose(1, 2).contiguous().view(batch_size * self.num_attention_heads, kv_len, self.head_dim)
+        v_for_attn = v.transpose(1, 2).contiguous().view(batch_size * self.num_attention_heads, kv_len, self.head_dim)
         
-        # Handle attention mask
+        # Handle attention mask (covers all key tokens, i.e. the gathered sequence)
         attn_mask = None
         if attention_mask is not None:
             additive_mask = torch.zeros_like(attention_mask, dtype=q_for_attn.dtype)
             additive_mask = additive_mask.masked_fill(~attention_mask, torch.finfo(q_for_attn.dtype).min)
-            additive_mask = additive_mask.view(batch_size, 1, seq_len)
+            additive_mask = additive_mask.view(batch_size, 1, kv_len)
             additive_mask = additive_mask.expand(-1, self.num_attention_heads, -1)
-            attn_mask = additive_mask.reshape(batch_size * self.num_attention_heads, 1, seq_len)
+            attn_mask = additive_mask.reshape(batch_size * self.num_attention_heads, 1, kv_len)
         
-        # Compute attention
-        attn_output = F.scaled_dot_product_attention(
+        # Compute attention (in query chunks when attention_chunk_size is set)
+        attn_output = chunked_scaled_dot_product_attention(
             q_for_attn,
             k_for_attn,
             v_for_attn,
             attn_mask=attn_mask,
-            dropout_p=0.0,
-            is_causal=False
+            chunk_size=self.attention_chunk_size,
         )
         
         # Reshape and project output
@@ -236,23 +317,32 @@ class BLIP3oAttentionBlock(nn.Module):
         norm_encoder = self.cross_norm(encoder_hidden_states)
         norm_hidden = norm_hidden * (1 + scale_cross.unsqueeze(1))
         
-        cross_attn_output, _ = self.cross_attn(
-            norm_hidden, norm_encoder, norm_encoder,
-            key_padding_mask=~encoder_mask if encoder_mask is not None else None,
-            need_weights=False
-        )
-        
-        hidden_states = residual + gate_cross.unsqueeze(1).tanh() * cross_attn_output
-        
-        # Feed-forward
+        key_padding_mask = ~encoder_mask if encoder_mask is not None else None
+        chunk_size = self.attention_chunk_size or seq_len
+        cross_attn_output = torch.cat([
+            self.cross_attn(
+                norm_hidden[:, start:start + chunk_size], norm_encoder, norm_encoder,
+                key_padding_mask=key_padding_mask,
+                need_weights=False
+            )[0]
+            for start in range(0, seq_len, chunk_size)
+        ], dim=1)
+        
+        return residual + gate_cross.unsqueeze(1).tanh() * cross_attn_output
+    
+    def _ffn_branch(
+        self,
+        hidden_states: torch.Tensor,
+        scale_mlp: torch.Tensor,
+        gate_mlp: torch.Tensor,
+    ) -> torch.Tensor:
+        """Feed-forward sub-block (with residual)."""
         residual = hidden_states
         norm_hidden = self.norm3(hidden_states)
         norm_hidden = norm_hidden * (1 + scale_mlp.unsqueeze(1))
         
         ffn_output = self.ffn(norm_hidden)
-        hidden_states = residual + gate_mlp.unsqueeze(1).tanh() * ffn_output
-        
-        return hidden_states
+        return residual + gate_mlp.unsqueeze(1).tanh() * ffn_output
 
 
 class GlobalAdaptationMLP(nn.Module):
@@ -371,6 +461,7 @@ class BLIP3oDiTModel(PreTrainedModel):
             in_channels=config.in_channels,
             embed_dim=config.dim,
             num_tokens=self.num_tokens,
+            grid_size=config.input_size,
         )
         
         # Timestep embedding
@@ -380,11 +471,14 @@ class BLIP3oDiTModel(PreTrainedModel):
             nn.SiLU(),
             nn.Linear(config.dim, config.dim),
         )
-        self.time_proj = self._create_sinusoidal_timestep_embedding(time_embed_dim)
+        self._time_embed_dim = time_embed_dim
         
         # EVA-CLIP projection
         self.eva_proj = nn.Linear(config.eva_embedding_size, config.dim)
         
+        # Timestep frequencies and RoPE tables (non-persistent buffers)
+        self.build_static_buffers()
+        
         # Transformer layers
         self.layers = nn.ModuleList([
             BLIP3oAttentionBlock(
@@ -392,6 +486,7 @@ class BLIP3oDiTModel(PreTrainedModel):
                 num_attention_heads=config.n_heads,
                 cross_attention_dim=config.dim,
                 norm_eps=config.norm_eps,
+                attention_chunk_size=getattr(config, 'attention_chunk_size', None),
             )
             for _ in range(config.n_layers)
         ])
@@ -416,11 +511,47 @@ class BLIP3oDiTModel(PreTrainedModel):
         
         self._init_weights()
         
+        # Token sharding across a process group (see enable_sequence_parallel)
+        self.sequence_parallel_group = None
+        self._sequence_parallel = False
+        
+        # Which layers / sub-blocks recompute activations in backward
+        self._checkpoint_layers = [False] * len(self.layers)
+        self.set_gradient_checkpointing_policy(
+            policy=getattr(config, 'gradient_checkpointing_policy', "full"),
+            every_k=getattr(config, 'gradient_checkpointing_every_k', 2),
+        )
+        
         print(f"✅ DUAL SUPERVISION BLIP3-o DiT model initialized for {self.num_tokens} tokens")
         print(f"   Patch output: [B, {self.num_tokens}, {config.in_channels}]")
         print(f"   Global output: [B, {self.clip_output_dim}]")
         print(f"   NOTE: This is our own implementation, NOT using pre-trained BLIP3-o models")
 
+    def build_static_buffers(self, device: Optional[torch.device] = None):
+        """
+        (Re)build the non-persistent buffers derived from the config.
+        
+        They are not in checkpoints, so a model created on the meta device
+        (see checkpoint_loader.py) rebuilds them on its target device.
+        """
+        place = (lambda tensor: tensor.to(device)) if device is not None else (lambda tensor: tensor)
+        
+        # Registered as a (non-persistent) buffer so it follows model.to(device) and
+        # is not copied host-to-device on every forward
+        self.register_buffer(
+            'time_proj', place(self._create_sinusoidal_timestep_embedding(self._time_embed_dim)),
+            persistent=False,
+        )
+        
+        # RoPE tables depend only on the grid, so build them once (non-persistent:
+        # checkpoints are unchanged) instead of on every forward
+        cos_emb, sin_emb = get_3d_rotary_pos_embed(
+            embed_dim=self.head_dim,
+            grid_size=self.config.input_size
+        )
+        self.register_buffer('rope_cos', place(cos_emb), persistent=False)
+        self.register_buffer('rope_sin', place(sin_emb), persistent=False)
+    
     def _create_sinusoidal_timestep_embedding(self, embed_dim: int):
         half_dim = embed_dim // 2
         emb = math.log(10000) / (half_dim - 1)
@@ -453,6 +584,8 @@ class BLIP3oDiTModel(PreTrainedModel):
         print(f"🔒 Loading frozen CLIP visual projection from {clip_model_name}")
         print(f"   NOTE: Only loading the visual projection layer, not full BLIP3-o model")
         
+        from transformers import CLIPModel
+
         clip_model = CLIPModel.from_pretrained(clip_model_name)
         
         # Extract visual projection layer
@@ -473,11 +606,127 @@ class BLIP3oDiTModel(PreTrainedModel):
         print(f"✅ Frozen CLIP visual projection loaded: {visual_proj.weight.shape}")
         print(f"   Input dim: {visual_proj.in_features}, Output dim: {visual_proj.out_features}")
     
-    def enable_gradient_checkpointing(self):
+    def enable_gradient_checkpointing(
+        self,
+        policy: Optional[str] = None,
+        every_k: Optional[int] = None,
+        memory_budget_gb: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        precision: str = "fp32",
+    ):
+        """
+        Enable activation checkpointing, optionally switching policy.
+        
+        See set_gradient_checkpointing_policy for the policy arguments.
+        Returns the active policy name.
+        """
         self._gradient_checkpointing = True
+        if policy is not None:
+            return self.set_gradient_checkpointing_policy(policy, every_k, memory_budget_gb, batch_size, precision)
+        self._apply_checkpointing_policy()
+        return self.gradient_checkpointing_policy
     
     def disable_gradient_checkpointing(self):
         self._gradient_checkpointing = False
+        self._apply_checkpointing_policy()
+    
+    def enable_sequence_parallel(self, group=None):
+        """
+        Shard tokens across the ranks of a torch.distributed process group.
+        
+        Every rank must receive the same batch. Embedding, self-attention queries,
+        cross-attention and FFN run on a 1/world_size token shard; self-attention
+        gathers keys/values and the patch output is gathered back, so outputs (and
+        any loss on them) are identical on all ranks. Parameter gradients must be
+        averaged over the group (DDP on the same group, or
+        sequence_parallel.sync_sequence_parallel_gradients).
+        
+        Args:
+            group: Process group (None = default group)
+        """
+        _, world_size = get_sequence_parallel_info(group)
+        get_token_shard(self.num_tokens, 0, world_size)  # validates divisibility
+        self.sequence_parallel_group = group
+        self._sequence_parallel = world_size > 1
+        for layer in self.layers:
+            layer.sequence_parallel = self._sequence_parallel
+            layer.sequence_parallel_group = group
+        return world_size
+    
+    def disable_sequence_parallel(self):
+        self.sequence_parallel_group = None
+        self._sequence_parallel = False
+        for layer in self.layers:
+            layer.sequence_parallel = False
+            layer.sequence_parallel_group = None
+    
+    def set_gradient_checkpointing_policy(
+        self,
+        policy: str = "full",
+        every_k: Optional[int] = None,
+        memory_budget_gb: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        precision: str = "fp32",
+    ) -> str:
+        """
+        Choose which activations are recomputed in backward.
+        
+        Args:
+            policy:
+                - "none": no checkpointing
+                - "full": checkpoint every layer (most memory saved, most recompute)
+                - "every_k": checkpoint every k-th layer
+                - "attention": checkpoint only the self/cross-attention branch of each layer
+                - "ffn": checkpoint only the feed-forward branch of each layer
+                - "auto": cheapest policy whose estimated training memory fits
+                  memory_budget_gb at batch_size (see select_checkpointing_policy)
+            every_k: Layer interval for "every_k"
+            memory_budget_gb: Per-GPU memory budget for "auto" (default: memory of the current CUDA device)
+            batch_size: Per-device batch size for "auto"
+            precision: Training precision for "auto" ("fp32", or "fp16"/"bf16" autocast)
+            
+        Returns:
+            The resolved policy name
+        """
+        if policy not in GRADIENT_CHECKPOINTING_POLICIES:
+            raise ValueError(f"Unknown checkpointing policy '{policy}'. Available: {GRADIENT_CHECKPOINTING_POLICIES}")
+        
+        every_k = every_k or getattr(self.config, 'gradient_checkpointing_every_k', 2)
+        
+        if policy == "auto":
+            from ..config.memory_optimized_config import select_checkpointing_policy
+            
+            if memory_budget_gb is None and torch.cuda.is_available():
+                memory_budget_gb = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory / (1024**3)
+            if memory_budget_gb is None or batch_size is None:
+                print("⚠️ Auto checkpointing needs a memory budget and batch size, using 'full'")
+                policy = "full"
+            else:
+                selection = select_checkpointing_policy(self.config, batch_size, memory_budget_gb, precision=precision)
+                policy, every_k = selection['policy'], selection['every_k']
+                print(f"🧠 Auto checkpointing policy: {policy}"
+                      f"{f' (k={every_k})' if policy == 'every_k' else ''}, "
+                      f"estimated {selection['estimated_memory_gb']:.1f} GB / {memory_budget_gb:.1f} GB")
+        
+        self.gradient_checkpointing_policy = policy
+        self.gradient_checkpointing_every_k = max(1, int(every_k))
+        self._apply_checkpointing_policy()
+        return policy
+    
+    def _apply_checkpointing_policy(self):
+        """Translate the policy into per-layer / per-branch checkpoint flags."""
+        policy = self.gradient_checkpointing_policy if self._gradient_checkpointing else "none"
+        every_k = self.gradient_checkpointing_every_k
+        
+        for i, layer in enumerate(self.layers):
+            if policy == "full":
+                self._checkpoint_layers[i] = True
+            elif policy == "every_k":
+                self._checkpoint_layers[i] = (i % every_k) == 0
+            else:
+                self._checkpoint_layers[i] = False
+            layer.checkpoint_attention = policy == "attention"
+            layer.checkpoint_ffn = policy == "ffn"
     
     def get_timestep_embedding(self, timesteps: torch.Tensor) -> torch.Tensor:
         device = timesteps.device
@@ -508,7 +757,6 @@ class BLIP3oDiTModel(PreTrainedModel):
             - global_output: [B, 768] for global supervision  
         """
         batch_size = hidden_states.shape[0]
-        device = hidden_states.device
         self._validate_forward_inputs(hidden_states, timestep, encoder_hidden_states)
         
         if timestep.dim() == 0:
@@ -516,23 +764,66 @@ class BLIP3oDiTModel(PreTrainedModel):
         elif timestep.shape[0] != batch_size:
             raise ValueError(f"Timestep batch size mismatch")
         
-        if encoder_attention_mask is None:
-            encoder_attention_mask = torch.ones(
-                (batch_size, encoder_hidden_states.shape[1]),
-                device=device,
-                dtype=torch.bool
-            )
+        patch_output = self._forward_patch(
+            hidden_states, timestep, encoder_hidden_states, encoder_attention_mask
+        )  # [B, 256, 1024]
         
-        hidden_states, attention_mask, img_size, _ = self.token_embedder(hidden_states)
+        # Global adaptation pipeline
+        # 1. Average pooling over token dimension
+        pooled_features = patch_output.mean(dim=1)  # [B, 1024]
         
-        # Create 3D RoPE embeddings
-        cos_emb, sin_emb = get_3d_rotary_pos_embed(
-            embed_dim=self.head_dim,
-            grid_size=self.config.input_size
-        )
-        cos_emb = cos_emb.to(device)
-        sin_emb = sin_emb.to(device)
-        image_rotary_emb = (cos_emb, sin_emb)
+        # 2-3. Custom MLP + frozen CLIP visual projection
+        adapted_features, global_output = self._project_global(pooled_features)
+        
+        if return_dict:
+            return {
+                'patch_output': patch_output,      # [B, 256, 1024] for patch loss
+                'global_output': global_output,    # [B, 768] for global loss
+                'pooled_features': pooled_features,  # [B, 1024] intermediate
+                'adapted_features': adapted_features, # [B, 1024] after MLP
+            }
+        else:
+            return patch_output, global_output
+    
+    def forward_static(
+        self,
+        hidden_states: torch.Tensor,          # [B, 256, 1024]
+        timestep: torch.Tensor,               # [B]
+        encoder_hidden_states: torch.Tensor,  # [B, 256, 4096]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Static-shape forward for torch.compile and CUDA graph capture.
+        
+        Skips input validation, mask construction and dict outputs, so the traced
+        graph is pure tensor ops. timestep must already have shape [B].
+        
+        Returns:
+            (patch_output [B, 256, 1024], pooled_features [B, 1024])
+        """
+        patch_output = self._forward_patch(hidden_states, timestep, encoder_hidden_states)
+        return patch_output, patch_output.mean(dim=1)
+    
+    def _forward_patch(
+        self,
+        hidden_states: torch.Tensor,
+        timestep: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        encoder_attention_mask: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Run embedder, DiT blocks and output projection; returns patch velocity [B, num_tokens, 1024]."""
+        # All tokens are always valid, so no self-attention mask is needed
+        if self._sequence_parallel:
+            rank, world_size = get_sequence_parallel_info(self.sequence_parallel_group)
+            token_range = get_token_shard(self.num_tokens, rank, world_size)
+            hidden_states = shard_tokens(hidden_states, dim=1, group=self.sequence_parallel_group)
+            hidden_states = self.token_embedder.embed(hidden_states, token_range)
+            image_rotary_emb = (
+                self.rope_cos[:, token_range[0]:token_range[1]],
+                self.rope_sin[:, token_range[0]:token_range[1]],
+            )
+        else:
+            hidden_states = self.token_embedder.embed(hidden_states)
+            image_rotary_emb = (self.rope_cos, self.rope_sin)
         
         # Timestep embedding
         timestep_emb = self.get_timestep_embedding(timestep)
@@ -541,15 +832,16 @@ class BLIP3oDiTModel(PreTrainedModel):
         # Project EVA-CLIP
         encoder_hidden_states = self.eva_proj(encoder_hidden_states)
         
-        # Transformer layers
-        for layer in self.layers:
-            if self.training and self._gradient_checkpointing:
+        # Transformer layers (whole-layer checkpointing per policy; branch-level
+        # checkpointing is handled inside the blocks)
+        for layer, checkpoint_layer in zip(self.layers, self._checkpoint_layers):
+            if self.training and checkpoint_layer:
                 hidden_states = torch.utils.checkpoint.checkpoint(
                     layer,
                     hidden_states,
                     encoder_hidden_states,
                     timestep_emb,
-                    attention_mask,
+                    None,
                     encoder_attention_mask,
                     image_rotary_emb,
                     use_reentrant=False
@@ -559,38 +851,32 @@ class BLIP3oDiTModel(PreTrainedModel):
                     hidden_states=hidden_states,
                     encoder_hidden_states=encoder_hidden_states,
                     timestep_emb=timestep_emb,
-                    attention_mask=attention_mask,
+                    attention_mask=None,
                     encoder_mask=encoder_attention_mask,
                     image_rotary_emb=image_rotary_emb,
                 )
         
         # Output projection
         hidden_states = self.norm_out(hidden_states)
-        patch_output = self.proj_out(hidden_states)  # [B, 256, 1024]
+        patch_output = self.proj_out(hidden_states)
         
-        # Global adaptation pipeline
-        # 1. Average pooling over token dimension
-        pooled_features = patch_output.mean(dim=1)  # [B, 1024]
-        
-        # 2. Custom MLP for domain adaptation  
+        if self._sequence_parallel:
+            patch_output = gather_tokens(
+                patch_output, dim=1, group=self.sequence_parallel_group, sum_grads=False
+            )
+        return patch_output
+    
+    def _project_global(self, pooled_features: torch.Tensor) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Adaptation MLP + frozen CLIP projection: [B, 1024] -> ([B, 1024], [B, 768] or None)."""
         adapted_features = self.global_adaptation_mlp(pooled_features)  # [B, 1024]
         
-        # 3. Frozen CLIP visual projection
         global_output = None
         if self.frozen_clip_visual_proj is not None:
             global_output = self.frozen_clip_visual_proj(adapted_features)  # [B, 768]
             # Normalize to unit norm (like CLIP)
             global_output = F.normalize(global_output, p=2, dim=-1)
         
-        if return_dict:
-            return {
-                'patch_output': patch_output,      # [B, 256, 1024] for patch loss
-                'global_output': global_output,    # [B, 768] for global loss
-                'pooled_features': pooled_features,  # [B, 1024] intermediate
-                'adapted_features': adapted_features, # [B, 1024] after MLP
-            }
-        else:
-            return patch_output, global_output
+        return adapted_features, global_output
     
     def _validate_forward_inputs(self, hidden_states, timestep, encoder_hidden_states):
         actual_tokens = hidden_states.shape[1]
@@ -615,6 +901,7 @@ class BLIP3oDiTModel(PreTrainedModel):
         eta: float = 0.0,  # DDIM parameter
         return_intermediate: bool = False,
         return_global_only: bool = True,  # FIXED: Default to global for better testing
+        noise: Optional[torch.Tensor] = None,
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, List[torch.Tensor]]]:
         """
         FIXED: Generation with proper dual supervision output handling.
@@ -627,6 +914,7 @@ class BLIP3oDiTModel(PreTrainedModel):
             eta: DDIM parameter
             return_intermediate: Whether to return intermediate states
             return_global_only: If True, return global embeddings [B, 768], else patch [B, 256, 1024]
+            noise: Explicit initial noise [batch_size, 256, 1024] (overrides generator)
             
         Returns:
             Generated embeddings - either global [B, 768] or patch [B, 256, 1024] based on return_global_only
@@ -640,12 +928,16 @@ class BLIP3oDiTModel(PreTrainedModel):
             raise ValueError(f"Expected {self.num_tokens} conditioning tokens, got {num_tokens}")
         
         # Initialize from random noise (source distribution)
-        sample = torch.randn(
-            (batch_size, num_tokens, self.config.in_channels),
-            device=device,
-            dtype=dtype,
-            generator=generator
-        )
+        if noise is not None:
+            sample = noise.to(device=device, dtype=dtype)
+        else:
+            sample = torch.randn(
+                (batch_size, num_tokens, self.config.in_channels),
+                device=device,
+                dtype=dtype,
+                generator=generator
+            )
+        self._validate_forward_inputs(sample, None, encoder_hidden_states)
         
         # Flow matching sampling with Euler integration
         dt = 1.0 / num_inference_steps
@@ -658,36 +950,29 @@ class BLIP3oDiTModel(PreTrainedModel):
             t = step * dt
             t_tensor = torch.full((batch_size,), t, device=device, dtype=dtype)
             
-            # Forward pass
-            outputs = self.forward(
-                hidden_states=sample,
-                timestep=t_tensor,
-                encoder_hidden_states=encoder_hidden_states,
-                return_dict=True
-            )
-            
-            # Use patch output for velocity in flow matching
-            velocity = outputs['patch_output']
-            
-            # Euler integration step: x_{t+dt} = x_t + dt * v_t
-            sample = sample + dt * velocity
+            with timer(SAMPLING_STEP):
+                # Forward pass (inputs validated once above); patch output is the velocity
+                velocity, _ = self.forward_static(sample, t_tensor, encoder_hidden_states)
+                
+                # Euler integration step: x_{t+dt} = x_t + dt * v_t
+                sample = sample + dt * velocity
             
             if return_intermediate:
                 intermediate_samples.append(sample.clone())
         
         # Final forward pass to get both outputs
-        final_outputs = self.forward(
-            hidden_states=sample,
-            timestep=torch.zeros(batch_size, device=device, dtype=dtype),
-            encoder_hidden_states=encoder_hidden_states,
-            return_dict=True
+        final_patch, final_pooled = self.forward_static(
+            sample,
+            torch.zeros(batch_size, device=device, dtype=dtype),
+            encoder_hidden_states,
         )
+        _, final_global = self._project_global(final_pooled)
         
         # FIXED: Return appropriate output based on flag and availability
-        if return_global_only and final_outputs.get('global_output') is not None:
-            result = final_outputs['global_output']  # [B, 768] - preferred for testing
+        if return_global_only and final_global is not None:
+            result = final_global  # [B, 768] - preferred for testing
         else:
-            result = final_outputs['patch_output']   # [B, 256, 1024] - fallback
+            result = final_patch   # [B, 256, 1024] - fallback
         
         if return_intermediate:
             return result, intermediate_samples
@@ -762,12 +1047,12 @@ def load_blip3o_dit_model(
     print(f"📁 Loading our trained BLIP3-o model from: {model_path}")
     print(f"   NOTE: This loads our own trained model, not a pre-trained BLIP3-o")
     
-    from transformers import AutoModel
+    from .checkpoint_loader import load_blip3o_checkpoint
+    
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
     
-    model = AutoModel.from_pretrained(
-        model_path,
-        torch_dtype=torch_dtype,
-        device_map=device if device != "auto" else None,
-    )
+    # Built on the meta device, weights memory-mapped straight to device / dtype
+    model, _, _ = load_blip3o_checkpoint(model_path, device=device, torch_dtype=torch_dtype)
     
     return model
\ No newline at end of file
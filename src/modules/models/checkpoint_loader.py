@@ -0,0 +1,266 @@
+"""
+Shared fast path for loading trained BLIP3-o DiT checkpoints.
+
+The previous loaders built the model on CPU in fp32 (random init), read the
+whole pytorch_model.bin into memory, filtered the state dict and finally
+called .to(device, dtype): three copies of the weights and a slow cold start.
+load_blip3o_checkpoint instead:
+- creates the model on the meta device (no allocation, no random init)
+- memory-maps model.safetensors (or a zip-format pytorch_model.bin via
+  torch.load(mmap=True)) and materializes each tensor directly in the target
+  dtype on the target device, one tensor at a time
+- assigns the tensors as the model's parameters (load_state_dict(assign=True)),
+  rebuilds the config-derived buffers and initializes only what the checkpoint
+  does not contain
+
+Used by BLIP3oInference, comp_eval.py and load_blip3o_dit_model (recall_dist).
+weights="ema" selects the EMA weights the trainer saves next to the live ones
+(ema_model.safetensors, see trainers/ema.py): same keys, so it is a drop-in.
+"""
+
+import json
+import time
+import torch
+import logging
+import torch.nn as nn
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple, Type, Union
+
+from ..config.blip3o_config import BLIP3oDiTConfig
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILES = ("blip3o_model_config.json", "config.json")
+# safetensors first: it is the one that can be memory-mapped straight to the device
+WEIGHT_FILES = ("model.safetensors", "pytorch_model.safetensors", "pytorch_model.bin")
+EMA_WEIGHT_FILE = "ema_model.safetensors"
+FROZEN_PROJECTION_KEY = "frozen_clip_visual_proj.weight"
+
+
+def find_config_file(model_path: Union[str, Path]) -> Path:
+    model_path = Path(model_path)
+    for name in CONFIG_FILES:
+        if (model_path / name).exists():
+            return model_path / name
+    raise FileNotFoundError(f"No config file found in {model_path}")
+
+
+def find_weight_file(model_path: Union[str, Path], weights: str = "live") -> Path:
+    """Weight file of a checkpoint directory; weights is "live" or "ema"."""
+    model_path = Path(model_path)
+    if weights == "ema":
+        if (model_path / EMA_WEIGHT_FILE).exists():
+            return model_path / EMA_WEIGHT_FILE
+        raise FileNotFoundError(f"No EMA weights ({EMA_WEIGHT_FILE}) found in {model_path}")
+    if weights != "live":
+        raise ValueError(f"weights must be 'live' or 'ema', got {weights!r}")
+    for name in WEIGHT_FILES:
+        if (model_path / name).exists():
+            return model_path / name
+    raise FileNotFoundError(f"No model weights found in {model_path}")
+
+
+def load_checkpoint_config(model_path: Union[str, Path]) -> Dict[str, Any]:
+    with open(find_config_file(model_path), 'r') as f:
+        return json.load(f)
+
+
+def iter_checkpoint_tensors(
+    weight_file: Union[str, Path],
+    device: Union[str, torch.device] = "cpu",
+    dtype: Optional[torch.dtype] = None,
+) -> Iterator[Tuple[str, torch.Tensor]]:
+    """
+    (name, tensor) pairs of a checkpoint, each materialized on `device` in
+    `dtype` (floating tensors only) straight from the memory-mapped file.
+    """
+    weight_file = Path(weight_file)
+    device = torch.device(device)
+
+    def convert(tensor: torch.Tensor) -> torch.Tensor:
+        if dtype is not None and tensor.is_floating_point():
+            return tensor.to(device=device, dtype=dtype)
+        return tensor.to(device=device)
+
+    if weight_file.suffix == ".safetensors":
+        from safetensors import safe_open
+
+        # safe_open memory-maps the file; get_tensor reads only that tensor's bytes
+        with safe_open(str(weight_file), framework="pt", device=str(device)) as f:
+            for name in f.keys():
+                yield name, convert(f.get_tensor(name))
+        return
+
+    try:
+        state_dict = torch.load(weight_file, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError:
+        # Legacy (non-zip) .bin files cannot be memory-mapped
+        logger.warning(f"{weight_file.name} is not memory-mappable, loading it into memory")
+        state_dict = torch.load(weight_file, map_location="cpu")
+    for name in list(state_dict.keys()):
+        yield name, convert(state_dict.pop(name))
+
+
+def load_checkpoint_state_dict(
+    model_path: Union[str, Path],
+    device: Union[str, torch.device] = "cpu",
+    dtype: Optional[torch.dtype] = None,
+) -> Dict[str, torch.Tensor]:
+    """Whole state dict of a checkpoint directory, already on `device` in `dtype`."""
+    return dict(iter_checkpoint_tensors(find_weight_file(model_path), device=device, dtype=dtype))
+
+
+def _initialize_missing(model: nn.Module, device: torch.device, dtype: torch.dtype) -> int:
+    """
+    Allocate and initialize parameters / buffers still on the meta device; returns how many.
+
+    Uses the model's own initialization (BLIP3oDiTModel._init_weights for Linear /
+    LayerNorm, nn.MultiheadAttention's in-projection init, reset_parameters() of
+    other modules). Raises ValueError listing the missing tensors that have no
+    initializer, instead of leaving them as uninitialized memory.
+    """
+    uninitialized = [
+        f"{prefix}.{name}" if prefix else name
+        for prefix, module in model.named_modules()
+        if not isinstance(module, (nn.Linear, nn.LayerNorm, nn.MultiheadAttention))
+        and not hasattr(module, "reset_parameters")
+        for name, tensor in list(module.named_parameters(recurse=False)) + list(module.named_buffers(recurse=False))
+        if tensor.is_meta
+    ]
+    if uninitialized:
+        raise ValueError(f"Checkpoint is missing tensors that cannot be initialized: {uninitialized}")
+
+    num_missing = 0
+    for module in model.modules():
+        tensors = list(module.named_parameters(recurse=False)) + list(module.named_buffers(recurse=False))
+        if not any(tensor.is_meta for _, tensor in tensors):
+            continue
+        num_missing += sum(1 for _, tensor in tensors if tensor.is_meta)
+        # Keep already loaded tensors of this module, allocate the rest
+        loaded = {name: tensor.detach() for name, tensor in tensors if not tensor.is_meta}
+        module.to_empty(device=device, recurse=False)
+        with torch.no_grad():
+            if isinstance(module, nn.Linear):
+                nn.init.xavier_uniform_(module.weight)
+                if module.bias is not None:
+                    nn.init.zeros_(module.bias)
+            elif isinstance(module, nn.LayerNorm):
+                nn.init.ones_(module.weight)
+                nn.init.zeros_(module.bias)
+            elif isinstance(module, nn.MultiheadAttention):
+                # Its own tensors only: _reset_parameters() would also reset the loaded out_proj
+                for name in ("in_proj_weight", "q_proj_weight", "k_proj_weight", "v_proj_weight"):
+                    if getattr(module, name, None) is not None:
+                        nn.init.xavier_uniform_(getattr(module, name))
+                if module.in_proj_bias is not None:
+                    nn.init.zeros_(module.in_proj_bias)
+                for name in ("bias_k", "bias_v"):
+                    if getattr(module, name, None) is not None:
+                        nn.init.xavier_normal_(getattr(module, name))
+            elif hasattr(module, "reset_parameters"):
+                module.reset_parameters()
+            for name, tensor in loaded.items():
+                getattr(module, name).copy_(tensor)
+        module.to(dtype=dtype)
+    return num_missing
+
+
+def load_blip3o_checkpoint(
+    model_path: Union[str, Path],
+    device: Union[str, torch.device] = "cpu",
+    torch_dtype: Optional[torch.dtype] = None,
+    model_class: Optional[Type[nn.Module]] = None,
+    load_clip_projection: bool = False,
+    weights: str = "live",
+) -> Tuple[nn.Module, BLIP3oDiTConfig, Dict[str, Any]]:
+    """
+    Build a BLIP3-o DiT directly on `device` in `torch_dtype` from a checkpoint directory.
+
+    Args:
+        model_path: Directory with config.json / blip3o_model_config.json and weights
+        device: Target device
+        torch_dtype: Target dtype of floating parameters (default float32)
+        model_class: Model class (default BLIP3oDiTModel)
+        load_clip_projection: Load CLIP's frozen visual projection when the
+            checkpoint does not contain it
+        weights: "live" (the trained weights) or "ema" (EMA of the weights)
+
+    Returns:
+        (model in eval mode, config, info) where info has the weight file,
+        load time and missing / unexpected / mismatched keys
+    """
+    if model_class is None:
+        from .blip3o_dit import BLIP3oDiTModel
+        model_class = BLIP3oDiTModel
+
+    start = time.perf_counter()
+    device = torch.device(device)
+    dtype = torch_dtype or torch.float32
+    model_path = Path(model_path)
+
+    config = BLIP3oDiTConfig(**load_checkpoint_config(model_path))
+    weight_file = find_weight_file(model_path, weights=weights)
+
+    # No allocation and no random init: every tensor comes from the checkpoint
+    with torch.device("meta"):
+        model = model_class(config)
+
+    model_state = model.state_dict()
+    state_dict, unexpected_keys, mismatched_keys = {}, [], []
+    has_frozen_projection = False
+    for name, tensor in iter_checkpoint_tensors(weight_file, device=device, dtype=dtype):
+        if name == FROZEN_PROJECTION_KEY and getattr(model, 'frozen_clip_visual_proj', False) is None:
+            # Saved with the frozen CLIP projection attached: rebuild it from the checkpoint
+            projection = nn.Linear(tensor.shape[1], tensor.shape[0], bias=False, device="meta")
+            projection.requires_grad_(False)
+            model.frozen_clip_visual_proj = projection
+            model_state[name] = projection.weight
+            has_frozen_projection = True
+        if name not in model_state:
+            unexpected_keys.append(name)
+        elif model_state[name].shape != tensor.shape:
+            logger.warning(f"Shape mismatch for {name}: {model_state[name].shape} vs {tensor.shape}")
+            mismatched_keys.append(name)
+        else:
+            state_dict[name] = tensor
+
+    missing_keys, _ = model.load_state_dict(state_dict, strict=False, assign=True)
+    del state_dict
+
+    if hasattr(model, "build_static_buffers"):
+        model.build_static_buffers(device)
+    num_initialized = _initialize_missing(model, device, dtype)
+    # Config-derived buffers follow the model dtype, as after model.to(device, dtype)
+    model.to(device=device, dtype=dtype)
+
+    if missing_keys:
+        logger.warning(f"Missing keys (initialized): {missing_keys}")
+    if unexpected_keys:
+        logger.warning(f"Unexpected keys: {unexpected_keys}")
+
+    if load_clip_projection and not has_frozen_projection and getattr(model, 'frozen_clip_visual_proj', None) is None:
+        model.load_frozen_clip_projection()
+        model.frozen_clip_visual_proj.to(device=device, dtype=dtype)
+
+    model.eval()
+    info = {
+        'weight_file': str(weight_file),
+        'load_seconds': time.perf_counter() - start,
+        'missing_keys': missing_keys,
+        'unexpected_keys': unexpected_keys,
+        'mismatched_keys': mismatched_keys,
+        'num_initialized': num_initialized,
+    }
+    logger.info(f"Loaded {weight_file.name} onto {device} ({dtype}) in {info['load_seconds']:.2f}s")
+    return model, config, info
+
+
+__all__ = [
+    "EMA_WEIGHT_FILE",
+    "find_config_file",
+    "find_weight_file",
+    "load_checkpoint_config",
+    "iter_checkpoint_tensors",
+    "load_checkpoint_state_dict",
+    "load_blip3o_checkpoint",
+]
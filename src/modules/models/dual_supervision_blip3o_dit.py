@@ -9,12 +9,32 @@ during training, resolving the training-inference mismatch.
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from typing import Optional, Dict, Any, Tuple, Union
+from typing import Optional, Dict, Any, Tuple, Union, List
 from transformers import PreTrainedModel
 
 from .blip3o_dit import BLIP3oDiTModel
 from ..config.blip3o_config import BLIP3oDiTConfig
 
+GLOBAL_DIM = 768
+
+# One generator, or one per sample (row i drawn from generator[i])
+GeneratorArg = Optional[Union[torch.Generator, List[torch.Generator]]]
+
+
+def _randn(
+    shape: Tuple[int, ...],
+    generator: GeneratorArg,
+    device: torch.device,
+    dtype: torch.dtype,
+) -> torch.Tensor:
+    """torch.randn that also accepts a list of per-sample generators."""
+    if isinstance(generator, (list, tuple)):
+        if len(generator) != shape[0]:
+            raise ValueError(f"Got {len(generator)} generators for {shape[0]} samples")
+        rows = [torch.randn(shape[1:], generator=g, device=g.device) for g in generator]
+        return torch.stack(rows).to(device=device, dtype=dtype)
+    return torch.randn(shape, device=device, dtype=dtype, generator=generator)
+
 
 class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
     """
@@ -31,7 +51,7 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
         super().__init__(config)
         
         # Add global velocity prediction layer
-        self.global_velocity_proj = nn.Linear(config.in_channels, 768, bias=True)
+        self.global_velocity_proj = nn.Linear(config.in_channels, GLOBAL_DIM, bias=True)
         
         # Initialize the new layer
         torch.nn.init.xavier_uniform_(self.global_velocity_proj.weight)
@@ -127,26 +147,37 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
         encoder_hidden_states: torch.Tensor,  # [B, 256, 4096] - EVA-CLIP conditioning
         num_inference_steps: int = 50,
         guidance_scale: float = 1.0,
-        generator: Optional[torch.Generator] = None,
+        generator: GeneratorArg = None,
         eta: float = 0.0,
         return_intermediate: bool = False,
         return_global_only: bool = True,  # FIXED: Default to global for recall
         generation_mode: str = "global",  # NEW: "global", "patch", or "dual"
+        noise: Optional[torch.Tensor] = None,
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, List[torch.Tensor]]]:
         """
         FIXED: Generation with proper global flow matching.
         
         Args:
+            generator: RNG, or a list with one RNG per sample (draws then do not
+                depend on which other samples are in the batch)
             generation_mode:
                 - "global": Generate directly in global space [B, 768] (for recall)
                 - "patch": Generate in patch space [B, 256, 1024] (for details)
                 - "dual": Generate both (for comparison)
+            noise: Explicit initial sample (overrides generator for it): [B, 768]
+                in global mode, [B, 256, 1024] in patch mode; in dual mode it is
+                used by the mode whose shape it has
         """
         batch_size = encoder_hidden_states.shape[0]
         num_tokens = encoder_hidden_states.shape[1]
         device = encoder_hidden_states.device
         dtype = encoder_hidden_states.dtype
         
+        if num_tokens != self.num_tokens:
+            raise ValueError(f"Expected {self.num_tokens} conditioning tokens, got {num_tokens}")
+        if encoder_hidden_states.shape[2] != self.config.eva_embedding_size:
+            raise ValueError(f"Expected {self.config.eva_embedding_size}-dim EVA-CLIP features")
+        
         self.eval()
         
         if generation_mode == "global":
@@ -154,12 +185,13 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
             print(f"🎯 Generating in GLOBAL space for recall optimization")
             
             # Initialize from random noise in global space
-            global_sample = torch.randn(
-                (batch_size, 768),  # Global dimension
-                device=device,
-                dtype=dtype,
-                generator=generator
-            )
+            if noise is not None:
+                if tuple(noise.shape) != (batch_size, GLOBAL_DIM):
+                    raise ValueError(f"Global generation expects noise [{batch_size}, {GLOBAL_DIM}], "
+                                     f"got {tuple(noise.shape)}")
+                global_sample = noise.to(device=device, dtype=dtype)
+            else:
+                global_sample = _randn((batch_size, GLOBAL_DIM), generator, device, dtype)
             
             dt = 1.0 / num_inference_steps
             intermediate_samples = [] if return_intermediate else None
@@ -169,22 +201,11 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
                 t_tensor = torch.full((batch_size,), t, device=device, dtype=dtype)
                 
                 # We need to create dummy patch input for the model
-                dummy_patch_input = torch.randn(
-                    (batch_size, num_tokens, self.config.in_channels),
-                    device=device,
-                    dtype=dtype
-                )
-                
-                # Forward pass to get global velocity
-                outputs = self.forward(
-                    hidden_states=dummy_patch_input,
-                    timestep=t_tensor,
-                    encoder_hidden_states=encoder_hidden_states,
-                    training_mode="global_generation",
-                    return_dict=True
-                )
+                dummy_patch_input = _randn((batch_size, num_tokens, self.config.in_channels), generator, device, dtype)
                 
-                global_velocity = outputs['global_velocity']  # [B, 768]
+                # Forward pass to get global velocity (static path: no per-step validation/dicts)
+                _, pooled_features = self.forward_static(dummy_patch_input, t_tensor, encoder_hidden_states)
+                global_velocity = self.global_velocity_proj(pooled_features)  # [B, 768]
                 
                 # Euler integration in global space
                 global_sample = global_sample + dt * global_velocity
@@ -198,12 +219,13 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
             # Generate in patch space (original method)
             print(f"🔧 Generating in PATCH space")
             
-            sample = torch.randn(
-                (batch_size, num_tokens, self.config.in_channels),
-                device=device,
-                dtype=dtype,
-                generator=generator
-            )
+            patch_shape = (batch_size, num_tokens, self.config.in_channels)
+            if noise is not None:
+                if tuple(noise.shape) != patch_shape:
+                    raise ValueError(f"Patch generation expects noise {list(patch_shape)}, got {tuple(noise.shape)}")
+                sample = noise.to(device=device, dtype=dtype)
+            else:
+                sample = _randn(patch_shape, generator, device, dtype)
             
             dt = 1.0 / num_inference_steps
             intermediate_samples = [] if return_intermediate else None
@@ -212,15 +234,7 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
                 t = step * dt
                 t_tensor = torch.full((batch_size,), t, device=device, dtype=dtype)
                 
-                outputs = self.forward(
-                    hidden_states=sample,
-                    timestep=t_tensor,
-                    encoder_hidden_states=encoder_hidden_states,
-                    training_mode="dual_supervision",
-                    return_dict=True
-                )
-                
-                velocity = outputs['patch_output']  # [B, 256, 1024]
+                velocity, _ = self.forward_static(sample, t_tensor, encoder_hidden_states)  # [B, 256, 1024]
                 sample = sample + dt * velocity
                 
                 if return_intermediate:
@@ -229,14 +243,13 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
             # Convert to global if requested
             if return_global_only:
                 # Final forward pass to get global output
-                final_outputs = self.forward(
-                    hidden_states=sample,
-                    timestep=torch.zeros(batch_size, device=device, dtype=dtype),
-                    encoder_hidden_states=encoder_hidden_states,
-                    training_mode="dual_supervision",
-                    return_dict=True
+                _, final_pooled = self.forward_static(
+                    sample,
+                    torch.zeros(batch_size, device=device, dtype=dtype),
+                    encoder_hidden_states,
                 )
-                result = final_outputs.get('global_output', sample.mean(dim=1))
+                _, final_global = self._project_global(final_pooled)
+                result = final_global if final_global is not None else sample.mean(dim=1)
             else:
                 result = sample
         
@@ -250,7 +263,8 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
                 num_inference_steps=num_inference_steps,
                 generator=generator,
                 generation_mode="global",
-                return_intermediate=False
+                return_intermediate=False,
+                noise=noise if noise is not None and noise.dim() == 2 else None,
             )
             
             # Generate patch
@@ -260,7 +274,8 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
                 generator=generator,
                 generation_mode="patch",
                 return_global_only=return_global_only,
-                return_intermediate=False
+                return_intermediate=False,
+                noise=noise if noise is not None and noise.dim() == 3 else None,
             )
             
             result = {
@@ -294,9 +309,9 @@ class FixedDualSupervisionBLIP3oDiTModel(BLIP3oDiTModel):
             'mlp_input_dim': getattr(self.global_adaptation_mlp, 'input_dim', 'unknown'),
             'mlp_output_dim': getattr(self.global_adaptation_mlp, 'output_dim', 'unknown'),
             'clip_proj_shape': self.frozen_clip_visual_proj.weight.shape if self.frozen_clip_visual_proj else None,
-            'expected_patch_velocity_shape': f"[batch_size, 256, {self.config.in_channels}]",
-            'expected_global_velocity_shape': "[batch_size, 768]",  # NEW
-            'expected_patch_output_shape': f"[batch_size, 256, {self.config.in_channels}]",
+            'expected_patch_velocity_shape': f"[batch_size, {self.num_tokens}, {self.config.in_channels}]",
+            'expected_global_velocity_shape': f"[batch_size, {GLOBAL_DIM}]",  # NEW
+            'expected_patch_output_shape': f"[batch_size, {self.num_tokens}, {self.config.in_channels}]",
             'expected_global_output_shape': "[batch_size, 768]",
             'key_fix': "Added global velocity projection for dual flow matching",
             'training_modes': ["dual_flow", "dual_supervision", "global_generation"],
@@ -0,0 +1,152 @@
+"""
+Sequence parallelism and chunked attention for BLIP3-o DiT.
+
+Larger token grids (24x24 = 576 or 32x32 = 1024 tokens from higher-resolution
+EVA/CLIP features) make self-attention memory quadratic in the grid size. Two
+complementary tools:
+- chunked_scaled_dot_product_attention: processes queries in chunks, so the
+  attention matrix never exceeds [chunk, seq_len] per head (exact result)
+- Sequence parallelism: every rank of a process group holds the same batch but
+  only a contiguous 1/world_size slice of the tokens. Token-local work (FFN,
+  projections, cross-attention queries) is sharded; self-attention all-gathers
+  keys/values. Works with any torch.distributed backend, including gloo on CPU.
+
+Gradient convention: the patch output is gathered back to all tokens and the
+loss is computed identically on every rank. Sharded activations receive
+world_size x their local gradient so that AVERAGING parameter gradients over the
+group (what DDP does, or sync_sequence_parallel_gradients) gives the exact
+single-device gradient.
+"""
+
+import torch
+import torch.nn.functional as F
+import torch.distributed as dist
+from typing import Optional, Tuple
+
+
+def get_sequence_parallel_info(group: Optional[dist.ProcessGroup] = None) -> Tuple[int, int]:
+    """Return (rank, world_size) within the sequence-parallel group."""
+    if not dist.is_available() or not dist.is_initialized():
+        return 0, 1
+    return dist.get_rank(group), dist.get_world_size(group)
+
+
+def get_token_shard(num_tokens: int, rank: int, world_size: int) -> Tuple[int, int]:
+    """Contiguous [start, end) token range owned by a rank."""
+    if num_tokens % world_size != 0:
+        raise ValueError(f"{num_tokens} tokens cannot be split evenly across {world_size} sequence-parallel ranks")
+    shard_size = num_tokens // world_size
+    return rank * shard_size, (rank + 1) * shard_size
+
+
+class _GatherTokens(torch.autograd.Function):
+    """
+    All-gather token shards along `dim`.
+
+    backward(sum_grads=True): all-reduce the gradient (every rank's queries attend
+    to every rank's keys) and keep the local slice - used for keys/values.
+    backward(sum_grads=False): keep the local slice scaled by world_size - used
+    for the output, whose downstream loss is replicated on every rank.
+    """
+
+    @staticmethod
+    def forward(ctx, tensor, dim, group, sum_grads):
+        rank, world_size = get_sequence_parallel_info(group)
+        ctx.dim, ctx.group, ctx.sum_grads = dim, group, sum_grads
+        ctx.rank, ctx.world_size = rank, world_size
+
+        shards = [torch.empty_like(tensor) for _ in range(world_size)]
+        dist.all_gather(shards, tensor.contiguous(), group=group)
+        return torch.cat(shards, dim=dim)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad_output = grad_output.contiguous()
+        if ctx.sum_grads:
+            dist.all_reduce(grad_output, group=ctx.group)
+        else:
+            grad_output = grad_output * ctx.world_size
+        local = grad_output.chunk(ctx.world_size, dim=ctx.dim)[ctx.rank]
+        return local.contiguous(), None, None, None
+
+
+def gather_tokens(
+    tensor: torch.Tensor,
+    dim: int = 1,
+    group: Optional[dist.ProcessGroup] = None,
+    sum_grads: bool = True,
+) -> torch.Tensor:
+    """Autograd-aware all-gather of token shards (see _GatherTokens for the gradient rule)."""
+    _, world_size = get_sequence_parallel_info(group)
+    if world_size == 1:
+        return tensor
+    return _GatherTokens.apply(tensor, dim, group, sum_grads)
+
+
+def shard_tokens(
+    tensor: torch.Tensor,
+    dim: int = 1,
+    group: Optional[dist.ProcessGroup] = None,
+) -> torch.Tensor:
+    """Keep this rank's contiguous slice of the tokens along `dim`."""
+    rank, world_size = get_sequence_parallel_info(group)
+    if world_size == 1:
+        return tensor
+    start, end = get_token_shard(tensor.shape[dim], rank, world_size)
+    return tensor.narrow(dim, start, end - start)
+
+
+def sync_sequence_parallel_gradients(model: torch.nn.Module, group: Optional[dist.ProcessGroup] = None):
+    """Average parameter gradients over the sequence-parallel group (not needed under DDP on the same group)."""
+    _, world_size = get_sequence_parallel_info(group)
+    if world_size == 1:
+        return
+    for param in model.parameters():
+        if param.grad is not None:
+            dist.all_reduce(param.grad, group=group)
+            param.grad.div_(world_size)
+
+
+def chunked_scaled_dot_product_attention(
+    query: torch.Tensor,
+    key: torch.Tensor,
+    value: torch.Tensor,
+    attn_mask: Optional[torch.Tensor] = None,
+    chunk_size: Optional[int] = None,
+) -> torch.Tensor:
+    """
+    F.scaled_dot_product_attention over query chunks.
+
+    Each query row is independent, so the result is exact; peak attention memory
+    is [..., chunk_size, kv_len] instead of [..., q_len, kv_len].
+
+    Args:
+        query: [..., q_len, head_dim]
+        key, value: [..., kv_len, head_dim]
+        attn_mask: Additive/boolean mask broadcastable to [..., q_len, kv_len]
+        chunk_size: Queries per chunk (None or >= q_len: single call)
+    """
+    q_len = query.shape[-2]
+    if chunk_size is None or chunk_size >= q_len:
+        return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=0.0, is_causal=False)
+
+    outputs = []
+    for start in range(0, q_len, chunk_size):
+        end = min(start + chunk_size, q_len)
+        chunk_mask = attn_mask
+        if attn_mask is not None and attn_mask.shape[-2] != 1:
+            chunk_mask = attn_mask[..., start:end, :]
+        outputs.append(F.scaled_dot_product_attention(
+            query[..., start:end, :], key, value, attn_mask=chunk_mask, dropout_p=0.0, is_causal=False
+        ))
+    return torch.cat(outputs, dim=-2)
+
+
+__all__ = [
+    "get_sequence_parallel_info",
+    "get_token_shard",
+    "gather_tokens",
+    "shard_tokens",
+    "sync_sequence_parallel_gradients",
+    "chunked_scaled_dot_product_attention",
+]
@@ -2,50 +2,82 @@
 Training utilities for BLIP3-o DiT - FIXED for Dual Supervision
 """
 
-from .blip3o_trainer import (
-    BLIP3oTrainer as StandardBLIP3oTrainer,
-    create_blip3o_training_args as create_standard_training_args,
-)
+from ..utils.lazy_imports import lazy_exports
 
-# Import dual supervision trainer with better error handling
-DUAL_SUPERVISION_TRAINER_AVAILABLE = False
-try:
-    from .dual_supervision_blip3o_trainer import (
-        DualSupervisionBLIP3oTrainer,
-        create_blip3o_training_args as create_dual_supervision_training_args,
+
+def _resolve_dual_supervision():
+    """
+    Pick the dual supervision trainer as BLIP3oTrainer if it imports, else the
+    standard one (on first use; sets DUAL_SUPERVISION_TRAINER_AVAILABLE).
+    """
+    global BLIP3oTrainer, create_blip3o_training_args, DUAL_SUPERVISION_TRAINER_AVAILABLE
+    global DualSupervisionBLIP3oTrainer, create_dual_supervision_training_args
+    from .blip3o_trainer import (
+        BLIP3oTrainer as StandardBLIP3oTrainer,
+        create_blip3o_training_args as create_standard_training_args,
     )
-    # Use dual supervision as default
-    BLIP3oTrainer = DualSupervisionBLIP3oTrainer
-    create_blip3o_training_args = create_dual_supervision_training_args
-    DUAL_SUPERVISION_TRAINER_AVAILABLE = True
-    print("✅ Dual supervision trainer loaded successfully")
-    
-except ImportError as e:
-    # Use standard trainer as fallback
-    BLIP3oTrainer = StandardBLIP3oTrainer
-    create_blip3o_training_args = create_standard_training_args
-    DUAL_SUPERVISION_TRAINER_AVAILABLE = False
-    print(f"⚠️ Dual supervision trainer import failed: {e}")
-    print("⚠️ Using standard trainer as fallback")
     
-except Exception as e:
-    # Handle other errors
-    BLIP3oTrainer = StandardBLIP3oTrainer
-    create_blip3o_training_args = create_standard_training_args
+    # Import dual supervision trainer with better error handling
     DUAL_SUPERVISION_TRAINER_AVAILABLE = False
-    print(f"⚠️ Unexpected error loading dual supervision trainer: {e}")
-    print("⚠️ Using standard trainer as fallback")
+    try:
+        from .dual_supervision_blip3o_trainer import (
+            DualSupervisionBLIP3oTrainer,
+            create_blip3o_training_args as create_dual_supervision_training_args,
+        )
+        # Use dual supervision as default
+        BLIP3oTrainer = DualSupervisionBLIP3oTrainer
+        create_blip3o_training_args = create_dual_supervision_training_args
+        DUAL_SUPERVISION_TRAINER_AVAILABLE = True
+        print("✅ Dual supervision trainer loaded successfully")
+        
+    except ImportError as e:
+        # Use standard trainer as fallback
+        BLIP3oTrainer = StandardBLIP3oTrainer
+        create_blip3o_training_args = create_standard_training_args
+        DUAL_SUPERVISION_TRAINER_AVAILABLE = False
+        print(f"⚠️ Dual supervision trainer import failed: {e}")
+        print("⚠️ Using standard trainer as fallback")
+        
+    except Exception as e:
+        # Handle other errors
+        BLIP3oTrainer = StandardBLIP3oTrainer
+        create_blip3o_training_args = create_standard_training_args
+        DUAL_SUPERVISION_TRAINER_AVAILABLE = False
+        print(f"⚠️ Unexpected error loading dual supervision trainer: {e}")
+        print("⚠️ Using standard trainer as fallback")
+
+
+# Imported on first access (PEP 562), see utils/lazy_imports.py
+_EXPORTS = {
+    "StandardBLIP3oTrainer": ".blip3o_trainer:BLIP3oTrainer",
+    "ModelEMA": ".ema",
+    "EMACallback": ".ema",
+    "create_model_ema": ".ema",
+    "CheckpointCompletionCallback": ".checkpointing",
+    "create_checkpoint_writer": ".checkpointing",
+    "wait_for_checkpoint_writes": ".checkpointing",
+    "InstrumentationCallback": ".instrumentation",
+    "instrument_trainer": ".instrumentation",
+    "create_standard_training_args": ".blip3o_trainer:create_blip3o_training_args",
+    "BLIP3oTrainer": _resolve_dual_supervision,
+    "create_blip3o_training_args": _resolve_dual_supervision,
+    "DUAL_SUPERVISION_TRAINER_AVAILABLE": _resolve_dual_supervision,
+    "DualSupervisionBLIP3oTrainer": _resolve_dual_supervision,
+    "create_dual_supervision_training_args": _resolve_dual_supervision,
+}
 
 __all__ = [
     "BLIP3oTrainer",
     "create_blip3o_training_args",
     "DUAL_SUPERVISION_TRAINER_AVAILABLE",
+    "ModelEMA",
+    "EMACallback",
+    "create_model_ema",
+    "CheckpointCompletionCallback",
+    "create_checkpoint_writer",
+    "wait_for_checkpoint_writes",
+    "InstrumentationCallback",
+    "instrument_trainer",
 ]
 
-if DUAL_SUPERVISION_TRAINER_AVAILABLE:
-    __all__.extend([
-        "DualSupervisionBLIP3oTrainer",
-        "StandardBLIP3oTrainer",
-        "create_standard_training_args",
-        "create_dual_supervision_training_args",
-    ])
\ No newline at end of file
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
@@ -10,7 +10,7 @@ from transformers import Trainer, TrainingArguments
 from transformers.trainer_utils import EvalPrediction
 from typing import Dict, Any, Optional, Union, Tuple, List
 import logging
-import wandb
+import sys
 from pathlib import Path
 import json
 import numpy as np
@@ -20,10 +20,25 @@ from collections import defaultdict
 from ..models.blip3o_dit import BLIP3oDiTModel
 from ..losses.flow_matching_loss import BLIP3oFlowMatchingLoss
 from ..config.blip3o_config import BLIP3oDiTConfig, FlowMatchingConfig
+from .checkpointing import (
+    CheckpointCompletionCallback,
+    can_save_async,
+    create_checkpoint_writer,
+    save_model_async,
+    wait_for_checkpoint_writes,
+)
+from .instrumentation import instrument_trainer
+from ..utils.instrumentation import FORWARD, LOSS, timer
 
 logger = logging.getLogger(__name__)
 
 
+def _active_wandb_run():
+    """wandb, if a run was started (wandb.init imports it); avoids importing wandb here."""
+    wandb = sys.modules.get("wandb")
+    return wandb if wandb is not None and wandb.run is not None else None
+
+
 class BLIP3oTrainer(Trainer):
     """
     Custom trainer for BLIP3-o DiT training with flow matching.
@@ -50,6 +65,9 @@ class BLIP3oTrainer(Trainer):
         callbacks=None,
         optimizers=(None, None),
         preprocess_logits_for_metrics=None,
+        async_checkpointing: bool = False,
+        persistent_checkpoint_dir: Optional[str] = None,
+        keep_last_checkpoints: Optional[int] = None,
         **kwargs
     ):
         """
@@ -68,6 +86,10 @@ class BLIP3oTrainer(Trainer):
             callbacks: Training callbacks
             optimizers: (optimizer, lr_scheduler) tuple
             preprocess_logits_for_metrics: Not used for flow matching
+            async_checkpointing: Write checkpoints in a background thread (training
+                only stalls for a pinned-memory snapshot of the weights)
+            persistent_checkpoint_dir: Copy every finished checkpoint here (in the background)
+            keep_last_checkpoints: Checkpoints kept in persistent_checkpoint_dir
             **kwargs: Additional arguments
         """
         super().__init__(
@@ -95,6 +117,17 @@ class BLIP3oTrainer(Trainer):
         # Loss components tracking
         self.loss_components = defaultdict(list)
         
+        # Background checkpoint writes / copies to persistent storage
+        self.async_checkpointing = async_checkpointing
+        self.checkpoint_writer = create_checkpoint_writer(
+            async_checkpointing, persistent_checkpoint_dir, keep_last_checkpoints,
+        )
+        if self.checkpoint_writer is not None:
+            self.add_callback(CheckpointCompletionCallback(self.checkpoint_writer))
+        
+        # Per-stage timers (no-ops unless instrumentation is enabled)
+        instrument_trainer(self)
+        
         logger.info("BLIP3-o trainer initialized")
     
     def compute_loss(
@@ -147,22 +180,24 @@ class BLIP3oTrainer(Trainer):
         )
         
         # Forward pass through DiT model
-        model_output = model(
-            hidden_states=noisy_clip,
-            timestep=timesteps,
-            encoder_hidden_states=eva_embeddings,
-            return_dict=False
-        )
+        with timer(FORWARD):
+            model_output = model(
+                hidden_states=noisy_clip,
+                timestep=timesteps,
+                encoder_hidden_states=eva_embeddings,
+                return_dict=False
+            )
         
         # Compute flow matching loss with detailed metrics
-        loss, metrics = self.flow_matching_loss(
-            model_output=model_output,
-            target_samples=clip_embeddings,
-            timesteps=timesteps,
-            eva_conditioning=eva_embeddings,
-            noise=noise,
-            return_metrics=True
-        )
+        with timer(LOSS):
+            loss, metrics = self.flow_matching_loss(
+                model_output=model_output,
+                target_samples=clip_embeddings,
+                timesteps=timesteps,
+                eva_conditioning=eva_embeddings,
+                noise=noise,
+                return_metrics=True
+            )
         
         # Store metrics for logging
         if metrics is not None:
@@ -243,7 +278,8 @@ class BLIP3oTrainer(Trainer):
         log_dict["train/epoch"] = self.state.epoch
         
         # Log to wandb if available
-        if wandb.run is not None:
+        wandb = _active_wandb_run()
+        if wandb is not None:
             wandb.log(log_dict, step=self.training_step_count)
         
         # Store in history
@@ -330,7 +366,8 @@ class BLIP3oTrainer(Trainer):
         eval_results.update({f'{metric_key_prefix}_{k}': v for k, v in sample_metrics.items()})
         
         # Log evaluation results
-        if wandb.run is not None:
+        wandb = _active_wandb_run()
+        if wandb is not None:
             wandb.log(eval_results, step=self.training_step_count)
         
         # Store in history
@@ -399,6 +436,16 @@ class BLIP3oTrainer(Trainer):
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
+        if self.async_checkpointing and can_save_async(self):
+            # Snapshot only; weights, configs and metrics are written in the background
+            save_model_async(
+                self, self.checkpoint_writer, output_dir,
+                files={**self._blip3o_config_files(), **self._metrics_history_files()},
+                mark_complete=not _internal_call,
+            )
+            logger.info(f"BLIP3-o model and configs queued for saving to {output_dir}")
+            return
+        
         # Save model using parent class
         super().save_model(output_dir, _internal_call)
         
@@ -410,8 +457,30 @@ class BLIP3oTrainer(Trainer):
         
         logger.info(f"BLIP3-o model and configs saved to {output_dir}")
     
+    def wait_for_checkpoints(self, barrier: bool = False):
+        """Block until background checkpoint writes / copies finish (barrier: on every rank)."""
+        wait_for_checkpoint_writes(self.checkpoint_writer, barrier=barrier)
+    
+    def _load_best_model(self):
+        # load_best_model_at_end reads the best checkpoint back from disk, on every rank
+        self.wait_for_checkpoints(barrier=True)
+        return super()._load_best_model()
+    
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.wait_for_checkpoints()
+    
     def _save_blip3o_configs(self, output_dir: Path):
         """Save BLIP3-o specific configurations."""
+        for name, content in self._blip3o_config_files().items():
+            with open(output_dir / name, 'w') as f:
+                json.dump(content, f, indent=2)
+    
+    def _blip3o_config_files(self) -> Dict[str, Any]:
+        """BLIP3-o specific configurations as {file name: JSON content}."""
+        files = {}
         
         # Save flow matching configuration
         flow_config = {
@@ -424,14 +493,11 @@ class BLIP3oTrainer(Trainer):
             'regularization_weight': self.flow_matching_loss.regularization_weight,
         }
         
-        with open(output_dir / 'flow_matching_config.json', 'w') as f:
-            json.dump(flow_config, f, indent=2)
+        files['flow_matching_config.json'] = flow_config
         
         # Save model configuration (if not already saved by parent)
         if hasattr(self.model, 'config'):
-            model_config = self.model.config.to_dict()
-            with open(output_dir / 'blip3o_model_config.json', 'w') as f:
-                json.dump(model_config, f, indent=2)
+            files['blip3o_model_config.json'] = self.model.config.to_dict()
         
         # FIXED: Create training summary without invalid lr_end
         training_summary = {
@@ -440,27 +506,33 @@ class BLIP3oTrainer(Trainer):
             'num_trainable_parameters': self.model.get_num_parameters(trainable_only=True),
             'memory_footprint': self.model.get_memory_footprint(),
             'gradient_checkpointing': self.model._gradient_checkpointing,
+            'gradient_checkpointing_policy': getattr(self.model, 'gradient_checkpointing_policy', None),
             'lr_scheduler_type': self.args.lr_scheduler_type,
             'learning_rate': self.args.learning_rate,
             'warmup_ratio': self.args.warmup_ratio,
             'warmup_steps': self.args.warmup_steps,
         }
         
-        with open(output_dir / 'training_summary.json', 'w') as f:
-            json.dump(training_summary, f, indent=2)
+        files['training_summary.json'] = training_summary
+        return files
     
     def _save_metrics_history(self, output_dir: Path):
         """Save training and evaluation metrics history."""
+        for name, content in self._metrics_history_files().items():
+            with open(output_dir / name, 'w') as f:
+                json.dump(content, f, indent=2)
+    
+    def _metrics_history_files(self) -> Dict[str, Any]:
+        """Metrics history as {file name: JSON content} (lists copied: training keeps appending)."""
+        files = {}
         
         # Save training metrics
         if self.train_metrics_history:
-            with open(output_dir / 'train_metrics_history.json', 'w') as f:
-                json.dump(self.train_metrics_history, f, indent=2)
+            files['train_metrics_history.json'] = list(self.train_metrics_history)
         
         # Save evaluation metrics
         if self.eval_metrics_history:
-            with open(output_dir / 'eval_metrics_history.json', 'w') as f:
-                json.dump(self.eval_metrics_history, f, indent=2)
+            files['eval_metrics_history.json'] = list(self.eval_metrics_history)
         
         # Save loss components summary
         loss_summary = {}
@@ -475,8 +547,8 @@ class BLIP3oTrainer(Trainer):
                     'count': len(values),
                 }
         
-        with open(output_dir / 'loss_components_summary.json', 'w') as f:
-            json.dump(loss_summary, f, indent=2)
+        files['loss_components_summary.json'] = loss_summary
+        return files
     
     def create_optimizer(self):
         """Create optimizer with BLIP3-o specific settings."""
@@ -555,6 +627,9 @@ def create_blip3o_training_args(
     load_best_model_at_end: bool = True,
     metric_for_best_model: str = "eval_loss",
     greater_is_better: bool = False,
+    torch_compile: bool = False,
+    torch_compile_mode: Optional[str] = None,
+    torch_compile_backend: Optional[str] = None,
     **kwargs
 ) -> TrainingArguments:
     """
@@ -582,6 +657,9 @@ def create_blip3o_training_args(
         load_best_model_at_end: Load best model at end of training
         metric_for_best_model: Metric to use for best model selection
         greater_is_better: Whether higher metric values are better
+        torch_compile: Compile the model with torch.compile for the training step
+        torch_compile_mode: torch.compile mode (e.g. "default", "max-autotune")
+        torch_compile_backend: torch.compile backend (None for inductor)
         **kwargs: Additional TrainingArguments parameters
         
     Returns:
@@ -630,6 +708,9 @@ def create_blip3o_training_args(
         load_best_model_at_end=load_best_model_at_end,
         metric_for_best_model=metric_for_best_model,
         greater_is_better=greater_is_better,
+        torch_compile=torch_compile,
+        torch_compile_mode=torch_compile_mode,
+        torch_compile_backend=torch_compile_backend,
         save_total_limit=3,
         prediction_loss_only=False,
         report_to=[],
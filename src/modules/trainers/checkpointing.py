@@ -0,0 +1,130 @@
+"""
+Asynchronous checkpoint saving for the BLIP3-o trainers.
+
+save_model_async() writes what Trainer._save writes for the DiT
+(model.safetensors, config.json, training_args.bin) plus the trainer's JSON
+files through an AsyncCheckpointWriter (utils/async_checkpoint.py), so a save
+only stalls training for the pinned-memory snapshot.
+CheckpointCompletionCallback marks checkpoint-* directories complete once the
+Trainer has also written optimizer / scheduler / trainer state into them, and
+queues their copy to persistent storage.
+"""
+
+import io
+import torch
+import torch.distributed as dist
+import logging
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Union
+
+from transformers import TrainerCallback
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+from ..utils.async_checkpoint import AsyncCheckpointWriter
+from .ema import unwrap_model
+
+logger = logging.getLogger(__name__)
+
+SAFE_WEIGHTS_NAME = "model.safetensors"
+TRAINING_ARGS_NAME = "training_args.bin"
+
+
+def can_save_async(trainer) -> bool:
+    """DeepSpeed / FSDP gather sharded weights collectively: those keep the blocking save."""
+    return not (getattr(trainer, 'is_deepspeed_enabled', False) or getattr(trainer, 'is_fsdp_enabled', False))
+
+
+def save_model_async(
+    trainer,
+    writer: AsyncCheckpointWriter,
+    output_dir: Union[str, Path],
+    files: Optional[Dict[str, Any]] = None,
+    extra_state_dicts: Optional[Dict[str, Dict[str, torch.Tensor]]] = None,
+    metadata: Optional[Dict[str, Dict[str, str]]] = None,
+    mark_complete: bool = True,
+) -> Optional[Future]:
+    """
+    Snapshot the trainer's model and queue the checkpoint write (main process only).
+
+    Args:
+        trainer: HF Trainer whose model is saved
+        writer: Background writer
+        output_dir: Checkpoint directory
+        files: Extra files {name: str / bytes / JSON-serializable}
+        extra_state_dicts: Extra safetensors files {name: state dict} (e.g. EMA weights)
+        metadata: Safetensors metadata per weight file
+        mark_complete: Write the completion marker with the files (False for
+            checkpoint-* directories, see CheckpointCompletionCallback)
+    """
+    if not trainer.args.should_save:
+        return None
+
+    model = unwrap_model(trainer.model)
+    all_files = dict(files or {})
+    if hasattr(model, 'config'):
+        all_files['config.json'] = model.config.to_json_string(use_diff=True)
+    training_args = io.BytesIO()
+    torch.save(trainer.args, training_args)
+    all_files[TRAINING_ARGS_NAME] = training_args.getvalue()
+
+    return writer.save(
+        output_dir,
+        state_dicts={SAFE_WEIGHTS_NAME: model.state_dict(), **(extra_state_dicts or {})},
+        files=all_files,
+        metadata=metadata,
+        mark_complete=mark_complete,
+    )
+
+
+class CheckpointCompletionCallback(TrainerCallback):
+    """
+    After each checkpoint save (the Trainer has written everything by then):
+    queue the completion marker and, with a persistent directory, the copy to
+    persistent storage (keeping the best checkpoint out of the retention).
+    """
+
+    def __init__(self, writer: AsyncCheckpointWriter):
+        self.writer = writer
+
+    def on_save(self, args, state, control, **kwargs):
+        if not state.is_world_process_zero:
+            return
+        checkpoint_dir = Path(args.output_dir) / f"{PREFIX_CHECKPOINT_DIR}-{state.global_step}"
+        if not checkpoint_dir.is_dir():
+            return
+        self.writer.mark_complete(checkpoint_dir, {'global_step': state.global_step})
+        protect = [Path(state.best_model_checkpoint).name] if state.best_model_checkpoint else []
+        self.writer.copy_to_persistent(checkpoint_dir, protect=protect)
+
+
+def create_checkpoint_writer(
+    async_checkpointing: bool = False,
+    persistent_checkpoint_dir: Optional[Union[str, Path]] = None,
+    keep_last_checkpoints: Optional[int] = None,
+) -> Optional[AsyncCheckpointWriter]:
+    """Writer for the trainers' checkpointing options (None when neither is used)."""
+    if not async_checkpointing and persistent_checkpoint_dir is None:
+        return None
+    return AsyncCheckpointWriter(persistent_dir=persistent_checkpoint_dir, keep_last=keep_last_checkpoints)
+
+
+def wait_for_checkpoint_writes(writer: Optional[AsyncCheckpointWriter], barrier: bool = False):
+    """
+    Block until the writer's background writes / copies finish (re-raises their
+    errors). barrier=True also waits for every rank: only rank 0 writes, so
+    other ranks must not read a checkpoint back before it is on disk.
+    """
+    if writer is not None:
+        writer.wait()
+    if barrier and dist.is_available() and dist.is_initialized():
+        dist.barrier()
+
+
+__all__ = [
+    "save_model_async",
+    "can_save_async",
+    "CheckpointCompletionCallback",
+    "create_checkpoint_writer",
+    "wait_for_checkpoint_writes",
+]
@@ -12,16 +12,36 @@ import torch.nn.functional as F
 from transformers import Trainer, TrainingArguments, CLIPModel
 from typing import Dict, Any, Optional, Union, Tuple, List
 import logging
-import wandb
+import sys
 import numpy as np
 import math
 from collections import defaultdict
+import functools
 import json
 from pathlib import Path
 
+from ..config.blip3o_config import EMAConfig
+from .ema import ModelEMA, EMACallback
+from ..models.checkpoint_loader import EMA_WEIGHT_FILE
+from .checkpointing import (
+    CheckpointCompletionCallback,
+    can_save_async,
+    create_checkpoint_writer,
+    save_model_async,
+    wait_for_checkpoint_writes,
+)
+from .instrumentation import instrument_trainer
+from ..utils.instrumentation import FORWARD, LOSS, timer
+
 logger = logging.getLogger(__name__)
 
 
+def _active_wandb_run():
+    """wandb, if a run was started (wandb.init imports it); avoids importing wandb here."""
+    wandb = sys.modules.get("wandb")
+    return wandb if wandb is not None and wandb.run is not None else None
+
+
 class FixedDualSupervisionBLIP3oTrainer(Trainer):
     """
     FIXED: Enhanced trainer for dual supervision BLIP3-o training with global flow matching.
@@ -47,6 +67,14 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         
         # Dual supervision specific
         clip_model_name: str = "openai/clip-vit-large-patch14",
+        
+        # EMA of the model weights (None: disabled)
+        ema_config: Optional[EMAConfig] = None,
+        
+        # Background checkpoint writes / copies to persistent storage
+        async_checkpointing: bool = False,
+        persistent_checkpoint_dir: Optional[str] = None,
+        keep_last_checkpoints: Optional[int] = None,
         **kwargs
     ):
         super().__init__(
@@ -82,6 +110,25 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         self.ema_global_generation_cosine = 0.0  # NEW: Track global generation quality
         self.ema_decay = 0.99
         
+        # EMA of the weights: updated after optimizer steps, saved as ema_model.safetensors
+        self.model_ema: Optional[ModelEMA] = None
+        if ema_config is not None:
+            self.model_ema = ModelEMA(self.model, ema_config)
+            self.add_callback(EMACallback(
+                self.model_ema, before_load=functools.partial(self.wait_for_checkpoints, barrier=True),
+            ))
+        
+        # Async checkpointing: saves only stall training for a pinned-memory snapshot
+        self.async_checkpointing = async_checkpointing
+        self.checkpoint_writer = create_checkpoint_writer(
+            async_checkpointing, persistent_checkpoint_dir, keep_last_checkpoints,
+        )
+        if self.checkpoint_writer is not None:
+            self.add_callback(CheckpointCompletionCallback(self.checkpoint_writer))
+        
+        # Per-stage timers (no-ops unless instrumentation is enabled)
+        instrument_trainer(self)
+        
         logger.info("✅ FIXED Dual Supervision BLIP3-o trainer with global flow matching")
     
     def _load_clip_model(self):
@@ -154,48 +201,50 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         batch_size = eva_embeddings.shape[0]
         device = eva_embeddings.device
         
-        # Sample timesteps for flow matching
-        timesteps = self.flow_matching_loss.sample_timesteps(batch_size, device)
-        
-        # Sample noise for flow matching
-        patch_noise = torch.randn_like(clip_embeddings)  # [B, 256, 1024]
-        
+        # Sample timesteps, source samples and noise ONCE for this step; the loss
+        # reuses the same draws for its velocity targets
+        flow_draws = self.flow_matching_loss.sample_flow_draws(
+            clip_embeddings,
+            global_dim=getattr(self.clip_visual_projection, 'out_features', 768),
+        )
+        timesteps = flow_draws['timesteps']
+
         # FIXED: Create noisy input for PATCH flow matching
-        x_0_patch = torch.randn_like(clip_embeddings)
         noisy_clip = self.flow_matching_loss.interpolate_data(
-            x_0=x_0_patch,
+            x_0=flow_draws['x_0_patch'],
             x_1=clip_embeddings,
             t=timesteps,
-            noise=patch_noise
+            noise=flow_draws['patch_noise']
         )
         
         # Compute target global features for supervision and flow matching
         target_global = self.compute_target_global_features(clip_embeddings)  # [B, 768]
         
         # FIXED: Forward pass in DUAL FLOW mode to get both velocity predictions
-        try:
-            outputs = model(
-                hidden_states=noisy_clip,
-                timestep=timesteps,
-                encoder_hidden_states=eva_embeddings,
-                training_mode="dual_flow",  # KEY: Get both patch and global velocities
-                return_dict=True
-            )
-        except RuntimeError as e:
-            if "training_mode" in str(e) or "unexpected keyword" in str(e):
-                # Fallback for models without training_mode support
-                logger.warning("Model doesn't support training_mode, using standard forward")
+        with timer(FORWARD):
+            try:
                 outputs = model(
                     hidden_states=noisy_clip,
                     timestep=timesteps,
                     encoder_hidden_states=eva_embeddings,
+                    training_mode="dual_flow",  # KEY: Get both patch and global velocities
                     return_dict=True
                 )
-                # Manually compute global velocity if not available
-                if 'global_velocity' not in outputs:
-                    outputs['global_velocity'] = outputs.get('global_output', target_global)
-            else:
-                raise e
+            except RuntimeError as e:
+                if "training_mode" in str(e) or "unexpected keyword" in str(e):
+                    # Fallback for models without training_mode support
+                    logger.warning("Model doesn't support training_mode, using standard forward")
+                    outputs = model(
+                        hidden_states=noisy_clip,
+                        timestep=timesteps,
+                        encoder_hidden_states=eva_embeddings,
+                        return_dict=True
+                    )
+                    # Manually compute global velocity if not available
+                    if 'global_velocity' not in outputs:
+                        outputs['global_velocity'] = outputs.get('global_output', target_global)
+                else:
+                    raise e
         
         # Extract outputs
         patch_velocity = outputs.get('patch_velocity', outputs.get('patch_output'))  # [B, 256, 1024]
@@ -217,30 +266,31 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
             target_global = target_global.to(global_velocity.device)
         
         # FIXED: Compute dual supervision loss with BOTH flow matching components
-        try:
-            loss, metrics = self.flow_matching_loss(
-                # DiT velocity outputs (KEY FIX)
-                dit_patch_output=patch_velocity,    # [B, 256, 1024] - patch velocity
-                dit_global_output=global_velocity,  # [B, 768] - global velocity
-                
-                # Targets
-                clip_patches=clip_embeddings,       # [B, 256, 1024] - patch targets
-                clip_global=target_global,          # [B, 768] - global targets
-                
-                # Flow matching inputs
-                timesteps=timesteps,
-                eva_conditioning=eva_embeddings,
-                noise=patch_noise,
-                return_metrics=True
-            )
-        except Exception as e:
-            logger.error(f"Error in loss computation: {e}")
-            logger.error(f"Tensor shapes:")
-            logger.error(f"  patch_velocity: {patch_velocity.shape if patch_velocity is not None else 'None'}")
-            logger.error(f"  global_velocity: {global_velocity.shape if global_velocity is not None else 'None'}")
-            logger.error(f"  clip_embeddings: {clip_embeddings.shape}")
-            logger.error(f"  target_global: {target_global.shape}")
-            raise e
+        with timer(LOSS):
+            try:
+                loss, metrics = self.flow_matching_loss(
+                    # DiT velocity outputs (KEY FIX)
+                    dit_patch_output=patch_velocity,    # [B, 256, 1024] - patch velocity
+                    dit_global_output=global_velocity,  # [B, 768] - global velocity
+                    
+                    # Targets
+                    clip_patches=clip_embeddings,       # [B, 256, 1024] - patch targets
+                    clip_global=target_global,          # [B, 768] - global targets
+                    
+                    # Flow matching inputs
+                    timesteps=timesteps,
+                    eva_conditioning=eva_embeddings,
+                    flow_draws=flow_draws,
+                    return_metrics=True
+                )
+            except Exception as e:
+                logger.error(f"Error in loss computation: {e}")
+                logger.error(f"Tensor shapes:")
+                logger.error(f"  patch_velocity: {patch_velocity.shape if patch_velocity is not None else 'None'}")
+                logger.error(f"  global_velocity: {global_velocity.shape if global_velocity is not None else 'None'}")
+                logger.error(f"  clip_embeddings: {clip_embeddings.shape}")
+                logger.error(f"  target_global: {target_global.shape}")
+                raise e
         
         # Store metrics
         if metrics is not None:
@@ -379,7 +429,8 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         })
         
         # Log to wandb
-        if wandb.run is not None:
+        wandb = _active_wandb_run()
+        if wandb is not None:
             wandb.log(log_dict, step=self.training_step_count)
         
         # Store in history
@@ -407,6 +458,21 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         eval_dataset=None,
         ignore_keys=None,
         metric_key_prefix: str = "eval",
+    ) -> Dict[str, float]:
+        """
+        Evaluate on the EMA weights when enabled (so logged metrics and best-model
+        selection track them), else on the live weights.
+        """
+        if self.model_ema is not None and self.model_ema.config.evaluate_with_ema:
+            with self.model_ema.average_parameters(self.model):
+                return self._evaluate_weights(eval_dataset, ignore_keys, metric_key_prefix)
+        return self._evaluate_weights(eval_dataset, ignore_keys, metric_key_prefix)
+    
+    def _evaluate_weights(
+        self,
+        eval_dataset=None,
+        ignore_keys=None,
+        metric_key_prefix: str = "eval",
     ) -> Dict[str, float]:
         """Enhanced evaluation with FIXED dual supervision and global generation metrics."""
         
@@ -520,10 +586,12 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
                 # Overall quality (emphasize global generation for recall)
                 f'{metric_key_prefix}_overall_quality': 0.2 * np.mean(patch_array) + 0.8 * np.mean(global_gen_array),
                 f'{metric_key_prefix}_fixed_dual_supervision': True,
+                f'{metric_key_prefix}_ema_weights': self.model_ema is not None and self.model_ema.config.evaluate_with_ema,
             })
         
         # Log evaluation results
-        if wandb.run is not None:
+        wandb = _active_wandb_run()
+        if wandb is not None:
             wandb.log(eval_results, step=self.training_step_count)
         
         self.eval_metrics_history.append({
@@ -546,16 +614,60 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
+        if self.async_checkpointing and can_save_async(self):
+            # Snapshot only (live and EMA weights); files are written in the background
+            extra_state_dicts, metadata = {}, {}
+            if self.model_ema is not None:
+                extra_state_dicts[EMA_WEIGHT_FILE] = self.model_ema.averaged_state_dict(self.model)
+                metadata[EMA_WEIGHT_FILE] = self.model_ema.metadata()
+            save_model_async(
+                self, self.checkpoint_writer, output_dir,
+                files=self._fixed_dual_supervision_files(),
+                extra_state_dicts=extra_state_dicts,
+                metadata=metadata,
+                mark_complete=not _internal_call,
+            )
+            self._print_fixed_dual_supervision_summary()
+            logger.info(f"✅ FIXED dual supervision BLIP3-o model queued for saving to {output_dir}")
+            return
+        
         # Save model using parent class
         super().save_model(output_dir, _internal_call)
         
+        # EMA weights next to the live ones (also in every checkpoint-* directory)
+        if self.model_ema is not None and self.args.should_save:
+            self.model_ema.save(self.model, output_dir)
+        
         # Save FIXED dual supervision specific configurations
         self._save_fixed_dual_supervision_configs(output_dir)
         
         logger.info(f"✅ FIXED dual supervision BLIP3-o model saved to {output_dir}")
     
+    def wait_for_checkpoints(self, barrier: bool = False):
+        """Block until background checkpoint writes / copies finish (barrier: on every rank)."""
+        wait_for_checkpoint_writes(self.checkpoint_writer, barrier=barrier)
+    
+    def _load_best_model(self):
+        # load_best_model_at_end reads the best checkpoint back from disk, on every rank
+        self.wait_for_checkpoints(barrier=True)
+        return super()._load_best_model()
+    
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            self.wait_for_checkpoints()
+    
     def _save_fixed_dual_supervision_configs(self, output_dir: Path):
         """Save FIXED dual supervision specific configurations and metrics."""
+        for name, content in self._fixed_dual_supervision_files().items():
+            with open(output_dir / name, 'w') as f:
+                json.dump(content, f, indent=2)
+        
+        self._print_fixed_dual_supervision_summary()
+    
+    def _fixed_dual_supervision_files(self) -> Dict[str, Any]:
+        """FIXED dual supervision configurations and metrics as {file name: JSON content}."""
         
         # FIXED dual supervision training summary
         fixed_summary = {
@@ -571,6 +683,7 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
             # Model configuration
             'clip_model_name': self.clip_model_name,
             'training_mode': 'dual_flow',
+            'ema_weights': self.model_ema.summary() if self.model_ema is not None else None,
             
             # Loss weights used
             'loss_weights': {
@@ -617,8 +730,6 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
             }
         }
         
-        with open(output_dir / 'fixed_dual_supervision_summary.json', 'w') as f:
-            json.dump(fixed_summary, f, indent=2)
         
         # Save performance tracking
         performance_log = {
@@ -631,9 +742,12 @@ class FixedDualSupervisionBLIP3oTrainer(Trainer):
             'recent_eval_metrics': self.eval_metrics_history[-10:] if self.eval_metrics_history else [],
         }
         
-        with open(output_dir / 'fixed_performance_log.json', 'w') as f:
-            json.dump(performance_log, f, indent=2)
-        
+        return {
+            'fixed_dual_supervision_summary.json': fixed_summary,
+            'fixed_performance_log.json': performance_log,
+        }
+    
+    def _print_fixed_dual_supervision_summary(self):
         print(f"📊 FIXED Training Summary:")
         print(f"   Global generation cosine: {self.ema_global_generation_cosine:.4f}")
         print(f"   Predicted recall improvement: {min(self.ema_global_generation_cosine * 70, 70):.1f}%")
@@ -661,9 +775,17 @@ def create_blip3o_training_args(
     load_best_model_at_end: bool = True,
     metric_for_best_model: str = "eval_global_generation_cosine_mean",  # FIXED: Use global generation metric
     greater_is_better: bool = True,
+    torch_compile: bool = False,
+    torch_compile_mode: Optional[str] = None,
+    torch_compile_backend: Optional[str] = None,
     **kwargs
 ) -> TrainingArguments:
-    """Create TrainingArguments optimized for FIXED dual supervision training."""
+    """
+    Create TrainingArguments optimized for FIXED dual supervision training.
+    
+    torch_compile wraps the model in torch.compile for the training step
+    (torch_compile_mode e.g. "default", "max-autotune"; backend defaults to inductor).
+    """
     
     # Ensure evaluation strategy compatibility
     if load_best_model_at_end and eval_steps > 0:
@@ -697,6 +819,9 @@ def create_blip3o_training_args(
         load_best_model_at_end=load_best_model_at_end,
         metric_for_best_model=metric_for_best_model,
         greater_is_better=greater_is_better,
+        torch_compile=torch_compile,
+        torch_compile_mode=torch_compile_mode,
+        torch_compile_backend=torch_compile_backend,
         save_total_limit=3,
         prediction_loss_only=False,
         report_to=[],
@@ -0,0 +1,296 @@
+"""
+EMA of the model weights for BLIP3-o DiT training.
+
+ModelEMA keeps an exponential moving average of the trainable parameters,
+updated after optimizer steps with one fused torch._foreach_lerp_ per
+(device, dtype) group. The average can be kept in reduced precision and / or
+offloaded to pinned host memory, and is saved as ema_model.safetensors next to
+the live weights (a full state dict, so BLIP3oInference(use_ema_weights=True)
+and load_blip3o_checkpoint(weights="ema") load it like any checkpoint).
+"""
+
+import math
+import torch
+import logging
+import contextlib
+import torch.nn as nn
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from transformers import TrainerCallback
+
+from ..config.blip3o_config import EMAConfig
+from ..models.checkpoint_loader import EMA_WEIGHT_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """Strip DDP / torch.compile wrappers (parameter names then match the checkpoint)."""
+    while True:
+        if hasattr(model, "module") and isinstance(model.module, nn.Module):
+            model = model.module
+        elif hasattr(model, "_orig_mod"):
+            model = model._orig_mod
+        else:
+            return model
+
+
+class ModelEMA:
+    """
+    Exponential moving average of a model's trainable parameters.
+
+    Frozen parameters and buffers are not averaged; they are taken from the
+    live model when the EMA weights are saved or swapped in.
+    """
+
+    def __init__(self, model: nn.Module, config: Optional[EMAConfig] = None):
+        self.config = config or EMAConfig()
+        model = unwrap_model(model)
+
+        self.names = [
+            name for name, param in model.named_parameters()
+            if param.requires_grad and param.is_floating_point()
+        ]
+        params = dict(model.named_parameters())
+        dtype = getattr(torch, self.config.dtype) if self.config.dtype else None
+        pin = self.config.offload_to_cpu and torch.cuda.is_available()
+
+        self.shadow: List[torch.Tensor] = []
+        for name in self.names:
+            param = params[name].detach()
+            device = torch.device("cpu") if self.config.offload_to_cpu else param.device
+            shadow = torch.empty(param.shape, dtype=dtype or param.dtype, device=device, pin_memory=pin)
+            shadow.copy_(param)
+            self.shadow.append(shadow)
+
+        # Staging buffers for parameters whose device / dtype differ from their average
+        self._staging: List[Optional[torch.Tensor]] = [
+            torch.empty_like(shadow, pin_memory=pin) if self._needs_staging(params[name], shadow) else None
+            for name, shadow in zip(self.names, self.shadow)
+        ]
+        self._groups = self._group_indices()
+
+        self.num_updates = 0
+        self.last_step = -1
+        self._warn_if_precision_too_low()
+
+        logger.info(
+            f"EMA of {len(self.names)} parameter tensors ({self.num_bytes() / 1024 ** 2:.1f} MB, "
+            f"decay={self.config.decay}, every {self.config.update_every} step(s), "
+            f"{'cpu' if self.config.offload_to_cpu else 'device'}, {self.config.dtype or 'parameter dtype'})"
+        )
+
+    @staticmethod
+    def _needs_staging(param: torch.Tensor, shadow: torch.Tensor) -> bool:
+        return param.device != shadow.device or param.dtype != shadow.dtype
+
+    def _group_indices(self) -> Dict[Tuple[torch.device, torch.dtype], List[int]]:
+        """Shadow tensors grouped by (device, dtype): one fused lerp per group."""
+        groups: Dict[Tuple[torch.device, torch.dtype], List[int]] = {}
+        for index, shadow in enumerate(self.shadow):
+            groups.setdefault((shadow.device, shadow.dtype), []).append(index)
+        return groups
+
+    def _warn_if_precision_too_low(self):
+        if not self.shadow:
+            return
+        eps = torch.finfo(self.shadow[0].dtype).eps
+        weight = 1.0 - self.config.decay ** self.config.update_every
+        if weight < eps:
+            # Updates smaller than half an ulp round away: the average would stop moving
+            min_interval = math.ceil(math.log(1.0 - eps) / math.log(self.config.decay))
+            logger.warning(
+                f"EMA update weight {weight:.2e} is below {self.shadow[0].dtype} resolution ({eps:.2e}); "
+                f"use update_every >= {min_interval} or a float32 EMA"
+            )
+
+    def num_bytes(self) -> int:
+        return sum(shadow.numel() * shadow.element_size() for shadow in self.shadow)
+
+    def get_decay(self, step: int) -> float:
+        """Decay applied at optimizer step `step`, compounded over the update interval."""
+        decay = self.config.decay
+        if self.config.use_warmup:
+            steps = max(step - self.config.start_step, 0)
+            decay = min(decay, (1 + steps) / (10 + steps))
+        return decay ** self.config.update_every
+
+    def _live_parameters(self, model: nn.Module) -> List[torch.Tensor]:
+        params = dict(unwrap_model(model).named_parameters())
+        return [params[name] for name in self.names]
+
+    @torch.no_grad()
+    def update(self, model: nn.Module, step: int) -> bool:
+        """Average in the current weights if `step` is an update step; returns whether it was."""
+        if step < self.config.start_step or step == self.last_step or step % self.config.update_every:
+            return False
+
+        live = self._live_parameters(model)
+        if self.num_updates == 0:
+            # First update (possibly after start_step): start from the current weights
+            for shadow, param in zip(self.shadow, live):
+                shadow.copy_(param)
+        else:
+            sources = []
+            for param, staging in zip(live, self._staging):
+                if staging is None:
+                    sources.append(param.detach())
+                else:
+                    staging.copy_(param, non_blocking=True)
+                    sources.append(staging)
+            if self.config.offload_to_cpu and torch.cuda.is_available():
+                # Device -> pinned host copies must land before the CPU lerp reads them
+                torch.cuda.current_stream().synchronize()
+
+            weight = 1.0 - self.get_decay(step)
+            for indices in self._groups.values():
+                torch._foreach_lerp_(
+                    [self.shadow[i] for i in indices],
+                    [sources[i] for i in indices],
+                    weight,
+                )
+
+        self.num_updates += 1
+        self.last_step = step
+        return True
+
+    @contextlib.contextmanager
+    def average_parameters(self, model: nn.Module) -> Iterator[nn.Module]:
+        """
+        Temporarily run `model` on the EMA weights (e.g. for evaluation).
+
+        Averages with the parameter's device and dtype are swapped in by
+        exchanging storage (no copy); the others are copied in and the live
+        weights restored afterwards.
+        """
+        live = self._live_parameters(model)
+        backups: List[Optional[torch.Tensor]] = []
+        with torch.no_grad():
+            for index, (param, shadow) in enumerate(zip(live, self.shadow)):
+                if self._needs_staging(param, shadow):
+                    backups.append(param.detach().clone())
+                    param.copy_(shadow)
+                else:
+                    backups.append(None)
+                    param.data, self.shadow[index] = shadow, param.data
+        try:
+            yield model
+        finally:
+            with torch.no_grad():
+                for index, (param, backup) in enumerate(zip(live, backups)):
+                    if backup is None:
+                        param.data, self.shadow[index] = self.shadow[index], param.data
+                    else:
+                        param.copy_(backup)
+
+    def averaged_state_dict(self, model: nn.Module) -> Dict[str, torch.Tensor]:
+        """Model state dict with the averaged parameters swapped in (tensors not copied)."""
+        state = unwrap_model(model).state_dict()
+        for name, shadow in zip(self.names, self.shadow):
+            state[name] = shadow
+        return state
+
+    def state_dict(self, model: nn.Module) -> Dict[str, torch.Tensor]:
+        """Full model state dict with the averaged parameters (drop-in for the checkpoint loader)."""
+        # Clone: safetensors refuses tensors that share storage
+        return {
+            name: tensor.detach().to("cpu").clone().contiguous()
+            for name, tensor in self.averaged_state_dict(model).items()
+        }
+
+    def metadata(self) -> Dict[str, str]:
+        """Safetensors metadata of ema_model.safetensors (read back by load())."""
+        return {
+            'decay': str(self.config.decay),
+            'update_every': str(self.config.update_every),
+            'num_updates': str(self.num_updates),
+            'last_step': str(self.last_step),
+        }
+
+    def save(self, model: nn.Module, output_dir: Union[str, Path]) -> Path:
+        """Write ema_model.safetensors into `output_dir`."""
+        from safetensors.torch import save_file
+
+        path = Path(output_dir) / EMA_WEIGHT_FILE
+        save_file(self.state_dict(model), str(path), metadata={'format': 'pt', **self.metadata()})
+        logger.info(f"EMA weights saved to {path} ({self.num_updates} updates)")
+        return path
+
+    @torch.no_grad()
+    def load(self, path: Union[str, Path]):
+        """Restore the average from an ema_model.safetensors file (or a directory containing one)."""
+        from safetensors import safe_open
+
+        path = Path(path)
+        if path.is_dir():
+            path = path / EMA_WEIGHT_FILE
+        with safe_open(str(path), framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {}
+            for name, shadow in zip(self.names, self.shadow):
+                shadow.copy_(f.get_tensor(name))
+        self.num_updates = int(metadata.get('num_updates', 1))
+        self.last_step = int(metadata.get('last_step', -1))
+        logger.info(f"EMA weights restored from {path} ({self.num_updates} updates)")
+
+    def summary(self) -> Dict[str, Union[int, float, str, bool, None]]:
+        return {
+            'decay': self.config.decay,
+            'update_every': self.config.update_every,
+            'start_step': self.config.start_step,
+            'dtype': self.config.dtype,
+            'offload_to_cpu': self.config.offload_to_cpu,
+            'evaluate_with_ema': self.config.evaluate_with_ema,
+            'num_updates': self.num_updates,
+            'last_step': self.last_step,
+            'size_mb': self.num_bytes() / 1024 ** 2,
+            'weight_file': EMA_WEIGHT_FILE,
+        }
+
+
+class EMACallback(TrainerCallback):
+    """
+    Updates a ModelEMA after each optimizer step; at the end of training with
+    load_best_model_at_end, restores the average saved with the best checkpoint.
+    before_load runs first (the trainers pass wait_for_checkpoints with a
+    barrier, so the file is complete on every rank).
+    """
+
+    def __init__(self, model_ema: ModelEMA, before_load: Optional[Callable[[], None]] = None):
+        self.model_ema = model_ema
+        self.before_load = before_load
+
+    def on_step_end(self, args, state, control, model=None, **kwargs):
+        if model is not None:
+            self.model_ema.update(model, state.global_step)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if args.load_best_model_at_end and state.best_model_checkpoint:
+            if self.before_load is not None:
+                self.before_load()
+            path = Path(state.best_model_checkpoint) / EMA_WEIGHT_FILE
+            if path.exists():
+                self.model_ema.load(path)
+
+
+def create_model_ema(model: nn.Module, config: Optional[EMAConfig] = None, **kwargs) -> ModelEMA:
+    """
+    Factory function for the EMA of the model weights.
+
+    Args:
+        model: Model being trained
+        config: EMA configuration (kwargs override / build one)
+    """
+    if config is None:
+        config = EMAConfig(**kwargs)
+    elif kwargs:
+        config = EMAConfig(**{**config.__dict__, **kwargs})
+    return ModelEMA(model, config)
+
+
+__all__ = [
+    "ModelEMA",
+    "EMACallback",
+    "create_model_ema",
+    "unwrap_model",
+]
@@ -0,0 +1,82 @@
+"""
+Hot-path instrumentation for the BLIP3-o trainers.
+
+instrument_trainer() times the stages the HF Trainer runs outside our
+compute_loss (which times forward and loss itself): host-to-device input
+transfer (_prepare_inputs), backward (accelerator.backward) and the optimizer
+step (between the on_pre_optimizer_step / on_optimizer_step callbacks). It
+also merges the data-stage timings DataLoader workers attach to each batch.
+InstrumentationCallback exports the aggregates every logging step to
+<output_dir>/instrumentation.jsonl and the active wandb run, then resets them,
+so each line covers one logging interval. All of it is a flag check while
+instrumentation is disabled (utils/instrumentation.py).
+"""
+
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+from transformers import TrainerCallback
+
+from ..utils.instrumentation import (
+    BACKWARD, H2D, OPTIMIZER_STEP, get_instrumentation, merge_worker_timings, timed, timer,
+)
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTATION_FILE = "instrumentation.jsonl"
+
+
+class InstrumentationCallback(TrainerCallback):
+    """Times optimizer steps and exports the aggregates on each log."""
+
+    def __init__(self, jsonl_path: Optional[Union[str, Path]] = None):
+        self.jsonl_path = jsonl_path
+        self._optimizer_timer = None
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._optimizer_timer = timer(OPTIMIZER_STEP)
+        self._optimizer_timer.__enter__()
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._optimizer_timer is not None:
+            self._optimizer_timer.__exit__(None, None, None)
+            self._optimizer_timer = None
+
+    def _export(self, args, state):
+        instrumentation = get_instrumentation()
+        if not instrumentation.enabled:
+            return
+        if state.is_world_process_zero:
+            instrumentation.log_to_wandb()
+            path = self.jsonl_path or Path(args.output_dir) / INSTRUMENTATION_FILE
+            instrumentation.export_jsonl(path, step=state.global_step, epoch=state.epoch)
+        instrumentation.reset()
+
+    def on_log(self, args, state, control, **kwargs):
+        self._export(args, state)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._export(args, state)
+
+
+def instrument_trainer(trainer, jsonl_path: Optional[Union[str, Path]] = None):
+    """Wrap the trainer's input transfer and backward in timers and add the export callback."""
+    prepare_inputs = timed(H2D)(trainer._prepare_inputs)
+
+    def _prepare_inputs(inputs):
+        return prepare_inputs(merge_worker_timings(inputs))
+
+    trainer._prepare_inputs = _prepare_inputs
+    accelerator = getattr(trainer, 'accelerator', None)
+    if accelerator is not None:
+        accelerator.backward = timed(BACKWARD)(accelerator.backward)
+    trainer.add_callback(InstrumentationCallback(jsonl_path))
+    return trainer
+
+
+__all__ = [
+    "InstrumentationCallback",
+    "instrument_trainer",
+    "INSTRUMENTATION_FILE",
+]
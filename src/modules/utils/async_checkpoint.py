@@ -0,0 +1,342 @@
+"""
+Asynchronous checkpoint writing for BLIP3-o training.
+
+AsyncCheckpointWriter.save() only blocks for the snapshot: parameters and
+buffers are copied into reused pinned host buffers (non-blocking device->host
+copies, one synchronize). A single background thread then
+- writes model.safetensors and the JSON / config files into a staging
+  directory next to the target and fsyncs them
+- publishes them (one directory rename, or os.replace per file when the
+  target already exists) and writes the CHECKPOINT_COMPLETE marker last
+  (or later, via mark_complete(), when other writers still add files, as the
+  HF Trainer does with optimizer / trainer state in checkpoint-* directories)
+- optionally copies finished checkpoints to persistent storage with the same
+  staging + rename + marker protocol, keeping only the newest K there
+
+Readers (resume, load_best_model_at_end, evaluation sweeps) can therefore
+trust any directory that has the marker. A thread is enough: safetensors
+writes and file copies release the GIL, and the snapshot is never pickled.
+"""
+
+import os
+import re
+import json
+import time
+import torch
+import shutil
+import logging
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+COMPLETE_MARKER = "CHECKPOINT_COMPLETE"
+STAGING_SUFFIX = ".staging"
+
+
+def is_complete_checkpoint(path: Union[str, Path]) -> bool:
+    return (Path(path) / COMPLETE_MARKER).exists()
+
+
+def _fsync(path: Path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _write_marker(directory: Path, info: Dict[str, Any]):
+    tmp = directory / f"{COMPLETE_MARKER}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(info, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, directory / COMPLETE_MARKER)
+
+
+def _write_file(path: Path, content: Any):
+    """str -> text, bytes -> binary, anything else -> JSON."""
+    if isinstance(content, bytes):
+        path.write_bytes(content)
+    elif isinstance(content, str):
+        path.write_text(content)
+    else:
+        with open(path, 'w') as f:
+            json.dump(content, f, indent=2)
+
+
+def publish_directory(staging: Path, target: Path):
+    """
+    Move a finished staging directory to `target`. A new target appears with a
+    single rename; into an existing one (e.g. a checkpoint-* directory the
+    Trainer also writes to) files are replaced one by one, marker (if any) last.
+    """
+    if not target.exists():
+        os.rename(staging, target)
+        return
+    marker = staging / COMPLETE_MARKER
+    (target / COMPLETE_MARKER).unlink(missing_ok=True)
+    for item in staging.iterdir():
+        if item.name == COMPLETE_MARKER:
+            continue
+        destination = target / item.name
+        if destination.is_dir():
+            shutil.rmtree(destination)
+        os.replace(item, destination)
+    if marker.exists():
+        os.replace(marker, target / COMPLETE_MARKER)
+    staging.rmdir()
+
+
+def copy_checkpoint_atomic(source: Union[str, Path], destination: Union[str, Path]) -> Path:
+    """copytree into a staging directory, mark it complete, then swap it in with renames."""
+    source, destination = Path(source), Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    staging = destination.with_name(destination.name + STAGING_SUFFIX)
+    if staging.exists():
+        shutil.rmtree(staging)
+
+    shutil.copytree(source, staging, ignore=shutil.ignore_patterns(COMPLETE_MARKER, f"*{STAGING_SUFFIX}"))
+    _write_marker(staging, {'source': str(source), 'copied_at': time.time()})
+
+    if destination.exists():
+        previous = destination.with_name(destination.name + ".old")
+        if previous.exists():
+            shutil.rmtree(previous)
+        os.rename(destination, previous)
+        os.rename(staging, destination)
+        shutil.rmtree(previous)
+    else:
+        os.rename(staging, destination)
+    return destination
+
+
+def _checkpoint_order(path: Path):
+    match = re.search(r"(\d+)$", path.name)
+    step = int(match.group(1)) if match else -1
+    return step, (path / COMPLETE_MARKER).stat().st_mtime
+
+
+def retain_newest_checkpoints(
+    parent: Union[str, Path],
+    keep_last: int,
+    protect: Iterable[str] = (),
+) -> List[Path]:
+    """
+    Delete all but the newest `keep_last` complete checkpoints in `parent`
+    (ordered by trailing step number, then marker time). Directories without
+    a marker are never touched; names in `protect` are kept. Returns the
+    deleted paths.
+    """
+    parent = Path(parent)
+    if keep_last is None or keep_last <= 0 or not parent.exists():
+        return []
+    protect = set(protect)
+    complete = sorted(
+        (path for path in parent.iterdir() if path.is_dir() and is_complete_checkpoint(path)),
+        key=_checkpoint_order,
+    )
+    deleted = []
+    for path in complete[:-keep_last]:
+        if path.name in protect:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        deleted.append(path)
+    if deleted:
+        logger.info(f"Removed {len(deleted)} old checkpoint(s) from {parent}")
+    return deleted
+
+
+class AsyncCheckpointWriter:
+    """
+    Background checkpoint writer with one worker thread (saves and copies run in
+    submission order).
+
+    Args:
+        persistent_dir: Where copy_to_persistent() puts finished checkpoints
+        keep_last: Complete checkpoints kept in persistent_dir (None: all)
+    """
+
+    def __init__(
+        self,
+        persistent_dir: Optional[Union[str, Path]] = None,
+        keep_last: Optional[int] = None,
+    ):
+        self.persistent_dir = Path(persistent_dir) if persistent_dir else None
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending: List[Future] = []
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self.stats = {
+            'saves': 0,
+            'copies': 0,
+            'snapshot_seconds': 0.0,
+            'wait_seconds': 0.0,
+            'write_seconds': 0.0,
+            'copy_seconds': 0.0,
+            'last_stall_seconds': 0.0,
+        }
+
+    def _snapshot(self, state_dicts: Dict[str, Dict[str, torch.Tensor]]) -> Dict[str, Dict[str, torch.Tensor]]:
+        """Copy each state dict into (reused) pinned host buffers."""
+        pin = torch.cuda.is_available()
+        snapshots = {}
+        for file_name, state_dict in state_dicts.items():
+            snapshot = {}
+            for name, tensor in state_dict.items():
+                tensor = tensor.detach()
+                key = f"{file_name}/{name}"
+                buffer = self._buffers.get(key)
+                if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+                    buffer = torch.empty(tensor.shape, dtype=tensor.dtype, device="cpu", pin_memory=pin)
+                    self._buffers[key] = buffer
+                buffer.copy_(tensor, non_blocking=True)
+                snapshot[name] = buffer
+            snapshots[file_name] = snapshot
+        if pin:
+            torch.cuda.synchronize()
+        return snapshots
+
+    def save(
+        self,
+        output_dir: Union[str, Path],
+        state_dicts: Optional[Dict[str, Dict[str, torch.Tensor]]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        metadata: Optional[Dict[str, Dict[str, str]]] = None,
+        mark_complete: bool = True,
+    ) -> Future:
+        """
+        Snapshot `state_dicts` ({file name: state dict}, written as safetensors)
+        and write them plus `files` ({name: str / bytes / JSON-serializable}) to
+        `output_dir` in the background.
+
+        Args:
+            metadata: Safetensors metadata per weight file name
+            mark_complete: Write the completion marker (False: the caller does
+                it with mark_complete() once every file is there)
+        """
+        start = time.perf_counter()
+        # The pinned buffers are reused: the previous write must have finished
+        self.wait()
+        waited = time.perf_counter() - start
+
+        snapshots = self._snapshot(state_dicts or {})
+        snapshot_seconds = time.perf_counter() - start - waited
+
+        future = self._executor.submit(
+            self._write, Path(output_dir), snapshots, dict(files or {}), dict(metadata or {}), mark_complete,
+        )
+        self._pending.append(future)
+
+        self.stats['saves'] += 1
+        self.stats['wait_seconds'] += waited
+        self.stats['snapshot_seconds'] += snapshot_seconds
+        self.stats['last_stall_seconds'] = time.perf_counter() - start
+        logger.info(
+            f"Checkpoint snapshot for {output_dir} took {snapshot_seconds:.2f}s "
+            f"(+{waited:.2f}s waiting for the previous write); writing in the background"
+        )
+        return future
+
+    def _write(self, output_dir: Path, snapshots, files: Dict[str, Any], metadata, mark_complete: bool):
+        from safetensors.torch import save_file
+
+        start = time.perf_counter()
+        try:
+            output_dir.parent.mkdir(parents=True, exist_ok=True)
+            staging = output_dir.with_name(output_dir.name + STAGING_SUFFIX)
+            if staging.exists():
+                shutil.rmtree(staging)
+            staging.mkdir()
+
+            written = []
+            for file_name, snapshot in snapshots.items():
+                save_file(snapshot, str(staging / file_name), metadata={'format': 'pt', **metadata.get(file_name, {})})
+                written.append(file_name)
+            for name, content in files.items():
+                _write_file(staging / name, content)
+                written.append(name)
+            for name in written:
+                _fsync(staging / name)
+
+            if mark_complete:
+                _write_marker(staging, {'files': written, 'saved_at': time.time()})
+            publish_directory(staging, output_dir)
+        except Exception as e:
+            logger.error(f"Background checkpoint write to {output_dir} failed: {e}")
+            raise
+        self.stats['write_seconds'] += time.perf_counter() - start
+        logger.info(f"Checkpoint written to {output_dir} in {time.perf_counter() - start:.2f}s")
+        return output_dir
+
+    def mark_complete(self, directory: Union[str, Path], info: Optional[Dict[str, Any]] = None) -> Future:
+        """Queue writing the completion marker into `directory` (after pending writes)."""
+        future = self._executor.submit(
+            _write_marker, Path(directory), {'saved_at': time.time(), **(info or {})},
+        )
+        self._pending.append(future)
+        return future
+
+    def copy_to_persistent(
+        self,
+        source: Union[str, Path],
+        name: Optional[str] = None,
+        protect: Iterable[str] = (),
+    ) -> Optional[Future]:
+        """Queue a copy of a finished checkpoint to persistent_dir (after pending writes)."""
+        if self.persistent_dir is None:
+            return None
+        source = Path(source)
+        destination = self.persistent_dir / (name or source.name)
+        future = self._executor.submit(self._copy, source, destination, tuple(protect))
+        self._pending.append(future)
+        return future
+
+    def _copy(self, source: Path, destination: Path, protect):
+        start = time.perf_counter()
+        try:
+            copy_checkpoint_atomic(source, destination)
+            retain_newest_checkpoints(destination.parent, self.keep_last, protect=(destination.name, *protect))
+        except Exception as e:
+            logger.error(f"Copy of {source} to persistent storage failed: {e}")
+            raise
+        self.stats['copies'] += 1
+        self.stats['copy_seconds'] += time.perf_counter() - start
+        logger.info(f"Checkpoint copied to persistent storage: {destination}")
+        return destination
+
+    def pending(self) -> int:
+        return sum(1 for future in self._pending if not future.done())
+
+    def wait(self):
+        """Block until queued writes / copies finish; re-raises their errors."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, float]:
+        return dict(self.stats, pending=self.pending())
+
+
+def create_async_checkpoint_writer(
+    persistent_dir: Optional[Union[str, Path]] = None,
+    keep_last: Optional[int] = None,
+) -> AsyncCheckpointWriter:
+    """Factory function for the background checkpoint writer."""
+    return AsyncCheckpointWriter(persistent_dir=persistent_dir, keep_last=keep_last)
+
+
+__all__ = [
+    "COMPLETE_MARKER",
+    "AsyncCheckpointWriter",
+    "create_async_checkpoint_writer",
+    "copy_checkpoint_atomic",
+    "retain_newest_checkpoints",
+    "is_complete_checkpoint",
+    "publish_directory",
+]
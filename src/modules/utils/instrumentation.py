@@ -0,0 +1,420 @@
+"""
+Named timers and counters for the BLIP3-o hot paths.
+
+    from src.modules.utils.instrumentation import timer, timed, increment, SHARD_LOAD
+
+    with timer(SHARD_LOAD):
+        shard = pickle.load(f)
+
+    @timed(COLLATE)
+    def chunked_collate_fn(batch): ...
+
+Instrumentation is off by default: timer() then returns a shared no-op
+context manager and timed() functions call straight through after one flag
+check. enable_instrumentation() (or BLIP3O_INSTRUMENT=1) aggregates count /
+total / min / max per name. With profiler_ranges=True every timer also opens a
+torch.profiler.record_function range, so the same names show up in traces
+recorded with profile_trace(). Aggregates are exported with export_jsonl()
+and log_to_wandb() (the run the trainers already log to).
+
+Timings are host wall time: CUDA work is asynchronous, so pass
+sync_cuda=True for per-stage device time (at the cost of a synchronize per
+timer). Timers run in the process that executes the code: stages inside
+DataLoader worker processes (num_workers > 0) are aggregated in the worker,
+attached to each collated batch with attach_worker_timings() and folded into
+the main process with merge_worker_timings() when the batch is consumed.
+"""
+
+import os
+import sys
+import json
+import time
+import torch
+import logging
+import functools
+import threading
+import contextlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Stage names used across the repo
+SHARD_LOAD = "data/shard_load"
+NORMALIZE = "data/normalize"
+COLLATE = "data/collate"
+H2D = "data/h2d"
+FORWARD = "model/forward"
+LOSS = "model/loss"
+BACKWARD = "model/backward"
+OPTIMIZER_STEP = "train/optimizer_step"
+SAMPLING_STEP = "inference/sampling_step"
+RETRIEVAL = "eval/retrieval"
+
+STAGES = (
+    SHARD_LOAD, NORMALIZE, COLLATE, H2D, FORWARD, LOSS, BACKWARD, OPTIMIZER_STEP, SAMPLING_STEP, RETRIEVAL,
+)
+
+# Batch key carrying DataLoader worker aggregates to the main process
+WORKER_TIMINGS_KEY = "_instrumentation"
+
+
+class _NullTimer:
+    """Shared context manager used while instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class TimerStats:
+    """Aggregate of one named timer."""
+
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, count: int, total: float, min_seconds: float, max_seconds: float):
+        """Fold in another aggregate (as returned by Instrumentation.drain())."""
+        self.count += count
+        self.total += total
+        if min_seconds < self.min:
+            self.min = min_seconds
+        if max_seconds > self.max:
+            self.max = max_seconds
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'min_ms': self.min * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000,
+        }
+
+
+class _Timer:
+    __slots__ = ("instrumentation", "name", "start", "_range")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+        self._range = None
+
+    def __enter__(self):
+        if self.instrumentation.profiler_ranges:
+            self._range = torch.profiler.record_function(self.name)
+            self._range.__enter__()
+        if self.instrumentation.sync_cuda:
+            torch.cuda.synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.instrumentation.sync_cuda:
+            torch.cuda.synchronize()
+        self.instrumentation.record(self.name, time.perf_counter() - self.start)
+        if self._range is not None:
+            self._range.__exit__(*exc)
+        return False
+
+
+class Instrumentation:
+    """
+    Registry of named timers and counters.
+
+    Args:
+        enabled: Aggregate timings (False: timers are no-ops)
+        profiler_ranges: Also open a torch.profiler.record_function range per timer
+        sync_cuda: Synchronize CUDA around each timer (device time instead of launch time)
+    """
+
+    def __init__(self, enabled: bool = False, profiler_ranges: bool = False, sync_cuda: bool = False):
+        self.enabled = enabled
+        self.profiler_ranges = profiler_ranges
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self._timers: Dict[str, TimerStats] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._since = time.time()
+
+    def timer(self, name: str):
+        """Context manager timing the enclosed block under `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorator timing every call of the function under `name`."""
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name: str, seconds: float):
+        """Add one externally measured duration to timer `name`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._timers.get(name)
+            if stats is None:
+                stats = self._timers[name] = TimerStats()
+            stats.add(seconds)
+
+    def increment(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregates since the last reset: {'timers': {name: stats}, 'counters': {name: value}}."""
+        with self._lock:
+            return {
+                'interval_seconds': time.time() - self._since,
+                'timers': {name: stats.to_dict() for name, stats in sorted(self._timers.items())},
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self._since = time.time()
+
+    def drain(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the raw aggregates as plain lists and reset them.
+
+        Returns:
+            {'timers': {name: [count, total, min, max]}, 'counters': {name: value}}
+        """
+        with self._lock:
+            drained = {
+                'timers': {
+                    name: [stats.count, stats.total, stats.min, stats.max]
+                    for name, stats in self._timers.items()
+                },
+                'counters': dict(self._counters),
+            }
+            self._timers.clear()
+            self._counters.clear()
+        return drained
+
+    def merge(self, drained: Dict[str, Dict[str, Any]]):
+        """Fold aggregates drained in another process into this registry."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, (count, total, min_seconds, max_seconds) in drained.get('timers', {}).items():
+                stats = self._timers.get(name)
+                if stats is None:
+                    stats = self._timers[name] = TimerStats()
+                stats.merge(count, total, min_seconds, max_seconds)
+            for name, value in drained.get('counters', {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def export_jsonl(
+        self,
+        path: Union[str, Path],
+        step: Optional[int] = None,
+        reset: bool = False,
+        **extra,
+    ) -> Optional[Dict[str, Any]]:
+        """Append the current aggregates as one JSON line (nothing if no timer fired)."""
+        summary = self.summary()
+        if not summary['timers'] and not summary['counters']:
+            return None
+        record = {'timestamp': time.time(), 'step': step, **extra, **summary}
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+        if reset:
+            self.reset()
+        return record
+
+    def wandb_metrics(self, prefix: str = "perf/") -> Dict[str, float]:
+        """Flat metrics for wandb.log: mean / total time per timer and counter values."""
+        summary = self.summary()
+        metrics = {}
+        for name, stats in summary['timers'].items():
+            metrics[f"{prefix}{name}/mean_ms"] = stats['mean_ms']
+            metrics[f"{prefix}{name}/total_seconds"] = stats['total_seconds']
+            metrics[f"{prefix}{name}/count"] = stats['count']
+        for name, value in summary['counters'].items():
+            metrics[f"{prefix}{name}"] = value
+        return metrics
+
+    def log_to_wandb(self, step: Optional[int] = None, prefix: str = "perf/") -> bool:
+        """Log the aggregates to the active wandb run (wandb is never imported here)."""
+        wandb = sys.modules.get("wandb")
+        if wandb is None or wandb.run is None:
+            return False
+        metrics = self.wandb_metrics(prefix)
+        if metrics:
+            wandb.log(metrics, step=step)
+        return bool(metrics)
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary['timers']:
+            return
+        print(f"⏱️ Instrumentation ({summary['interval_seconds']:.1f}s):")
+        for name, stats in summary['timers'].items():
+            print(f"   {name:<28} {stats['count']:>8} calls  {stats['mean_ms']:>10.2f} ms mean  "
+                  f"{stats['total_seconds']:>9.2f}s total")
+        for name, value in summary['counters'].items():
+            print(f"   {name:<28} {value}")
+
+
+def _env_enabled() -> bool:
+    return os.environ.get("BLIP3O_INSTRUMENT", "0").lower() in ("1", "true", "yes")
+
+
+# Process-wide instance used by the module-level helpers
+_instrumentation = Instrumentation(enabled=_env_enabled())
+
+
+def get_instrumentation() -> Instrumentation:
+    return _instrumentation
+
+
+def enable_instrumentation(profiler_ranges: bool = False, sync_cuda: bool = False) -> Instrumentation:
+    # Spawned DataLoader workers re-import this module and read the flag from the environment
+    os.environ["BLIP3O_INSTRUMENT"] = "1"
+    _instrumentation.enabled = True
+    _instrumentation.profiler_ranges = profiler_ranges
+    _instrumentation.sync_cuda = sync_cuda and torch.cuda.is_available()
+    return _instrumentation
+
+
+def disable_instrumentation():
+    os.environ.pop("BLIP3O_INSTRUMENT", None)
+    _instrumentation.enabled = False
+    _instrumentation.profiler_ranges = False
+
+
+def instrumentation_enabled() -> bool:
+    return _instrumentation.enabled
+
+
+def timer(name: str):
+    """Context manager timing the enclosed block under `name` (no-op while disabled)."""
+    if not _instrumentation.enabled:
+        return _NULL_TIMER
+    return _Timer(_instrumentation, name)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorator timing every call under `name` (checks the flag at call time)."""
+    return _instrumentation.timed(name)
+
+
+def increment(name: str, value: float = 1):
+    _instrumentation.increment(name, value)
+
+
+def attach_worker_timings(batch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Move the aggregates of a DataLoader worker into `batch` under
+    WORKER_TIMINGS_KEY. Called at the end of a collate function; a no-op in
+    the main process (num_workers=0 timers already land there) or while disabled.
+    """
+    if not _instrumentation.enabled or torch.utils.data.get_worker_info() is None:
+        return batch
+    drained = _instrumentation.drain()
+    if drained['timers'] or drained['counters']:
+        batch[WORKER_TIMINGS_KEY] = drained
+    return batch
+
+
+def merge_worker_timings(batch: Any) -> Any:
+    """Pop worker aggregates attached by attach_worker_timings() and fold them in here."""
+    if isinstance(batch, dict):
+        drained = batch.pop(WORKER_TIMINGS_KEY, None)
+        if drained is not None:
+            _instrumentation.merge(drained)
+    return batch
+
+
+@contextlib.contextmanager
+def profile_trace(
+    output_path: Union[str, Path],
+    record_shapes: bool = False,
+    with_stack: bool = False,
+) -> Iterator["torch.profiler.profile"]:
+    """
+    Record a torch.profiler trace of the enclosed block with the timer names
+    as ranges, and export it as a Chrome trace (chrome://tracing, Perfetto).
+    """
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    previous = (_instrumentation.enabled, _instrumentation.profiler_ranges)
+    _instrumentation.enabled = True
+    _instrumentation.profiler_ranges = True
+    try:
+        with torch.profiler.profile(
+            activities=activities, record_shapes=record_shapes, with_stack=with_stack,
+        ) as profiler:
+            yield profiler
+    finally:
+        _instrumentation.enabled, _instrumentation.profiler_ranges = previous
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    profiler.export_chrome_trace(str(output_path))
+    logger.info(f"Profiler trace written to {output_path}")
+
+
+__all__ = [
+    "SHARD_LOAD",
+    "NORMALIZE",
+    "COLLATE",
+    "H2D",
+    "FORWARD",
+    "LOSS",
+    "BACKWARD",
+    "OPTIMIZER_STEP",
+    "SAMPLING_STEP",
+    "RETRIEVAL",
+    "STAGES",
+    "WORKER_TIMINGS_KEY",
+    "Instrumentation",
+    "TimerStats",
+    "get_instrumentation",
+    "enable_instrumentation",
+    "disable_instrumentation",
+    "instrumentation_enabled",
+    "timer",
+    "timed",
+    "increment",
+    "attach_worker_timings",
+    "merge_worker_timings",
+    "profile_trace",
+]
@@ -0,0 +1,119 @@
+"""
+PEP 562 lazy attribute loading for the src.modules packages.
+
+Package __init__ files declare what they export instead of importing it:
+
+    _EXPORTS = {
+        "BLIP3oInference": ".blip3o_inference",             # same name in the submodule
+        "create_blip3o_dataloader": ".blip3o_dataset:create_chunked_dataloader",
+        "DUAL_SUPERVISION_AVAILABLE": _resolve_dual_supervision,  # resolver sets globals
+    }
+    __getattr__, __dir__ = lazy_exports(__name__, _EXPORTS, globals())
+
+The submodule is imported on first attribute access and the value is cached
+in the package namespace, so `import src.modules.datasets` no longer pulls in
+models, trainers (transformers.Trainer, wandb) and inference. Explicit
+`from package import name` and `from package import *` (via __all__) work as
+before.
+"""
+
+import importlib
+from typing import Any, Callable, Dict, Sequence, Tuple, Union
+
+ExportTarget = Union[str, Callable[[], None]]
+
+
+def lazy_exports(
+    package: str,
+    exports: Dict[str, ExportTarget],
+    namespace: Dict[str, Any],
+    submodules: Sequence[str] = (),
+) -> Tuple[Callable[[str], Any], Callable[[], list]]:
+    """
+    Module-level __getattr__ / __dir__ for `package`.
+
+    Args:
+        package: The package's __name__ (relative targets are resolved against it)
+        exports: Attribute name -> "module" / "module:attribute", or a resolver
+            callable that assigns the attribute(s) into the package namespace
+        namespace: The package's globals() (resolved values are cached there)
+        submodules: Submodule names that are themselves lazily importable attributes
+    """
+    submodules = set(submodules)
+
+    def __getattr__(name: str) -> Any:
+        if name in submodules:
+            value = importlib.import_module(f".{name}", package)
+        else:
+            target = exports.get(name)
+            if target is None:
+                raise AttributeError(f"module {package!r} has no attribute {name!r}")
+            if callable(target):
+                target()
+                if name not in namespace:
+                    raise AttributeError(f"module {package!r} has no attribute {name!r}")
+                return namespace[name]
+            module_name, _, attribute = target.partition(":")
+            value = getattr(importlib.import_module(module_name, package), attribute or name)
+        namespace[name] = value
+        return value
+
+    def __dir__() -> list:
+        return sorted(set(namespace) | set(exports) | submodules)
+
+    return __getattr__, __dir__
+
+
+def lazy_reexports(
+    package: str,
+    subpackages: Sequence[str],
+    namespace: Dict[str, Any],
+) -> Tuple[Callable[[str], Any], Callable[[], list]]:
+    """
+    __getattr__ / __dir__ re-exporting the public names of lazy subpackages
+    (the lazy equivalent of `from .sub import *` for each sub in order; later
+    subpackages win on name clashes, as with star imports).
+    """
+    def _subpackage(name: str):
+        return importlib.import_module(f".{name}", package)
+
+    def __getattr__(name: str) -> Any:
+        if name in subpackages:
+            value = _subpackage(name)
+        else:
+            for subpackage in reversed(subpackages):
+                module = _subpackage(subpackage)
+                if name in getattr(module, "__all__", ()):
+                    value = getattr(module, name)
+                    break
+            else:
+                raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        namespace[name] = value
+        return value
+
+    def __dir__() -> list:
+        names = set(namespace) | set(subpackages)
+        for subpackage in subpackages:
+            names.update(getattr(_subpackage(subpackage), "__all__", ()))
+        return sorted(names)
+
+    return __getattr__, __dir__
+
+
+def reexported_names(package: str, subpackages: Sequence[str]) -> list:
+    """
+    __all__ for a package using lazy_reexports: the subpackage names plus the
+    union of their __all__, in order. Only the subpackage __init__ files are
+    imported, which declare their exports without importing them.
+    """
+    names = dict.fromkeys(subpackages)
+    for subpackage in subpackages:
+        names.update(dict.fromkeys(getattr(importlib.import_module(f".{subpackage}", package), "__all__", ())))
+    return list(names)
+
+
+__all__ = [
+    "lazy_exports",
+    "lazy_reexports",
+    "reexported_names",
+]
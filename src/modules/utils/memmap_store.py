@@ -0,0 +1,296 @@
+"""
+Incremental, memory-mapped array store for large extraction / generation runs.
+
+Instead of accumulating per-sample tensors in Python lists and pickling one
+giant dict at the end, MemmapArrayWriter preallocates one .npy file per field
+(np.lib.format.open_memmap) and copies each batch straight into it. Host
+memory stays at one batch regardless of the run size, and a run that dies
+half-way leaves every completed batch readable.
+
+Layout of a store directory:
+- <field>.npy: [capacity, ...] arrays (only the first num_samples rows are valid)
+- records.jsonl: optional per-sample metadata (ids, captions, paths), one line per sample
+- manifest.json: fields, dtypes, shapes, num_samples and free-form metadata
+
+MemmapArrayReader opens the arrays lazily (copy-on-write memory maps).
+"""
+
+import json
+import time
+import torch
+import numpy as np
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+RECORDS_NAME = "records.jsonl"
+
+
+def _to_numpy(value: Union[torch.Tensor, np.ndarray]) -> Tuple[np.ndarray, str]:
+    """Array and logical dtype name; bfloat16 is stored bit-exact as uint16."""
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        if value.dtype == torch.bfloat16:
+            return value.contiguous().view(torch.int16).numpy().view(np.uint16), "bfloat16"
+        value = value.numpy()
+    value = np.asarray(value)
+    return value, value.dtype.name
+
+
+class MemmapArrayWriter:
+    """
+    Appends batches into preallocated memory-mapped arrays.
+
+    Fields are created on first use from the batch's shape and dtype, so the
+    writer needs only the total capacity up front.
+    """
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        capacity: int,
+        metadata: Optional[Dict[str, Any]] = None,
+        flush_every: int = 16,
+    ):
+        """
+        Args:
+            output_dir: Store directory (created if missing)
+            capacity: Maximum number of samples (rows) per field
+            metadata: Free-form metadata written to the manifest
+            flush_every: Flush memory maps every N appended batches
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.capacity = capacity
+        self.metadata = dict(metadata or {})
+        self.flush_every = flush_every
+
+        self.num_samples = 0
+        self._arrays: Dict[str, np.memmap] = {}
+        self._fields: Dict[str, Dict[str, Any]] = {}
+        self._field_counts: Dict[str, int] = {}
+        self._records_file = None
+        self._num_batches = 0
+        self._closed = False
+        self._write_manifest()
+
+    def _create_field(self, name: str, array: np.ndarray, dtype_name: str, capacity: Optional[int] = None):
+        capacity = self.capacity if capacity is None else capacity
+        path = self.output_dir / f"{name}.npy"
+        self._arrays[name] = np.lib.format.open_memmap(
+            path, mode="w+", dtype=array.dtype, shape=(capacity,) + array.shape[1:]
+        )
+        self._fields[name] = {
+            "file": path.name,
+            "dtype": dtype_name,
+            "sample_shape": list(array.shape[1:]),
+            "capacity": capacity,
+        }
+        self._field_counts[name] = 0
+
+    def write_field(
+        self,
+        name: str,
+        values: Union[torch.Tensor, np.ndarray],
+        start: Optional[int] = None,
+        capacity: Optional[int] = None,
+    ) -> int:
+        """
+        Write rows of one field (at `start`, default: after its last row); returns the new row count.
+
+        `capacity` overrides the store capacity for fields with a different
+        number of rows (e.g. subsampled intermediates).
+        """
+        array, dtype_name = _to_numpy(values)
+        if name not in self._arrays:
+            self._create_field(name, array, dtype_name, capacity)
+        target = self._arrays[name]
+        start = self._field_counts[name] if start is None else start
+        end = start + array.shape[0]
+        if end > target.shape[0]:
+            raise ValueError(f"Field '{name}' overflow: {end} rows > capacity {target.shape[0]}")
+        if tuple(array.shape[1:]) != tuple(target.shape[1:]):
+            raise ValueError(f"Field '{name}' shape mismatch: {tuple(array.shape[1:])} vs {tuple(target.shape[1:])}")
+        target[start:end] = array
+        self._field_counts[name] = max(self._field_counts[name], end)
+        return self._field_counts[name]
+
+    def append(
+        self,
+        arrays: Dict[str, Union[torch.Tensor, np.ndarray]],
+        records: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> int:
+        """
+        Append one batch: every array shares the leading (sample) dimension.
+
+        Returns:
+            Index of the first appended sample
+        """
+        if self._closed:
+            raise RuntimeError("Writer is closed")
+        sizes = {name: value.shape[0] for name, value in arrays.items()}
+        if records is not None:
+            sizes['records'] = len(records)
+        if len(set(sizes.values())) > 1:
+            raise ValueError(f"Misaligned batch, leading dimensions differ: {sizes}")
+        batch_size = next(iter(sizes.values()), 0)
+
+        start = self.num_samples
+        for name, value in arrays.items():
+            self.write_field(name, value, start=start)
+
+        if records is not None:
+            if self._records_file is None:
+                self._records_file = open(self.output_dir / RECORDS_NAME, "w")
+            for record in records:
+                self._records_file.write(json.dumps(record, default=str) + "\n")
+
+        self.num_samples += batch_size
+        self._num_batches += 1
+        if self._num_batches % self.flush_every == 0:
+            self.flush()
+        return start
+
+    def flush(self):
+        """Flush memory maps and records, and update the manifest (makes partial runs readable)."""
+        for array in self._arrays.values():
+            array.flush()
+        if self._records_file is not None:
+            self._records_file.flush()
+        self._write_manifest()
+
+    def _write_manifest(self, complete: bool = False):
+        fields = {
+            name: {**info, "num_rows": self._field_counts.get(name, 0)}
+            for name, info in self._fields.items()
+        }
+        manifest = {
+            "format_version": STORE_FORMAT_VERSION,
+            "num_samples": self.num_samples,
+            "capacity": self.capacity,
+            "fields": fields,
+            "has_records": self._records_file is not None,
+            "complete": complete,
+            "updated": time.time(),
+            "metadata": self.metadata,
+        }
+        tmp_path = self.output_dir / (MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        tmp_path.replace(self.output_dir / MANIFEST_NAME)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None) -> Path:
+        """Flush everything and mark the store complete; returns the store directory."""
+        if self._closed:
+            return self.output_dir
+        if metadata:
+            self.metadata.update(metadata)
+        for array in self._arrays.values():
+            array.flush()
+        if self._records_file is not None:
+            self._records_file.close()
+        self._write_manifest(complete=True)
+        self._arrays.clear()
+        self._closed = True
+        logger.info(f"Closed array store {self.output_dir} ({self.num_samples} samples)")
+        return self.output_dir
+
+    def __enter__(self) -> "MemmapArrayWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MemmapArrayReader:
+    """Lazy reader for a MemmapArrayWriter store."""
+
+    def __init__(self, store_dir: Union[str, Path]):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / MANIFEST_NAME, "r") as f:
+            self.manifest = json.load(f)
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.manifest["num_samples"]
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.manifest["fields"])
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.manifest["metadata"]
+
+    @property
+    def complete(self) -> bool:
+        return self.manifest.get("complete", False)
+
+    def array(self, name: str) -> np.ndarray:
+        """Memory-mapped NumPy array with the valid rows of a field (copy-on-write)."""
+        if name not in self._arrays:
+            info = self.manifest["fields"][name]
+            array = np.load(self.store_dir / info["file"], mmap_mode="c")
+            self._arrays[name] = array[:info.get("num_rows", len(self))]
+        return self._arrays[name]
+
+    def tensor(self, name: str, start: int = 0, end: Optional[int] = None) -> torch.Tensor:
+        """Rows [start, end) of a field as a tensor (backed by the memory map)."""
+        array = self.array(name)[start:end]
+        tensor = torch.from_numpy(array)
+        if self.manifest["fields"][name]["dtype"] == "bfloat16":
+            tensor = tensor.view(torch.bfloat16)
+        return tensor
+
+    def __getitem__(self, name: str) -> torch.Tensor:
+        return self.tensor(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.manifest["fields"]
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        path = self.store_dir / RECORDS_NAME
+        if not path.exists():
+            return
+        with open(path, "r") as f:
+            for count, line in enumerate(f):
+                if count >= len(self):
+                    break
+                yield json.loads(line)
+
+    def record_field(self, key: str) -> List[Any]:
+        """One key of every record (e.g. all captions)."""
+        return [record.get(key) for record in self.records()]
+
+    def iter_batches(self, batch_size: int, fields: Optional[Sequence[str]] = None) -> Iterator[Dict[str, torch.Tensor]]:
+        """Stream sample-aligned batches of the selected fields."""
+        fields = [f for f in (fields or self.fields) if self.manifest["fields"][f].get("capacity") == self.manifest["capacity"]]
+        for start in range(0, len(self), batch_size):
+            yield {name: self.tensor(name, start, start + batch_size) for name in fields}
+
+
+def open_array_store(store_dir: Union[str, Path]) -> MemmapArrayReader:
+    """Open a store written by MemmapArrayWriter."""
+    return MemmapArrayReader(store_dir)
+
+
+def create_array_writer(
+    output_dir: Union[str, Path],
+    capacity: int,
+    metadata: Optional[Dict[str, Any]] = None,
+    **kwargs
+) -> MemmapArrayWriter:
+    """Factory function for MemmapArrayWriter."""
+    return MemmapArrayWriter(output_dir=output_dir, capacity=capacity, metadata=metadata, **kwargs)
+
+
+__all__ = [
+    "MemmapArrayWriter",
+    "MemmapArrayReader",
+    "create_array_writer",
+    "open_array_store",
+]
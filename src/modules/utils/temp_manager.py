@@ -19,6 +19,8 @@ import time
 from datetime import datetime
 import logging
 
+from .async_checkpoint import AsyncCheckpointWriter, copy_checkpoint_atomic, retain_newest_checkpoints
+
 logger = logging.getLogger(__name__)
 
 
@@ -297,15 +299,31 @@ class SnelliusTempManager:
     
     def save_checkpoint_to_persistent(self, 
                                     temp_checkpoint_path: Path, 
-                                    checkpoint_name: str) -> Path:
-        """Copy checkpoint from temp to persistent storage."""
+                                    checkpoint_name: str,
+                                    blocking: bool = True,
+                                    keep_last: Optional[int] = None) -> Path:
+        """
+        Copy checkpoint from temp to persistent storage.
+        
+        Directories are copied to a staging directory, marked complete and
+        renamed into place (see async_checkpoint.py), so an interrupted copy
+        never replaces a good checkpoint. With blocking=False the copy runs in
+        a background thread (wait_for_persistent_copies() joins it);
+        keep_last keeps only the newest complete checkpoints.
+        """
         persistent_path = self.dirs['checkpoints'] / checkpoint_name
+        temp_checkpoint_path = Path(temp_checkpoint_path)
+        
+        if temp_checkpoint_path.is_dir() and not blocking:
+            writer = self._get_checkpoint_writer(keep_last)
+            writer.copy_to_persistent(temp_checkpoint_path, name=checkpoint_name)
+            logger.info(f"Checkpoint copy to persistent storage queued: {persistent_path}")
+            return persistent_path
         
         try:
             if temp_checkpoint_path.is_dir():
-                if persistent_path.exists():
-                    shutil.rmtree(persistent_path)
-                shutil.copytree(temp_checkpoint_path, persistent_path)
+                copy_checkpoint_atomic(temp_checkpoint_path, persistent_path)
+                retain_newest_checkpoints(self.dirs['checkpoints'], keep_last, protect=(checkpoint_name,))
             else:
                 shutil.copy2(temp_checkpoint_path, persistent_path)
             
@@ -315,6 +333,20 @@ class SnelliusTempManager:
             logger.error(f"Failed to save checkpoint to persistent storage: {e}")
             raise
     
+    def _get_checkpoint_writer(self, keep_last: Optional[int] = None) -> AsyncCheckpointWriter:
+        writer = getattr(self, '_checkpoint_writer', None)
+        if writer is None:
+            writer = AsyncCheckpointWriter(persistent_dir=self.dirs['checkpoints'])
+            self._checkpoint_writer = writer
+        writer.keep_last = keep_last
+        return writer
+    
+    def wait_for_persistent_copies(self):
+        """Block until background checkpoint copies finish (re-raises their errors)."""
+        writer = getattr(self, '_checkpoint_writer', None)
+        if writer is not None:
+            writer.wait()
+    
     def cleanup_temp_files(self, keep_patterns: Optional[list] = None):
         """Clean up temporary files, optionally keeping files matching patterns."""
         keep_patterns = keep_patterns or []
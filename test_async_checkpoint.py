@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+AsyncCheckpointWriter writes the completion marker last and keeps only the
+newest complete checkpoints in persistent storage.
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.utils.async_checkpoint import (
+    COMPLETE_MARKER,
+    create_async_checkpoint_writer,
+    is_complete_checkpoint,
+)
+
+WEIGHTS_FILE = "model.safetensors"
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    config = BLIP3oDiTConfig(input_size=4, dim=64, n_layers=2, n_heads=4, mlp_hidden_dim=128)
+    return BLIP3oDiTModel(config).eval()
+
+
+@pytest.fixture
+def writer():
+    writer = create_async_checkpoint_writer()
+    yield writer
+    writer.close()
+
+
+def _save_checkpoint(writer, model, output_dir, extra_state_dicts=None, mark_complete=True):
+    """Same files as save_model_async: weights (+ EMA) and the config diff."""
+    return writer.save(
+        output_dir,
+        state_dicts={WEIGHTS_FILE: model.state_dict(), **(extra_state_dicts or {})},
+        files={'config.json': model.config.to_json_string(use_diff=True)},
+        mark_complete=mark_complete,
+    )
+
+
+def test_async_writer_marker_written_last(model, writer, tmp_path):
+    checkpoint_dir = tmp_path / "checkpoint-10"
+    # Trainer-style save: more files follow, the marker comes with mark_complete()
+    _save_checkpoint(writer, model, checkpoint_dir, mark_complete=False).result()
+    assert (checkpoint_dir / WEIGHTS_FILE).exists()
+    assert not is_complete_checkpoint(checkpoint_dir)
+
+    (checkpoint_dir / "trainer_state.json").write_text("{}")
+    writer.mark_complete(checkpoint_dir, {'global_step': 10}).result()
+    assert is_complete_checkpoint(checkpoint_dir)
+
+    # Re-saving into a complete directory drops the stale marker until the new files are in
+    _save_checkpoint(writer, model, checkpoint_dir, mark_complete=False).result()
+    assert not is_complete_checkpoint(checkpoint_dir)
+    assert (checkpoint_dir / "trainer_state.json").exists()
+
+    _save_checkpoint(writer, model, tmp_path / "final").result()
+    assert is_complete_checkpoint(tmp_path / "final")
+    assert not list(tmp_path.glob("*.staging"))
+
+
+def test_async_writer_retention(model, tmp_path):
+    persistent = tmp_path / "persistent"
+    writer = create_async_checkpoint_writer(persistent_dir=persistent, keep_last=2)
+    # Incomplete directories in the persistent location are never deleted
+    (persistent / "checkpoint-1").mkdir(parents=True)
+
+    try:
+        for step in (10, 20, 30, 40):
+            checkpoint_dir = tmp_path / "output" / f"checkpoint-{step}"
+            _save_checkpoint(writer, model, checkpoint_dir)
+            # As CheckpointCompletionCallback protects the best checkpoint
+            writer.copy_to_persistent(checkpoint_dir, protect=["checkpoint-10"])
+        writer.wait()
+    finally:
+        writer.close()
+
+    remaining = sorted(path.name for path in persistent.iterdir())
+    assert remaining == ["checkpoint-1", "checkpoint-10", "checkpoint-30", "checkpoint-40"]
+    for name in ("checkpoint-10", "checkpoint-30", "checkpoint-40"):
+        assert is_complete_checkpoint(persistent / name)
+        assert (persistent / name / WEIGHTS_FILE).exists()
+    assert not (persistent / "checkpoint-1" / COMPLETE_MARKER).exists()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+load_blip3o_checkpoint round-trips what the trainers write (same files as
+save_model_async), in the saved or a reduced dtype. Tensors missing from a
+checkpoint are initialized like a fresh model (or rejected), never left as
+uninitialized memory.
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+import torch.nn as nn
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.models.checkpoint_loader import _initialize_missing, load_blip3o_checkpoint
+from src.modules.utils.async_checkpoint import create_async_checkpoint_writer
+
+WEIGHTS_FILE = "model.safetensors"
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    config = BLIP3oDiTConfig(input_size=4, dim=64, n_layers=2, n_heads=4, mlp_hidden_dim=128)
+    return BLIP3oDiTModel(config).eval()
+
+
+@pytest.fixture
+def writer():
+    writer = create_async_checkpoint_writer()
+    yield writer
+    writer.close()
+
+
+def _save_checkpoint(writer, model, output_dir, extra_state_dicts=None, mark_complete=True):
+    """Same files as save_model_async: weights (+ EMA) and the config diff."""
+    return writer.save(
+        output_dir,
+        state_dicts={WEIGHTS_FILE: model.state_dict(), **(extra_state_dicts or {})},
+        files={'config.json': model.config.to_json_string(use_diff=True)},
+        mark_complete=mark_complete,
+    )
+
+
+def test_load_checkpoint_round_trip(model, writer, tmp_path):
+    _save_checkpoint(writer, model, tmp_path / "checkpoint").result()
+
+    loaded, config, info = load_blip3o_checkpoint(tmp_path / "checkpoint")
+
+    assert config.dim == model.config.dim and config.n_layers == model.config.n_layers
+    assert not info['missing_keys'] and not info['unexpected_keys']
+    expected = model.state_dict()
+    actual = loaded.state_dict()
+    assert actual.keys() == expected.keys()
+    for name, tensor in expected.items():
+        assert torch.equal(actual[name], tensor), name
+
+    eva_embeddings = torch.randn(2, model.num_tokens, model.config.eva_embedding_size)
+    noise = torch.randn(2, model.num_tokens, model.config.in_channels)
+    with torch.no_grad():
+        torch.testing.assert_close(
+            loaded.generate(eva_embeddings, num_inference_steps=2, noise=noise, return_global_only=False),
+            model.generate(eva_embeddings, num_inference_steps=2, noise=noise, return_global_only=False),
+            rtol=0, atol=0,
+        )
+
+
+def test_load_checkpoint_dtype(model, writer, tmp_path):
+    _save_checkpoint(writer, model, tmp_path / "checkpoint").result()
+
+    loaded, _, _ = load_blip3o_checkpoint(tmp_path / "checkpoint", torch_dtype=torch.bfloat16)
+
+    for name, param in loaded.named_parameters():
+        assert param.dtype == torch.bfloat16, name
+        assert torch.equal(param, model.get_parameter(name).to(torch.bfloat16)), name
+
+
+def test_missing_tensors_are_initialized(model, writer, tmp_path):
+    dropped = ['token_embedder.pos_embed', 'layers.0.cross_attn.in_proj_weight', 'layers.0.cross_attn.in_proj_bias']
+    state_dict = {name: tensor for name, tensor in model.state_dict().items() if name not in dropped}
+    writer.save(
+        tmp_path / "checkpoint",
+        state_dicts={WEIGHTS_FILE: state_dict},
+        files={'config.json': model.config.to_json_string(use_diff=True)},
+    ).result()
+
+    loaded, _, info = load_blip3o_checkpoint(tmp_path / "checkpoint")
+
+    assert sorted(info['missing_keys']) == sorted(dropped)
+    assert info['num_initialized'] == len(dropped)
+    loaded_state = loaded.state_dict()
+    # Same initialization as a fresh model: N(0, 0.02) positions, xavier in-projection, zero bias
+    pos_embed = loaded_state['token_embedder.pos_embed']
+    assert pos_embed.abs().max() < 0.2 and 0.01 < pos_embed.std() < 0.03
+    in_proj = loaded_state['layers.0.cross_attn.in_proj_weight']
+    xavier_bound = (6 / (in_proj.shape[0] + in_proj.shape[1])) ** 0.5
+    assert in_proj.abs().max() <= xavier_bound and in_proj.std() > 0
+    assert torch.equal(loaded_state['layers.0.cross_attn.in_proj_bias'], torch.zeros_like(in_proj[:, 0]))
+    # Everything else (including the loaded out_proj of the same attention) is untouched
+    for name, tensor in model.state_dict().items():
+        if name not in dropped:
+            assert torch.equal(loaded_state[name], tensor), name
+
+
+class BareParameter(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.scale = nn.Parameter(torch.ones(3))
+
+
+def test_missing_tensors_without_initializer_raise():
+    with torch.device("meta"):
+        module = nn.Sequential(nn.Linear(3, 3), BareParameter())
+
+    with pytest.raises(ValueError, match=r"1\.scale"):
+        _initialize_missing(module, torch.device("cpu"), torch.float32)
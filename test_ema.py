@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+EMA of the weights:
+- ModelEMA.update follows shadow += (1 - decay ** update_every) * (param - shadow)
+- average_parameters swaps the average in and restores the live weights
+- load_blip3o_checkpoint(weights="ema") loads the saved average
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+import torch.nn as nn
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig, EMAConfig
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.models.checkpoint_loader import EMA_WEIGHT_FILE, load_blip3o_checkpoint
+from src.modules.trainers.ema import create_model_ema
+from src.modules.utils.async_checkpoint import create_async_checkpoint_writer
+
+WEIGHTS_FILE = "model.safetensors"
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    config = BLIP3oDiTConfig(input_size=4, dim=64, n_layers=2, n_heads=4, mlp_hidden_dim=128)
+    return BLIP3oDiTModel(config).eval()
+
+
+@pytest.fixture
+def writer():
+    writer = create_async_checkpoint_writer()
+    yield writer
+    writer.close()
+
+
+def _perturb(model: nn.Module, scale: float = 0.1, seed: int = 1):
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for param in model.parameters():
+            param.add_(torch.randn(param.shape, generator=generator) * scale)
+
+
+def _save_checkpoint(writer, model, output_dir, extra_state_dicts=None, mark_complete=True):
+    """Same files as save_model_async: weights (+ EMA) and the config diff."""
+    return writer.save(
+        output_dir,
+        state_dicts={WEIGHTS_FILE: model.state_dict(), **(extra_state_dicts or {})},
+        files={'config.json': model.config.to_json_string(use_diff=True)},
+        mark_complete=mark_complete,
+    )
+
+
+def test_load_ema_weights(model, writer, tmp_path):
+    ema = create_model_ema(model, EMAConfig(decay=0.5, use_warmup=False))
+    ema.update(model, step=0)
+    _perturb(model)
+    ema.update(model, step=1)
+    _save_checkpoint(writer, model, tmp_path / "checkpoint", extra_state_dicts={EMA_WEIGHT_FILE: ema.state_dict(model)}).result()
+
+    live, _, _ = load_blip3o_checkpoint(tmp_path / "checkpoint")
+    averaged, _, _ = load_blip3o_checkpoint(tmp_path / "checkpoint", weights="ema")
+
+    for name, shadow in zip(ema.names, ema.shadow):
+        assert torch.equal(live.get_parameter(name), model.get_parameter(name)), name
+        assert torch.equal(averaged.get_parameter(name), shadow), name
+
+
+def test_ema_update_math():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(8, 4), nn.LayerNorm(4))
+    model[1].weight.requires_grad_(False)
+    ema = create_model_ema(model, EMAConfig(decay=0.9, update_every=2, start_step=2, use_warmup=False))
+
+    assert ema.names == ['0.weight', '0.bias', '1.bias']
+    assert not ema.update(model, step=0)  # Before start_step
+
+    # The first update copies the weights
+    _perturb(model, seed=1)
+    assert ema.update(model, step=2)
+    expected = [model.get_parameter(name).detach().clone() for name in ema.names]
+    for shadow, value in zip(ema.shadow, expected):
+        assert torch.equal(shadow, value)
+
+    _perturb(model, seed=2)
+    assert not ema.update(model, step=3)  # Off the update interval
+    assert ema.update(model, step=4)
+    assert not ema.update(model, step=4)  # Same step twice
+    weight = 1.0 - 0.9 ** 2
+    for name, shadow, previous in zip(ema.names, ema.shadow, expected):
+        param = model.get_parameter(name).detach()
+        torch.testing.assert_close(shadow, previous + weight * (param - previous))
+    assert ema.num_updates == 2 and ema.last_step == 4
+
+
+def test_ema_warmup_decay():
+    model = nn.Linear(2, 2)
+    ema = create_model_ema(model, EMAConfig(decay=0.999, update_every=4, start_step=10))
+
+    assert ema.get_decay(10) == pytest.approx((1 / 10) ** 4)
+    assert ema.get_decay(20) == pytest.approx((11 / 20) ** 4)
+    assert ema.get_decay(10 ** 6) == pytest.approx(0.999 ** 4)
+
+
+def test_ema_average_parameters_restores_live_weights():
+    torch.manual_seed(0)
+    model = nn.Linear(4, 4)
+    ema = create_model_ema(model, EMAConfig(decay=0.5, use_warmup=False))
+    ema.update(model, step=0)
+    averaged = [shadow.clone() for shadow in ema.shadow]
+    _perturb(model)
+    live = [param.detach().clone() for param in model.parameters()]
+
+    with ema.average_parameters(model):
+        for param, shadow in zip(model.parameters(), averaged):
+            assert torch.equal(param, shadow)
+    for param, value in zip(model.parameters(), live):
+        assert torch.equal(param, value)
+    for shadow, value in zip(ema.shadow, averaged):
+        assert torch.equal(shadow, value)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Persistent embedding cache:
+- entries are per item, so subsets, reorderings and other shard splits of
+  cached inputs hit the cache and only missing items are encoded
+- storing an entry never evicts that entry; entries above the cap are refused
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import torch
+
+from src.modules.evaluation.embedding_cache import cached_embeddings, create_embedding_cache
+
+DIM = 8
+
+
+class RecordingEncoder:
+    """Stand-in evaluator: deterministic per-caption rows, records what it encodes."""
+
+    def __init__(self, cache):
+        self.embedding_cache = cache
+        self.clip_model = None
+        self.clip_processor = None
+        self.calls = []
+
+    @cached_embeddings("clip_text", "clip_model", "clip_processor", model_name="test")
+    def extract_clip_text_embeddings(self, captions):
+        self.calls.append(list(captions))
+        return torch.stack([self.encode(caption) for caption in captions])
+
+    @staticmethod
+    def encode(caption):
+        generator = torch.Generator().manual_seed(sum(map(ord, caption)))
+        return torch.randn(DIM, generator=generator)
+
+
+def _expected(captions):
+    return torch.stack([RecordingEncoder.encode(caption) for caption in captions])
+
+
+def test_cache_is_keyed_per_item(tmp_path):
+    encoder = RecordingEncoder(create_embedding_cache(tmp_path))
+    captions = [f"caption {i}" for i in range(6)]
+
+    first = encoder.extract_clip_text_embeddings(captions)
+    assert torch.equal(first, _expected(captions))
+    assert encoder.calls == [captions]
+
+    # Shards, reorderings and subsets of cached captions are all hits
+    encoder.calls.clear()
+    for items in (captions[:3], captions[3:], captions[::-1], [captions[4], captions[1]]):
+        assert torch.equal(encoder.extract_clip_text_embeddings(items), _expected(items))
+    assert encoder.calls == []
+
+    # Only the missing captions are encoded, one call per contiguous run
+    mixed = ["new a", captions[0], captions[1], "new b", "new c", captions[2]]
+    assert torch.equal(encoder.extract_clip_text_embeddings(mixed), _expected(mixed))
+    assert encoder.calls == [["new a"], ["new b", "new c"]]
+    assert encoder.embedding_cache.get_stats()["num_entries"] == 9
+
+
+def test_put_does_not_evict_the_new_entry(tmp_path):
+    row = torch.zeros(DIM)
+    cache = create_embedding_cache(tmp_path)
+    cache.put("old", row)
+    cache.put("new", row)
+    entry_bytes = cache.entries()[0]["size_bytes"]
+
+    # Room for one entry: the older one goes, the one just written stays
+    cache.max_size_bytes = entry_bytes
+    cache.put("newest", row)
+    assert [entry["key"] for entry in cache.entries()] == ["newest"]
+    assert torch.equal(cache.get("newest"), row)
+
+
+def test_oversized_entries_are_not_stored(tmp_path):
+    cache = create_embedding_cache(tmp_path)
+    cache.put("kept", torch.zeros(DIM))
+    cache.max_size_bytes = DIM * 4 - 1
+
+    assert not cache.put("too_large", torch.zeros(DIM))
+    assert cache.get("too_large") is None
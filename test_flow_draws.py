@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Shared flow matching draws between the dual-supervision trainer and loss:
+- the noisy model input and both velocity targets use exactly the x_0 /
+  noise / t returned by one sample_flow_draws() call
+- seeded draws are offset by rank, so DDP ranks do not share noise
+"""
+
+import sys
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from src.modules.losses.dual_supervision_flow_matching_loss import FixedDualSupervisionFlowMatchingLoss
+from src.modules.trainers.dual_supervision_blip3o_trainer import FixedDualSupervisionBLIP3oTrainer
+
+BATCH_SIZE = 3
+NUM_TOKENS = 16
+CLIP_DIM = 1024
+GLOBAL_DIM = 768
+
+
+@pytest.fixture(autouse=True)
+def single_rank(monkeypatch):
+    monkeypatch.delenv("RANK", raising=False)
+
+
+def _create_loss(clip_dir: Path, **kwargs) -> FixedDualSupervisionFlowMatchingLoss:
+    # An empty local directory: the loss falls back to a random CLIP projection without network access
+    return FixedDualSupervisionFlowMatchingLoss(clip_model_name=str(clip_dir), **kwargs)
+
+
+class RecordingDiT(nn.Module):
+    """Stand-in DiT returning velocities that depend on its (recorded) input."""
+
+    def __init__(self):
+        super().__init__()
+        self.global_head = nn.Linear(CLIP_DIM, GLOBAL_DIM)
+        self.calls = []
+
+    def forward(self, hidden_states, timestep, encoder_hidden_states, training_mode=None, return_dict=True):
+        self.calls.append({'hidden_states': hidden_states.clone(), 'timestep': timestep.clone()})
+        return {
+            'patch_velocity': hidden_states * 0.5,
+            'global_velocity': self.global_head(hidden_states.mean(dim=1)),
+        }
+
+
+def _bare_trainer(flow_matching_loss):
+    """compute_loss only needs these attributes (the HF Trainer needs accelerate)."""
+    trainer = object.__new__(FixedDualSupervisionBLIP3oTrainer)
+    trainer.flow_matching_loss = flow_matching_loss
+    trainer.clip_visual_projection = flow_matching_loss.clip_visual_projection
+    trainer.loss_components = defaultdict(list)
+    trainer.training_step_count = 1
+    trainer.args = SimpleNamespace(logging_steps=1000)
+    return trainer
+
+
+@pytest.mark.parametrize("reuse_noise_buffers", [False, True])
+def test_trainer_and_loss_share_flow_draws(reuse_noise_buffers, tmp_path):
+    torch.manual_seed(0)
+    loss_fn = _create_loss(tmp_path, noise_seed=7, reuse_noise_buffers=reuse_noise_buffers)
+    trainer = _bare_trainer(loss_fn)
+
+    draws = []
+    sample_flow_draws = loss_fn.sample_flow_draws
+
+    def recording_sample_flow_draws(*args, **kwargs):
+        result = sample_flow_draws(*args, **kwargs)
+        draws.append({key: value.clone() for key, value in result.items()})
+        return result
+
+    loss_fn.sample_flow_draws = recording_sample_flow_draws
+
+    model = RecordingDiT()
+    inputs = {
+        'eva_embeddings': torch.randn(BATCH_SIZE, NUM_TOKENS, 64),
+        'clip_embeddings': torch.randn(BATCH_SIZE, NUM_TOKENS, CLIP_DIM),
+    }
+    loss = trainer.compute_loss(model, inputs)
+
+    # One draw per step: the loss did not sample its own x_0 / noise
+    assert len(draws) == 1 and len(model.calls) == 1
+    draw, call = draws[0], model.calls[0]
+    clip = inputs['clip_embeddings']
+    t = draw['timesteps']
+
+    # Noisy input: x_t = (1 - t) x_0 + t x_1 + sigma_t * noise
+    sigma_t = loss_fn.sigma_min + (loss_fn.sigma_max - loss_fn.sigma_min) * (1 - t)
+    expected_x_t = (
+        (1 - t)[:, None, None] * draw['x_0_patch'] + t[:, None, None] * clip
+        + sigma_t[:, None, None] * draw['patch_noise']
+    )
+    assert torch.equal(call['timestep'], t)
+    torch.testing.assert_close(call['hidden_states'], expected_x_t)
+
+    # Velocity targets: v = x_1 - x_0 + (sigma_max - sigma_min) * noise, from the same draws
+    scale = loss_fn.sigma_max - loss_fn.sigma_min
+    patch_velocity = call['hidden_states'] * 0.5
+    patch_target = clip - draw['x_0_patch'] + scale * draw['patch_noise']
+    target_global = trainer.compute_target_global_features(clip)
+    global_velocity = model.global_head(call['hidden_states'].mean(dim=1))
+    global_target = target_global - draw['x_0_global'] + scale * draw['global_noise']
+
+    metrics = trainer.loss_components
+    assert metrics['patch_flow_loss'][0] == pytest.approx(F.mse_loss(patch_velocity, patch_target).item(), rel=1e-5)
+    assert metrics['global_flow_loss'][0] == pytest.approx(F.mse_loss(global_velocity, global_target).item(), rel=1e-5)
+    assert metrics['total_loss'][0] == pytest.approx(loss.item(), rel=1e-6)
+
+
+def _draws_for_rank(monkeypatch, clip_dir, rank, noise_seed=11):
+    monkeypatch.setenv("RANK", str(rank))
+    loss_fn = _create_loss(clip_dir, noise_seed=noise_seed)
+    loss_fn.eval()
+    return loss_fn.sample_flow_draws(torch.zeros(BATCH_SIZE, NUM_TOKENS, CLIP_DIM))
+
+
+def test_seeded_draws_are_offset_by_rank(monkeypatch, tmp_path):
+    rank0 = _draws_for_rank(monkeypatch, tmp_path, 0)
+    rank0_again = _draws_for_rank(monkeypatch, tmp_path, 0)
+    rank1 = _draws_for_rank(monkeypatch, tmp_path, 1)
+
+    for key in ('timesteps', 'x_0_patch', 'patch_noise', 'x_0_global', 'global_noise'):
+        assert torch.equal(rank0[key], rank0_again[key]), key
+        assert not torch.equal(rank0[key], rank1[key]), key
+    # Within one step the source sample and the noise are independent draws
+    assert not torch.equal(rank0['x_0_patch'], rank0['patch_noise'])
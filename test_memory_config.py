@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Memory estimates for the frozen CLIP target models:
+- only the CLIP visual projections the trainer and loss move to the GPU
+  count towards GPU memory
+- the full frozen CLIPModels are reported as host memory
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig
+from src.modules.config.memory_optimized_config import (
+    CLIP_PROJECTION_DIM,
+    FROZEN_CLIP_COPIES,
+    FROZEN_CLIP_PARAMS,
+    estimate_memory_usage,
+)
+
+GB = 1024**3
+
+
+def test_frozen_clip_counts_projections_on_gpu_and_models_on_host():
+    config = BLIP3oDiTConfig()
+    with_clip = estimate_memory_usage(config, batch_size=8)
+    without_clip = estimate_memory_usage(config, batch_size=8, include_frozen_clip=False)
+
+    projection_gb = FROZEN_CLIP_COPIES * config.in_channels * CLIP_PROJECTION_DIM * 4 / GB
+    assert with_clip['frozen_memory_gb'] == pytest.approx(projection_gb)
+    assert with_clip['frozen_clip_host_memory_gb'] == pytest.approx(FROZEN_CLIP_COPIES * FROZEN_CLIP_PARAMS * 4 / GB)
+
+    # The GPU total only grows by the projections, not the host-resident CLIPModels
+    extra_gpu_gb = with_clip['total_training_memory_gb'] - without_clip['total_training_memory_gb']
+    assert extra_gpu_gb == pytest.approx(projection_gb)
+    assert without_clip['frozen_clip_host_memory_gb'] == 0.0
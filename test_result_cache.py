@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+A GenerationResultCache hit (memory or disk) is bit-identical to a fresh
+seeded generation, however the samples were batched.
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig
+from src.modules.evaluation.embedding_cache import hash_item
+from src.modules.inference.result_cache import (
+    DEFAULT_SEEDED_BATCH_SIZE,
+    create_result_cache,
+    generate_in_fixed_batches,
+    generation_namespace,
+    sample_noise,
+)
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+
+NUM_INFERENCE_STEPS = 3
+SEED = 0
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = BLIP3oDiTConfig(input_size=4, dim=64, n_layers=2, n_heads=4, mlp_hidden_dim=128)
+    return BLIP3oDiTModel(config).eval()
+
+
+@pytest.fixture(scope="module")
+def eva_embeddings(model):
+    generator = torch.Generator().manual_seed(1)
+    return torch.randn(11, model.num_tokens, model.config.eva_embedding_size, generator=generator)
+
+
+def _generate_fn(model):
+    def generate(eva_embeddings, noise):
+        with torch.no_grad():
+            return model.generate(
+                eva_embeddings,
+                num_inference_steps=NUM_INFERENCE_STEPS,
+                noise=noise,
+                return_global_only=False,
+            )
+    return generate
+
+
+def _fresh_generation(model, eva_embeddings):
+    noise = sample_noise(
+        [hash_item(row) for row in eva_embeddings], SEED, (model.num_tokens, model.config.in_channels),
+    )
+    return generate_in_fixed_batches(_generate_fn(model), eva_embeddings, noise, DEFAULT_SEEDED_BATCH_SIZE)
+
+
+def test_result_cache_hit_is_bit_identical(model, eva_embeddings, tmp_path):
+    namespace = generation_namespace("test-checkpoint", SEED, NUM_INFERENCE_STEPS, output="patch")
+    sample_shape = (model.num_tokens, model.config.in_channels)
+    fresh = _fresh_generation(model, eva_embeddings)
+
+    def cached_generate(cache, rows):
+        return cache.cached_generate(
+            _generate_fn(model), eva_embeddings[rows], namespace,
+            seed=SEED, sample_shape=sample_shape, batch_size=DEFAULT_SEEDED_BATCH_SIZE,
+        )
+
+    cache = create_result_cache(tmp_path)
+    # Misses generated in a different grouping than the reference run
+    assert torch.equal(cached_generate(cache, [7, 2, 9]), fresh[[7, 2, 9]])
+    assert torch.equal(cached_generate(cache, list(range(11))), fresh)
+    assert cache.stats['memory_hits'] == 3
+    cache.close()
+
+    # Disk tier only
+    reopened = create_result_cache(tmp_path, memory_max_mb=0)
+    assert torch.equal(cached_generate(reopened, list(range(10, -1, -1))), fresh.flip(0))
+    assert reopened.stats['disk_hits'] == 11 and reopened.stats['misses'] == 0
+    reopened.close()
+
+
+def test_result_cache_namespaces_do_not_collide(model, eva_embeddings, tmp_path):
+    sample_shape = (model.num_tokens, model.config.in_channels)
+    cache = create_result_cache(tmp_path)
+    outputs = [
+        cache.cached_generate(
+            _generate_fn(model), eva_embeddings[:2],
+            generation_namespace("test-checkpoint", seed, NUM_INFERENCE_STEPS, output="patch"),
+            seed=seed, sample_shape=sample_shape, batch_size=DEFAULT_SEEDED_BATCH_SIZE,
+        )
+        for seed in (0, 1)
+    ]
+    assert cache.stats['misses'] == 4
+    assert not torch.equal(outputs[0], outputs[1])
+    cache.close()
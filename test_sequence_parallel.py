@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Sequence-parallel BLIP3-o DiT on 2 CPU processes (gloo):
+- the gathered patch output and the global-path features match the
+  single-process model
+- after sync_sequence_parallel_gradients every rank holds the single-process
+  parameter gradients
+"""
+
+import os
+import socket
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from src.modules.config.blip3o_config import BLIP3oDiTConfig
+from src.modules.models.blip3o_dit import BLIP3oDiTModel
+from src.modules.models.sequence_parallel import sync_sequence_parallel_gradients
+
+WORLD_SIZE = 2
+BATCH_SIZE = 2
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _forward_backward(model, inputs):
+    """Outputs and parameter gradients of a loss on the patch output and the global path."""
+    model.zero_grad(set_to_none=True)
+    outputs = model(**inputs, return_dict=True)
+    loss = outputs['patch_output'].pow(2).mean() + outputs['adapted_features'].pow(2).mean()
+    loss.backward()
+    return outputs, loss
+
+
+def _worker(rank: int, port: int):
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=WORLD_SIZE)
+    try:
+        # Same weights and batch on every rank
+        torch.manual_seed(0)
+        config = BLIP3oDiTConfig(input_size=4, dim=64, n_layers=2, n_heads=4, mlp_hidden_dim=128)
+        model = BLIP3oDiTModel(config).eval()
+        inputs = {
+            'hidden_states': torch.randn(BATCH_SIZE, model.num_tokens, config.in_channels),
+            'timestep': torch.rand(BATCH_SIZE),
+            'encoder_hidden_states': torch.randn(BATCH_SIZE, model.num_tokens, config.eva_embedding_size),
+        }
+
+        # Single-process reference
+        reference, reference_loss = _forward_backward(model, inputs)
+        reference_grads = {name: param.grad.clone() for name, param in model.named_parameters() if param.grad is not None}
+
+        assert model.enable_sequence_parallel() == WORLD_SIZE
+        outputs, loss = _forward_backward(model, inputs)
+        sync_sequence_parallel_gradients(model)
+
+        for key in ('patch_output', 'pooled_features', 'adapted_features'):
+            torch.testing.assert_close(outputs[key], reference[key], rtol=1e-5, atol=1e-6, msg=f"rank {rank}: {key}")
+        torch.testing.assert_close(loss, reference_loss, rtol=1e-5, atol=1e-7)
+
+        grads = {name: param.grad for name, param in model.named_parameters() if param.grad is not None}
+        assert grads.keys() == reference_grads.keys(), f"rank {rank}: {set(grads) ^ set(reference_grads)}"
+        for name, grad in grads.items():
+            torch.testing.assert_close(grad, reference_grads[name], rtol=1e-4, atol=1e-6, msg=f"rank {rank}: {name}")
+    finally:
+        dist.destroy_process_group()
+
+
+def test_sequence_parallel_matches_single_process():
+    # A failed assertion in a worker makes spawn raise in the test process
+    mp.spawn(_worker, args=(_free_port(),), nprocs=WORLD_SIZE, join=True)
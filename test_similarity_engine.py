@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+BlockedSimilarityEngine.topk equals dense top-k for any block sizes and
+worker counts.
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from src.modules.evaluation.similarity_engine import create_similarity_engine
+
+
+@pytest.mark.parametrize("query_block_size,gallery_block_size,num_workers", [
+    (7, 13, 0),
+    (64, 1000, 0),
+    (5, 17, 3),
+])
+def test_blocked_topk_matches_dense(query_block_size, gallery_block_size, num_workers):
+    generator = torch.Generator().manual_seed(0)
+    queries = torch.randn(50, 32, generator=generator)
+    gallery = torch.randn(300, 32, generator=generator)
+    k = 10
+
+    engine = create_similarity_engine(
+        query_block_size=query_block_size,
+        gallery_block_size=gallery_block_size,
+        num_workers=num_workers,
+    )
+    scores, indices = engine.topk(queries, gallery, k)
+
+    dense = F.normalize(queries, dim=-1) @ F.normalize(gallery, dim=-1).t()
+    dense_scores, dense_indices = dense.topk(k, dim=1)
+
+    assert scores.shape == (50, k) and indices.shape == (50, k)
+    torch.testing.assert_close(scores, dense_scores)
+    assert torch.equal(indices, dense_indices)
+
+
+def test_blocked_topk_clamps_k_to_gallery_size():
+    generator = torch.Generator().manual_seed(1)
+    queries = torch.randn(4, 8, generator=generator)
+    gallery = torch.randn(6, 8, generator=generator)
+
+    scores, indices = create_similarity_engine(query_block_size=3, gallery_block_size=4).topk(queries, gallery, 10)
+
+    assert scores.shape == (4, 6)
+    assert torch.equal(indices.sort(dim=1).values, torch.arange(6).expand(4, 6))
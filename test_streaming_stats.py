@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+StreamingQuantileSketch is exact below exact_limit and within one bin width
+of torch.quantile in histogram mode (also after merges).
+"""
+
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pytest
+import torch
+
+from src.modules.evaluation.streaming_stats import StreamingQuantileSketch
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def test_quantile_sketch_is_exact_below_limit():
+    values = torch.randn(1000, generator=torch.Generator().manual_seed(2))
+    sketch = StreamingQuantileSketch(num_bins=64, exact_limit=10_000)
+    for chunk in values.split(97):
+        sketch.update(chunk)
+
+    assert sketch.is_exact
+    for q in QUANTILES:
+        assert sketch.quantile(q) == pytest.approx(torch.quantile(values, q).item(), abs=1e-6)
+    assert sketch.median() == torch.median(values).item()
+
+
+def test_quantile_sketch_histogram_error_bound():
+    generator = torch.Generator().manual_seed(3)
+    # Growing spread, so the histogram range has to double several times
+    values = torch.cat([torch.randn(2000, generator=generator) * scale for scale in (0.1, 1.0, 10.0)])
+    sketch = StreamingQuantileSketch(num_bins=256, exact_limit=500)
+    for chunk in values.split(250):
+        sketch.update(chunk)
+
+    assert not sketch.is_exact
+    assert sketch.count == values.numel()
+    for q in QUANTILES:
+        assert abs(sketch.quantile(q) - torch.quantile(values, q).item()) <= sketch.width
+
+
+def test_quantile_sketch_merge_error_bound():
+    generator = torch.Generator().manual_seed(4)
+    shards = [torch.randn(1500, generator=generator) + offset for offset in (-3.0, 0.0, 5.0)]
+    sketches = []
+    for values in shards:
+        sketch = StreamingQuantileSketch(num_bins=256, exact_limit=1000)
+        sketch.update(values)
+        sketches.append(sketch)
+    # One shard stays in exact mode
+    exact = StreamingQuantileSketch(num_bins=256, exact_limit=1000)
+    exact.update(shards[0][:100])
+    sketches.append(exact)
+
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+
+    values = torch.cat(shards + [shards[0][:100]])
+    assert merged.count == values.numel()
+    assert merged.min == values.min().item() and merged.max == values.max().item()
+    for q in QUANTILES:
+        # Each merged histogram bin is re-added at its center: half a source bin of extra error
+        assert abs(merged.quantile(q) - torch.quantile(values, q).item()) <= 1.5 * merged.width
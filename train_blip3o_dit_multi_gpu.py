@@ -88,6 +88,14 @@ def parse_arguments():
                            help="Number of warmup steps")
     train_group.add_argument("--gradient_accumulation_steps", type=int, default=6,
                            help="Gradient accumulation steps")
+    train_group.add_argument("--auto_batch_size", action="store_true",
+                           help="Pick the largest per-GPU batch that fits --gpu_memory_budget_gb "
+                                "(overrides --batch_size / --gradient_accumulation_steps)")
+    train_group.add_argument("--target_global_batch_size", type=int, default=None,
+                           help="Effective batch for --auto_batch_size "
+                                "(default: batch_size * gradient_accumulation_steps * world_size)")
+    train_group.add_argument("--profile_memory", action="store_true",
+                           help="Calibrate --auto_batch_size with a short measured forward/backward")
     train_group.add_argument("--lr_scheduler_type", type=str, default="cosine",
                         choices=["linear", "cosine", "constant", "cosine_with_restarts"],
                         help="Learning rate scheduler type")
@@ -106,6 +114,10 @@ def parse_arguments():
                           help="Weight for global flow matching loss (KEY FIX)")
     loss_group.add_argument("--use_cosine_similarity", action="store_true",
                           help="Use cosine similarity instead of MSE for losses")
+    loss_group.add_argument("--noise_seed", type=int, default=None,
+                          help="Seed for per-step flow matching draws (offset by rank)")
+    loss_group.add_argument("--reuse_noise_buffers", action="store_true",
+                          help="Refill cached noise buffers instead of allocating new ones each step")
     
     # Hardware configuration
     hw_group = parser.add_argument_group("Hardware Configuration")
@@ -113,6 +125,52 @@ def parse_arguments():
                         help="Use mixed precision training (fp16)")
     hw_group.add_argument("--dataloader_num_workers", type=int, default=4,
                         help="Number of dataloader workers per GPU")
+    hw_group.add_argument("--torch_compile", action="store_true",
+                        help="Compile the model training step with torch.compile")
+    hw_group.add_argument("--torch_compile_mode", type=str, default=None,
+                        choices=["default", "reduce-overhead", "max-autotune"],
+                        help="torch.compile mode for the training step")
+    hw_group.add_argument("--checkpointing_policy", type=str, default="full",
+                        choices=["none", "full", "every_k", "attention", "ffn", "auto"],
+                        help="Activation checkpointing policy (auto: least recompute that fits the memory budget)")
+    hw_group.add_argument("--checkpointing_every_k", type=int, default=2,
+                        help="Layer interval for the every_k checkpointing policy")
+    hw_group.add_argument("--gpu_memory_budget_gb", type=float, default=None,
+                        help="Per-GPU memory budget for auto checkpointing (default: detected GPU memory)")
+    
+    # Checkpointing
+    ckpt_group = parser.add_argument_group("Checkpoint Configuration")
+    ckpt_group.add_argument("--async_checkpointing", action="store_true",
+                          help="Write checkpoints in a background thread (training stalls only for the snapshot)")
+    ckpt_group.add_argument("--persistent_checkpoint_dir", type=str, default=None,
+                          help="Copy every finished checkpoint here in the background (e.g. scratch-shared)")
+    ckpt_group.add_argument("--keep_last_checkpoints", type=int, default=None,
+                          help="Checkpoints kept in --persistent_checkpoint_dir (default: all)")
+    
+    # EMA of the model weights
+    ema_group = parser.add_argument_group("EMA Configuration")
+    ema_group.add_argument("--use_ema_weights", action="store_true",
+                         help="Keep an EMA of the weights (saved as ema_model.safetensors, used for evaluation)")
+    ema_group.add_argument("--ema_decay", type=float, default=0.9999,
+                         help="EMA decay per optimizer step")
+    ema_group.add_argument("--ema_update_every", type=int, default=1,
+                         help="EMA update interval in optimizer steps")
+    ema_group.add_argument("--ema_start_step", type=int, default=0,
+                         help="First optimizer step averaged into the EMA")
+    ema_group.add_argument("--ema_dtype", type=str, default=None,
+                         choices=["float32", "bfloat16", "float16"],
+                         help="EMA precision (default: parameter dtype)")
+    ema_group.add_argument("--ema_cpu_offload", action="store_true",
+                         help="Keep the EMA weights in pinned host memory")
+    
+    # Hot-path instrumentation
+    perf_group = parser.add_argument_group("Instrumentation")
+    perf_group.add_argument("--instrument", action="store_true",
+                          help="Per-stage timers, exported each logging step to <output_dir>/instrumentation.jsonl and wandb")
+    perf_group.add_argument("--instrument_sync_cuda", action="store_true",
+                          help="Synchronize CUDA around each timer (device time; slows training)")
+    perf_group.add_argument("--profiler_ranges", action="store_true",
+                          help="Emit torch.profiler ranges for the timed stages (implies --instrument)")
     
     # CLIP model configuration
     clip_group = parser.add_argument_group("CLIP Configuration")
@@ -206,7 +264,9 @@ def main():
             norm_eps=1e-5,
             qk_norm=True,
             learn_sigma=False,
-            _gradient_checkpointing=True,
+            _gradient_checkpointing=args.checkpointing_policy != "none",
+            gradient_checkpointing_policy="full" if args.checkpointing_policy == "auto" else args.checkpointing_policy,
+            gradient_checkpointing_every_k=args.checkpointing_every_k,
             # MLP configuration for dual supervision
             mlp_hidden_dim=args.mlp_hidden_dim,
             mlp_num_layers=args.mlp_num_layers,
@@ -228,9 +288,75 @@ def main():
             enable_dual_supervision=True,
         )
         
-        # Enable gradient checkpointing for memory efficiency
-        if hasattr(model, 'enable_gradient_checkpointing'):
-            model.enable_gradient_checkpointing()
+        precision = "fp16" if args.fp16 else "fp32"
+        can_checkpoint = hasattr(model, 'enable_gradient_checkpointing')
+        
+        # Enable gradient checkpointing for memory efficiency (policy-selected layers/branches).
+        # "auto" is resolved below, once the per-GPU batch size is final; until then the
+        # model keeps the config's "full" policy (what --auto_batch_size sizes against)
+        if can_checkpoint and args.checkpointing_policy not in ("none", "auto"):
+            resolved_policy = model.enable_gradient_checkpointing(
+                policy=args.checkpointing_policy,
+                every_k=args.checkpointing_every_k,
+            )
+            if local_rank == 0:
+                print(f"🧠 Gradient checkpointing policy: {resolved_policy}")
+        
+        # Per-GPU memory budget for --auto_batch_size and "auto" checkpointing: this rank's GPU
+        memory_budget_gb = args.gpu_memory_budget_gb
+        if memory_budget_gb is None and torch.cuda.is_available():
+            memory_budget_gb = torch.cuda.get_device_properties(local_rank).total_memory / (1024**3)
+        
+        # Largest safe per-GPU batch (deterministic across ranks: the profile counts
+        # saved-tensor bytes, not allocator state)
+        if args.auto_batch_size:
+            from src.modules.config.memory_optimized_config import profile_memory_usage, find_max_batch_size
+            
+            if memory_budget_gb is None:
+                if local_rank == 0:
+                    print("⚠️ --auto_batch_size needs a GPU or --gpu_memory_budget_gb, keeping --batch_size")
+            else:
+                calibration = None
+                if args.profile_memory:
+                    profile_device = torch.device(f"cuda:{local_rank}") if torch.cuda.is_available() else torch.device("cpu")
+                    calibration = profile_memory_usage(model, batch_sizes=(1, 2), device=profile_device, precision=precision)
+                
+                target_global_batch_size = args.target_global_batch_size or (
+                    args.batch_size * args.gradient_accumulation_steps * world_size
+                )
+                policy = getattr(model, 'gradient_checkpointing_policy', "none") if model._gradient_checkpointing else "none"
+                batch_plan = find_max_batch_size(
+                    model.config,
+                    memory_budget_gb,
+                    target_global_batch_size=target_global_batch_size,
+                    num_gpus=world_size,
+                    precision=precision,
+                    checkpointing_policy=policy,
+                    checkpointing_every_k=getattr(model, 'gradient_checkpointing_every_k', 2),
+                    calibration=calibration,
+                )
+                args.batch_size = batch_plan['per_device_batch_size']
+                args.gradient_accumulation_steps = batch_plan['gradient_accumulation_steps']
+                
+                if local_rank == 0:
+                    status = "✅" if batch_plan['fits'] else "⚠️ (does not fit even at batch 1)"
+                    print(f"📏 Auto batch size {status}:")
+                    print(f"   Per-GPU batch: {args.batch_size}")
+                    print(f"   Gradient accumulation: {args.gradient_accumulation_steps}")
+                    print(f"   Effective batch: {batch_plan['effective_batch_size']}")
+                    print(f"   Estimated memory: {batch_plan['estimated_memory_gb']:.1f} GB / {memory_budget_gb:.1f} GB")
+        
+        # Auto checkpointing: least recompute that fits at the final batch size and precision
+        if can_checkpoint and args.checkpointing_policy == "auto":
+            resolved_policy = model.enable_gradient_checkpointing(
+                policy="auto",
+                every_k=args.checkpointing_every_k,
+                memory_budget_gb=memory_budget_gb,
+                batch_size=args.batch_size,
+                precision=precision,
+            )
+            if local_rank == 0:
+                print(f"🧠 Gradient checkpointing policy: {resolved_policy}")
         
         # Check if model has the fixed global velocity projection
         has_global_velocity_proj = hasattr(model, 'global_velocity_proj')
@@ -262,6 +388,8 @@ def main():
             global_flow_weight=args.global_flow_weight,      # NEW: Global flow weight (KEY FIX)
             use_cosine_similarity=args.use_cosine_similarity,
             clip_model_name=args.clip_model_name,
+            noise_seed=args.noise_seed,
+            reuse_noise_buffers=args.reuse_noise_buffers,
         )
         
         if local_rank == 0:
@@ -349,11 +477,28 @@ def main():
             load_best_model_at_end=has_eval_dataloader,
             metric_for_best_model="eval_global_generation_cosine_mean",  # FIXED: Use global generation metric
             greater_is_better=True,
+            torch_compile=args.torch_compile,
+            torch_compile_mode=args.torch_compile_mode,
         )
         
         if local_rank == 0:
             print("🔧 Creating FIXED dual supervision trainer with global flow matching...")
         
+        if args.instrument or args.profiler_ranges:
+            from src.modules.utils.instrumentation import enable_instrumentation
+            enable_instrumentation(profiler_ranges=args.profiler_ranges, sync_cuda=args.instrument_sync_cuda)
+        
+        ema_config = None
+        if args.use_ema_weights:
+            from src.modules.config.blip3o_config import EMAConfig
+            ema_config = EMAConfig(
+                decay=args.ema_decay,
+                update_every=args.ema_update_every,
+                start_step=args.ema_start_step,
+                dtype=args.ema_dtype,
+                offload_to_cpu=args.ema_cpu_offload,
+            )
+        
         # Create FIXED trainer
         trainer = FixedDualSupervisionBLIP3oTrainer(
             model=model,
@@ -362,12 +507,20 @@ def main():
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
             clip_model_name=args.clip_model_name,
+            ema_config=ema_config,
+            async_checkpointing=args.async_checkpointing,
+            persistent_checkpoint_dir=args.persistent_checkpoint_dir,
+            keep_last_checkpoints=args.keep_last_checkpoints,
         )
         
         if local_rank == 0:
             print(f"✅ FixedDualSupervisionBLIP3oTrainer created successfully")
             print(f"   Metric for best model: {training_args.metric_for_best_model}")
             print(f"   Training both patch and global generation")
+            if ema_config is not None:
+                print(f"   EMA weights: decay={ema_config.decay}, every {ema_config.update_every} step(s)")
+            if args.instrument or args.profiler_ranges:
+                print(f"   Instrumentation: {args.output_dir}/instrumentation.jsonl")
         
         # Override dataloader methods to use our chunked dataloaders
         def get_train_dataloader_override():
@@ -409,6 +562,7 @@ def main():
         if local_rank == 0:
             print("💾 Saving final FIXED dual supervision model...")
             trainer.save_model()
+            trainer.wait_for_checkpoints()
             
             # Print final metrics
             if hasattr(trainer, 'ema_global_generation_cosine'):